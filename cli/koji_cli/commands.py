@@ -13,6 +13,7 @@ import re
 import stat
 import sys
 import textwrap
+import threading
 import time
 import traceback
 from datetime import datetime
@@ -34,6 +35,7 @@ from koji_cli.lib import (
     _running_in_bg,
     activate_session,
     arg_filter,
+    DownloadPool,
     download_archive,
     download_file,
     download_rpm,
@@ -1831,6 +1833,387 @@ def handle_write_signed_rpm(goptions, session, args):
             m.writeSignedRPM(rpminfo['id'], key)
 
 
+def _prune_histline(event_id, x):
+    if event_id == x['revoke_event']:
+        ts = x['revoke_ts']
+        fmt = "Untagged %(name)s-%(version)s-%(release)s from %(tag_name)s"
+    elif event_id == x['create_event']:
+        ts = x['create_ts']
+        fmt = "Tagged %(name)s-%(version)s-%(release)s with %(tag_name)s"
+        if x['active']:
+            fmt += " [still active]"
+    else:
+        raise koji.GenericError("No such event: (%r, %r)" % (event_id, x))
+    time_str = time.asctime(time.localtime(ts))
+    return "%s: %s" % (time_str, fmt % x)
+
+
+def _prune_keep_build(options, cutoff_ts, nvr, binfo, tags, get_history):
+    """Check if the signed copies of a build need to be kept
+
+    That is the case if the build was latest in one of its tags since the
+    cutoff or if it is (or was until the cutoff) in a protected tag.
+
+    :param list tags: names of the tags the build is or was in
+    :param get_history: function returning the tag_listing history of the
+                        build's package in the given tag
+    """
+    is_latest = False
+    is_protected = False
+    last_latest = None
+    for tag_name in tags:
+        if tag_name == options.trashcan_tag:
+            if options.debug:
+                print("Ignoring trashcan tag for build %s" % nvr)
+            continue
+        ignore_tag = False
+        for pattern in options.ignore_tag:
+            if fnmatch.fnmatch(tag_name, pattern):
+                if options.debug:
+                    print("Ignoring tag %s for build %s" % (tag_name, nvr))
+                ignore_tag = True
+                break
+        if ignore_tag:
+            continue
+        # in order to determine how recently this build was latest, we have
+        # to look at the tagging history.
+        hist = get_history(tag_name)
+        if not hist:
+            # really shouldn't happen
+            raise koji.GenericError("No history found for %s in %s" % (nvr, tag_name))
+        timeline = []
+        for x in hist:
+            # note that for revoked entries, we're effectively splitting them into
+            # two parts: creation and revocation.
+            timeline.append((x['create_event'], 1, x))
+            # at the same event, revokes happen first
+            if x['revoke_event'] is not None:
+                timeline.append((x['revoke_event'], 0, x))
+        timeline.sort(key=lambda entry: entry[:2])
+        # find most recent creation entry for our build and crop there
+        latest_ts = None
+        for i in range(len(timeline) - 1, -1, -1):
+            # searching in reverse cronological order
+            event_id, is_create, entry = timeline[i]
+            if entry['build_id'] == binfo['id'] and is_create:
+                latest_ts = event_id
+                break
+        if not latest_ts:
+            # really shouldn't happen
+            raise koji.GenericError("No creation event found for %s in %s" % (nvr, tag_name))
+        our_entry = entry
+        if options.debug:
+            print(_prune_histline(event_id, our_entry))
+        # now go through the events since most recent creation entry
+        timeline = timeline[i + 1:]
+        if not timeline:
+            is_latest = True
+            if options.debug:
+                print("%s is latest in tag %s" % (nvr, tag_name))
+            break
+        # before we go any further, is this a protected tag?
+        protect_tag = False
+        for pattern in options.protect_tag:
+            if fnmatch.fnmatch(tag_name, pattern):
+                protect_tag = True
+                break
+        if protect_tag:
+            # we use the same time limit as for the latest calculation
+            # if this build was in this tag within that limit, then we will
+            # not prune its signed copies
+            if our_entry['revoke_event'] is None:
+                # we're still tagged with a protected tag
+                if options.debug:
+                    print("Build %s has protected tag %s" % (nvr, tag_name))
+                is_protected = True
+                break
+            elif our_entry['revoke_ts'] > cutoff_ts:
+                # we were still tagged here sometime before the cutoff
+                if options.debug:
+                    print("Build %s had protected tag %s until %s"
+                          % (nvr, tag_name,
+                             time.asctime(time.localtime(our_entry['revoke_ts']))))
+                is_protected = True
+                break
+        replaced_ts = None
+        revoke_ts = None
+        others = {}
+        for event_id, is_create, entry in timeline:
+            # So two things can knock this build from the title of latest:
+            #  - it could be untagged (entry revoked)
+            #  - another build could become latest (replaced)
+            # Note however that if the superceding entry is itself revoked, then
+            # our build could become latest again
+            if options.debug:
+                print(_prune_histline(event_id, entry))
+            if entry['build_id'] == binfo['id']:
+                if is_create:
+                    # shouldn't happen
+                    raise koji.GenericError("Duplicate creation event found for %s in %s"
+                                            % (nvr, tag_name))
+                else:
+                    # we've been revoked
+                    revoke_ts = entry['revoke_ts']
+                    break
+            else:
+                if is_create:
+                    # this build has become latest
+                    replaced_ts = entry['create_ts']
+                    if entry['active']:
+                        # this entry not revoked yet, so we're done for this tag
+                        break
+                    # since this entry is revoked later, our build might eventually be
+                    # uncovered, so we have to keep looking
+                    others[entry['build_id']] = 1
+                else:
+                    # other build revoked
+                    # see if our build has resurfaced
+                    if entry['build_id'] in others:
+                        del others[entry['build_id']]
+                    if replaced_ts is not None and not others:
+                        # we've become latest again
+                        # (note: we're not revoked yet because that triggers a break above)
+                        replaced_ts = None
+                        latest_ts = entry['revoke_ts']
+        if last_latest is None:
+            timestamps = []
+        else:
+            timestamps = [last_latest]
+        if revoke_ts is None:
+            if replaced_ts is None:
+                # turns out we are still latest
+                is_latest = True
+                if options.debug:
+                    print("%s is latest (again) in tag %s" % (nvr, tag_name))
+                break
+            else:
+                # replaced (but not revoked)
+                timestamps.append(replaced_ts)
+                if options.debug:
+                    print("tag %s: %s not latest (replaced %s)"
+                          % (tag_name, nvr, time.asctime(time.localtime(replaced_ts))))
+        elif replaced_ts is None:
+            # revoked but not replaced
+            timestamps.append(revoke_ts)
+            if options.debug:
+                print("tag %s: %s not latest (revoked %s)"
+                      % (tag_name, nvr, time.asctime(time.localtime(revoke_ts))))
+        else:
+            # revoked AND replaced
+            timestamps.append(min(revoke_ts, replaced_ts))
+            if options.debug:
+                print("tag %s: %s not latest (revoked %s, replaced %s)"
+                      % (tag_name, nvr, time.asctime(time.localtime(revoke_ts)),
+                         time.asctime(time.localtime(replaced_ts))))
+        last_latest = max(timestamps)
+        if last_latest > cutoff_ts:
+            if options.debug:
+                print("%s was latest past the cutoff" % nvr)
+            is_latest = True
+            break
+    return is_latest or is_protected
+
+
+def _prune_build_copies(options, cutoff_ts, nvr, binfo, rpms, sigs):
+    """Remove the signed copies of a build
+
+    :param list rpms: rpms of the build
+    :param list sigs: signatures of each of the rpms
+    :returns: the number of removed files and their size
+    """
+    by_sig = {}
+    # index by sig
+    for rpminfo, rpm_sigs in zip(rpms, sigs):
+        for sig in rpm_sigs:
+            sigkey = sig['sigkey']
+            by_sig.setdefault(sigkey, []).append(rpminfo)
+    builddir = koji.pathinfo.build(binfo)
+    build_files = 0
+    build_space = 0
+    if not by_sig and options.debug:
+        print("(build has no signatures)")
+    for sigkey, rpms in six.iteritems(by_sig):
+        mycount = 0
+        archdirs = {}
+        sigdirs = {}
+        for rpminfo in rpms:
+            signedpath = "%s/%s" % (builddir, koji.pathinfo.signed(rpminfo, sigkey))
+            try:
+                st = os.lstat(signedpath)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                # warn about this
+                print("Skipping %s. Not a regular file" % signedpath)
+                continue
+            if st.st_mtime > cutoff_ts:
+                print("Skipping %s. File newer than cutoff" % signedpath)
+                continue
+            if options.test:
+                print("Would have unlinked: %s" % signedpath)
+            else:
+                if options.verbose:
+                    print("Unlinking: %s" % signedpath)
+                try:
+                    os.unlink(signedpath)
+                except OSError as e:
+                    print("Error removing %s: %s" % (signedpath, e))
+                    print("This script needs write access to %s" % koji.BASEDIR)
+                    continue
+            mycount += 1
+            build_files += 1
+            build_space += st.st_size
+            # XXX - this makes some layout assumptions, but
+            #      pathinfo doesn't report what we need
+            mydir = os.path.dirname(signedpath)
+            archdirs[mydir] = 1
+            sigdirs[os.path.dirname(mydir)] = 1
+        for dir in archdirs:
+            if options.test:
+                print("Would have removed dir: %s" % dir)
+            else:
+                if options.verbose:
+                    print("Removing dir: %s" % dir)
+                try:
+                    os.rmdir(dir)
+                except OSError as e:
+                    print("Error removing %s: %s" % (signedpath, e))
+        if len(sigdirs) == 1:
+            dir = to_list(sigdirs.keys())[0]
+            if options.test:
+                print("Would have removed dir: %s" % dir)
+            else:
+                if options.verbose:
+                    print("Removing dir: %s" % dir)
+                try:
+                    os.rmdir(dir)
+                except OSError as e:
+                    print("Error removing %s: %s" % (signedpath, e))
+        elif len(sigdirs) > 1:
+            warn("More than one signature dir for %s: %r" % (sigkey, sigdirs))
+    if not build_files and options.debug and by_sig:
+        print("(build has no signed copies)")
+    return build_files, build_space
+
+
+def _prune_signed_copies_bulk(options, session, builds, cutoff_ts):
+    """Prune signed copies for batches of packages
+
+    The whole tag_listing history of each package is fetched with one query,
+    which covers the tags of all its builds. The rpms and signatures of the
+    builds to prune are fetched with multicalls. The files are then removed
+    by a set of threads for each volume.
+
+    With a checkpoint file, the last finished package and the running totals
+    are saved after each batch and an interrupted run resumes from there. The
+    file is removed once all packages are done. Test mode does not write it.
+
+    :returns: the number of removed files and their size
+    """
+    totals = {'files': 0, 'space': 0}
+    last_package = None
+    if options.checkpoint and os.path.exists(options.checkpoint):
+        with open(options.checkpoint, 'rt') as fo:
+            checkpoint = json.load(fo)
+        last_package = checkpoint['package']
+        totals['files'] = checkpoint['files']
+        totals['space'] = checkpoint['space']
+        print("Resuming after package %s" % last_package)
+    by_package = {}
+    for nvr, binfo in builds:
+        # listBuilds returns slightly different data than normal
+        if 'id' not in binfo:
+            binfo['id'] = binfo['build_id']
+        if 'name' not in binfo:
+            binfo['name'] = binfo['package_name']
+        by_package.setdefault(binfo['name'], []).append((nvr, binfo))
+    packages = sorted(by_package)
+    if last_package is not None:
+        packages = [p for p in packages if p > last_package]
+    lock = threading.Lock()
+    errors = []
+
+    def worker(todo):
+        while not errors:
+            try:
+                nvr, binfo, rpms, sigs = todo.get_nowait()
+            except six.moves.queue.Empty:
+                return
+            try:
+                build_files, build_space = _prune_build_copies(options, cutoff_ts, nvr, binfo,
+                                                               rpms, sigs)
+            except Exception as e:
+                errors.append(e)
+                return
+            if not build_files:
+                continue
+            with lock:
+                totals['files'] += build_files
+                totals['space'] += build_space
+                if options.verbose:
+                    print("Build: %s, Removed %i signed copies (%i bytes). Total: %i/%i"
+                          % (nvr, build_files, build_space, totals['files'],
+                             totals['space']))
+
+    for i in range(0, len(packages), options.batch):
+        batch = packages[i:i + options.batch]
+        if options.verbose:
+            print("Checking packages %s .. %s" % (batch[0], batch[-1]))
+        with session.multicall(strict=True) as m:
+            histories = [m.queryHistory(tables=['tag_listing'], package=package)
+                         for package in batch]
+        candidates = []
+        for package, history in zip(batch, histories):
+            by_tag = {}
+            by_build = {}
+            for entry in history.result['tag_listing']:
+                by_tag.setdefault(entry['tag.name'], []).append(entry)
+                by_build.setdefault(entry['build_id'], {})[entry['tag.name']] = 1
+            for nvr, binfo in by_package[package]:
+                if options.debug:
+                    print("DEBUG: %s" % nvr)
+                tags = by_build.get(binfo['id'], {})
+                if options.debug:
+                    print("Tags: %s" % to_list(tags.keys()))
+                if not _prune_keep_build(options, cutoff_ts, nvr, binfo, tags, by_tag.get):
+                    candidates.append((nvr, binfo))
+        # not latest anywhere since cutoff, so we can remove all signed copies
+        with session.multicall(strict=True) as m:
+            rpm_calls = [m.listRPMs(buildID=binfo['id']) for nvr, binfo in candidates]
+        with session.multicall(strict=True, batch=1000) as m:
+            sig_calls = [[m.queryRPMSigs(rpm_id=rpminfo['id']) for rpminfo in call.result]
+                         for call in rpm_calls]
+        by_volume = {}
+        for (nvr, binfo), call, calls in zip(candidates, rpm_calls, sig_calls):
+            volume = binfo.get('volume_name') or 'DEFAULT'
+            if volume not in by_volume:
+                by_volume[volume] = six.moves.queue.Queue()
+            by_volume[volume].put((nvr, binfo, call.result, [c.result for c in calls]))
+        threads = []
+        for volume in sorted(by_volume):
+            todo = by_volume[volume]
+            for n in range(min(options.jobs, todo.qsize())):
+                threads.append(threading.Thread(target=worker, args=(todo,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        if options.checkpoint and not options.test:
+            checkpoint = {'package': batch[-1], 'files': totals['files'],
+                          'space': totals['space']}
+            tmp = '%s.tmp' % options.checkpoint
+            with open(tmp, 'wt') as fo:
+                json.dump(checkpoint, fo)
+            os.rename(tmp, options.checkpoint)
+    if options.checkpoint and not options.test and os.path.exists(options.checkpoint):
+        # the run is complete, the next one starts over
+        os.unlink(options.checkpoint)
+    return totals['files'], totals['space']
+
+
 def handle_prune_signed_copies(goptions, session, args):
     "[admin] Prune signed copies"
     usage = "usage: %prog prune-signed-copies [options]"
@@ -1849,10 +2232,22 @@ def handle_prune_signed_copies(goptions, session, args):
     parser.add_option("--protect-tag-file",
                       help="File to read tag protect patterns from")
     parser.add_option("--trashcan-tag", default="trashcan", help="Specify trashcan tag")
+    parser.add_option("--bulk", action="store_true",
+                      help="Query history and signatures for many packages at once")
+    parser.add_option("--batch", type="int", default=100, metavar="N",
+                      help="Packages per batch in bulk mode (default: 100)")
+    parser.add_option("-j", "--jobs", type="int", default=1, metavar="N",
+                      help="Threads removing files per volume in bulk mode")
+    parser.add_option("--checkpoint", metavar="FILE",
+                      help="Save bulk mode progress to FILE and resume from it")
     # Don't use local debug option, this one stays here for backward compatibility
     # https://pagure.io/koji/issue/2084
     parser.add_option("--debug", action="store_true", default=goptions.debug, help=SUPPRESS_HELP)
     (options, args) = parser.parse_args(args)
+    if not options.bulk and (options.jobs != 1 or options.checkpoint):
+        parser.error("--jobs and --checkpoint can only be used with --bulk")
+    if options.batch < 1 or options.jobs < 1:
+        parser.error("--batch and --jobs must be at least 1")
     # different ideas/modes
     #  1) remove all signed copies of builds that are not latest for some tag
     #  2) remove signed copies when a 'better' signature is available
@@ -1908,19 +2303,10 @@ def handle_prune_signed_copies(goptions, session, args):
     total_files = 0
     total_space = 0
 
-    def _histline(event_id, x):
-        if event_id == x['revoke_event']:
-            ts = x['revoke_ts']
-            fmt = "Untagged %(name)s-%(version)s-%(release)s from %(tag_name)s"
-        elif event_id == x['create_event']:
-            ts = x['create_ts']
-            fmt = "Tagged %(name)s-%(version)s-%(release)s with %(tag_name)s"
-            if x['active']:
-                fmt += " [still active]"
-        else:
-            raise koji.GenericError("No such event: (%r, %r)" % (event_id, x))
-        time_str = time.asctime(time.localtime(ts))
-        return "%s: %s" % (time_str, fmt % x)
+    if options.bulk:
+        total_files, total_space = _prune_signed_copies_bulk(options, session, builds,
+                                                             cutoff_ts)
+        builds = []
     for nvr, binfo in builds:
         # listBuilds returns slightly different data than normal
         if 'id' not in binfo:
@@ -1930,9 +2316,6 @@ def handle_prune_signed_copies(goptions, session, args):
         if options.debug:
             print("DEBUG: %s" % nvr)
         # see how recently this build was latest for a tag
-        is_latest = False
-        is_protected = False
-        last_latest = None
         tags = {}
         for entry in session.queryHistory(build=binfo['id'])['tag_listing']:
             # we used queryHistory rather than listTags so we can consider tags
@@ -1940,243 +2323,26 @@ def handle_prune_signed_copies(goptions, session, args):
             tags.setdefault(entry['tag.name'], 1)
         if options.debug:
             print("Tags: %s" % to_list(tags.keys()))
-        for tag_name in tags:
-            if tag_name == options.trashcan_tag:
-                if options.debug:
-                    print("Ignoring trashcan tag for build %s" % nvr)
-                continue
-            ignore_tag = False
-            for pattern in options.ignore_tag:
-                if fnmatch.fnmatch(tag_name, pattern):
-                    if options.debug:
-                        print("Ignoring tag %s for build %s" % (tag_name, nvr))
-                    ignore_tag = True
-                    break
-            if ignore_tag:
-                continue
-            # in order to determine how recently this build was latest, we have
-            # to look at the tagging history.
-            hist = session.queryHistory(tag=tag_name, package=binfo['name'])['tag_listing']
-            if not hist:
-                # really shouldn't happen
-                raise koji.GenericError("No history found for %s in %s" % (nvr, tag_name))
-            timeline = []
-            for x in hist:
-                # note that for revoked entries, we're effectively splitting them into
-                # two parts: creation and revocation.
-                timeline.append((x['create_event'], 1, x))
-                # at the same event, revokes happen first
-                if x['revoke_event'] is not None:
-                    timeline.append((x['revoke_event'], 0, x))
-            timeline.sort(key=lambda entry: entry[:2])
-            # find most recent creation entry for our build and crop there
-            latest_ts = None
-            for i in range(len(timeline) - 1, -1, -1):
-                # searching in reverse cronological order
-                event_id, is_create, entry = timeline[i]
-                if entry['build_id'] == binfo['id'] and is_create:
-                    latest_ts = event_id
-                    break
-            if not latest_ts:
-                # really shouldn't happen
-                raise koji.GenericError("No creation event found for %s in %s" % (nvr, tag_name))
-            our_entry = entry
-            if options.debug:
-                print(_histline(event_id, our_entry))
-            # now go through the events since most recent creation entry
-            timeline = timeline[i + 1:]
-            if not timeline:
-                is_latest = True
-                if options.debug:
-                    print("%s is latest in tag %s" % (nvr, tag_name))
-                break
-            # before we go any further, is this a protected tag?
-            protect_tag = False
-            for pattern in options.protect_tag:
-                if fnmatch.fnmatch(tag_name, pattern):
-                    protect_tag = True
-                    break
-            if protect_tag:
-                # we use the same time limit as for the latest calculation
-                # if this build was in this tag within that limit, then we will
-                # not prune its signed copies
-                if our_entry['revoke_event'] is None:
-                    # we're still tagged with a protected tag
-                    if options.debug:
-                        print("Build %s has protected tag %s" % (nvr, tag_name))
-                    is_protected = True
-                    break
-                elif our_entry['revoke_ts'] > cutoff_ts:
-                    # we were still tagged here sometime before the cutoff
-                    if options.debug:
-                        print("Build %s had protected tag %s until %s"
-                              % (nvr, tag_name,
-                                 time.asctime(time.localtime(our_entry['revoke_ts']))))
-                    is_protected = True
-                    break
-            replaced_ts = None
-            revoke_ts = None
-            others = {}
-            for event_id, is_create, entry in timeline:
-                # So two things can knock this build from the title of latest:
-                #  - it could be untagged (entry revoked)
-                #  - another build could become latest (replaced)
-                # Note however that if the superceding entry is itself revoked, then
-                # our build could become latest again
-                if options.debug:
-                    print(_histline(event_id, entry))
-                if entry['build_id'] == binfo['id']:
-                    if is_create:
-                        # shouldn't happen
-                        raise koji.GenericError("Duplicate creation event found for %s in %s"
-                                                % (nvr, tag_name))
-                    else:
-                        # we've been revoked
-                        revoke_ts = entry['revoke_ts']
-                        break
-                else:
-                    if is_create:
-                        # this build has become latest
-                        replaced_ts = entry['create_ts']
-                        if entry['active']:
-                            # this entry not revoked yet, so we're done for this tag
-                            break
-                        # since this entry is revoked later, our build might eventually be
-                        # uncovered, so we have to keep looking
-                        others[entry['build_id']] = 1
-                    else:
-                        # other build revoked
-                        # see if our build has resurfaced
-                        if entry['build_id'] in others:
-                            del others[entry['build_id']]
-                        if replaced_ts is not None and not others:
-                            # we've become latest again
-                            # (note: we're not revoked yet because that triggers a break above)
-                            replaced_ts = None
-                            latest_ts = entry['revoke_ts']
-            if last_latest is None:
-                timestamps = []
-            else:
-                timestamps = [last_latest]
-            if revoke_ts is None:
-                if replaced_ts is None:
-                    # turns out we are still latest
-                    is_latest = True
-                    if options.debug:
-                        print("%s is latest (again) in tag %s" % (nvr, tag_name))
-                    break
-                else:
-                    # replaced (but not revoked)
-                    timestamps.append(replaced_ts)
-                    if options.debug:
-                        print("tag %s: %s not latest (replaced %s)"
-                              % (tag_name, nvr, time.asctime(time.localtime(replaced_ts))))
-            elif replaced_ts is None:
-                # revoked but not replaced
-                timestamps.append(revoke_ts)
-                if options.debug:
-                    print("tag %s: %s not latest (revoked %s)"
-                          % (tag_name, nvr, time.asctime(time.localtime(revoke_ts))))
-            else:
-                # revoked AND replaced
-                timestamps.append(min(revoke_ts, replaced_ts))
-                if options.debug:
-                    print("tag %s: %s not latest (revoked %s, replaced %s)"
-                          % (tag_name, nvr, time.asctime(time.localtime(revoke_ts)),
-                             time.asctime(time.localtime(replaced_ts))))
-            last_latest = max(timestamps)
-            if last_latest > cutoff_ts:
-                if options.debug:
-                    print("%s was latest past the cutoff" % nvr)
-                is_latest = True
-                break
-        if is_latest:
-            continue
-        if is_protected:
+
+        def get_history(tag_name):
+            return session.queryHistory(tag=tag_name, package=binfo['name'])['tag_listing']
+
+        if _prune_keep_build(options, cutoff_ts, nvr, binfo, tags, get_history):
             continue
         # not latest anywhere since cutoff, so we can remove all signed copies
         rpms = session.listRPMs(buildID=binfo['id'])
         session.multicall = True
         for rpminfo in rpms:
             session.queryRPMSigs(rpm_id=rpminfo['id'])
-        by_sig = {}
-        # index by sig
-        for rpminfo, [sigs] in zip(rpms, session.multiCall()):
-            for sig in sigs:
-                sigkey = sig['sigkey']
-                by_sig.setdefault(sigkey, []).append(rpminfo)
-        builddir = koji.pathinfo.build(binfo)
-        build_files = 0
-        build_space = 0
-        if not by_sig and options.debug:
-            print("(build has no signatures)")
-        for sigkey, rpms in six.iteritems(by_sig):
-            mycount = 0
-            archdirs = {}
-            sigdirs = {}
-            for rpminfo in rpms:
-                signedpath = "%s/%s" % (builddir, koji.pathinfo.signed(rpminfo, sigkey))
-                try:
-                    st = os.lstat(signedpath)
-                except OSError:
-                    continue
-                if not stat.S_ISREG(st.st_mode):
-                    # warn about this
-                    print("Skipping %s. Not a regular file" % signedpath)
-                    continue
-                if st.st_mtime > cutoff_ts:
-                    print("Skipping %s. File newer than cutoff" % signedpath)
-                    continue
-                if options.test:
-                    print("Would have unlinked: %s" % signedpath)
-                else:
-                    if options.verbose:
-                        print("Unlinking: %s" % signedpath)
-                    try:
-                        os.unlink(signedpath)
-                    except OSError as e:
-                        print("Error removing %s: %s" % (signedpath, e))
-                        print("This script needs write access to %s" % koji.BASEDIR)
-                        continue
-                mycount += 1
-                build_files += 1
-                build_space += st.st_size
-                # XXX - this makes some layout assumptions, but
-                #      pathinfo doesn't report what we need
-                mydir = os.path.dirname(signedpath)
-                archdirs[mydir] = 1
-                sigdirs[os.path.dirname(mydir)] = 1
-            for dir in archdirs:
-                if options.test:
-                    print("Would have removed dir: %s" % dir)
-                else:
-                    if options.verbose:
-                        print("Removing dir: %s" % dir)
-                    try:
-                        os.rmdir(dir)
-                    except OSError as e:
-                        print("Error removing %s: %s" % (signedpath, e))
-            if len(sigdirs) == 1:
-                dir = to_list(sigdirs.keys())[0]
-                if options.test:
-                    print("Would have removed dir: %s" % dir)
-                else:
-                    if options.verbose:
-                        print("Removing dir: %s" % dir)
-                    try:
-                        os.rmdir(dir)
-                    except OSError as e:
-                        print("Error removing %s: %s" % (signedpath, e))
-            elif len(sigdirs) > 1:
-                warn("More than one signature dir for %s: %r" % (sigkey, sigdirs))
+        sigs = [rpm_sigs for [rpm_sigs] in session.multiCall()]
+        build_files, build_space = _prune_build_copies(options, cutoff_ts, nvr, binfo, rpms,
+                                                       sigs)
         if build_files:
             total_files += build_files
             total_space += build_space
             if options.verbose:
                 print("Build: %s, Removed %i signed copies (%i bytes). Total: %i/%i"
                       % (nvr, build_files, build_space, total_files, total_space))
-        elif options.debug and by_sig:
-            print("(build has no signed copies)")
     print("--- Grand Totals ---")
     print("Files: %i" % total_files)
     print("Bytes: %i" % total_space)
@@ -6903,6 +7069,8 @@ def anon_handle_download_build(options, session, args):
     parser.add_option("--topurl", metavar="URL", default=options.topurl,
                       help="URL under which Koji files are accessible")
     parser.add_option("--noprogress", action="store_true", help="Do not display progress meter")
+    parser.add_option("-j", "--jobs", type="int", default=1, metavar="N",
+                      help="Download up to N files at once (implies --noprogress)")
     parser.add_option("-q", "--quiet", action="store_true",
                       help="Suppress output", default=options.quiet)
     (suboptions, args) = parser.parse_args(args)
@@ -6910,6 +7078,11 @@ def anon_handle_download_build(options, session, args):
         parser.error("Please specify a package N-V-R or build ID")
     elif len(args) > 1:
         parser.error("Only a single package N-V-R or build ID may be specified")
+    if suboptions.jobs < 1:
+        parser.error("The number of jobs must be at least 1")
+    if suboptions.jobs > 1:
+        # progress meters of parallel downloads would overwrite each other
+        suboptions.noprogress = True
 
     ensure_connection(session, options)
     build = args[0]
@@ -6997,14 +7170,13 @@ def anon_handle_download_build(options, session, args):
 
     size = len(rpms) + len(unsigned) + len(archives)
     number = 0
+    pool = DownloadPool(suboptions.jobs)
 
-    # run the download
-    for rpm in rpms:
-        number += 1
+    def download_signed_rpm(rpm, number):
         try:
             download_rpm(info, rpm, suboptions.topurl, sigkey=suboptions.key,
                          quiet=suboptions.quiet, noprogress=suboptions.noprogress, num=number,
-                         size=size)
+                         size=size, session=pool.session)
         except HTTPError as err:
             # this is necessary even with the 'unsigned' handling above
             # because sometimes queryRPMSigs will still tell us a
@@ -7013,17 +7185,24 @@ def anon_handle_download_build(options, session, args):
             if suboptions.key and suboptions.fallback_unsigned and err.response.status_code == 404:
                 warn("Signed copy not present, will download unsigned copy")
                 download_rpm(info, rpm, suboptions.topurl, sigkey=None, quiet=suboptions.quiet,
-                             noprogress=suboptions.noprogress, num=number, size=size)
+                             noprogress=suboptions.noprogress, num=number, size=size,
+                             session=pool.session)
             else:
                 raise
+
+    # run the download
+    for rpm in rpms:
+        number += 1
+        pool.add(download_signed_rpm, rpm, number)
     for rpm in unsigned:
         number += 1
-        download_rpm(info, rpm, suboptions.topurl, sigkey=None, quiet=suboptions.quiet,
-                     noprogress=suboptions.noprogress, num=number, size=size)
+        pool.add(download_rpm, info, rpm, suboptions.topurl, sigkey=None, quiet=suboptions.quiet,
+                 noprogress=suboptions.noprogress, num=number, size=size, session=pool.session)
     for archive in archives:
         number += 1
-        download_archive(info, archive, suboptions.topurl, quiet=suboptions.quiet,
-                         noprogress=suboptions.noprogress, num=number, size=size)
+        pool.add(download_archive, info, archive, suboptions.topurl, quiet=suboptions.quiet,
+                 noprogress=suboptions.noprogress, num=number, size=size, session=pool.session)
+    pool.wait()
 
 
 def anon_handle_download_logs(options, session, args):
@@ -7049,10 +7228,14 @@ def anon_handle_download_logs(options, session, args):
                       help="Continue previous download")
     parser.add_option("-d", "--dir", metavar="DIRECTORY", default='kojilogs',
                       help="Write logs to DIRECTORY")
+    parser.add_option("-j", "--jobs", type="int", default=1, metavar="N",
+                      help="Download up to N build logs at once")
     (suboptions, args) = parser.parse_args(args)
 
     if len(args) < 1:
         parser.error("Please specify at least one task id or n-v-r")
+    if suboptions.jobs < 1:
+        parser.error("The number of jobs must be at least 1")
 
     def write_fail_log(task_log_dir, task_id):
         """Gets output only from failed tasks"""
@@ -7136,6 +7319,7 @@ def anon_handle_download_logs(options, session, args):
                 save_logs(child_task['id'], match, task_log_dir, recurse)
 
     ensure_connection(session, options)
+    pool = DownloadPool(suboptions.jobs)
     for arg in args:
         task_id = None
         build_id = None
@@ -7174,7 +7358,9 @@ def anon_handle_download_logs(options, session, args):
                     continue
                 if match and not koji.util.multi_fnmatch(log['name'], match):
                     continue
-                download_file(url, filepath)
+                pool.add(download_file, url, filepath, noprogress=suboptions.jobs > 1,
+                         session=pool.session)
+    pool.wait()
 
 
 def anon_handle_download_task(options, session, args):
@@ -7191,6 +7377,8 @@ def anon_handle_download_task(options, session, args):
     parser.add_option("--topurl", metavar="URL", default=options.topurl,
                       help="URL under which Koji files are accessible")
     parser.add_option("--noprogress", action="store_true", help="Do not display progress meter")
+    parser.add_option("-j", "--jobs", type="int", default=1, metavar="N",
+                      help="Download up to N files at once (implies --noprogress)")
     parser.add_option("--wait", action="store_true",
                       help="Wait for running tasks to finish, even if running in the background")
     parser.add_option("--nowait", action="store_false", dest="wait",
@@ -7211,6 +7399,11 @@ def anon_handle_download_task(options, session, args):
         parser.error("Please specify a task ID")
     elif len(args) > 1:
         parser.error("Only one task ID may be specified")
+    if suboptions.jobs < 1:
+        parser.error("The number of jobs must be at least 1")
+    if suboptions.jobs > 1:
+        # progress meters of parallel downloads would overwrite each other
+        suboptions.noprogress = True
 
     base_task_id = int(args.pop())
     if len(suboptions.arches) > 0:
@@ -7338,6 +7531,7 @@ def anon_handle_download_task(options, session, args):
     pathinfo = koji.PathInfo(topdir=suboptions.topurl)
     files_downloaded = []
     dirpertask_msg = False
+    pool = DownloadPool(suboptions.jobs)
     for (task, filename, volume, new_filename, task_id) in downloads:
         if suboptions.dirpertask:
             koji.ensuredir(task_id)
@@ -7353,14 +7547,16 @@ def anon_handle_download_task(options, session, args):
             error('Invalid file name: %s' % filename)
         url = '%s/%s/%s' % (pathinfo.work(volume), pathinfo.taskrelpath(task["id"]), filename)
         if (new_filename, volume) not in files_downloaded:
-            download_file(url, new_filename, quiet=suboptions.quiet,
-                          noprogress=suboptions.noprogress, size=len(downloads), num=number)
+            pool.add(download_file, url, new_filename, quiet=suboptions.quiet,
+                     noprogress=suboptions.noprogress, size=len(downloads), num=number,
+                     session=pool.session)
             files_downloaded.append((new_filename, volume))
         else:
             if not suboptions.quiet:
                 print("Downloading [%d/%d]: %s" % (number, len(downloads), new_filename))
                 print("File %s already downloaded, skipping" % new_filename)
             dirpertask_msg = True
+    pool.wait()
     if dirpertask_msg:
         warn("Duplicate files, for download all duplicate files use --dirpertask.")
 
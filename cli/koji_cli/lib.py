@@ -9,6 +9,7 @@ import random
 import socket
 import string
 import sys
+import threading
 import time
 from contextlib import closing
 from copy import copy
@@ -546,7 +547,7 @@ def linked_upload(localfile, path, name=None):
 
 
 def download_file(url, relpath, quiet=False, noprogress=False, size=None,
-                  num=None, filesize=None):
+                  num=None, filesize=None, session=None):
     """Download files from remote
 
     :param str url: URL to be downloaded
@@ -558,7 +559,9 @@ def download_file(url, relpath, quiet=False, noprogress=False, size=None,
     :param int num: download index (printed in verbose mode)
     :param int filesize: expected file size, used for appending to file, no
                          other checks are performed, caller is responsible for
-                         checking, that resulting file is valid."""
+                         checking, that resulting file is valid.
+    :param requests.Session session: session to download with (e.g. the
+                                     shared one of a DownloadPool)"""
 
     if '/' in relpath:
         koji.ensuredir(os.path.dirname(relpath))
@@ -569,7 +572,10 @@ def download_file(url, relpath, quiet=False, noprogress=False, size=None,
             print("Downloading: %s" % relpath)
 
     if not filesize:
-        response = requests.head(url, timeout=10, allow_redirects=True)
+        if session:
+            response = session.head(url, timeout=10, allow_redirects=True)
+        else:
+            response = requests.head(url, timeout=10, allow_redirects=True)
         if response.status_code == 200 and response.headers.get('Content-Length'):
             filesize = int(response.headers['Content-Length'])
 
@@ -591,10 +597,12 @@ def download_file(url, relpath, quiet=False, noprogress=False, size=None,
         # rewrite
         f = open(relpath, 'wb')
 
+    if not session:
+        session = koji.request_with_retry()
     mtime = None
     try:
         # closing needs to be used for requests < 2.18.0
-        with closing(koji.request_with_retry().get(url, headers=headers, stream=True)) as response:
+        with closing(session.get(url, headers=headers, stream=True)) as response:
             if response.status_code in (200, 416):  # full content provided or reaching behind EOF
                 # rewrite in such case
                 f.close()
@@ -630,7 +638,7 @@ def download_file(url, relpath, quiet=False, noprogress=False, size=None,
 
 
 def download_rpm(build, rpm, topurl, sigkey=None, quiet=False, noprogress=False, num=None,
-                 size=None):
+                 size=None, session=None):
     "Wrapper around download_file, do additional checks for rpm files"
     pi = koji.PathInfo(topdir=topurl)
     if sigkey:
@@ -643,7 +651,7 @@ def download_rpm(build, rpm, topurl, sigkey=None, quiet=False, noprogress=False,
     path = os.path.basename(fname)
 
     download_file(url, path, quiet=quiet, noprogress=noprogress, filesize=filesize, num=num,
-                  size=size)
+                  size=size, session=session)
 
     # size - we have stored size only for unsigned copies
     if not sigkey:
@@ -668,7 +676,8 @@ def download_rpm(build, rpm, topurl, sigkey=None, quiet=False, noprogress=False,
         error("Downloaded rpm %s doesn't match db, deleting" % path)
 
 
-def download_archive(build, archive, topurl, quiet=False, noprogress=False, num=None, size=None):
+def download_archive(build, archive, topurl, quiet=False, noprogress=False, num=None, size=None,
+                     session=None):
     "Wrapper around download_file, do additional checks for archive files"
 
     pi = koji.PathInfo(topdir=topurl)
@@ -688,7 +697,7 @@ def download_archive(build, archive, topurl, quiet=False, noprogress=False, num=
         path = archive['filename']
 
     download_file(url, path, quiet=quiet, noprogress=noprogress, filesize=archive['size'], num=num,
-                  size=size)
+                  size=size, session=session)
 
     # check size
     if os.path.getsize(path) != archive['size']:
@@ -716,6 +725,56 @@ def download_archive(build, archive, topurl, quiet=False, noprogress=False, num=
         error("Downloaded archive %s doesn't match checksum, deleting" % path)
 
 
+class DownloadPool(object):
+    """Run downloads in parallel over a shared connection pool
+
+    Downloads are added as a function and its arguments, e.g. download_file
+    with session=pool.session. With jobs=1 they run right away in the calling
+    thread. Otherwise they are queued and wait() runs them with up to jobs
+    threads. Once a download fails, no further queued ones are started and
+    wait() raises the first error after the running ones are finished.
+    """
+
+    def __init__(self, jobs=1):
+        self.jobs = max(jobs or 1, 1)
+        self.session = koji.request_with_retry(pool_maxsize=self.jobs)
+        self.queue = six.moves.queue.Queue()
+        self.errors = []
+
+    def add(self, func, *args, **kwargs):
+        if self.jobs == 1:
+            func(*args, **kwargs)
+        else:
+            self.queue.put((func, args, kwargs))
+
+    def _worker(self):
+        while not self.errors:
+            try:
+                func, args, kwargs = self.queue.get_nowait()
+            except six.moves.queue.Empty:
+                return
+            try:
+                func(*args, **kwargs)
+            except (Exception, SystemExit) as e:
+                # the download_* checks call error(), which exits
+                self.errors.append(e)
+
+    def wait(self):
+        """Run the queued downloads and wait for them to finish"""
+        workers = min(self.jobs, self.queue.qsize())
+        threads = [threading.Thread(target=self._worker) for i in range(workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            err = self.errors[0]
+            self.errors = []
+            self.queue = six.moves.queue.Queue()
+            raise err
+
+
 def _download_progress(download_t, download_d, size=None):
     if download_t == 0:
         percent_done = 0.0
@@ -41,6 +41,7 @@ import socket
 import struct
 import sys
 import tempfile
+import threading
 import time
 import traceback
 import warnings
@@ -68,6 +69,7 @@ from requests.packages.urllib3.util.retry import Retry
 from requests.packages.urllib3.exceptions import MaxRetryError, HostChangedError
 from six.moves import range, zip
 
+from koji import jsonrpc
 from koji.tasks import parse_task_params
 from koji.xmlrpcplus import DateTime, Fault, dumps, getparser, loads, xmlrpc_client  # noqa: F401
 
@@ -2001,13 +2003,18 @@ def format_exc_plus():
 
 
 def request_with_retry(retries=3, backoff_factor=0.3,
-                       status_forcelist=(500, 502, 504, 408, 429), session=None):
+                       status_forcelist=(500, 502, 504, 408, 429), session=None,
+                       pool_maxsize=None):
     # stolen from https://www.peterbe.com/plog/best-practice-with-retries-with-requests
     session = session or requests.Session()
     retry = Retry(total=retries, read=retries, connect=retries,
                   backoff_factor=backoff_factor,
                   status_forcelist=status_forcelist)
-    adapter = HTTPAdapter(max_retries=retry)
+    if pool_maxsize:
+        # keep up to pool_maxsize connections per host for threaded use
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+    else:
+        adapter = HTTPAdapter(max_retries=retry)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -2136,6 +2143,7 @@ def read_config(profile_name, user_config=None):
         'auth_timeout': DEFAULT_AUTH_TIMEOUT,
         'use_fast_upload': True,
         'upload_blocksize': 1048576,
+        'upload_workers': 1,
         'poll_interval': 6,
         'principal': None,
         'keytab': None,
@@ -2145,6 +2153,7 @@ def read_config(profile_name, user_config=None):
         'authtype': None,
         'debug': False,
         'debug_xmlrpc': False,
+        'use_json': False,
         'pyver': None,
         'plugin_paths': None,
         'force_auth': False,
@@ -2184,12 +2193,12 @@ def read_config(profile_name, user_config=None):
             # not have a default value set in the option parser.
             if name in result:
                 if name in ('anon_retry', 'offline_retry', 'use_fast_upload',
-                            'debug', 'debug_xmlrpc', 'force_auth'):
+                            'debug', 'debug_xmlrpc', 'use_json', 'force_auth'):
                     result[name] = config.getboolean(profile_name, name)
                 elif name in ('max_retries', 'retry_interval',
                               'offline_retry_interval', 'poll_interval',
                               'timeout', 'auth_timeout',
-                              'upload_blocksize', 'pyver'):
+                              'upload_blocksize', 'upload_workers', 'pyver'):
                     try:
                         result[name] = int(value)
                     except ValueError:
@@ -2586,8 +2595,10 @@ def grab_session_options(options):
         'auth_timeout',
         'use_fast_upload',
         'upload_blocksize',
+        'upload_workers',
         'no_ssl_verify',
         'serverca',
+        'use_json',
     )
     # cert is omitted for now
     if isinstance(options, dict):
@@ -2633,6 +2644,8 @@ class ClientSession(object):
         self.exclusive = False
         self.auth_method = auth_method
         self.__hub_version = None
+        # set once the hub tells us it accepts json requests
+        self.__hub_json = False
 
     @property
     def hub_version(self):
@@ -2997,16 +3010,21 @@ class ClientSession(object):
         else:
             handler = self.baseurl
 
-        request = dumps(args, name, allow_none=1)
-        if six.PY3:
-            # For python2, dumps() without encoding specified means return a str
-            # encoded as UTF-8. For python3 it means "return a str with an appropriate
-            # xml declaration for encoding as UTF-8".
-            request = request.encode('utf-8')
+        if self.opts.get('use_json') and self.__hub_json:
+            request = jsonrpc.dumps(args, name).encode('utf-8')
+            content_type = jsonrpc.CONTENT_TYPE
+        else:
+            request = dumps(args, name, allow_none=1)
+            if six.PY3:
+                # For python2, dumps() without encoding specified means return a str
+                # encoded as UTF-8. For python3 it means "return a str with an appropriate
+                # xml declaration for encoding as UTF-8".
+                request = request.encode('utf-8')
+            content_type = 'text/xml'
         headers += [
             # connection class handles Host
             ('User-Agent', 'koji/1'),
-            ('Content-Type', 'text/xml'),
+            ('Content-Type', content_type),
             ('Content-Length', str(len(request))),
         ]
         return handler, headers, request
@@ -3090,8 +3108,13 @@ class ClientSession(object):
             hub_version = r.headers.get('Koji-Version')
             if hub_version:
                 self.__hub_version = hub_version
+            if jsonrpc.CONTENT_TYPE in r.headers.get('Koji-Content-Types', '').split():
+                self.__hub_json = True
             try:
-                ret = self._read_xmlrpc_response(r)
+                if r.headers.get('Content-Type') == jsonrpc.CONTENT_TYPE:
+                    ret = self._read_json_response(r)
+                else:
+                    ret = self._read_xmlrpc_response(r)
             finally:
                 r.close()
         return ret
@@ -3108,6 +3131,18 @@ class ClientSession(object):
             result = result[0]
         return result
 
+    def _read_json_response(self, response):
+        p, u = jsonrpc.getparser()
+        for chunk in response.iter_content(8192):
+            if self.opts.get('debug_xmlrpc', False):
+                self.logger.debug("body: %r" % chunk)
+            p.feed(chunk)
+        p.close()
+        result = u.close()
+        if len(result) == 1:
+            result = result[0]
+        return result
+
     def _renew_session(self):
         """Renew expirated session or subsession."""
         if not hasattr(self, 'auth_method'):
@@ -3287,9 +3322,22 @@ class ClientSession(object):
         if name is None:
             name = os.path.basename(localfile)
         self.logger.debug("Fast upload: %s to %s/%s", localfile, path, name)
+        size = os.path.getsize(localfile)
+        workers = self.opts.get('upload_workers') or 1
+        if workers > 1 and size > blocksize * 2:
+            try:
+                self._parallelUpload(localfile, path, name, size, callback, blocksize,
+                                     overwrite, volume, workers)
+                return
+            except (SystemExit, KeyboardInterrupt):
+                raise
+            except Exception as e:
+                self.logger.warning("Parallel upload of %s failed, retrying sequentially: %s",
+                                    localfile, e)
+                # start over, replacing whatever we uploaded so far
+                overwrite = True
         fo = open(localfile, 'rb')
         ofs = 0
-        size = os.path.getsize(localfile)
         start = time.time()
         if callback:
             callback(0, size, 0, 0, 0)
@@ -3324,27 +3372,144 @@ class ClientSession(object):
             # max is to prevent possible divide by zero in callback function
             if callback:
                 callback(ofs, size, len(chunk), t1, t2)
+        fo.close()
         if ofs != size:
             self.logger.error("Local file changed size: %s, %s -> %s", localfile, size, ofs)
+        self._checkUpload(path, name, ofs, volume, problems and full_chksum.hexdigest())
+        self.logger.debug("Fast upload: %s complete. %i bytes in %.1f seconds",
+                          localfile, size, t2)
+
+    def _checkUpload(self, path, name, size, volume=None, hexdigest=None):
+        """Verify an uploaded file
+
+        The checksum is only verified if hexdigest is given
+        """
         chk_opts = {}
         if volume and volume != 'DEFAULT':
             chk_opts['volume'] = volume
-        if problems:
+        if hexdigest:
             chk_opts['verify'] = 'adler32'
         result = self._callMethod('checkUpload', (path, name), chk_opts)
         if result is None:
             raise GenericError("File upload failed: %s/%s" % (path, name))
-        if int(result['size']) != ofs:
+        if int(result['size']) != size:
             raise GenericError("Uploaded file is wrong length: %s/%s, %s != %s"
-                               % (path, name, result['size'], ofs))
-        if problems and result['hexdigest'] != full_chksum.hexdigest():
+                               % (path, name, result['size'], size))
+        if hexdigest and result['hexdigest'] != hexdigest:
             raise GenericError("Uploaded file has wrong checksum: %s/%s, %s != %s"
-                               % (path, name, result['hexdigest'], full_chksum.hexdigest()))
-        self.logger.debug("Fast upload: %s complete. %i bytes in %.1f seconds",
-                          localfile, size, t2)
+                               % (path, name, result['hexdigest'], hexdigest))
+
+    def _uploadChunk(self, chunk, ofs, path, name, callopts):
+        """Upload a single chunk and verify the result"""
+        result = self._callMethod('rawUpload', (chunk, ofs, path, name), callopts)
+        hexdigest = util.adler32_constructor(chunk).hexdigest()
+        if result['size'] != len(chunk):
+            raise GenericError("server returned wrong chunk size: %s != %s" %
+                               (result['size'], len(chunk)))
+        if result['hexdigest'] != hexdigest:
+            raise GenericError('upload checksum failed: %s != %s'
+                               % (result['hexdigest'], hexdigest))
+        # report whether we had to retry
+        return self.retries > 1
+
+    def _parallelUpload(self, localfile, path, name, size, callback, blocksize, overwrite,
+                        volume, workers):
+        """Upload a file with several chunks in flight at once
+
+        The first chunk is uploaded on its own (it creates or truncates the
+        file), the remaining chunks are uploaded by worker threads, each using
+        its own subsession. Raises an error if any chunk fails.
+        """
+        start = time.time()
+        if callback:
+            callback(0, size, 0, 0, 0)
+        callopts = {'overwrite': overwrite}
+        if volume and volume != 'DEFAULT':
+            callopts['volume'] = volume
+        with open(localfile, 'rb') as fo:
+            chunk = fo.read(blocksize)
+        problems = self._uploadChunk(chunk, 0, path, name, callopts)
+        if callback:
+            now = time.time()
+            callback(len(chunk), size, len(chunk), max(now - start, 0.00001),
+                     max(now - start, 0.00001))
+
+        todo = six.moves.queue.Queue()
+        offsets = list(range(len(chunk), size, blocksize))
+        for ofs in offsets:
+            todo.put(ofs)
+        done = six.moves.queue.Queue()
+        stop = []
+        callopts = {'parallel': True}
+        if volume and volume != 'DEFAULT':
+            callopts['volume'] = volume
+
+        def worker(session):
+            with open(localfile, 'rb') as fo:
+                while not stop:
+                    try:
+                        ofs = todo.get_nowait()
+                    except six.moves.queue.Empty:
+                        return
+                    lap = time.time()
+                    try:
+                        fo.seek(ofs)
+                        chunk = fo.read(blocksize)
+                        retried = session._uploadChunk(chunk, ofs, path, name, callopts)
+                    except Exception as e:
+                        done.put((ofs, 0, None, e))
+                        return
+                    done.put((ofs, len(chunk), time.time() - lap, retried))
+
+        workers = min(workers, len(offsets))
+        sessions = []
+        threads = []
+        try:
+            for i in range(workers):
+                sessions.append(self.subsession())
+            for session in sessions:
+                thread = threading.Thread(target=worker, args=(session,))
+                thread.daemon = True
+                thread.start()
+                threads.append(thread)
+            uploaded = len(chunk)
+            for i in range(len(offsets)):
+                ofs, length, lap, result = done.get()
+                if isinstance(result, Exception):
+                    raise result
+                problems = problems or result
+                uploaded += length
+                if callback:
+                    callback(uploaded, size, length, max(lap, 0.00001),
+                             max(time.time() - start, 0.00001))
+        finally:
+            stop.append(True)
+            for thread in threads:
+                thread.join()
+            for session in sessions:
+                try:
+                    session.logout()
+                except Exception:
+                    self.logger.debug("Failed to close upload session", exc_info=True)
+        if uploaded != size:
+            raise GenericError("Local file changed size: %s, %s -> %s"
+                               % (localfile, size, uploaded))
+        hexdigest = None
+        if problems:
+            full_chksum = util.adler32_constructor()
+            with open(localfile, 'rb') as fo:
+                while True:
+                    chunk = fo.read(blocksize)
+                    if not chunk:
+                        break
+                    full_chksum.update(chunk)
+            hexdigest = full_chksum.hexdigest()
+        self._checkUpload(path, name, size, volume, hexdigest)
+        self.logger.debug("Fast upload: %s complete. %i bytes in %.1f seconds with %i workers",
+                          localfile, size, time.time() - start, workers)
 
     def _prepUpload(self, chunk, offset, path, name, verify="adler32", overwrite=False,
-                    volume=None):
+                    volume=None, parallel=False):
         """prep a rawUpload call"""
         if not self.logged_in:
             raise ActionNotAllowed("you must be logged in to upload")
@@ -3360,6 +3525,8 @@ class ClientSession(object):
             args['overwrite'] = "1"
         if volume is not None:
             args['volume'] = volume
+        if parallel:
+            args['parallel'] = "1"
         size = len(chunk)
         self.callnum += 1
         headers = []
@@ -3552,10 +3719,20 @@ class MultiCallSession(object):
 
     """Manages a single multicall, acts like a session"""
 
-    def __init__(self, session, strict=False, batch=None):
+    def __init__(self, session, strict=False, batch=None, workers=None, batch_timeout=None,
+                 batch_retries=None, worker_sessions=None):
         self._session = session
         self._strict = strict
         self._batch = batch
+        self._workers = workers
+        if worker_sessions and (batch_timeout is not None or batch_retries is not None):
+            # the options of these sessions are set when they are opened
+            raise ParameterError('batch_timeout and batch_retries cannot be used with '
+                                 'worker_sessions, pass them to the multicall which '
+                                 'opens the sessions')
+        self._batch_timeout = batch_timeout
+        self._batch_retries = batch_retries
+        self._worker_sessions = worker_sessions
         self._calls = []
 
     def __getattr__(self, name):
@@ -3574,19 +3751,34 @@ class MultiCallSession(object):
         """compatibility wrapper for _callMethod"""
         return self._callMethod(name, args, opts)
 
-    def call_all(self, strict=None, batch=None):
+    def call_all(self, strict=None, batch=None, workers=None):
         """Perform all calls in one or more multiCall batches
 
         Returns a list of results for each call. For successful calls, the
         entry will be a singleton list. For calls that raised a fault, the
         entry will be a dictionary with keys "faultCode", "faultString",
         and "traceback".
+
+        If workers is greater than one, up to that many batches are sent
+        concurrently, each worker using its own connection (and its own
+        subsession if the session is logged in). The order in which batches
+        are handled by the hub is then not defined, so this is only suitable
+        for independent calls. The batch_timeout and batch_retries options
+        of the multicall override the timeout and max_retries session options
+        for these batches.
+
+        If the multicall was given a list of worker_sessions, the workers use
+        those instead, and they are left open so that they can be reused by
+        later multicalls. The batch_timeout and batch_retries options are then
+        those of the multicall that opened them with open_worker_sessions.
         """
 
         if strict is None:
             strict = self._strict
         if batch is None:
             batch = self._batch
+        if workers is None:
+            workers = self._workers
 
         if len(self._calls) == 0:
             return []
@@ -3601,12 +3793,12 @@ class MultiCallSession(object):
         else:
             batches = [calls]
         results = []
-        for calls in batches:
-            args = ([c.format() for c in calls],)
-            _results = self._session._callMethod('multiCall', args, {})
-            for call, result in zip(calls, _results):
-                call._result = result
-            results.extend(_results)
+        if workers and workers > 1 and len(batches) > 1:
+            for _results in self._call_batches_parallel(batches, workers):
+                results.extend(_results)
+        else:
+            for calls in batches:
+                results.extend(self._call_batch(self._session, calls))
         if strict:
             # check for faults and raise first one
             for entry in results:
@@ -3616,6 +3808,101 @@ class MultiCallSession(object):
                     raise err
         return results
 
+    def _call_batch(self, session, calls):
+        args = ([c.format() for c in calls],)
+        _results = session._callMethod('multiCall', args, {})
+        for call, result in zip(calls, _results):
+            call._result = result
+        return _results
+
+    def _worker_session(self):
+        """Create a session for a multicall worker thread"""
+        session = self._session
+        if session.logged_in:
+            # sessions are not thread safe and the hub requires call numbers to
+            # increase within a session, so each worker gets a subsession
+            worker = session.subsession()
+        else:
+            worker = type(session)(session.baseurl, opts=session.opts)
+        # the sessions have their own copy of the options
+        if self._batch_timeout is not None:
+            worker.opts['timeout'] = self._batch_timeout
+        if self._batch_retries is not None:
+            worker.opts['max_retries'] = self._batch_retries
+        return worker
+
+    def _call_batches_parallel(self, batches, workers):
+        """Send the batches using a pool of worker threads
+
+        Returns the results of each batch, in order
+        """
+        workers = min(workers, len(batches))
+        self._session.logger.debug("MultiCall with %i workers", workers)
+        results = [None] * len(batches)
+        todo = six.moves.queue.Queue()
+        for item in enumerate(batches):
+            todo.put(item)
+        errors = []
+
+        def worker(session):
+            while not errors:
+                try:
+                    n, calls = todo.get_nowait()
+                except six.moves.queue.Empty:
+                    return
+                try:
+                    results[n] = self._call_batch(session, calls)
+                except Exception as e:
+                    # stop handing out batches
+                    errors.append(e)
+
+        if self._worker_sessions:
+            # the sessions belong to the caller and stay open
+            self._run_workers(worker, self._worker_sessions[:workers])
+        else:
+            sessions = self.open_worker_sessions(workers)
+            try:
+                self._run_workers(worker, sessions)
+            finally:
+                self._close_sessions(sessions)
+        if errors:
+            raise errors[0]
+        return results
+
+    def open_worker_sessions(self, count):
+        """Open sessions for multicall workers
+
+        The sessions can be passed as worker_sessions to later multicalls, so
+        that they do not have to open (and log out) their own sessions each
+        time. The batch_timeout and batch_retries options of this multicall
+        apply to them. The caller should log them out when done.
+        """
+        sessions = []
+        try:
+            for i in range(count):
+                sessions.append(self._worker_session())
+        except Exception:
+            self._close_sessions(sessions)
+            raise
+        return sessions
+
+    def _close_sessions(self, sessions):
+        for session in sessions:
+            try:
+                session.logout()
+            except Exception:
+                self._session.logger.debug("Failed to close multicall worker session",
+                                           exc_info=True)
+
+    @staticmethod
+    def _run_workers(worker, sessions):
+        threads = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
     # alias for compatibility with ClientSession
     multiCall = call_all
 
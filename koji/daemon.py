@@ -732,6 +732,11 @@ class TaskManager(object):
         self.ready = False
         self.hostdata = {}
         self.task_load = 0.0
+        # waiting tasks woken up by the last updateTasks
+        self.alerted = set()
+        # whether the hub supports host.waitForWork and host.heartbeat
+        self.hub_wait = True
+        self.hub_heartbeat = True
         self.host_id = self.session.host.getID()
         self.start_ts = self.session.getSessionInfo()['start_ts']
         self.logger = logging.getLogger("koji.TaskManager")
@@ -771,7 +776,35 @@ class TaskManager(object):
         self.session.host.freeTasks(to_list(self.tasks.keys()))
         self.session.host.updateHost(task_load=0.0, ready=False)
 
-    def updateBuildroots(self, nolocal=False):
+    def heartbeat(self):
+        """Report our status and get the data for the next iteration in one call
+
+        The result can be passed to updateBuildroots, updateTasks and getNextTask.
+
+        :returns: the host.heartbeat data, or None if the hub does not support it
+        """
+        if not self.hub_heartbeat:
+            return None
+        # drop the tasks that finished since the last iteration, so that they
+        # do not count against our load and readiness
+        self.reapTasks()
+        # the host data from the last heartbeat is used, the hub checks it again
+        self.ready = self.readyForTask(hostdata=self.hostdata or None)
+        try:
+            heartbeat = self.session.host.heartbeat(self.task_load, self.ready,
+                                                    data=self._get_host_data(),
+                                                    task_ids=to_list(self.pids.keys()))
+        except koji.GenericError as e:
+            if 'Invalid method' not in str(e):
+                raise
+            self.logger.info('Hub does not support host.heartbeat, using separate calls')
+            self.hub_heartbeat = False
+            return None
+        self.hostdata = heartbeat['host']
+        self.ready = heartbeat['ready']
+        return heartbeat
+
+    def updateBuildroots(self, nolocal=False, heartbeat=None):
         """Handle buildroot cleanup/maintenance
 
         - examine current buildroots on system
@@ -781,10 +814,14 @@ class TaskManager(object):
             - /etc/mock/koji
 
         If nolocal is True, do not try to scan local buildroots.
+        If heartbeat data is given, the active buildroots are taken from it.
         """
         # query buildroots in db that are not expired
-        states = [koji.BR_STATES[x] for x in ('INIT', 'WAITING', 'BUILDING')]
-        db_br = self.session.listBuildroots(hostID=self.host_id, state=tuple(states))
+        if heartbeat:
+            db_br = heartbeat['buildroots']
+        else:
+            states = [koji.BR_STATES[x] for x in ('INIT', 'WAITING', 'BUILDING')]
+            db_br = self.session.listBuildroots(hostID=self.host_id, state=tuple(states))
         # index by id
         db_br = dict([(row['id'], row) for row in db_br])
         st_expired = koji.BR_STATES['EXPIRED']
@@ -954,7 +991,7 @@ class TaskManager(object):
                 buildroots[id]['dir'] = vardir
         return buildroots
 
-    def updateTasks(self):
+    def updateTasks(self, heartbeat=None):
         """Read and process task statuses from server
 
         The processing we do is:
@@ -964,13 +1001,22 @@ class TaskManager(object):
                 * remove buildroots
                     - with some possible exceptions
             2) wake waiting tasks if appropriate
+
+        If heartbeat data is given, the task statuses are taken from it.
         """
         tasks = {}
         stale = []
+        alerted = set()
         task_load = 0.0
         if self.pids:
             self.logger.info("pids: %r" % self.pids)
-        for task in self.session.host.getHostTasks():
+        if heartbeat:
+            host_tasks = heartbeat['tasks']
+            task_info = dict([(t['id'], t) for t in heartbeat['task_info']])
+        else:
+            host_tasks = self.session.host.getHostTasks()
+            task_info = {}
+        for task in host_tasks:
             self.logger.info("open task: %r" % task)
             # the tasks returned are those that are open and locked
             # by this host.
@@ -985,24 +1031,20 @@ class TaskManager(object):
                 # wake up the process
                 self.logger.info("Waking up task: %r" % task)
                 os.kill(self.pids[id], signal.SIGUSR2)
+                alerted.add(id)
             if not task['waiting']:
                 task_load += task['weight']
         self.logger.debug("Task Load: %s" % task_load)
         self.task_load = task_load
         self.tasks = tasks
+        self.alerted = alerted
         self.logger.debug("Current tasks: %r" % self.tasks)
         if len(stale) > 0:
             # A stale task is one which is opened to us, but we know nothing
             # about). This will happen after a daemon restart, for example.
             self.logger.info("freeing stale tasks: %r" % stale)
             self.session.host.freeTasks(stale)
-        for id, pid in list(self.pids.items()):
-            if self._waitTask(id, pid):
-                # the subprocess handles most everything, we just need to clear things out
-                if self.cleanupTask(id, wait=False):
-                    del self.pids[id]
-                if id in self.tasks:
-                    del self.tasks[id]
+        self.reapTasks()
         for id, pid in list(self.pids.items()):
             if id not in tasks:
                 # expected to happen when:
@@ -1011,7 +1053,9 @@ class TaskManager(object):
                 #    exits.
                 #  - task is canceled
                 #  - task is forcibly reassigned/unassigned
-                tinfo = self.session.getTaskInfo(id)
+                tinfo = task_info.get(id)
+                if tinfo is None:
+                    tinfo = self.session.getTaskInfo(id)
                 if tinfo is None:
                     raise koji.GenericError("Invalid task %r (pid %r)" % (id, pid))
                 elif tinfo['state'] == koji.TASK_STATES['CANCELED']:
@@ -1025,6 +1069,20 @@ class TaskManager(object):
                 else:
                     self.logger.info("Lingering task %r (pid %r)" % (id, pid))
 
+    def reapTasks(self):
+        """Clean up after the task processes that have exited
+
+        Their tasks are dropped from the current tasks and the task load.
+        """
+        for id, pid in list(self.pids.items()):
+            if self._waitTask(id, pid):
+                # the subprocess handles most everything, we just need to clear things out
+                if self.cleanupTask(id, wait=False):
+                    del self.pids[id]
+                task = self.tasks.pop(id, None)
+                if task and not task['waiting']:
+                    self.task_load -= task['weight']
+
     def _get_host_data(self):
         data = {
             'methods': list(self.handlers.keys()),
@@ -1036,19 +1094,27 @@ class TaskManager(object):
         }
         return data
 
-    def getNextTask(self):
+    def getNextTask(self, heartbeat=None):
         """Task the next task
 
+        If heartbeat data is given, our status has already been reported and the
+        assigned tasks are taken from it.
+
         :returns: True if a task was taken, False otherwise
         """
-        self.ready = self.readyForTask()
-        self.session.host.updateHost(self.task_load, self.ready, data=self._get_host_data())
+        if not heartbeat:
+            self.ready = self.readyForTask()
+            self.session.host.updateHost(self.task_load, self.ready,
+                                         data=self._get_host_data())
         if not self.ready:
             self.logger.info("Not ready for task")
             return False
 
         # get our assigned tasks
-        tasks = self.session.host.getTasks()
+        if heartbeat:
+            tasks = heartbeat['assigned']
+        else:
+            tasks = self.session.host.getTasks()
         for task in tasks:
             self.logger.debug("task: %r" % task)
             if task['id'] in self.tasks:
@@ -1072,6 +1138,33 @@ class TaskManager(object):
 
         return False
 
+    def waitForWork(self):
+        """Wait on the hub until there is something to do
+
+        The wait ends when a task is assigned to us, one of our tasks changes
+        or its subtasks finish. It is bounded by the long_poll_timeout option.
+
+        :returns: True if we waited, False if the caller should sleep instead
+        """
+        timeout = getattr(self.options, 'long_poll_timeout', 0)
+        if not timeout or not self.hub_wait:
+            return False
+        if set(self.pids) - set(self.tasks):
+            # a finished task process is still exiting, we need to poll for it
+            return False
+        try:
+            ret = self.session.host.waitForWork(list(self.tasks), list(self.alerted),
+                                                timeout)
+        except koji.GenericError as e:
+            if 'Invalid method' not in str(e):
+                raise
+            ret = None
+        if ret is None:
+            self.logger.info('Hub does not support waiting for work, polling instead')
+            self.hub_wait = False
+            return False
+        return True
+
     def _waitTask(self, task_id, pid=None):
         """Wait (nohang) on the task, return true if finished"""
         if pid is None:
@@ -1269,11 +1362,12 @@ class TaskManager(object):
             return False
         return True
 
-    def readyForTask(self):
+    def readyForTask(self, hostdata=None):
         """Determine if the system is ready to accept a new task.
 
         This function measures the system load and tries to determine
-        if there is room to accept a new task."""
+        if there is room to accept a new task. The host data is fetched
+        from the hub, unless it is given."""
         #       key resources to track:
         #               disk_space
         #                       df -P path
@@ -1293,7 +1387,9 @@ class TaskManager(object):
                 return False
             else:
                 raise koji.tasks.ServerRestart
-        self.hostdata = self.session.host.getHost()
+        if hostdata is None:
+            hostdata = self.session.host.getHost()
+        self.hostdata = hostdata
         self.logger.debug('hostdata: %r' % self.hostdata)
         if not self.hostdata['enabled']:
             self.status = "Host is disabled"
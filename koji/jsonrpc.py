@@ -0,0 +1,249 @@
+"""
+JSON encoding of koji calls
+
+This is an alternative to the xmlrpc encoding in koji.xmlrpcplus, negotiated via
+the Content-Type header. The data model is the same as our xmlrpc one:
+
+    - None is allowed
+    - integers are not limited to 32 bits
+    - generators are encoded as lists, regex patterns as their repr
+    - DateTime and datetime values are decoded as xmlrpc DateTime instances
+    - bytes are decoded as xmlrpc Binary instances
+    - dictionary keys must be strings
+    - errors are reported as a Fault
+
+Values which have no JSON representation are encoded with the JSON-RPC 1.0
+class hinting convention, e.g. {"__jsonclass__": ["DateTime", ["20240102T03:04:05"]]}
+Dictionaries which themselves have "__jsonclass__" as their only key are encoded
+as {"__jsonclass__": ["dict", [[["__jsonclass__", ...]]]]}, so they are not
+mistaken for class hints.
+"""
+
+from __future__ import absolute_import
+
+import base64
+import datetime
+import json
+import re
+import types
+
+import six
+
+from koji.xmlrpcplus import CHUNK_SIZE, ChunkWriter, DateTime, Fault, xmlrpc_client
+
+CONTENT_TYPE = 'application/json'
+
+Binary = xmlrpc_client.Binary
+
+try:
+    _pattern_type = re.Pattern
+except AttributeError:
+    _pattern_type = re._pattern_type
+
+
+class ExtendedEncoder(json.JSONEncoder):
+    """JSON encoder handling the koji data model
+
+    If datetime_as_string is set, datetime values are encoded as plain strings,
+    matching how the hub returns them via xmlrpc.
+
+    Like our xmlrpc Marshaller, the encoder writes its output piecewise via
+    dump(), consuming generators as it goes. Non-string dictionary keys raise
+    a TypeError, as they do with xmlrpc.
+    """
+
+    def __init__(self, datetime_as_string=False, **kwargs):
+        super(ExtendedEncoder, self).__init__(**kwargs)
+        self.datetime_as_string = datetime_as_string
+        if self.ensure_ascii:
+            self._encode_string = json.encoder.encode_basestring_ascii
+        else:
+            self._encode_string = json.encoder.encode_basestring
+
+    def iterencode(self, o, _one_shot=False):
+        chunks = []
+        self.dump(o, chunks.append)
+        return chunks
+
+    def dump(self, value, write):
+        """Encode value, passing the pieces of output to write"""
+        if value is None:
+            write('null')
+        elif value is True:
+            write('true')
+        elif value is False:
+            write('false')
+        elif isinstance(value, six.string_types):
+            write(self._encode_string(value))
+        elif isinstance(value, six.integer_types):
+            write(str(int(value)))
+        elif isinstance(value, float):
+            write(json.dumps(value, allow_nan=self.allow_nan))
+        elif isinstance(value, dict):
+            if len(value) == 1 and '__jsonclass__' in value:
+                # don't let it pass for a class hint
+                value = {'__jsonclass__': ['dict', [[[k, v] for k, v in value.items()]]]}
+            self._dump_dict(value, write)
+        elif isinstance(value, (list, tuple, types.GeneratorType)):
+            write('[')
+            first = True
+            for item in value:
+                if not first:
+                    write(self.item_separator)
+                first = False
+                self.dump(item, write)
+            write(']')
+        else:
+            value = self.default(value)
+            if isinstance(value, dict):
+                # a class hint
+                self._dump_dict(value, write)
+            else:
+                self.dump(value, write)
+
+    def _dump_dict(self, value, write):
+        write('{')
+        first = True
+        for key, item in value.items():
+            if not isinstance(key, six.string_types):
+                raise TypeError("dictionary key must be string")
+            if not first:
+                write(self.item_separator)
+            first = False
+            write(self._encode_string(key))
+            write(self.key_separator)
+            self.dump(item, write)
+        write('}')
+
+    def default(self, value):
+        if isinstance(value, datetime.datetime):
+            if self.datetime_as_string:
+                return value.isoformat(' ')
+            return {'__jsonclass__': ['DateTime', [value.strftime('%Y%m%dT%H:%M:%S')]]}
+        elif isinstance(value, DateTime):
+            return {'__jsonclass__': ['DateTime', [value.value]]}
+        elif isinstance(value, Binary):
+            value = value.data
+        if isinstance(value, (bytes, bytearray)):
+            return {'__jsonclass__': ['Binary', [base64.b64encode(value).decode('ascii')]]}
+        elif isinstance(value, _pattern_type):
+            return repr(value)
+        return super(ExtendedEncoder, self).default(value)
+
+
+def _object_hook(obj):
+    if '__jsonclass__' in obj and len(obj) == 1:
+        name, args = obj['__jsonclass__']
+        if name == 'DateTime':
+            return DateTime(args[0])
+        elif name == 'Binary':
+            return Binary(base64.b64decode(args[0]))
+        elif name == 'dict':
+            return dict(args[0])
+        raise ValueError('Unknown json class: %r' % name)
+    return obj
+
+
+def _call_data(params, methodname=None, methodresponse=None):
+    if isinstance(params, Fault):
+        data = {'fault': {'faultCode': params.faultCode, 'faultString': params.faultString}}
+    elif not isinstance(params, tuple):
+        raise TypeError('params must be a tuple or Fault instance')
+    elif methodname:
+        data = {'method': methodname, 'params': params}
+    elif methodresponse:
+        if len(params) != 1:
+            raise ValueError('response tuple must be a singleton')
+        data = {'result': params[0]}
+    else:
+        data = {'params': params}
+    return data
+
+
+def dumps(params, methodname=None, methodresponse=None, datetime_as_string=False):
+    """encode a call or a response (str)
+
+    The arguments match those of koji.xmlrpcplus.dumps
+    """
+    data = _call_data(params, methodname=methodname, methodresponse=methodresponse)
+    encoder = ExtendedEncoder(datetime_as_string=datetime_as_string, separators=(',', ':'))
+    return encoder.encode(data)
+
+
+def dumps_chunks(params, methodresponse=None, datetime_as_string=False, chunk_size=CHUNK_SIZE):
+    """encode a response as a list of encoded chunks
+
+    This is the counterpart of koji.xmlrpcplus.dumps_chunks. The response is
+    encoded piecewise, so generators in the params are consumed as they are
+    encoded and the result exists in memory only as encoded chunks.
+    """
+    if not isinstance(params, Fault) and not methodresponse:
+        raise ValueError('only method responses can be encoded in chunks')
+    data = _call_data(params, methodresponse=methodresponse)
+    encoder = ExtendedEncoder(datetime_as_string=datetime_as_string, separators=(',', ':'))
+    writer = ChunkWriter('utf-8', chunk_size)
+    encoder.dump(data, writer.write)
+    writer.flush()
+    return writer.chunks or [b'']
+
+
+def loads(data):
+    """decode a call or a response
+
+    Returns a tuple (params, methodname) like xmlrpc loads.
+    Raises Fault if the data is a fault response.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    data = json.loads(data, object_hook=_object_hook)
+    if not isinstance(data, dict):
+        raise ValueError('Invalid json call data')
+    if 'fault' in data:
+        raise Fault(data['fault']['faultCode'], data['fault']['faultString'])
+    if 'result' in data:
+        return (data['result'],), None
+    return tuple(data.get('params', ())), data.get('method')
+
+
+class Parser(object):
+    """Incremental reader with the interface of the xmlrpc parser/unmarshaller pair
+
+    The data is only decoded on close
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._params = None
+        self._method = None
+
+    def feed(self, data):
+        self._chunks.append(data)
+
+    def close(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._params, self._method = loads(data)
+
+    def getmethodname(self):
+        return self._method
+
+    def result(self):
+        return self._params
+
+
+class Unmarshaller(object):
+
+    def __init__(self, parser):
+        self._parser = parser
+
+    def close(self):
+        return self._parser.result()
+
+    def getmethodname(self):
+        return self._parser.getmethodname()
+
+
+def getparser():
+    """Return a (parser, unmarshaller) pair like xmlrpc getparser"""
+    parser = Parser()
+    return parser, Unmarshaller(parser)
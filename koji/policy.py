@@ -21,6 +21,7 @@ from __future__ import absolute_import
 
 import fnmatch
 import logging
+import time
 
 import six
 
@@ -34,6 +35,10 @@ class BaseSimpleTest(object):
     # Provide the name of the test
     name = None
 
+    # Whether the result only depends on the test string and the policy data.
+    # Such results are reused when a test occurs in several rules of a policy.
+    cacheable = True
+
     def __init__(self, str):
         """Read the test parameters from string"""
         self.str = str
@@ -261,6 +266,8 @@ class SimpleRuleSet(object):
 
     def __init__(self, rules, tests):
         self.tests = tests
+        self.handlers = {}
+        self.test_keys = {}
         self.rules = self.parse_rules(rules)
         self.lastrule = None
         self.lastaction = None
@@ -285,6 +292,9 @@ class SimpleRuleSet(object):
               [[[test1, test2], negate, "action"],
                [[test1, test2, test3], negate
                 [[[test1, test2], negate, "action"]]]]]]
+
+        Identical tests are given the same key in self.test_keys, so that
+        their result can be reused within a single apply call.
         """
         cursor = []
         self.ruleset = cursor
@@ -354,11 +364,18 @@ class SimpleRuleSet(object):
         return tests, negate, action
 
     def get_test_handler(self, str):
+        handler = self.handlers.get(str)
+        if handler is not None:
+            return handler
         name = str.split(None, 1)[0]
         try:
-            return self.tests[name](str)
+            handler = self.tests[name](str)
         except KeyError:
             raise koji.GenericError("missing test handler: %s" % name)
+        self.handlers[str] = handler
+        # tests only differing in whitespace are the same test
+        self.test_keys[id(handler)] = ' '.join(str.split())
+        return handler
 
     def all_actions(self):
         """report a list of all actions in the ruleset
@@ -376,13 +393,23 @@ class SimpleRuleSet(object):
         _recurse(self.ruleset, index)
         return to_list(index.keys())
 
-    def _apply(self, rules, data, top=False):
+    def _run_test(self, test, data, results):
+        if not test.cacheable:
+            return test.run(data)
+        key = self.test_keys[id(test)]
+        if key not in results:
+            results[key] = test.run(data)
+        return results[key]
+
+    def _apply(self, rules, data, results, top=False, timing=None, depth=0):
         for tests, negate, action in rules:
             if top:
                 self.lastrule = []
+            if timing is not None:
+                start = time.time()
             value = False
             for test in tests:
-                check = test.run(data)
+                check = self._run_test(test, data, results)
                 self.logger.debug("%s -> %s", test, check)
                 if not check:
                     break
@@ -391,12 +418,19 @@ class SimpleRuleSet(object):
                 value = True
             if negate:
                 value = not value
+            if timing is not None:
+                timing.append({
+                    'rule': self.rule_text(tests, negate, action),
+                    'depth': depth,
+                    'matched': value,
+                    'time': time.time() - start,
+                })
             if value:
                 self.lastrule.append([tests, negate])
                 if isinstance(action, list):
                     self.logger.debug("matched: entering subrule")
                     # action is a list of subrules
-                    ret = self._apply(action, data)
+                    ret = self._apply(action, data, results, timing=timing, depth=depth + 1)
                     if ret is not None:
                         return ret
                     # if ret is None, then none of the subrules matched,
@@ -406,24 +440,44 @@ class SimpleRuleSet(object):
                     return action
         return None
 
-    def apply(self, data):
+    def apply(self, data, timing=None):
+        """Apply the policy to data and return the resulting action
+
+        If timing is a list, an entry is appended to it for every evaluated
+        rule, giving the rule text, its nesting depth, whether it matched and
+        the time spent in its tests.
+        """
         self.logger.debug("policy start")
         self.lastrule = []
-        self.lastaction = self._apply(self.ruleset, data, top=True)
+        self.lastaction = self._apply(self.ruleset, data, {}, top=True, timing=timing)
         self.logger.debug("policy done")
         return self.lastaction
 
+    @staticmethod
+    def _tests_text(tests, negate):
+        """Format the tests of a parsed rule, up to and including the operator"""
+        line = '&&'.join([str(t) for t in tests])
+        if negate:
+            line += '!! '
+        else:
+            line += ':: '
+        return line
+
+    def rule_text(self, tests, negate, action):
+        """Format a parsed rule as a policy line"""
+        line = self._tests_text(tests, negate)
+        if isinstance(action, list):
+            line += '{'
+        else:
+            line += action
+        return line
+
     def last_rule(self):
         if self.lastrule is None:
             return None
         ret = []
         for (tests, negate) in self.lastrule:
-            line = '&&'.join([str(t) for t in tests])
-            if negate:
-                line += '!! '
-            else:
-                line += ':: '
-            ret.append(line)
+            ret.append(self._tests_text(tests, negate))
         ret = '... '.join(ret)
         if self.lastaction is None:
             ret += "(no match)"
@@ -58,6 +58,27 @@ class ExtendedMarshaller(xmlrpc_client.Marshaller):
             return xmlrpc_client.Marshaller.dump_int(self, value, write)
     dispatch[int] = dump_int
 
+    def dump_params(self, values, write):
+        """Marshal params or a Fault, passing the output to write
+
+        This is the same as dumps(), but without collecting the output.
+        """
+        # Parent class is unfriendly to subclasses :-/
+        dump = self._Marshaller__dump
+        if isinstance(values, Fault):
+            write("<fault>\n")
+            dump({'faultCode': values.faultCode,
+                  'faultString': values.faultString},
+                 write)
+            write("</fault>\n")
+        else:
+            write("<params>\n")
+            for v in values:
+                write("<param>\n")
+                dump(v, write)
+                write("</param>\n")
+            write("</params>\n")
+
     def dump_re(self, value, write):
         return self._dump(repr(value), write)
     # re.Pattern is supported >= py3.7
@@ -127,3 +148,69 @@ def dumps(params, methodname=None, methodresponse=None, encoding=None,
     else:
         return data  # return as is
     return ''.join(parts)
+
+
+# approximate size (in characters) of the chunks returned by dumps_chunks
+CHUNK_SIZE = 65536
+
+
+class ChunkWriter(object):
+    """Collect written strings as a list of encoded chunks"""
+
+    def __init__(self, encoding="utf-8", chunk_size=CHUNK_SIZE):
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.chunks.append(''.join(self.buffer).encode(self.encoding))
+            self.buffer = []
+            self.size = 0
+
+
+def dumps_chunks(params, methodresponse=None, encoding=None, marshaller=None,
+                 chunk_size=CHUNK_SIZE):
+    """encode an xmlrpc response as a list of encoded chunks
+
+    The output is the same as encoding the result of dumps(), but it is
+    encoded piecewise while marshalling. Generators in the params are consumed
+    as they are marshalled, so large results exist in memory only once, as
+    encoded chunks of about chunk_size characters. The list can be returned
+    directly as a WSGI iterable.
+    """
+    if isinstance(params, Fault):
+        methodresponse = 1
+    elif not isinstance(params, tuple):
+        raise TypeError('params must be a tuple or Fault instance')
+    elif methodresponse and len(params) != 1:
+        raise ValueError('response tuple must be a singleton')
+    if not methodresponse:
+        raise ValueError('only method responses can be encoded in chunks')
+
+    if not encoding:
+        encoding = "utf-8"
+
+    if marshaller is not None:
+        m = marshaller(encoding, allow_none=True)
+    else:
+        m = ExtendedMarshaller(encoding, allow_none=True)
+
+    writer = ChunkWriter(encoding, chunk_size)
+    if encoding != "utf-8":
+        writer.write("<?xml version='1.0' encoding='%s'?>\n" % str(encoding))
+    else:
+        writer.write("<?xml version='1.0'?>\n")  # utf-8 is default
+    writer.write("<methodResponse>\n")
+    m.dump_params(params, writer.write)
+    writer.write("</methodResponse>\n")
+    writer.flush()
+    return writer.chunks
@@ -26,6 +26,7 @@ import random
 import re
 import socket
 import string
+import threading
 import time
 
 import six
@@ -57,11 +58,110 @@ RetryWhitelist = [
     'repoProblem',
 ]
 
+# methods which may be validated from the session cache (see SessionCacheTime)
+# These are read-only, so they need neither the session row lock nor the callnum
+# bookkeeping (their callnum update is never committed).
+SessionCacheWhitelist = [
+    'host.getID',
+    'host.getHost',
+    'host.getHostTasks',
+    'host.getLoadData',
+    'host.getTasks',
+    'host.isEnabled',
+    'getLoggedInUser',
+]
+
 AUTH_METHODS = ['login', 'sslLogin']
 
+# how often (in seconds) to log the rate of session row locks
+ROWLOCK_STATS_INTERVAL = 60
+
 logger = logging.getLogger('koji.auth')
 
 
+class SessionCache(object):
+    """Process-wide cache of validated sessions
+
+    Only used for methods in SessionCacheWhitelist when SessionCacheTime is set.
+    Updates of the session update_time are collected here and written out in a
+    single statement at most once per SessionCacheTime seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.touched = set()
+        self.last_flush = time.time()
+        self.rowlocks = 0
+        self.rowlocks_since = time.time()
+
+    def get(self, key, ttl):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or time.time() - entry['ts'] >= ttl:
+            return None
+        return entry
+
+    def set(self, key, session_data, user_data, exclusive, lockerror, excl_id):
+        entry = {
+            'ts': time.time(),
+            'session_data': session_data,
+            'user_data': user_data,
+            'exclusive': exclusive,
+            'lockerror': lockerror,
+            'excl_id': excl_id,
+        }
+        with self.lock:
+            self.entries[key] = entry
+        return entry
+
+    def clear(self):
+        """Drop all cached sessions
+
+        Called whenever session state changes (logout, exclusive mode, renewal)
+        """
+        with self.lock:
+            self.entries = {}
+
+    def touch(self, session_id):
+        """Schedule an update_time update for given session"""
+        with self.lock:
+            self.touched.add(session_id)
+
+    def pop_touched(self, interval):
+        """Return session ids which should have their update_time updated now
+
+        Returns an empty list if the last flush is more recent than interval.
+        Expired cache entries are purged at the same time.
+        """
+        now = time.time()
+        with self.lock:
+            if now - self.last_flush < interval:
+                return []
+            self.last_flush = now
+            ids = sorted(self.touched)
+            self.touched = set()
+            self.entries = dict([(k, v) for k, v in self.entries.items()
+                                 if now - v['ts'] < interval])
+        return ids
+
+    def count_rowlock(self):
+        """Record a session row lock and periodically log the rate"""
+        now = time.time()
+        with self.lock:
+            self.rowlocks += 1
+            elapsed = now - self.rowlocks_since
+            if elapsed < ROWLOCK_STATS_INTERVAL:
+                return
+            count = self.rowlocks
+            self.rowlocks = 0
+            self.rowlocks_since = now
+        logger.info("Session row locks: %.2f/s (%i in %.0fs)", count / elapsed, count, elapsed)
+
+
+session_cache = SessionCache()
+
+
 class Session(object):
 
     def __init__(self, args=None, hostip=None):
@@ -117,6 +217,18 @@ class Session(object):
             self.message = 'no Koji-Session-* headers'
             return
         hostip = self.get_remote_ip(override=hostip)
+        # validated sessions can be cached for calls which don't need the row lock
+        cache_time = context.opts.get('SessionCacheTime')
+        cacheable = bool(cache_time) and \
+            getattr(context, 'method', None) in SessionCacheWhitelist
+        cache_key = (self.id, self.key, hostip)
+        if cacheable:
+            cached = session_cache.get(cache_key, cache_time)
+            if cached and not self._renewal_expired(cached['session_data']) and \
+                    self._check_cached(cached, hostip):
+                self._set_cached(cached, hostip, callnum, cache_time)
+                return
+
         # lookup the session
         # sort for stability (unittests)
 
@@ -131,7 +243,9 @@ class Session(object):
                                clauses=['id = %(id)i', 'key = %(key)s', 'hostip = %(hostip)s',
                                         'closed IS FALSE'],
                                values={'id': self.id, 'key': self.key, 'hostip': hostip},
-                               opts={'rowlock': True})
+                               opts={'rowlock': not cacheable})
+        if not cacheable:
+            session_cache.count_rowlock()
         session_data = query.executeOne(strict=False)
         if not session_data:
             query = QueryProcessor(tables=['sessions'], columns=['key', 'hostip'],
@@ -145,21 +259,14 @@ class Session(object):
                     logger.warning("Session ID %s is not related to host IP %s.", self.id, hostip)
             raise koji.AuthError('Invalid session or bad credentials')
 
-        if not session_data['expired'] and context.opts['SessionRenewalTimeout'] != 0:
-            if session_data['renew_ts']:
-                renewal_cutoff = (session_data['renew_ts'] +
-                                  context.opts['SessionRenewalTimeout'] * 60)
-            else:
-                renewal_cutoff = (session_data['start_ts'] +
-                                  context.opts['SessionRenewalTimeout'] * 60)
-            if time.time() > renewal_cutoff:
-                session_data['expired'] = True
-                update = UpdateProcessor('sessions',
-                                         data={'expired': True},
-                                         clauses=['id = %(id)s OR master = %(id)s'],
-                                         values={'id': self.id})
-                update.execute()
-                context.cnx.commit()
+        if not session_data['expired'] and self._renewal_expired(session_data):
+            session_data['expired'] = True
+            update = UpdateProcessor('sessions',
+                                     data={'expired': True},
+                                     clauses=['id = %(id)s OR master = %(id)s'],
+                                     values={'id': self.id})
+            update.execute()
+            context.cnx.commit()
 
         if session_data['expired']:
             if getattr(context, 'method') not in AUTH_METHODS:
@@ -185,7 +292,7 @@ class Session(object):
                     # callnum in the db then a previous attempt succeeded but failed to
                     # return. Data was changed, so we cannot simply try the call again.
                     method = getattr(context, 'method', 'UNKNOWN')
-                    if method not in RetryWhitelist:
+                    if method not in RetryWhitelist and not cacheable:
                         raise koji.RetryError(
                             "unable to retry call %s (method %s) for session %s" %
                             (callnum, method, self.id))
@@ -209,6 +316,7 @@ class Session(object):
         if session_data['exclusive']:
             # we are the exclusive session for this user
             self.exclusive = True
+            excl_id = self.id
         else:
             # see if an exclusive session exists
             query = QueryProcessor(tables=['sessions'], columns=['id'],
@@ -229,6 +337,12 @@ class Session(object):
                     # if appropriate (otherwise it would be impossible to steal
                     # an exclusive session with the force option).
 
+        if cacheable:
+            cached = session_cache.set(cache_key, session_data, user_data, self.exclusive,
+                                       self.lockerror, excl_id)
+            self._set_cached(cached, hostip, callnum, cache_time)
+            return
+
         # update timestamp
         update = UpdateProcessor('sessions', rawdata={'update_time': 'NOW()'},
                                  clauses=['id = %(id)i'], values={'id': self.id})
@@ -253,6 +367,76 @@ class Session(object):
         self.user_data = user_data
         self.logged_in = True
 
+    def _renewal_expired(self, session_data):
+        """Check if the session is past the SessionRenewalTimeout"""
+        if context.opts['SessionRenewalTimeout'] == 0:
+            return False
+        if session_data['renew_ts']:
+            renewal_cutoff = (session_data['renew_ts'] +
+                              context.opts['SessionRenewalTimeout'] * 60)
+        else:
+            renewal_cutoff = (session_data['start_ts'] +
+                              context.opts['SessionRenewalTimeout'] * 60)
+        return time.time() > renewal_cutoff
+
+    def _check_cached(self, cached, hostip):
+        """Check that a cached session is still valid
+
+        The cache is per process, so logouts, exclusive session changes and user
+        status changes made via other hub processes are caught by this single
+        query, which needs no row lock.
+        """
+        fields = (
+            ('sessions.expired', 'expired'),
+            ('sessions.exclusive', 'exclusive'),
+            ('users.status', 'status'),
+            ("(SELECT excl.id FROM sessions AS excl WHERE excl.user_id = sessions.user_id "
+             "AND excl.exclusive = TRUE AND excl.closed = FALSE LIMIT 1)", 'excl_id'),
+        )
+        columns, aliases = zip(*fields)
+        query = QueryProcessor(tables=['sessions'], columns=columns, aliases=aliases,
+                               joins=['users ON users.id = sessions.user_id'],
+                               clauses=['sessions.id = %(id)i', 'sessions.key = %(key)s',
+                                        'sessions.hostip = %(hostip)s',
+                                        'sessions.closed IS FALSE'],
+                               values={'id': self.id, 'key': self.key, 'hostip': hostip})
+        row = query.executeOne(strict=False)
+        return bool(row and not row['expired'] and
+                    row['status'] == cached['user_data']['status'] and
+                    row['exclusive'] == cached['session_data']['exclusive'] and
+                    row['excl_id'] == cached['excl_id'])
+
+    def _set_cached(self, cached, hostip, callnum, cache_time):
+        """Record the login data from a session cache entry
+
+        The update_time write is deferred and batched with other sessions. The
+        callnum is not stored as these calls can always be retried.
+        """
+        if callnum is not None:
+            try:
+                callnum = int(callnum)
+            except (ValueError, TypeError):
+                raise koji.AuthError("Invalid callnum: %r" % callnum)
+        session_data = cached['session_data']
+        session_cache.touch(self.id)
+        session_ids = session_cache.pop_touched(cache_time)
+        if session_ids:
+            update = UpdateProcessor('sessions', rawdata={'update_time': 'NOW()'},
+                                     clauses=['id IN %(session_ids)s'],
+                                     values={'session_ids': session_ids})
+            update.execute()
+            context.cnx.commit()
+        self.hostip = hostip
+        self.callnum = callnum
+        self.exclusive = cached['exclusive']
+        self.lockerror = cached['lockerror']
+        self.user_id = session_data['user_id']
+        self.authtype = session_data['authtype']
+        self.master = session_data['master']
+        self.session_data = dict(session_data)
+        self.user_data = dict(cached['user_data'])
+        self.logged_in = True
+
     def __getattr__(self, name):
         # grab perm and groups data on the fly
         if name == 'perms':
@@ -473,6 +657,7 @@ class Session(object):
                                  clauses=['id=%(session_id)s'], values={'session_id': session_id})
         update.execute()
         context.cnx.commit()
+        session_cache.clear()
 
     def makeShared(self):
         """Drop out of exclusive mode"""
@@ -481,6 +666,7 @@ class Session(object):
                                  clauses=['id=%(session_id)s'], values={'session_id': session_id})
         update.execute()
         context.cnx.commit()
+        session_cache.clear()
 
     def logout(self, session_id=None):
         """close a login session"""
@@ -504,6 +690,7 @@ class Session(object):
                                  values={'id': ses_id})
         update.execute()
         context.cnx.commit()
+        session_cache.clear()
         if not session_id:
             self.logged_in = False
 
@@ -518,6 +705,7 @@ class Session(object):
                                  values={'session_id': session_id, 'master': self.id})
         update.execute()
         context.cnx.commit()
+        session_cache.clear()
 
     def createSession(self, user_id, hostip, authtype, master=None, renew=False):
         """Create a new session for the given user.
@@ -550,6 +738,7 @@ class Session(object):
                                      data={'key': self.key, 'expired': False},
                                      values={'id': self.id})
             update.execute()
+            session_cache.clear()
         else:
             # get a session id
             session_id = nextval('sessions_id_seq')
@@ -35,6 +35,7 @@ import os
 # del psycopg2.extensions.string_types[1083]
 # del psycopg2.extensions.string_types[1266]
 import re
+import select
 import sys
 import threading
 import time
@@ -58,13 +59,20 @@ _DBopts = None
 # will be used to service all requests handled
 # by that worker.
 _DBconn = threading.local()
+# A connection pool shared by all threads, used instead of _DBconn if configured
+_DBpool = None
+# Whether to check connections at the start of each request
+_DBcheck = True
+# The autocommit connection each thread uses for LISTEN, see Listener
+_DBlisten = threading.local()
 
 logger = logging.getLogger('koji.db')
 
 
 class DBWrapper:
-    def __init__(self, cnx):
+    def __init__(self, cnx, pool=None):
         self.cnx = cnx
+        self.pool = pool
 
     def __getattr__(self, key):
         if not self.cnx:
@@ -81,10 +89,18 @@ class DBWrapper:
         # this DBWrapper is no longer usable after close()
         if not self.cnx:
             raise Exception('connection is closed')
-        self.cnx.cursor().execute('ROLLBACK')
-        # We do this rather than cnx.rollback to avoid opening a new transaction
-        # If our connection gets recycled cnx.rollback will be called then.
-        self.cnx = None
+        if self.pool is None:
+            _end_transaction(self.cnx, _DBcheck)
+            self.cnx = None
+            return
+        cnx, self.cnx = self.cnx, None
+        try:
+            _end_transaction(cnx, self.pool.check_on_connect)
+        except psycopg2.Error:
+            # broken connection, drop it rather than handing it out again
+            self.pool.discard(cnx)
+            raise
+        self.pool.put(cnx)
 
 
 class CursorWrapper:
@@ -177,26 +193,26 @@ def getDBopts():
     return _DBopts
 
 
-def connect():
-    logger = logging.getLogger('koji.db')
-    global _DBconn
-    if hasattr(_DBconn, 'conn'):
-        # Make sure the previous transaction has been
-        # closed.  This is safe to call multiple times.
-        conn = _DBconn.conn
-        try:
-            # Under normal circumstances, the last use of this connection
-            # will have issued a raw ROLLBACK to close the transaction. To
-            # avoid 'no transaction in progress' warnings (depending on postgres
-            # configuration) we open a new one here.
-            # Should there somehow be a transaction in progress, a second
-            # BEGIN will be a harmless no-op, though there may be a warning.
-            conn.cursor().execute('BEGIN')
-            conn.rollback()
-            return DBWrapper(conn)
-        except psycopg2.Error:
-            del _DBconn.conn
-    # create a fresh connection
+def provideDBpool(minsize=0, maxsize=0, idle_timeout=300, max_lifetime=3600,
+                  check_interval=30, check_on_connect=True):
+    """Set up a connection pool shared by all threads of the process
+
+    If maxsize is 0, no pool is used and each thread keeps its own connection.
+    If check_on_connect is False, connections are not checked with a
+    BEGIN/ROLLBACK round trip when handed out to a request.
+    Like provideDBopts, this only has effect the first time it is called.
+    """
+    global _DBpool, _DBcheck
+    _DBcheck = check_on_connect
+    if _DBpool is None and maxsize:
+        _DBpool = ConnectionPool(minsize=minsize, maxsize=maxsize, idle_timeout=idle_timeout,
+                                 max_lifetime=max_lifetime, check_interval=check_interval,
+                                 check_on_connect=check_on_connect)
+        _DBpool.start()
+
+
+def _open_connection():
+    """Open a new database connection using the provided options"""
     opts = _DBopts
     if opts is None:
         opts = {}
@@ -209,8 +225,243 @@ def connect():
     except Exception:
         logger.error(''.join(traceback.format_exception(*sys.exc_info())))
         raise
-    # XXX test
-    # return conn
+    return conn
+
+
+def _end_transaction(conn, checked):
+    """Roll back the transaction of a connection at the end of a request
+
+    If the connection will be checked when it is handed out again, a raw
+    ROLLBACK is used. The check then opens and rolls back a transaction,
+    which resets the psycopg2 transaction state.
+    Otherwise conn.rollback is used, so that psycopg2 knows the transaction
+    is over and starts a new one with the next statement.
+    """
+    if checked:
+        conn.cursor().execute('ROLLBACK')
+    else:
+        conn.rollback()
+
+
+def _reset_connection(conn):
+    """Make sure psycopg2 has no transaction open on an unchecked connection"""
+    if conn.status != psycopg2.extensions.STATUS_READY:
+        conn.rollback()
+
+
+def _check_connection(conn):
+    """Check that the connection is usable, leaving no transaction open"""
+    try:
+        # Under normal circumstances, the last use of this connection
+        # will have issued a raw ROLLBACK to close the transaction. To
+        # avoid 'no transaction in progress' warnings (depending on postgres
+        # configuration) we open a new one here.
+        # Should there somehow be a transaction in progress, a second
+        # BEGIN will be a harmless no-op, though there may be a warning.
+        conn.cursor().execute('BEGIN')
+        conn.rollback()
+    except psycopg2.Error:
+        return False
+    return True
+
+
+class ConnectionPool(object):
+    """A pool of database connections shared between threads
+
+    Connections are handed out by get() and returned by put(). Idle
+    connections are checked and pruned by a background thread, so that
+    requests do not have to pay for a liveness check or a reconnect after
+    a database failover.
+
+    minsize - number of connections to keep open even when idle
+    maxsize - maximum number of open connections, get() waits when reached
+    idle_timeout - seconds after which unused connections (above minsize) are closed
+    max_lifetime - seconds after which connections are closed and replaced
+    check_interval - seconds between background checks of the idle connections
+    check_on_connect - if True, also check each connection when it is handed out
+    wait_timeout - seconds get() waits for a free connection before failing
+    """
+
+    def __init__(self, minsize=0, maxsize=10, idle_timeout=300, max_lifetime=3600,
+                 check_interval=30, check_on_connect=True, wait_timeout=60, connect=None):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+        self.check_on_connect = check_on_connect
+        self.wait_timeout = wait_timeout
+        self._connect = connect or _open_connection
+        self.logger = logging.getLogger('koji.db.pool')
+        self.cond = threading.Condition()
+        # idle connections as [conn, created, last_used], most recently used last
+        self.idle = []
+        # creation time of all open connections, keyed by id(conn)
+        self.created = {}
+        # number of connections being opened
+        self.opening = 0
+        self.checker = None
+        self.stopped = False
+
+    def start(self):
+        """Start the background checker thread"""
+        if self.check_interval and self.checker is None:
+            self.checker = threading.Thread(target=self._run_checker, name='koji-db-pool',
+                                            daemon=True)
+            self.checker.start()
+
+    def stop(self):
+        """Stop the background checker and close idle connections"""
+        with self.cond:
+            self.stopped = True
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for conn, created, last_used in idle:
+            self.discard(conn)
+
+    def size(self):
+        """Return the number of open connections"""
+        with self.cond:
+            return len(self.created)
+
+    def _expired(self, created, now):
+        return self.max_lifetime and now - created > self.max_lifetime
+
+    def get(self):
+        """Get a connection from the pool, opening a new one if needed"""
+        while True:
+            with self.cond:
+                deadline = time.time() + self.wait_timeout
+                while not self.idle and len(self.created) + self.opening >= self.maxsize:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise koji.GenericError('Timed out waiting for a database connection')
+                    self.cond.wait(remaining)
+                if self.idle:
+                    entry = self.idle.pop()
+                else:
+                    entry = None
+                    self.opening += 1
+            if entry is None:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self.cond:
+                        self.opening -= 1
+                with self.cond:
+                    self.created[id(conn)] = time.time()
+                return conn
+            conn, created, last_used = entry
+            if conn.closed or self._expired(created, time.time()):
+                self.discard(conn)
+                continue
+            if self.check_on_connect:
+                if not _check_connection(conn):
+                    self.logger.warning('Dropping broken database connection')
+                    self.discard(conn)
+                    continue
+            else:
+                try:
+                    _reset_connection(conn)
+                except psycopg2.Error:
+                    self.logger.warning('Dropping broken database connection')
+                    self.discard(conn)
+                    continue
+            return conn
+
+    def put(self, conn):
+        """Return a connection to the pool"""
+        with self.cond:
+            created = self.created.get(id(conn))
+            if created is None or self.stopped:
+                close = True
+            else:
+                close = False
+                self.idle.append([conn, created, time.time()])
+                self.cond.notify()
+        if close:
+            self.discard(conn)
+
+    def discard(self, conn):
+        """Close a connection and remove it from the pool"""
+        with self.cond:
+            self.created.pop(id(conn), None)
+            self.cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def check(self):
+        """Check idle connections, prune unneeded ones and open up to minsize"""
+        now = time.time()
+        with self.cond:
+            idle, self.idle = self.idle, []
+        keep = []
+        # least recently used first, so those are the ones closed when idle
+        for n, entry in enumerate(idle):
+            conn, created, last_used = entry
+            spare = len(idle) - n > self.minsize
+            if conn.closed or self._expired(created, now) or \
+                    (spare and now - last_used > self.idle_timeout):
+                self.discard(conn)
+            elif not _check_connection(conn):
+                self.logger.warning('Dropping broken database connection')
+                self.discard(conn)
+            else:
+                keep.append(entry)
+        while len(keep) < self.minsize:
+            with self.cond:
+                if len(self.created) + self.opening >= self.maxsize:
+                    break
+            try:
+                conn = self._connect()
+            except Exception:
+                # already logged, try again on the next check
+                break
+            created = time.time()
+            with self.cond:
+                self.created[id(conn)] = created
+            keep.insert(0, [conn, created, created])
+        with self.cond:
+            # connections returned in the meantime were used more recently
+            self.idle = keep + self.idle
+            self.cond.notify_all()
+
+    def _run_checker(self):
+        while True:
+            with self.cond:
+                self.cond.wait(self.check_interval)
+                if self.stopped:
+                    return
+            try:
+                self.check()
+            except Exception:
+                self.logger.exception('Error checking database connections')
+
+
+def connect():
+    global _DBconn
+    if _DBpool is not None:
+        return DBWrapper(_DBpool.get(), pool=_DBpool)
+    if hasattr(_DBconn, 'conn'):
+        # Make sure the previous transaction has been
+        # closed.  This is safe to call multiple times.
+        conn = _DBconn.conn
+        # psycopg2 marks the connection closed if it was lost during a query
+        if not conn.closed:
+            if _DBcheck:
+                if _check_connection(conn):
+                    return DBWrapper(conn)
+            else:
+                try:
+                    _reset_connection(conn)
+                    return DBWrapper(conn)
+                except psycopg2.Error:
+                    pass
+        del _DBconn.conn
+    # create a fresh connection
+    conn = _open_connection()
     _DBconn.conn = conn
 
     return DBWrapper(conn)
@@ -320,6 +571,23 @@ def get_event():
     return event_id
 
 
+def get_events(count):
+    """Create count new events and return their ids in order
+
+    Unlike get_event, the events are not cached in context. Bulk operations
+    use these to record one event per item, matching a series of calls with
+    the event bumped in between.
+    """
+    if count <= 0:
+        return []
+    query = """INSERT INTO events (time)
+    SELECT clock_timestamp() FROM generate_series(1, %(count)s)
+    RETURNING id"""
+    events = sorted([row[0] for row in _fetchMulti(query, {'count': count})])
+    context.commit_pending = True
+    return events
+
+
 def nextval(sequence):
     """Get the next value for the given sequence"""
     data = {'sequence': sequence}
@@ -369,6 +637,93 @@ def db_lock(name, wait=True):
     raise koji.LockError(f"Lock not defined: {name}")
 
 
+def notify(channel, payload=''):
+    """Send a notification on the given channel
+
+    Listeners receive it when the current transaction commits
+    """
+    _fetchMulti("SELECT pg_notify(%(channel)s, %(payload)s)",
+                {'channel': channel, 'payload': payload})
+
+
+class Listener(object):
+    """Wait for notifications on a set of channels
+
+    Notifications are only delivered between transactions, so this uses a
+    separate autocommit connection rather than the one of the request. The
+    connection is kept for the next listener of the same thread.
+    """
+
+    CHANNEL_RE = re.compile(r'^[a-z_][a-z0-9_]*$')
+
+    def __init__(self, channels):
+        for channel in channels:
+            if not self.CHANNEL_RE.match(channel):
+                raise koji.ParameterError('Invalid channel name: %s' % channel)
+        reused = getattr(_DBlisten, 'conn', None) is not None
+        while True:
+            self.conn = _listen_connection()
+            try:
+                cursor = self.conn.cursor()
+                for channel in channels:
+                    cursor.execute('LISTEN %s' % channel)
+                return
+            except psycopg2.Error:
+                _drop_listen_connection()
+                if not reused:
+                    raise
+                # the kept connection may have been lost, retry with a new one
+                reused = False
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for notifications
+
+        :returns: list of the channels notified, empty on timeout
+        """
+        end = time.time() + timeout
+        while not self.conn.notifies:
+            remain = end - time.time()
+            if remain <= 0:
+                break
+            select.select([self.conn], [], [], remain)
+            self.conn.poll()
+        channels = [n.channel for n in self.conn.notifies]
+        del self.conn.notifies[:]
+        return channels
+
+    def close(self):
+        """Stop listening, the connection stays open for reuse"""
+        try:
+            self.conn.cursor().execute('UNLISTEN *')
+            # drop anything that arrived before the UNLISTEN
+            self.conn.poll()
+            del self.conn.notifies[:]
+        except psycopg2.Error:
+            _drop_listen_connection()
+
+
+def _listen_connection():
+    """Return the listen connection of this thread, opening it if needed"""
+    conn = getattr(_DBlisten, 'conn', None)
+    if conn is not None and not conn.closed:
+        return conn
+    conn = _open_connection()
+    conn.autocommit = True
+    _DBlisten.conn = conn
+    return conn
+
+
+def _drop_listen_connection():
+    conn = getattr(_DBlisten, 'conn', None)
+    if conn is None:
+        return
+    del _DBlisten.conn
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
 class Savepoint(object):
 
     def __init__(self, name):
@@ -1181,6 +1536,8 @@ class BulkUpdateProcessor(object):
             self.match_keys = []
         else:
             self.match_keys = list(match_keys)
+        self.rawdata = {}
+        self.clauses = []
         self._values = {}
 
     def __str__(self):
@@ -1196,6 +1553,7 @@ class BulkUpdateProcessor(object):
         utable = f'__kojibulk_{self.table}'
         utable.replace('.', '_')  # in case schema qualified
         assigns = [f'{key} = {utable}.{key}' for key in set_keys]
+        assigns.extend([f'{key} = {value}' for key, value in sorted(self.rawdata.items())])
         values = {}  # values for lookup
         fdata = []  # data for VALUES clause
         for n, row in enumerate(self.data):
@@ -1208,6 +1566,7 @@ class BulkUpdateProcessor(object):
             fdata.append('(%s)' % ', '.join(parts))
 
         clauses = [f'{self.table}.{key} = {utable}.{key}' for key in match_keys]
+        clauses.extend(self.clauses)
 
         parts = [
             'UPDATE %s SET %s\n' % (self.table, ', '.join(assigns)),
@@ -1238,6 +1597,24 @@ class BulkUpdateProcessor(object):
     def __repr__(self):
         return "<BulkUpdateProcessor: %r>" % vars(self)
 
+    def make_revoke(self, event_id=None, user_id=None):
+        """Revoke the matching active rows of a versioned table
+
+        Rows that do not give their own revoke_event are revoked at event_id,
+        which defaults to the current event.
+        """
+        if user_id is None:
+            context.session.assertLogin()
+            user_id = context.session.user_id
+        for row in self.data:
+            if 'revoke_event' not in row:
+                if event_id is None:
+                    event_id = get_event()
+                row['revoke_event'] = event_id
+            row['revoker_id'] = user_id
+        self.rawdata['active'] = 'NULL'
+        self.clauses.append(f'{self.table}.active = TRUE')
+
     def execute(self):
         sql = self.get_sql()  # sets self._values
         return _dml(sql, self._values)
@@ -80,8 +80,10 @@ from . import repos
 from .auth import get_user_perms, get_user_groups
 from .db import (  # noqa: F401
     BulkInsertProcessor,
+    BulkUpdateProcessor,
     DeleteProcessor,
     InsertProcessor,
+    Listener,
     QueryProcessor,
     QueryView,
     Savepoint,
@@ -90,11 +92,14 @@ from .db import (  # noqa: F401
     _applyQueryOpts,
     _dml,
     _fetchSingle,
+    _multiRow,
     _singleValue,
     get_event,
+    get_events,
     nextval,
     currval,
     convert_timestamp,
+    notify,
 )
 
 
@@ -108,6 +113,39 @@ def log_error(msg):
     logger.error(msg)
 
 
+def _close_transaction():
+    """Commit or roll back the current transaction in the middle of a call
+
+    This is what the end of the request does, for calls that block for long.
+    """
+    if context.commit_pending:
+        flush_tag_last_change()
+        koji.plugin.run_callbacks('preCommit')
+        context.cnx.commit()
+        koji.plugin.run_callbacks('postCommit')
+        context.commit_pending = False
+    else:
+        context.tag_last_change = []
+        context.cnx.rollback()
+
+
+def host_channel(host_id):
+    """Return the notification channel of a host"""
+    return 'koji_host_%i' % host_id
+
+
+def notify_hosts(host_ids):
+    """Wake the given hosts if they are waiting in host.waitForWork
+
+    The notifications are only sent if HostWaitTimeout is enabled and are
+    delivered when the transaction commits.
+    """
+    if not context.opts.get('HostWaitTimeout'):
+        return
+    for host_id in sorted(set([h for h in host_ids if h is not None])):
+        notify(host_channel(host_id))
+
+
 def xform_user_krb(entry):
     entry['krb_principals'] = [x for x in entry['krb_principals'] if x is not None]
     return entry
@@ -290,10 +328,23 @@ class Task(object):
         if state == koji.TASK_STATES['OPEN']:
             update.rawset(start_time='NOW()')
         update.execute()
+        if newstate == 'ASSIGNED':
+            notify_hosts([host_id])
         self.runCallbacks('postTaskStateChange', info, 'state', koji.TASK_STATES[newstate])
         self.runCallbacks('postTaskStateChange', info, 'host_id', host_id)
         return True
 
+    def _notify_hosts(self, info):
+        """Wake the host of this task and the host of its parent"""
+        if not context.opts.get('HostWaitTimeout'):
+            return
+        host_ids = [info['host_id']]
+        if info['parent']:
+            query = QueryProcessor(tables=['task'], columns=['host_id'],
+                                   clauses=['id = %(parent)i'], values=info)
+            host_ids.append(query.singleValue(strict=False))
+        notify_hosts(host_ids)
+
     def assign(self, host_id, force=False):
         """Attempt to assign the task to host.
 
@@ -338,6 +389,7 @@ class Task(object):
         update = UpdateProcessor('task', clauses=['id=%(task_id)s'], values={'task_id': self.id},
                                  data={'state': newstate, 'host_id': newhost})
         update.execute()
+        notify_hosts([info['host_id']])
         self.runCallbacks('postTaskStateChange', info, 'state', koji.TASK_STATES['FREE'])
         self.runCallbacks('postTaskStateChange', info, 'host_id', None)
         return True
@@ -391,6 +443,7 @@ class Task(object):
                                  data={'result': info['result'], 'state': state},
                                  rawdata={'completion_time': 'NOW()'})
         update.execute()
+        self._notify_hosts(info)
 
         self.runCallbacks('postTaskStateChange', info, 'state', state)
         self.runCallbacks('postTaskStateChange', info, 'completion_ts', now)
@@ -442,6 +495,7 @@ class Task(object):
         update = UpdateProcessor('task', clauses=['id = %(task_id)i'], values={'task_id': self.id},
                                  data={'state': st_canceled}, rawdata={'completion_time': 'NOW()'})
         update.execute()
+        self._notify_hosts(info)
         self.runCallbacks('postTaskStateChange', info, 'state', koji.TASK_STATES['CANCELED'])
         self.runCallbacks('postTaskStateChange', info, 'completion_ts', now)
         # cancel associated builds (only if state is 'BUILDING')
@@ -744,6 +798,8 @@ def make_task(method, arglist, **opts):
     insert.execute()
     task_id = currval('task_id_seq')
     opts['id'] = task_id
+    if opts.get('assign'):
+        notify_hosts([opts['assign']])
     koji.plugin.run_callbacks(
         'postTaskStateChange', attribute='state', old=None, new='FREE', info=opts)
     scheduler.auto_arch_refuse(task_id)  # temporary workaround
@@ -790,6 +846,47 @@ def readDescendantsData(tag_id, event=None):
     return data
 
 
+def readInheritanceGraph(tag_id, event=None, reverse=False):
+    """Read the whole inheritance subgraph reachable from tag_id in one query
+
+    Returns a dictionary mapping tag ids to their inheritance links, in the
+    same form (and order) as returned by readInheritanceData. If reverse is
+    True, the graph is followed towards descendants and the links are in the
+    form returned by readDescendantsData instead.
+    """
+    if reverse:
+        near, far = 'parent_id', 'tag_id'
+    else:
+        near, far = 'tag_id', 'parent_id'
+    # UNION (rather than UNION ALL) discards already seen tags, so loops terminate
+    query = f"""WITH RECURSIVE nodes(id) AS (
+                  SELECT %(tag_id)s::INTEGER
+                UNION
+                  SELECT tag_inheritance.{far}
+                  FROM tag_inheritance
+                  JOIN nodes ON tag_inheritance.{near} = nodes.id
+                  WHERE {eventCondition(event, 'tag_inheritance')}
+                )
+                SELECT tag_inheritance.tag_id, parent_id, name, priority, maxdepth,
+                       intransitive, noconfig, pkg_filter
+                FROM tag_inheritance
+                JOIN tag ON tag_inheritance.{far} = tag.id
+                WHERE {eventCondition(event, 'tag_inheritance')}
+                  AND tag_inheritance.{near} IN (SELECT id FROM nodes)
+                ORDER BY priority"""
+    fields = ['tag_id', 'parent_id', 'name', 'priority', 'maxdepth', 'intransitive',
+              'noconfig', 'pkg_filter']
+    graph = {}
+    for link in _multiRow(query, {'tag_id': tag_id}, fields):
+        if reverse:
+            graph.setdefault(link['parent_id'], []).append(link)
+        else:
+            # match readInheritanceData
+            link['child_id'] = link.pop('tag_id')
+            graph.setdefault(link['child_id'], []).append(link)
+    return graph
+
+
 def writeInheritanceData(tag_id, changes, clear=False):
     """Add or change inheritance data for a tag"""
     context.session.assertPerm('tag')
@@ -799,6 +896,7 @@ def writeInheritanceData(tag_id, changes, clear=False):
 def _writeInheritanceData(tag_id, changes, clear=False):
     """Add or change inheritance data for a tag"""
     fields = ('parent_id', 'priority', 'maxdepth', 'intransitive', 'noconfig', 'pkg_filter')
+    clear_inheritance_cache()
     if isinstance(changes, dict):
         changes = [changes]
     for link in changes:
@@ -877,17 +975,51 @@ def _writeInheritanceData(tag_id, changes, clear=False):
         insert = InsertProcessor('tag_inheritance', data=newlink)
         insert.make_create()
         insert.execute()
+    log_tag_change(tag_id, 'tag_inheritance')
+
+
+def _get_inheritance_cache():
+    """Return the request-scoped inheritance cache, or None if caching is not active
+
+    The cache is set up by the request handler and lives in context, so it is
+    dropped at the end of every call.
+    """
+    cache = getattr(context, 'inheritance_cache', None)
+    if not isinstance(cache, dict):
+        return None
+    return cache
+
+
+def clear_inheritance_cache():
+    """Drop any cached inheritance data for the current request"""
+    cache = _get_inheritance_cache()
+    if cache is not None:
+        cache.clear()
 
 
 def readFullInheritance(tag_id, event=None, reverse=False):
-    """Returns a list representing the full, ordered inheritance from tag"""
+    """Returns a list representing the full, ordered inheritance from tag
+
+    Results are cached for the duration of the request, keyed by
+    (tag_id, event, reverse). Callers get their own copy of the data.
+    """
+    cache = _get_inheritance_cache()
+    key = (tag_id, event, reverse)
+    if cache is not None and key in cache:
+        return copy.deepcopy(cache[key])
     order = []
-    readFullInheritanceRecurse(tag_id, event, order, {}, {}, 0, None, False, [], reverse)
+    graph = None
+    if context.opts.get('RecursiveInheritanceQuery'):
+        graph = readInheritanceGraph(tag_id, event, reverse)
+    readFullInheritanceRecurse(tag_id, event, order, {}, {}, 0, None, False, [], reverse,
+                               graph=graph)
+    if cache is not None:
+        cache[key] = copy.deepcopy(order)
     return order
 
 
 def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxdepth, noconfig,
-                               pfilter, reverse):
+                               pfilter, reverse, graph=None):
     if maxdepth is not None and maxdepth < 1:
         return
     # note: maxdepth is relative to where we are, but currdepth is absolute from
@@ -895,7 +1027,10 @@ def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxde
     currdepth += 1
     top = top.copy()
     top[tag_id] = 1
-    if reverse:
+    if graph is not None:
+        # links get annotated below, so each visit needs its own copies
+        node = [link.copy() for link in graph.get(tag_id, [])]
+    elif reverse:
         node = readDescendantsData(tag_id, event)
     else:
         node = readInheritanceData(tag_id, event)
@@ -971,7 +1106,7 @@ def readFullInheritanceRecurse(tag_id, event, order, top, hist, currdepth, maxde
             # add link, but don't follow it
             continue
         readFullInheritanceRecurse(id, event, order, top, hist, currdepth, nextdepth, noconfig,
-                                   filter, reverse)
+                                   filter, reverse, graph=graph)
 
 # tag-package operations
 #       add
@@ -987,6 +1122,7 @@ def _pkglist_remove(tag_id, pkg_id):
     update = UpdateProcessor('tag_packages', values=locals(), clauses=clauses)
     update.make_revoke()  # XXX user_id?
     update.execute()
+    log_tag_change(tag_id, 'tag_packages')
 
 
 def _pkglist_owner_remove(tag_id, pkg_id):
@@ -1018,6 +1154,7 @@ def _pkglist_add(tag_id, pkg_id, owner, block, extra_arches):
     insert = InsertProcessor('tag_packages', data=data)
     insert.make_create()  # XXX user_id?
     insert.execute()
+    log_tag_change(tag_id, 'tag_packages')
     _pkglist_owner_add(tag_id, pkg_id, owner)
 
 
@@ -1110,6 +1247,52 @@ def _direct_pkglist_add(taginfo, pkginfo, owner, block, extra_arches, force,
                               force=force, update=update, user=user)
 
 
+def _bulk_pkglist_add(tag, pkgs, force=False):
+    """Add package list entries to a tag without any package data yet
+
+    pkgs is a list of entries as returned by readPackageList. Each one is
+    added with its owner, blocked flag and extra arches. This is equivalent to
+    calling _direct_pkglist_add for each entry with the event bumped in
+    between, but the inserts are done in bulk. No access check.
+    """
+    if not pkgs:
+        return
+    user = get_user(context.session.user_id)
+    entries = []
+    for pkg in pkgs:
+        package = {'id': pkg['package_id'], 'name': pkg['package_name']}
+        owner = pkg['owner_id']
+        if owner is None:
+            owner = user['id']
+        block = bool(pkg['blocked'])
+        extra_arches = pkg['extra_arches']
+        if extra_arches is not None:
+            extra_arches = koji.parse_arches(extra_arches, strict=True, allow_none=True)
+        entries.append((package, owner, block, extra_arches))
+    for package, owner, block, extra_arches in entries:
+        koji.plugin.run_callbacks('prePackageListChange', action=block and 'block' or 'add',
+                                  tag=tag, package=package, owner=owner,
+                                  block=block, extra_arches=extra_arches,
+                                  force=force, update=False, user=user)
+    events = get_events(len(entries))
+    packages = BulkInsertProcessor('tag_packages')
+    owners = BulkInsertProcessor('tag_package_owners')
+    for (package, owner, block, extra_arches), event_id in zip(entries, events):
+        packages.add_record(tag_id=tag['id'], package_id=package['id'], blocked=block,
+                            extra_arches=extra_arches, create_event=event_id,
+                            creator_id=user['id'])
+        owners.add_record(tag_id=tag['id'], package_id=package['id'], owner=owner,
+                          create_event=event_id, creator_id=user['id'])
+    packages.execute()
+    owners.execute()
+    log_tag_change(tag['id'], 'tag_packages', event_id=events)
+    for package, owner, block, extra_arches in entries:
+        koji.plugin.run_callbacks('postPackageListChange', action=block and 'block' or 'add',
+                                  tag=tag, package=package, owner=owner,
+                                  block=block, extra_arches=extra_arches,
+                                  force=force, update=False, user=user)
+
+
 def pkglist_remove(taginfo, pkginfo, force=False):
     """Remove a package from a tag's package list
 
@@ -1480,7 +1663,6 @@ def readTaggedBuilds(tag, event=None, inherit=False, latest=False, package=None,
 
     clauses = [
         eventCondition(event, 'tag_listing'),
-        'tag_id = %(tagid)s',
         'build.state = %(st_complete)i'
     ]
     if package:
@@ -1489,6 +1671,12 @@ def readTaggedBuilds(tag, event=None, inherit=False, latest=False, package=None,
         clauses.append('users.name = %(owner)s')
     if draft is not None:
         clauses.append(draft_clause(draft))
+
+    if context.opts.get('SingleQueryTaggedBuilds'):
+        return _read_tagged_builds_single(taglist, packages, latest, fields, tables, joins,
+                                          clauses, locals(), extra)
+
+    clauses.append('tag_id = %(tagid)s')
     queryOpts = {'order': '-create_event,-id'}
     # most recently tagged first
     # in a tie (e.g. two builds tagged at same event), newest build first
@@ -1527,6 +1715,55 @@ def readTaggedBuilds(tag, event=None, inherit=False, latest=False, package=None,
     return builds
 
 
+def _read_tagged_builds_single(taglist, packages, latest, fields, tables, joins, clauses,
+                               values, extra):
+    """Single query variant of the readTaggedBuilds loop
+
+    The ordered taglist and the unblocked package ids are passed to the
+    database, which applies the package list and the latest selection itself.
+    The results are the same as querying the tags one by one.
+    """
+    pkg_ids = [pkg_id for pkg_id, pinfo in packages.items() if not pinfo['blocked']]
+    if not pkg_ids:
+        return []
+    values = values.copy()
+    # list values are passed as tuples for IN clauses, so the ordered taglist
+    # is passed as an array literal
+    values['taglist'] = '{%s}' % ','.join([str(int(tag_id)) for tag_id in taglist])
+    values['pkg_ids'] = pkg_ids
+    # the position of the tag in taglist takes precedence over the tagging event,
+    # repeated tags in taglist are kept just like in the per-tag query
+    columns = ['tag_listing.tag_id', 'tag_listing.build_id', 'tag_listing.create_event',
+               'taglist.depth']
+    if latest:
+        columns.append('row_number() OVER (PARTITION BY build.pkg_id ORDER BY taglist.depth, '
+                       'tag_listing.create_event DESC, tag_listing.build_id DESC) AS pkg_rank')
+    ranked = QueryProcessor(
+        columns=columns, tables=tables,
+        joins=['unnest(%(taglist)s::INTEGER[]) WITH ORDINALITY AS taglist(tag_id, depth) '
+               'ON taglist.tag_id = tag_listing.tag_id'] + joins,
+        clauses=clauses + ['build.pkg_id IN %(pkg_ids)s'])
+    # the outer query reuses the same joins, so the subquery stands in for tag_listing
+    outer_clauses = []
+    if latest:
+        values['latest'] = int(latest)
+        outer_clauses.append('tag_listing.pkg_rank <= %(latest)i')
+    order_map = {
+        'depth': 'tag_listing.depth',
+        'create_event': 'tag_listing.create_event',
+        'id': 'build.id',
+    }
+    transform = None
+    if extra:
+        fields = fields + [('build.extra', 'extra')]
+        transform = _fix_extra_field
+    query = QueryProcessor(columns=[x[0] for x in fields], aliases=[x[1] for x in fields],
+                           tables=['(%s) AS tag_listing' % ranked], joins=joins,
+                           clauses=outer_clauses, values=values, transform=transform,
+                           opts={'order': 'depth,-create_event,-id'}, order_map=order_map)
+    return query.execute()
+
+
 def readTaggedRPMS(tag, package=None, arch=None, event=None, inherit=False, latest=True,
                    rpmsigs=False, owner=None, type=None, extra=True, draft=None):
     """Returns a list of rpms and builds for specified tag
@@ -1557,8 +1794,6 @@ def readTaggedRPMS(tag, package=None, arch=None, event=None, inherit=False, late
     """
     taglist = [tag]
     if inherit:
-        # XXX really should cache this - it gets called several places
-        #   (however, it is fairly quick)
         taglist += [link['parent_id'] for link in readFullInheritance(tag, event)]
 
     builds = readTaggedBuilds(tag, event=event, inherit=inherit, latest=latest, package=package,
@@ -1669,8 +1904,6 @@ def readTaggedArchives(tag, package=None, event=None, inherit=False, latest=True
     """
     taglist = [tag]
     if inherit:
-        # XXX really should cache this - it gets called several places
-        #   (however, it is fairly quick)
         taglist += [link['parent_id'] for link in readFullInheritance(tag, event)]
 
     # If type == 'maven', we require that both the build *and* the archive have Maven metadata
@@ -1850,9 +2083,102 @@ def _direct_tag_build(tag, build, user, force=False):
     insert.set(tag_id=tag_id, build_id=build_id)
     insert.make_create(user_id=user_id)
     insert.execute()
+    log_tag_change(tag_id, table)
     koji.plugin.run_callbacks('postTag', tag=tag, build=build, user=user, force=force)
 
 
+def _direct_tag_builds(tag, builds, user, force=False):
+    """Directly tag a list of builds, in order. No access check or value lookup.
+
+    This is equivalent to calling _direct_tag_build for each build with the
+    event bumped in between, but the checks and inserts are done in bulk.
+    Each build gets its own event, so the tagging order is preserved.
+    """
+    _direct_tag_changes(tag, [(build, True) for build in builds], user, force=force)
+
+
+def _direct_tag_changes(tag, changes, user, force=False):
+    """Directly apply a series of tag and untag operations. No access check or value lookup.
+
+    changes is a list of (build, tagged) pairs, where tagged is True to tag the
+    build and False to untag it (strictly). This is equivalent to calling
+    _direct_tag_build or _direct_untag_build for each pair with the event
+    bumped in between, but the checks, revokes and inserts are done in bulk.
+    """
+    if not changes:
+        return
+    serial = False
+    tagged_builds = set()
+    for build, tagged in changes:
+        if build['id'] in tagged_builds:
+            # changing a build again after tagging it needs the row inserted
+            # for the earlier change, so this takes the serial path
+            serial = True
+            break
+        if tagged:
+            tagged_builds.add(build['id'])
+    if serial:
+        for build, tagged in changes:
+            if tagged:
+                _direct_tag_build(tag, build, user, force=force)
+            else:
+                _direct_untag_build(tag, build, user, force=force)
+            _delete_event_id()
+        return
+    for build, tagged in changes:
+        if tagged:
+            koji.plugin.run_callbacks('preTag', tag=tag, build=build, user=user, force=force)
+        else:
+            koji.plugin.run_callbacks(
+                'preUntag', tag=tag, build=build, user=user, force=force, strict=True)
+    for build, tagged in changes:
+        if tagged and build['state'] != koji.BUILD_STATES['COMPLETE']:
+            # incomplete builds may not be tagged, not even when forced
+            nvr = "%(name)s-%(version)s-%(release)s" % build
+            state = koji.BUILD_STATES[build['state']]
+            raise koji.TagError("build %s not complete: state %s" % (nvr, state))
+    tag_id = tag['id']
+    user_id = user['id']
+    table = 'tag_listing'
+    build_ids = tuple(sorted(set([build['id'] for build, tagged in changes])))
+    query = QueryProcessor(columns=['build_id'], tables=[table],
+                           clauses=['active = TRUE', 'tag_id=%(tag_id)i',
+                                    'build_id IN %(build_ids)s'],
+                           values={'tag_id': tag_id, 'build_ids': build_ids},
+                           opts={'rowlock': True})
+    current = set([row['build_id'] for row in query.execute()])
+    events = get_events(len(changes))
+    update = BulkUpdateProcessor(table, match_keys=('tag_id', 'build_id'))
+    insert = BulkInsertProcessor(table)
+    for (build, tagged), event_id in zip(changes, events):
+        build_id = build['id']
+        nvr = "%(name)s-%(version)s-%(release)s" % build
+        if build_id in current:
+            if tagged and not force:
+                raise koji.TagError("build %s already tagged (%s)" % (nvr, tag['name']))
+            # revoke the old tag first
+            update.data.append({'tag_id': tag_id, 'build_id': build_id,
+                                'revoke_event': event_id})
+            current.remove(build_id)
+        elif not tagged:
+            raise koji.TagError("build %s not in tag %s" % (nvr, tag['name']))
+        if tagged:
+            insert.add_record(tag_id=tag_id, build_id=build_id, create_event=event_id,
+                              creator_id=user_id)
+    if update.data:
+        update.make_revoke(user_id=user_id)
+        update.execute()
+    if insert.data:
+        insert.execute()
+    log_tag_change(tag_id, table, event_id=events)
+    for build, tagged in changes:
+        if tagged:
+            koji.plugin.run_callbacks('postTag', tag=tag, build=build, user=user, force=force)
+        else:
+            koji.plugin.run_callbacks(
+                'postUntag', tag=tag, build=build, user=user, force=force, strict=True)
+
+
 def _untag_build(tag, build, user_id=None, strict=True, force=False):
     """Untag a build
 
@@ -1885,6 +2211,8 @@ def _direct_untag_build(tag, build, user, strict=True, force=False):
     if count == 0 and strict:
         nvr = "%(name)s-%(version)s-%(release)s" % build
         raise koji.TagError("build %s not in tag %s" % (nvr, tag['name']))
+    if count:
+        log_tag_change(tag['id'], 'tag_listing')
     koji.plugin.run_callbacks(
         'postUntag', tag=tag, build=build, user=user, force=force, strict=strict)
 
@@ -1949,6 +2277,7 @@ def _grplist_add(taginfo, grpinfo, block, force, **opts):
     insert = InsertProcessor('group_config', data=opts)
     insert.make_create()
     insert.execute()
+    log_tag_change(tag['id'], 'group_config')
 
 
 def grplist_remove(taginfo, grpinfo, force=False):
@@ -1991,6 +2320,7 @@ def _grplist_remove(taginfo, grpinfo, force=False):
     update = UpdateProcessor('group_config', values=locals(), clauses=clauses)
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, 'group_config')
 
 
 def grplist_block(taginfo, grpinfo):
@@ -2026,6 +2356,7 @@ def _grplist_unblock(taginfo, grpinfo):
     update = UpdateProcessor(table, values=locals(), clauses=clauses)
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, table)
 
 
 # tag-group-pkg operations
@@ -2096,6 +2427,7 @@ def _grp_pkg_add(taginfo, grpinfo, pkg_name, block, force, **opts):
     insert = InsertProcessor('group_package_listing', data=opts)
     insert.make_create()
     insert.execute()
+    log_tag_change(tag['id'], 'group_package_listing')
 
 
 def grp_pkg_remove(taginfo, grpinfo, pkg_name):
@@ -2119,6 +2451,7 @@ def _grp_pkg_remove(taginfo, grpinfo, pkg_name):
                                       'group_id = %(grp_id)s'])
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, 'group_package_listing')
 
 
 def grp_pkg_block(taginfo, grpinfo, pkg_name):
@@ -2153,6 +2486,7 @@ def _grp_pkg_unblock(taginfo, grpinfo, pkg_name):
     update = UpdateProcessor('group_package_listing', values=locals(), clauses=clauses)
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, 'group_package_listing')
 
 
 # tag-group-req operations
@@ -2224,6 +2558,7 @@ def _grp_req_add(taginfo, grpinfo, reqinfo, block, force, **opts):
     insert = InsertProcessor('group_req_listing', data=opts)
     insert.make_create()
     insert.execute()
+    log_tag_change(tag['id'], 'group_req_listing')
 
 
 def grp_req_remove(taginfo, grpinfo, reqinfo, force=None):
@@ -2250,6 +2585,7 @@ def _grp_req_remove(taginfo, grpinfo, reqinfo, force):
                                       'group_id = %(grp_id)s'])
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, 'group_req_listing')
 
 
 def grp_req_block(taginfo, grpinfo, reqinfo):
@@ -2286,6 +2622,7 @@ def _grp_req_unblock(taginfo, grpinfo, reqinfo):
     update = UpdateProcessor('group_req_listing', values=locals(), clauses=clauses)
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, 'group_req_listing')
 
 
 def get_tag_groups(tag, event=None, inherit=True, incl_pkgs=True, incl_reqs=True):
@@ -2682,6 +3019,10 @@ def maven_tag_archives(tag_id, event_id=None, inherit=True):
     return _iter_archives()
 
 
+# number of rpms repo_init collects before writing out the pkglist/rpmlist files
+REPO_INIT_BATCH = 10000
+
+
 def repo_init(tag, task_id=None, event=None, opts=None):
     """Create a new repo entry in the INIT state
 
@@ -2742,21 +3083,26 @@ def repo_init(tag, task_id=None, event=None, opts=None):
     latest = not tinfo['extra'].get('repo_include_all', False)
     # Note: the repo_include_all option is not recommended for common use
     #       see https://pagure.io/koji/issue/588 for background
+    timings = {}
+    start = time.time()
     rpms, builds = readTaggedRPMS(tag_id, event=event_id, inherit=True, latest=latest)
 
     groups = readTagGroups(tag_id, event=event_id, inherit=True)
     blocks = [pkg for pkg in readPackageList(tag_id, event=event_id, inherit=True,
                                              with_owners=False).values()
               if pkg['blocked']]
+    timings['query'] = time.time() - start
     repodir = koji.pathinfo.repo(repo_id, tinfo['name'])
     os.makedirs(repodir)  # should not already exist
 
     # generate comps and groups.spec
+    start = time.time()
     groupsdir = "%s/groups" % (repodir)
     koji.ensuredir(groupsdir)
     comps = koji.generate_comps(groups, expand_groups=True)
     with open("%s/comps.xml" % groupsdir, 'wt', encoding='utf-8') as fo:
         fo.write(comps)
+    timings['comps'] = time.time() - start
 
     # write repo info to disk
     repo_info = {
@@ -2776,6 +3122,7 @@ def repo_init(tag, task_id=None, event=None, opts=None):
         json.dump(repo_info, fp, indent=2)
 
     # get build dirs
+    start = time.time()
     relpathinfo = koji.PathInfo(topdir='toplink')
     builddirs = {}
     for build in builds:
@@ -2793,39 +3140,51 @@ def repo_init(tag, task_id=None, event=None, opts=None):
         os.symlink(top_relpath, top_link)
         pkglist[repoarch] = open(joinpath(archdir, 'pkglist'), 'wt', encoding='utf-8')
         rpmlist[repoarch] = open(joinpath(archdir, 'rpmlist.jsonl'), 'wt', encoding='utf-8')
+    # output is collected per arch and written out in large chunks
+    pkglist_buf = dict([(repoarch, []) for repoarch in repo_arches])
+    rpmlist_buf = dict([(repoarch, []) for repoarch in repo_arches])
+    noarch_arches = [repoarch for repoarch in repo_arches if repoarch != 'src']
+    buffered = 0
+
+    def _flush_lists():
+        for repoarch in repo_arches:
+            pkglist[repoarch].write(''.join(pkglist_buf[repoarch]))
+            rpmlist[repoarch].write(''.join(rpmlist_buf[repoarch]))
+            del pkglist_buf[repoarch][:]
+            del rpmlist_buf[repoarch][:]
+
     # NOTE - rpms is a generator
     for rpminfo in rpms:
         if not opts['debuginfo'] and koji.is_debuginfo(rpminfo['name']):
             continue
-        relpath = "%s/%s\n" % (builddirs[rpminfo['build_id']], relpathinfo.rpm(rpminfo))
-        rpm_json = json.dumps(rpminfo, indent=None)
-        # must be one line for nl-delimited json
         arch = rpminfo['arch']
         if arch == 'src':
+            targets = []
             if opts['src']:
-                for repoarch in repo_arches:
-                    pkglist[repoarch].write(relpath)
-                    rpmlist[repoarch].write(rpm_json)
-                    rpmlist[repoarch].write('\n')
+                targets.extend(repo_arches)
             if opts['separate_src']:
-                pkglist[arch].write(relpath)
-                rpmlist[arch].write(rpm_json)
-                rpmlist[arch].write('\n')
+                targets.append(arch)
         elif arch == 'noarch':
-            for repoarch in repo_arches:
-                if repoarch == 'src':
-                    continue
-                pkglist[repoarch].write(relpath)
-                rpmlist[repoarch].write(rpm_json)
-                rpmlist[repoarch].write('\n')
+            targets = noarch_arches
         else:
             repoarch = koji.canonArch(arch)
             if repoarch not in repo_arches:
                 # Do not create a repo for arches not in the arch list for this tag
                 continue
-            pkglist[repoarch].write(relpath)
-            rpmlist[repoarch].write(rpm_json)
-            rpmlist[repoarch].write('\n')
+            targets = [repoarch]
+        if not targets:
+            continue
+        relpath = "%s/%s\n" % (builddirs[rpminfo['build_id']], relpathinfo.rpm(rpminfo))
+        # encoded once for all arches, must be one line for nl-delimited json
+        rpm_json = json.dumps(rpminfo, indent=None) + '\n'
+        for repoarch in targets:
+            pkglist_buf[repoarch].append(relpath)
+            rpmlist_buf[repoarch].append(rpm_json)
+        buffered += 1
+        if buffered >= REPO_INIT_BATCH:
+            _flush_lists()
+            buffered = 0
+    _flush_lists()
     for repoarch in repo_arches:
         pkglist[repoarch].close()
         rpmlist[repoarch].close()
@@ -2837,7 +3196,9 @@ def repo_init(tag, task_id=None, event=None, opts=None):
             blocklist.write(pkg['package_name'])
             blocklist.write('\n')
         blocklist.close()
+    timings['pkglist'] = time.time() - start
 
+    start = time.time()
     if opts['maven']:
         if not context.opts.get('EnableMaven'):
             # either option override or recently disabled
@@ -2873,6 +3234,10 @@ def repo_init(tag, task_id=None, event=None, opts=None):
                 log_error('Error linking %s to %s' % (destlink, relpath))
         for artifact_dir, artifacts in artifact_dirs.items():
             _write_maven_repo_metadata(artifact_dir, artifacts)
+    timings['maven'] = time.time() - start
+    logger.info('repo_init for repo %s (tag %s) timings: %s', repo_id, tinfo['name'],
+                ', '.join(['%s %.3fs' % (k, timings[k])
+                           for k in ('query', 'comps', 'pkglist', 'maven')]))
 
     koji.plugin.run_callbacks('postRepoInit', tag=tinfo, event=event, repo_id=repo_id,
                               task_id=task_id, opts=opts)
@@ -3122,32 +3487,81 @@ def tag_changed_since_event(event, taglist):
 
     Returns: True or False
     """
-    data = locals().copy()
-    # first check the tag_updates table
-    query = QueryProcessor(tables=['tag_updates'], columns=['id'],
-                           clauses=['update_event > %(event)i', 'tag_id IN %(taglist)s'],
-                           values=data, opts={'limit': 1})
-    if query.execute():
-        return True
-    # also check these versioned tables
-    tables = (
-        'tag_listing',
-        'tag_inheritance',
-        'tag_config',
-        'tag_extra',
-        'tag_packages',
-        'tag_external_repos',
-        'group_package_listing',
-        'group_req_listing',
-        'group_config',
-    )
-    for table in tables:
-        query = QueryProcessor(tables=[table], columns=['tag_id'], values=data,
-                               clauses=['create_event > %(event)i OR revoke_event > %(event)i',
-                                        'tag_id IN %(taglist)s'], opts={'limit': 1})
-        if query.execute():
-            return True
-    return False
+    event = convert_value(event, int)
+    taglist = [convert_value(tag_id, int) for tag_id in taglist]
+    if not taglist:
+        return False
+    index = read_tag_last_change(taglist, inherit=False)
+    for tag_id in taglist:
+        if tag_id not in index:
+            # not indexed yet, check the journal
+            return _read_tag_changes(taglist, after=event) is not None
+    return max(index.values()) > event
+
+
+def read_tag_last_change(tag_ids, inherit=True):
+    """Read the last change events for the given tags from the tag_last_change index
+
+    The index only holds the direct changes of each tag. Inherited values are
+    computed here from the current inheritance of each tag.
+
+    :param list tag_ids: tags to look up
+    :param bool inherit: report changes in the tags they inherit from too
+    :returns: a dict mapping tag ids to events. Tags without an indexed value
+              for the tag or any of its parents are omitted.
+    """
+    if not tag_ids:
+        return {}
+    tag_ids = sorted(set(tag_ids))
+    chains = {}
+    for tag_id in tag_ids:
+        chains[tag_id] = [tag_id]
+        if inherit:
+            chains[tag_id].extend([link['parent_id'] for link in readFullInheritance(tag_id)])
+    all_tags = set()
+    for chain in chains.values():
+        all_tags.update(chain)
+    query = QueryProcessor(tables=['tag_last_change'], columns=['tag_id', 'event_id'],
+                           clauses=['tag_id IN %(tag_ids)s', 'event_id IS NOT NULL'],
+                           values={'tag_ids': sorted(all_tags)})
+    index = dict([(row['tag_id'], row['event_id']) for row in query.execute()])
+    ret = {}
+    for tag_id, chain in chains.items():
+        if all(t in index for t in chain):
+            ret[tag_id] = max([index[t] for t in chain])
+    return ret
+
+
+def _read_tag_changes(tags, before=None, after=None):
+    """Look up the tag_changes journal for the given tags
+
+    Returns the first change after the after event if it is given, otherwise
+    the last change before the before event (if any). Returns None if there
+    is no such change.
+    """
+    if after is not None:
+        func = 'min'
+        clause = ' AND tag_changes.event_id > %(after)i'
+    else:
+        func = 'max'
+        clause = ''
+        if before is not None:
+            clause = ' AND tag_changes.event_id < %(before)i'
+    # one index lookup per tag
+    query = QueryProcessor(
+        tables=['tag'],
+        columns=[f'(SELECT {func}(event_id) FROM tag_changes '
+                 f'WHERE tag_changes.tag_id = tag.id{clause})'],
+        aliases=['event_id'],
+        clauses=['tag.id IN %(tags)s'],
+        values={'tags': tags, 'before': before, 'after': after})
+    events = [row['event_id'] for row in query.execute() if row['event_id'] is not None]
+    if not events:
+        return None
+    elif after is not None:
+        return min(events)
+    else:
+        return max(events)
 
 
 def tag_last_change_event(tag, before=None, inherit=True):
@@ -3170,100 +3584,25 @@ def tag_last_change_event(tag, before=None, inherit=True):
     if before is None and tag_delete:
         return tag_delete
 
+    if before is None:
+        last = read_tag_last_change([tag_id], inherit=inherit).get(tag_id)
+        if last is not None:
+            return last
+        # otherwise the tag is not indexed yet, use the journal
+
     # get inheritance at the event
     tags = [tag_id]
     if inherit:
         tags += [link['parent_id'] for link in readFullInheritance(tag_id, event=before)]
 
-    data = {
-        'before': before,
-        'tags': tags,
-    }
-
-    # first check the tag_updates table
-    tag_clause = 'tag_id IN %(tags)s'
-    clauses = [tag_clause]
-    if before is not None:
-        clauses.append('update_event < %(before)s')
-    query = QueryProcessor(tables=['tag_updates'], clauses=clauses,
-                           columns=['max(update_event)'], values=data)
-    update_event = query.singleValue()
-    logger.debug('tag_update event %s', update_event)
-    events = [update_event]
-
-    # check for changes in versioned tables
-    tables = (
-        'tag_listing',
-        'tag_inheritance',
-        'tag_config',
-        'tag_packages',
-        'tag_external_repos',
-        'tag_extra',
-        'group_package_listing',
-        'group_req_listing',
-        'group_config',
-    )
-    for table in tables:
-        # create events
-        clauses = [tag_clause]
-        if before is not None:
-            clauses.append('create_event < %(before)s')
-        query = QueryProcessor(tables=[table], columns=['max(create_event)'],
-                               clauses=clauses, values=data)
-        events.append(query.singleValue())
-        logger.debug('%s create event %s', table, events[-1])
-
-        # revoke events
-        clauses = [tag_clause]
-        if before is not None:
-            clauses.append('revoke_event < %(before)s')
-        query = QueryProcessor(tables=[table], columns=['max(revoke_event)'],
-                               clauses=clauses, values=data)
-        events.append(query.singleValue())
-        logger.debug('%s revoke event %s', table, events[-1])
-
-    # also check external repo changes
-    repos = set()
-    for tag_id in tags:
-        for tag_repo in get_tag_external_repos(tag_info=tag_id, event=before):
-            repos.add(tag_repo['external_repo_id'])
-    if repos:
-        repos = list(repos)
-        repos.sort()
-        repo_clause = 'external_repo_id IN %(repos)s'
-        data['repos'] = repos
-        tables = (
-            'external_repo_config',
-            'external_repo_data',
-        )
-        for table in tables:
-            # create events
-            clauses = [repo_clause]
-            if before is not None:
-                clauses.append('create_event < %(before)s')
-            query = QueryProcessor(tables=[table], columns=['max(create_event)'],
-                                   clauses=clauses, values=data)
-            events.append(query.singleValue())
-            logger.debug('%s create event %s', table, events[-1])
-
-            # revoke events
-            clauses = [repo_clause]
-            if before is not None:
-                clauses.append('revoke_event < %(before)s')
-            query = QueryProcessor(tables=[table], columns=['max(revoke_event)'],
-                                   clauses=clauses, values=data)
-            events.append(query.singleValue())
-            logger.debug('%s revoke event %s', table, events[-1])
-
-    # return the most recent event
-    events = [ev for ev in events if ev is not None]
-    if not events:
+    last = _read_tag_changes(tags, before=before)
+    if last is None:
         # this could happen if our before value is before the tag existed
         return None
     elif tag_delete:
-        return min(tag_delete, max(events))
+        return min(tag_delete, last)
     else:
-        return max(events)
+        return last
 
 
 def tag_first_change_event(tag, after=None, inherit=True):
@@ -3289,28 +3628,42 @@ def tag_first_change_event(tag, after=None, inherit=True):
     if after is None:
         return tag_create
 
+    last = read_tag_last_change([tag_id], inherit=inherit).get(tag_id)
+    if last is not None and last <= after:
+        # no subsequent changes
+        return None
+
     # get tag list
     tags = [tag_id]
     if inherit:
         tags += [link['parent_id'] for link in readFullInheritance(tag_id, event=after)]
 
-    data = {
-        'after': after,
-        'tags': tags,
-    }
+    first = _read_tag_changes(tags, after=after)
+    if first is None:
+        # no subsequent changes found
+        return None
+    else:
+        return max(first, tag_create)
+
+
+def check_tag_last_change(repair=False):
+    """Check the tag_last_change index against the versioned tag tables
 
-    # first check the tag_updates table
-    tag_clause = 'tag_id IN %(tags)s'
-    clauses = [tag_clause]
-    if after:
-        clauses.append('update_event > %(after)s')
-    query = QueryProcessor(tables=['tag_updates'], clauses=clauses,
-                           columns=['min(update_event)'], values=data)
-    update_event = query.singleValue()
-    logger.debug('tag_update event %s', update_event)
-    events = [update_event]
-
-    # check for changes in versioned tables
+    The expected values are computed from the history tables: the last direct
+    change to each tag.
+
+    :param bool repair: rewrite the index entries that do not match
+    :returns: a list of the mismatched entries, with the current and the
+              expected values
+    """
+    context.session.assertPerm('admin')
+    repair = convert_value(repair, bool)
+
+    # last direct change for each tag
+    direct = {}
+    queries = [QueryProcessor(tables=['tag_updates'], columns=['tag_id', 'max(update_event)'],
+                              aliases=['tag_id', 'event_id'], opts={'group': 'tag_id'},
+                              enable_group=True)]
     tables = (
         'tag_listing',
         'tag_inheritance',
@@ -3323,62 +3676,49 @@ def tag_first_change_event(tag, after=None, inherit=True):
         'group_config',
     )
     for table in tables:
-        clauses = [tag_clause]
-        if after is not None:
-            clauses.append('create_event > %(after)s')
-        query = QueryProcessor(tables=[table], columns=['min(create_event)'],
-                               clauses=clauses, values=data)
-        events.append(query.singleValue())
-        logger.debug('%s create event %s', table, events[-1])
-
-        clauses = [tag_clause]
-        if after is not None:
-            clauses.append('revoke_event > %(after)s')
-        query = QueryProcessor(tables=[table], columns=['min(revoke_event)'],
-                               clauses=clauses, values=data)
-        events.append(query.singleValue())
-        logger.debug('%s revoke event %s', table, events[-1])
-
-    # also check external repo changes
-    repos = set()
-    for tag_id in tags:
-        for tag_repo in get_tag_external_repos(tag_info=tag_id, event=after):
-            repos.add(tag_repo['external_repo_id'])
-    if repos:
-        repos = list(repos)
-        repos.sort()
-        repo_clause = 'external_repo_id IN %(repos)s'
-        data['repos'] = repos
-        tables = (
-            'external_repo_config',
-            'external_repo_data',
-        )
-        for table in tables:
-            # create events
-            clauses = [repo_clause]
-            if after is not None:
-                clauses.append('create_event > %(after)s')
-            query = QueryProcessor(tables=[table], columns=['min(create_event)'],
-                                   clauses=clauses, values=data)
-            events.append(query.singleValue())
-            logger.debug('%s create event %s', table, events[-1])
-
-            # revoke events
-            clauses = [repo_clause]
-            if after is not None:
-                clauses.append('revoke_event > %(after)s')
-            query = QueryProcessor(tables=[table], columns=['min(revoke_event)'],
-                                   clauses=clauses, values=data)
-            events.append(query.singleValue())
-            logger.debug('%s revoke event %s', table, events[-1])
-
-    # return the most recent event
-    events = [ev for ev in events if ev is not None]
-    if not events:
-        # no subsequent changes found
-        return None
-    else:
-        return max(min(events), tag_create)
+        queries.append(QueryProcessor(
+            tables=[table], columns=['tag_id', 'max(GREATEST(create_event, revoke_event))'],
+            aliases=['tag_id', 'event_id'], opts={'group': 'tag_id'}, enable_group=True))
+    # external repo changes count for the tags using the repo
+    for table in ('external_repo_config', 'external_repo_data'):
+        queries.append(QueryProcessor(
+            tables=['tag_external_repos'],
+            columns=['tag_external_repos.tag_id',
+                     f'max(GREATEST({table}.create_event, {table}.revoke_event))'],
+            aliases=['tag_id', 'event_id'],
+            joins=[f'{table} ON {table}.external_repo_id = tag_external_repos.external_repo_id'],
+            clauses=['tag_external_repos.active IS TRUE'],
+            opts={'group': 'tag_external_repos.tag_id'}, enable_group=True))
+    for query in queries:
+        for row in query.execute():
+            if row['event_id'] is not None:
+                direct[row['tag_id']] = max(row['event_id'], direct.get(row['tag_id'], 0))
+
+    query = QueryProcessor(tables=['tag_last_change'],
+                           columns=['tag_id', 'event_id'])
+    index = dict([(row['tag_id'], row) for row in query.execute()])
+
+    mismatches = []
+    for tag_id in sorted(set(direct) | set(index)):
+        expected = direct.get(tag_id)
+        current = index.get(tag_id, {})
+        if current.get('event_id') == expected:
+            continue
+        mismatches.append({
+            'tag_id': tag_id,
+            'event_id': current.get('event_id'),
+            'expected_event_id': expected,
+        })
+    logger.info('Checked tag_last_change for %i tags, %i mismatches', len(direct),
+                len(mismatches))
+    if repair:
+        for entry in mismatches:
+            data = {
+                'tag_id': entry['tag_id'],
+                'event_id': entry['expected_event_id'],
+            }
+            UpsertProcessor('tag_last_change', data=data, keys=['tag_id']).execute()
+    return mismatches
 
 
 def set_tag_update(tag_id, utype, event_id=None, user_id=None):
@@ -3395,6 +3735,82 @@ def set_tag_update(tag_id, utype, event_id=None, user_id=None):
             'updater_id': user_id}
     insert = InsertProcessor('tag_updates', data=data)
     insert.execute()
+    log_tag_change(tag_id, 'tag_updates', event_id=event_id)
+
+
+def log_tag_change(tag_ids, kind, event_id=None):
+    """Record a tag change in the tag_changes journal
+
+    The journal lets the repo code find tag changes without scanning all the
+    versioned tag tables. Changes are recorded only for the tags whose data
+    changed. Readers follow inheritance to propagate them to descendant tags.
+
+    :param tag_ids: id or list of ids of the changed tags
+    :param str kind: what changed, normally the name of the table that was written
+    :param event_id: event or list of events of the change, defaults to the current event
+    """
+    if isinstance(tag_ids, int):
+        tag_ids = [tag_ids]
+    if not tag_ids:
+        return
+    if event_id is None:
+        event_id = get_event()
+    if not isinstance(event_id, (list, tuple)):
+        event_id = [event_id]
+    values = {
+        'tag_ids': sorted(set(tag_ids)),
+        'event_ids': sorted(set(event_id)),
+        'kind': kind,
+    }
+    _dml("""INSERT INTO tag_changes (tag_id, event_id, kind)
+    SELECT tag.id, events.id, %(kind)s FROM tag, events
+    WHERE tag.id IN %(tag_ids)s AND events.id IN %(event_ids)s
+    ORDER BY tag.id, events.id
+    ON CONFLICT DO NOTHING""", values)
+    # the tag_last_change index is updated once, right before the commit
+    if not hasattr(context, 'tag_last_change'):
+        context.tag_last_change = []
+    first = values['event_ids'][0]
+    context.tag_last_change.extend([(tag_id, first) for tag_id in values['tag_ids']])
+
+
+def flush_tag_last_change():
+    """Update the tag_last_change index for the tags changed in this transaction
+
+    This is called right before the commit, so the index rows are only locked
+    for the commit itself, and in tag id order, so that concurrent commits lock
+    them in the same order. The values come from the tag_changes journal, which
+    leaves out changes that were rolled back. Values are only ever raised, so
+    the commits can happen in any order.
+    """
+    pending = getattr(context, 'tag_last_change', None)
+    if not pending:
+        return
+    context.tag_last_change = []
+    values = {
+        'tag_ids': sorted(set([tag_id for tag_id, event_id in pending])),
+        'after': min([event_id for tag_id, event_id in pending]),
+    }
+    _dml("""INSERT INTO tag_last_change (tag_id, event_id)
+    SELECT tag_id, max(event_id) FROM tag_changes
+    WHERE tag_id IN %(tag_ids)s AND event_id >= %(after)s
+    GROUP BY tag_id ORDER BY tag_id
+    ON CONFLICT (tag_id) DO UPDATE SET
+        event_id = GREATEST(tag_last_change.event_id, EXCLUDED.event_id)""", values)
+
+
+def log_external_repo_change(repo_id, kind, event_id=None):
+    """Record an external repo change for the tags that use the repo
+
+    :param int repo_id: id of the external repo
+    :param str kind: what changed, normally the name of the table that was written
+    :param int event_id: event of the change, defaults to the current event
+    """
+    query = QueryProcessor(tables=['tag_external_repos'], columns=['tag_id'],
+                           clauses=['external_repo_id = %(repo_id)i', 'active IS TRUE'],
+                           values={'repo_id': repo_id}, opts={'asList': True})
+    tag_ids = [row[0] for row in query.execute()]
+    log_tag_change(tag_ids, kind, event_id=event_id)
 
 
 def create_build_target(name, build_tag, dest_tag):
@@ -3744,6 +4160,7 @@ def _create_tag(name, parent=None, arches=None, perm=None, locked=False, maven_s
     insert.set(maven_support=maven_support, maven_include_all=maven_include_all)
     insert.make_create()
     insert.execute()
+    log_tag_change(tag_id, 'tag_config')
 
     # add extra data
     if extra is not None:
@@ -3955,8 +4372,10 @@ def _edit_tag(tagInfo, **kwargs):
         insert.set(**dslice(data, ('maven_support', 'maven_include_all')))
         insert.make_create()
         insert.execute()
+        log_tag_change(tag['id'], 'tag_config')
 
     # handle extra data
+    extra_changed = False
     if 'extra' in kwargs:
         removed = set(kwargs.get('block_extra', [])) | set(kwargs.get('remove_extra', []))
         # check whether one key is both in extra and remove_extra
@@ -3985,6 +4404,7 @@ def _edit_tag(tagInfo, **kwargs):
                 insert = InsertProcessor('tag_extra', data=data)
                 insert.make_create()
                 insert.execute()
+                extra_changed = True
 
     if 'block_extra' in kwargs:
         for key in kwargs['block_extra']:
@@ -4002,6 +4422,7 @@ def _edit_tag(tagInfo, **kwargs):
             insert = InsertProcessor('tag_extra', data=data)
             insert.make_create()
             insert.execute()
+            extra_changed = True
 
     # handle remove_extra data
     if 'remove_extra' in kwargs:
@@ -4019,6 +4440,9 @@ def _edit_tag(tagInfo, **kwargs):
                                                                         'key=%(key)s'])
             update.make_revoke()
             update.execute()
+            extra_changed = True
+    if extra_changed:
+        log_tag_change(tag['id'], 'tag_extra')
 
 
 def old_edit_tag(tagInfo, name, arches, locked, permissionID, extra=None):
@@ -4046,6 +4470,7 @@ def _delete_tag(tagInfo):
 
     tag = get_tag(tagInfo, strict=True)
     tagID = tag['id']
+    children = [link['tag_id'] for link in readDescendantsData(tagID)]
 
     _tagDelete('tag_config', tagID)
     # technically, to 'delete' the tag we only have to revoke the tag_config entry
@@ -4053,6 +4478,7 @@ def _delete_tag(tagInfo):
     _tagDelete('tag_extra', tagID)
     _tagDelete('tag_inheritance', tagID)
     _tagDelete('tag_inheritance', tagID, 'parent_id')
+    clear_inheritance_cache()
     _tagDelete('build_target_config', tagID, 'build_tag')
     _tagDelete('build_target_config', tagID, 'dest_tag')
     _tagDelete('tag_listing', tagID)
@@ -4062,6 +4488,9 @@ def _delete_tag(tagInfo):
     _tagDelete('group_config', tagID)
     _tagDelete('group_req_listing', tagID)
     _tagDelete('group_package_listing', tagID)
+    log_tag_change(tagID, 'tag_config')
+    # the children lose their inheritance link
+    log_tag_change(children, 'tag_inheritance')
     # note: we do not delete the entry in the tag table (we can't actually, it
     # is still referenced by the revoked rows).
     # note: there is no need to do anything with the repo entries that reference tagID
@@ -4183,6 +4612,7 @@ def edit_external_repo(info, name=None, url=None):
 
         update.execute()
         insert.execute()
+        log_external_repo_change(repo_id, 'external_repo_config')
 
 
 def delete_external_repo(info):
@@ -4242,6 +4672,7 @@ def add_external_repo_to_tag(tag_info, repo_info, priority, merge_mode='koji', a
                merge_mode=merge_mode, arches=arches)
     insert.make_create()
     insert.execute()
+    log_tag_change(tag_id, 'tag_external_repos')
 
 
 def remove_external_repo_from_tag(tag_info, repo_info):
@@ -4262,6 +4693,7 @@ def remove_external_repo_from_tag(tag_info, repo_info):
                              clauses=["tag_id = %(tag_id)i", "external_repo_id = %(repo_id)i"])
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_id, 'tag_external_repos')
 
 
 def edit_tag_external_repo(tag_info, repo_info, priority=None, merge_mode=None, arches=None):
@@ -4684,6 +5116,55 @@ def get_build(buildInfo, strict=False):
     if buildID is None:
         return None
 
+    query = _get_build_query(['build.id = %(buildID)i'], {'buildID': buildID})
+    result = query.executeOne()
+
+    if not result:
+        if strict:
+            raise koji.GenericError('No such build: %s' % buildInfo)
+        else:
+            return None
+    if result['cg_id']:
+        result['cg_name'] = lookup_name('content_generator', result['cg_id'], strict=True)['name']
+    else:
+        result['cg_name'] = None
+    return result
+
+
+def get_builds(build_ids, strict=False):
+    """Return information about several builds, as get_build does for one
+
+    :param list build_ids: numeric build ids
+    :param bool strict: raise an error if a build does not exist
+    :returns: a list of build maps, in the order of build_ids. Missing builds
+              are None unless strict is set.
+    """
+    if not build_ids:
+        return []
+    query = _get_build_query(['build.id IN %(build_ids)s'],
+                             {'build_ids': list(set(build_ids))})
+    builds = dict([(row['id'], row) for row in query.execute()])
+    cg_names = {}
+    for binfo in builds.values():
+        cg_id = binfo['cg_id']
+        if cg_id and cg_id not in cg_names:
+            cg_names[cg_id] = lookup_name('content_generator', cg_id, strict=True)['name']
+        binfo['cg_name'] = cg_names.get(cg_id)
+    ret = []
+    for build_id in build_ids:
+        binfo = builds.get(build_id)
+        if binfo is None:
+            if strict:
+                raise koji.GenericError('No such build: %s' % build_id)
+        else:
+            # duplicate ids get their own copy
+            binfo = binfo.copy()
+        ret.append(binfo)
+    return ret
+
+
+def _get_build_query(clauses, values):
+    """Return a query for the build fields reported by get_build"""
     fields = (('build.id', 'id'), ('build.version', 'version'), ('build.release', 'release'),
               ('build.id', 'build_id'),
               ('build.epoch', 'epoch'),
@@ -4714,22 +5195,9 @@ def get_build(buildInfo, strict=False):
              'users on build.owner = users.id',
              'LEFT JOIN users AS promoter ON build.promoter = promoter.id',
              ]
-    clauses = ['build.id = %(buildID)i']
-    query = QueryProcessor(columns=fields, aliases=aliases, values=locals(),
-                           transform=_fix_extra_field,
-                           tables=['build'], joins=joins, clauses=clauses)
-    result = query.executeOne()
-
-    if not result:
-        if strict:
-            raise koji.GenericError('No such build: %s' % buildInfo)
-        else:
-            return None
-    if result['cg_id']:
-        result['cg_name'] = lookup_name('content_generator', result['cg_id'], strict=True)['name']
-    else:
-        result['cg_name'] = None
-    return result
+    return QueryProcessor(columns=fields, aliases=aliases, values=values,
+                          transform=_fix_extra_field,
+                          tables=['build'], joins=joins, clauses=clauses)
 
 
 def get_build_logs(build):
@@ -8943,183 +9411,194 @@ def build_references(build_id, limit=None, lazy=False):
 
     :returns: dict of reference results for each reference type
     """
+    return builds_references([build_id], limit=limit, lazy=lazy)[build_id]
+
+
+def _build_refs_query(columns, query, build_ids, limit):
+    """Run a reference query for each of the builds
+
+    The query is run for each build via a lateral join, with the build id
+    available as src.build_id, so that the limit applies to each build.
 
+    :returns: dict mapping build ids to lists of result rows
+    """
     ret = {}
+    if not build_ids:
+        return ret
+    # list values are passed as tuples for IN clauses, so the ids are passed
+    # as an array literal
+    values = {
+        'build_ids': '{%s}' % ','.join([str(int(build_id)) for build_id in build_ids]),
+        'st_complete': koji.BUILD_STATES['COMPLETE'],
+        'limit': limit,
+    }
+    q = """SELECT src.build_id, %s
+           FROM unnest(%%(build_ids)s::INTEGER[]) AS src(build_id)
+           CROSS JOIN LATERAL (%s LIMIT %%(limit)s) AS refs""" % (
+        ', '.join(['refs.%s' % c for c in columns]), query)
+    for row in _multiRow(q, values, ['src_build_id'] + list(columns)):
+        ret.setdefault(row.pop('src_build_id'), []).append(row)
+    return ret
+
+
+def builds_references(build_ids, limit=None, lazy=False):
+    """Returns references to a set of builds
+
+    Same as build_references, but each reference type is queried for all of
+    the builds at once.
+
+    :param list build_ids: numeric build ids
+    :param int limit: If given, only return up to N results of each ref type
+                      for each build
+    :param bool lazy: If true, stop checking a build when any reference is
+                      found for it
+
+    :returns: dict mapping each build id to its reference results
+    """
+    build_ids = [int(build_id) for build_id in build_ids]
+    ret = dict([(build_id, {}) for build_id in build_ids])
+    # builds which are still checked, in lazy mode builds with references are dropped
+    pending = list(ret)
+
+    def set_refs(key, refs):
+        for build_id in pending:
+            ret[build_id][key] = refs.get(build_id, [])
+        if lazy:
+            pending[:] = [build_id for build_id in pending if not ret[build_id][key]]
 
     # find tags
     fields = [
+        ('tag_listing.build_id', 'build_id'),
         ('tag_id', 'tag_id'),
         ('tag.name', 'name')
     ]
     columns, aliases = zip(*fields)
     query = QueryProcessor(tables=['tag_listing'], columns=columns, aliases=aliases,
                            joins=['tag on tag_id = tag.id'],
-                           clauses=['build_id = %(build_id)i', 'active = TRUE'],
-                           values={'build_id': build_id})
-    ret['tags'] = query.execute()
-    if lazy and ret['tags']:
+                           clauses=['build_id IN %(build_ids)s', 'active = TRUE'],
+                           values={'build_ids': list(pending)})
+    refs = {}
+    for row in query.execute():
+        refs.setdefault(row.pop('build_id'), []).append(row)
+    set_refs('tags', refs)
+    if not pending:
         return ret
 
-    # we'll need the component rpm and archive ids for the rest
-    query = QueryProcessor(tables=['rpminfo'], columns=['id'],
-                           clauses=['build_id=%(build_id)i'],
-                           values={'build_id': build_id}, opts={'asList': True})
-    build_rpm_ids = [(i,) for i in query.execute()]
-    query = QueryProcessor(tables=['archiveinfo'], columns=['id'],
-                           clauses=['build_id=%(build_id)i'],
-                           values={'build_id': build_id}, opts={'asList': True})
-    build_archive_ids = [(i,) for i in query.execute()]
-    if not build_archive_ids:
-        build_archive_ids = []
+    # we'll need to know which builds have component rpms and archives for the rest
+    rpm_builds = set()
+    archive_builds = set()
+    for table, found in (('rpminfo', rpm_builds), ('archiveinfo', archive_builds)):
+        query = QueryProcessor(tables=[table], columns=['build_id'],
+                               clauses=['build_id IN %(build_ids)s'],
+                               values={'build_ids': list(pending)},
+                               opts={'asList': True, 'group': 'build_id'},
+                               enable_group=True)
+        found.update([row[0] for row in query.execute()])
 
     # find rpms whose buildroots we were in
-    st_complete = koji.BUILD_STATES['COMPLETE']
-    fields = [
-        ('rpminfo.id', 'id'),
-        ('rpminfo.name', 'name'),
-        ('rpminfo.version', 'version'),
-        ('rpminfo.release', 'release'),
-        ('rpminfo.arch', 'arch'),
-        ('rpminfo.build_id', 'build_id')
-    ]
-    columns, aliases = zip(*fields)
-    idx = {}
-    if limit is not None:
-        queryOpts = {'limit': limit}
-    else:
-        queryOpts = {}
-    for rpm_id in build_rpm_ids:
-        query = QueryProcessor(tables=['rpminfo', 'build'],
-                               columns=columns,
-                               aliases=aliases,
-                               clauses=['rpminfo.buildroot_id IN (SELECT DISTINCT buildroot_id '
-                                        'FROM buildroot_listing WHERE rpm_id = %(rpm_id)s)',
-                                        'rpminfo.build_id = build.id',
-                                        'build.state = %(st_complete)i'],
-                               values={'rpm_id': rpm_id, 'st_complete': st_complete},
-                               opts=queryOpts
-                               )
-        for row in query.execute():
-            idx.setdefault(row['id'], row)
-        if limit is not None and len(idx) > limit:
-            break
-    ret['rpms'] = list(idx.values())
-
-    if lazy and ret['rpms']:
+    columns = ['id', 'name', 'version', 'release', 'arch', 'build_id']
+    set_refs('rpms', _build_refs_query(
+        columns,
+        """SELECT DISTINCT rpminfo.id, rpminfo.name, rpminfo.version, rpminfo.release,
+                  rpminfo.arch, rpminfo.build_id
+           FROM rpminfo AS build_rpms
+           JOIN buildroot_listing ON buildroot_listing.rpm_id = build_rpms.id
+           JOIN rpminfo ON rpminfo.buildroot_id = buildroot_listing.buildroot_id
+           JOIN build ON rpminfo.build_id = build.id
+           WHERE build_rpms.build_id = src.build_id
+             AND build.state = %(st_complete)i""",
+        [build_id for build_id in pending if build_id in rpm_builds], limit))
+    if not pending:
         return ret
 
-    ret['component_of'] = []
     # find images/archives that contain the build rpms
-    fields = ['archive_id']
-    joins = ['archiveinfo on archiveinfo.id = archive_id',
-             'build on archiveinfo.build_id = build.id']
-    clauses = ['archive_rpm_components.rpm_id = %(rpm_id)s',
-               'build.state = %(st_complete)s']
-    values = {'st_complete': koji.BUILD_STATES['COMPLETE']}
-    qopts = {'asList': True}
-    if limit:
-        qopts['limit'] = limit
-    query = QueryProcessor(columns=fields, tables=['archive_rpm_components'],
-                           clauses=clauses, joins=joins, values=values, opts=qopts)
-    for rpm_id in build_rpm_ids:
-        query.values['rpm_id'] = rpm_id
-        archive_ids = [i[0] for i in query.execute()]
-        ret['component_of'].extend(archive_ids)
-
-    if lazy and ret['component_of']:
+    refs = _build_refs_query(
+        ['archive_id'],
+        """SELECT DISTINCT archive_rpm_components.archive_id
+           FROM rpminfo AS build_rpms
+           JOIN archive_rpm_components ON archive_rpm_components.rpm_id = build_rpms.id
+           JOIN archiveinfo ON archiveinfo.id = archive_rpm_components.archive_id
+           JOIN build ON archiveinfo.build_id = build.id
+           WHERE build_rpms.build_id = src.build_id
+             AND build.state = %(st_complete)i""",
+        [build_id for build_id in pending if build_id in rpm_builds], limit)
+    component_of = dict([(build_id, [row['archive_id'] for row in rows])
+                         for build_id, rows in refs.items()])
+    set_refs('component_of', component_of)
+    if not pending:
         return ret
 
     # find archives whose buildroots we were in
-    fields = [
-        ('archiveinfo.id', 'id'),
-        ('archiveinfo.type_id', 'type_id'),
-        ('archivetypes.name', 'type_name'),
-        ('archiveinfo.build_id', 'build_id'),
-        ('archiveinfo.filename', 'filename')
-    ]
-    columns, aliases = zip(*fields)
-    idx = {}
-    opts = {}
-    if limit is not None:
-        opts = {'limit': limit}
-    for archive_id in build_archive_ids:
-        query = QueryProcessor(tables=['buildroot_archives'], columns=columns, aliases=aliases,
-                               joins=['archiveinfo ON archiveinfo.buildroot_id = '
-                                      'buildroot_archives.buildroot_id',
-                                      'build ON archiveinfo.build_id = build.id',
-                                      'archivetypes ON archivetypes.id = archiveinfo.type_id'],
-                               clauses=['buildroot_archives.archive_id = %(archive_id)i',
-                                        'build.state = %(st_complete)i'],
-                               values={'archive_id': archive_id, 'st_complete': st_complete},
-                               opts=opts)
-        for row in query.execute():
-            idx.setdefault(row['id'], row)
-        if limit is not None and len(idx) > limit:
-            break
-    ret['archives'] = list(idx.values())
-
-    if lazy and ret['archives']:
+    columns = ['id', 'type_id', 'type_name', 'build_id', 'filename']
+    set_refs('archives', _build_refs_query(
+        columns,
+        """SELECT DISTINCT archiveinfo.id, archiveinfo.type_id, archivetypes.name,
+                  archiveinfo.build_id, archiveinfo.filename
+           FROM archiveinfo AS build_archives
+           JOIN buildroot_archives ON buildroot_archives.archive_id = build_archives.id
+           JOIN archiveinfo ON archiveinfo.buildroot_id = buildroot_archives.buildroot_id
+           JOIN build ON archiveinfo.build_id = build.id
+           JOIN archivetypes ON archivetypes.id = archiveinfo.type_id
+           WHERE build_archives.build_id = src.build_id
+             AND build.state = %(st_complete)i""",
+        [build_id for build_id in pending if build_id in archive_builds], limit))
+    if not pending:
         return ret
 
     # find images/archives that contain the build archives
-    fields = ['archive_id']
-    joins = ['archiveinfo on archiveinfo.id = archive_id',
-             'build on archiveinfo.build_id = build.id']
-    clauses = ['archive_components.component_id = %(archive_id)s',
-               'build.state = %(st_complete)s']
-    values = {'st_complete': koji.BUILD_STATES['COMPLETE']}
-    qopts = {'asList': True}
-    if limit:
-        qopts['limit'] = limit
-    query = QueryProcessor(columns=fields, tables=['archive_components'],
-                           clauses=clauses, joins=joins, values=values, opts=qopts)
-    for archive_id in build_archive_ids:
-        query.values['archive_id'] = archive_id
-        archive_ids = [i[0] for i in query.execute()]
-        ret['component_of'].extend(archive_ids)
-
-    if lazy and ret['component_of']:
+    refs = _build_refs_query(
+        ['archive_id'],
+        """SELECT DISTINCT archive_components.archive_id
+           FROM archiveinfo AS build_archives
+           JOIN archive_components ON archive_components.component_id = build_archives.id
+           JOIN archiveinfo ON archiveinfo.id = archive_components.archive_id
+           JOIN build ON archiveinfo.build_id = build.id
+           WHERE build_archives.build_id = src.build_id
+             AND build.state = %(st_complete)i""",
+        [build_id for build_id in pending if build_id in archive_builds], limit)
+    for build_id, rows in refs.items():
+        component_of.setdefault(build_id, []).extend([row['archive_id'] for row in rows])
+    set_refs('component_of', component_of)
+    if not pending:
         return ret
 
     # find timestamp of most recent use in a buildroot
-    event_id = 0
-    if build_rpm_ids:
-        # psql planner gots confused if buildroot table is large (>trillion)
-        # and len(rpm_ids) > ~500. In such case it switched to looped sequential scans
-        # using "SET enabled_hashjoin=off" improved it for some cases. CTE could be slower for
-        # simple cases but would improve complicated ones.
-        q = """WITH buildroot_ids as (
-                 SELECT DISTINCT buildroot_id
-                 FROM buildroot_listing
-                 WHERE rpm_id IN %(rpm_ids)s
-               )
-               SELECT MAX(create_event)
-               FROM standard_buildroot
-               WHERE buildroot_id IN (
-                  SELECT buildroot_id FROM buildroot_ids
-               )"""
-        event_id = (_fetchSingle(q, {'rpm_ids': build_rpm_ids}) or (0,))[0] or 0
-    if build_archive_ids:
+    last_event = {}
+    # psql planner gots confused if buildroot table is large (>trillion)
+    # and the number of rpms is > ~500. In such case it switched to looped sequential scans
+    # using "SET enabled_hashjoin=off" improved it for some cases. CTE could be slower for
+    # simple cases but would improve complicated ones.
+    for table, listing, column, found in (
+            ('rpminfo', 'buildroot_listing', 'rpm_id', rpm_builds),
+            ('archiveinfo', 'buildroot_archives', 'archive_id', archive_builds)):
+        found_ids = [build_id for build_id in pending if build_id in found]
+        if not found_ids:
+            continue
         q = """WITH buildroot_ids as (
-                 SELECT DISTINCT buildroot_id
-                 FROM buildroot_archives
-                 WHERE archive_id IN %(archive_ids)s
+                 SELECT DISTINCT %(table)s.build_id, %(listing)s.buildroot_id
+                 FROM %(listing)s
+                 JOIN %(table)s ON %(table)s.id = %(listing)s.%(column)s
+                 WHERE %(table)s.build_id IN %%(build_ids)s
                )
-               SELECT MAX(create_event)
+               SELECT buildroot_ids.build_id, MAX(create_event)
                FROM standard_buildroot
-               WHERE buildroot_id IN (
-                  SELECT buildroot_id FROM buildroot_ids
-               )"""
-        event_id2 = (_fetchSingle(q, {'archive_ids': build_archive_ids}) or (0,))[0] or 0
-        event_id = max(event_id, event_id2)
-    if event_id:
-        q = """SELECT date_part('epoch', get_event_time(%(event_id)i))"""
-        ret['last_used'] = _singleValue(q, locals())
-    else:
-        ret['last_used'] = None
-
-    # set 'images' field for backwards compat
-    ret['images'] = ret['component_of']
+               JOIN buildroot_ids ON buildroot_ids.buildroot_id = standard_buildroot.buildroot_id
+               GROUP BY buildroot_ids.build_id""" % locals()
+        for row in _multiRow(q, {'build_ids': found_ids}, ['build_id', 'event_id']):
+            if row['event_id']:
+                last_event[row['build_id']] = max(row['event_id'],
+                                                  last_event.get(row['build_id'], 0))
+    event_ts = {}
+    if last_event:
+        query = QueryProcessor(tables=['events'], columns=['id', "date_part('epoch', time)"],
+                               aliases=['id', 'ts'], clauses=['id IN %(event_ids)s'],
+                               values={'event_ids': sorted(set(last_event.values()))})
+        event_ts = dict([(row['id'], row['ts']) for row in query.execute()])
+    for build_id in pending:
+        event_id = last_event.get(build_id)
+        ret[build_id]['last_used'] = event_ts.get(event_id) if event_id else None
+        # set 'images' field for backwards compat
+        ret[build_id]['images'] = ret[build_id]['component_of']
 
     return ret
 
@@ -9212,9 +9691,14 @@ def _delete_build(binfo):
                                  values={'rpm_id': rpm_id})
         delete.execute()
     values = {'build_id': build_id}
+    query = QueryProcessor(tables=['tag_listing'], columns=['tag_id'],
+                           clauses=['build_id=%(build_id)i', 'active = TRUE'],
+                           values=values, opts={'asList': True})
+    tag_ids = [row[0] for row in query.execute()]
     update = UpdateProcessor('tag_listing', clauses=["build_id=%(build_id)i"], values=values)
     update.make_revoke()
     update.execute()
+    log_tag_change(tag_ids, 'tag_listing')
     update = UpdateProcessor('build', values=values, clauses=['id=%(build_id)i'],
                              data={'state': st_deleted})
     update.execute()
@@ -9803,28 +10287,99 @@ class OperationTest(koji.policy.MatchTest):
     field = 'operation'
 
 
+def _get_policy_cache():
+    """Return the request-scoped policy lookup cache, or None if caching is not active
+
+    Like the inheritance cache, this is set up by the request handler, so
+    lookups shared by several policy tests or policies are only done once
+    per call.
+    """
+    cache = getattr(context, 'policy_cache', None)
+    if not isinstance(cache, dict):
+        return None
+    return cache
+
+
+def clear_policy_cache():
+    """Drop any cached policy lookups for the current request"""
+    cache = _get_policy_cache()
+    if cache is not None:
+        cache.clear()
+
+
+def _policy_cached(name, data, fields, lookup, *args):
+    """Call lookup(data, *args), caching the result for the request
+
+    The cache key is built from the given policy data fields, so these must
+    cover everything the lookup depends on. None results are not cached.
+    """
+    cache = _get_policy_cache()
+    if cache is None:
+        return lookup(data, *args)
+    key = (name, repr([(f, data[f]) for f in fields if f in data]), args)
+    if key in cache:
+        return copy.deepcopy(cache[key])
+    result = lookup(data, *args)
+    if result is not None:
+        cache[key] = copy.deepcopy(result)
+    return result
+
+
 def policy_get_user(data):
     """Determine user from policy data (default to logged-in user)"""
     if 'user_id' in data:
-        return get_user(data['user_id'])
+        return _policy_cached('user', data, ['user_id'], _policy_get_user)
     elif context.session.logged_in:
-        return get_user(context.session.user_id)
+        return _policy_cached('user', {'user_id': context.session.user_id}, ['user_id'],
+                              _policy_get_user)
     return None
 
 
+def _policy_get_user(data):
+    return get_user(data['user_id'])
+
+
+def policy_get_user_groups(user):
+    """Return the groups of a policy user, as get_user_groups"""
+    return _policy_cached('user_groups', {'user_id': user['id']}, ['user_id'],
+                          _policy_get_user_groups)
+
+
+def _policy_get_user_groups(data):
+    return get_user_groups(data['user_id'])
+
+
+def policy_get_user_perms(user):
+    """Return the permissions of a policy user, as get_user_perms"""
+    return _policy_cached('user_perms', {'user_id': user['id']}, ['user_id'],
+                          _policy_get_user_perms)
+
+
+def _policy_get_user_perms(data):
+    return get_user_perms(data['user_id'])
+
+
 def policy_get_pkg(data):
     """Determine package from policy data (default to logged-in user)
 
     returns dict as lookup_package
     if package does not exist yet, the id field will be None
     """
+    pkginfo = _policy_cached('pkg', data, ['package', 'build'], _policy_get_pkg)
+    if pkginfo is None:
+        # for some operations (e.g. adding a new package), the package
+        # entry may not exist yet
+        return {'id': None, 'name': data['package']}
+    return pkginfo
+
+
+def _policy_get_pkg(data):
     if 'package' in data:
         pkginfo = lookup_package(data['package'], strict=False)
         if not pkginfo:
-            # for some operations (e.g. adding a new package), the package
-            # entry may not exist yet
             if isinstance(data['package'], str):
-                return {'id': None, 'name': data['package']}
+                # not cached, the package may be added later in the call
+                return None
             else:
                 raise koji.GenericError("No such package: %s" % data['package'])
         return pkginfo
@@ -9894,6 +10449,17 @@ def policy_get_cgs(data):
 
 def policy_get_build_tags(data, taginfo=False):
     """If taginfo is set, return list of taginfos, else list of names only"""
+    tags = _policy_cached('build_tags', data,
+                          ['build_tag', 'build_tags', 'target', 'buildroots', 'build'],
+                          _policy_get_build_tags)
+    if taginfo:
+        return list(tags.values())
+    else:
+        return list(tags.keys())
+
+
+def _policy_get_build_tags(data):
+    """Return a dict of build taginfos indexed by name"""
     tags = {}
     if 'build_tag' in data:
         buildtag = get_tag(data['build_tag'], strict=True, event="auto")
@@ -9923,11 +10489,6 @@ def policy_get_build_tags(data, taginfo=False):
                 if tinfo['tag_name']:
                     tags[tinfo['tag_name']] = get_tag(tinfo['tag_name'], strict=True,
                                                       event=tinfo['repo_create_event_id'])
-
-    if taginfo:
-        tags = tags.values()
-    else:
-        tags = tags.keys()
     return tags
 
 
@@ -10227,7 +10788,7 @@ class IsBuildOwnerTest(koji.policy.BaseSimpleTest):
             return True
         if owner['usertype'] == koji.USERTYPES['GROUP']:
             # owner is a group, check to see if user is a member
-            if owner['id'] in get_user_groups(user['id']):
+            if owner['id'] in policy_get_user_groups(user):
                 return True
         # otherwise...
         return False
@@ -10259,7 +10820,7 @@ class UserInGroupTest(koji.policy.BaseSimpleTest):
         user = policy_get_user(data)
         if not user:
             return False
-        groups = get_user_groups(user['id'])
+        groups = policy_get_user_groups(user)
         args = self.str.split()[1:]
         for group_id, group in groups.items():
             for pattern in args:
@@ -10281,7 +10842,7 @@ class HasPermTest(koji.policy.BaseSimpleTest):
         user = policy_get_user(data)
         if not user:
             return False
-        perms = get_user_perms(user['id'])
+        perms = policy_get_user_perms(user)
         args = self.str.split()[1:]
         for perm in perms:
             for pattern in args:
@@ -10424,7 +10985,7 @@ def check_policy(name, data, default='deny', strict=False, force=False):
         logger.error("Invalid action in policy %s, rule: %s", name, lastrule)
     if force:
         user = policy_get_user(data)
-        if user and 'admin' in get_user_perms(user['id']):
+        if user and 'admin' in policy_get_user_perms(user):
             msg = "Policy %s overriden by force: %s" % (name, user["name"])
             if reason:
                 msg += ": %s" % reason
@@ -10440,18 +11001,28 @@ def check_policy(name, data, default='deny', strict=False, force=False):
     raise koji.ActionNotAllowed(err_str)
 
 
-def eval_policy(name, data):
+def eval_policy(name, data, timing=False):
     """Evaluate named policy with given data and return the result
 
     :param str name: the policy name
     :param dict data: the policy data
-    :returns the action as a string
+    :param bool timing: report the time spent in each rule
+    :returns the action as a string. If timing is set, a dict is returned
+             instead, with the action as 'result', the total time in seconds
+             as 'time' and a list of the evaluated rules as 'rules'. Each rule
+             entry gives its 'rule' text, nesting 'depth', whether it 'matched'
+             and the 'time' spent in its tests.
     :raises koji.GenericError if the policy is empty or not found
     """
     ruleset = context.policy.get(name)
     if not ruleset:
         raise koji.GenericError("no such policy: %s" % name)
-    return ruleset.apply(data)
+    if not timing:
+        return ruleset.apply(data)
+    rules = []
+    start = time.time()
+    result = ruleset.apply(data, timing=rules)
+    return {'result': result, 'time': time.time() - start, 'rules': rules}
 
 
 def policy_data_from_task(task_id):
@@ -11500,8 +12071,22 @@ class RootExports(object):
     deleteBuild = staticmethod(delete_build)
 
     def buildReferences(self, build, limit=None, lazy=False):
+        """Returns references to a build
+
+        This call is used to determine whether a build can be deleted
+
+        :param build: build id, nvr or dict, or a list of those
+        :param int limit: If given, only return up to N results of each ref type
+        :param bool lazy: If true, stop when any reference is found
+
+        :returns: dict of reference results for each reference type, or a list
+                  of such dicts in the same order if a list of builds was given
+        """
+        if isinstance(build, (list, tuple)):
+            build_ids = [get_build(b, strict=True)['id'] for b in build]
+            refs = builds_references(build_ids, limit, lazy)
+            return [refs[build_id] for build_id in build_ids]
         return build_references(get_build(build, strict=True)['id'], limit, lazy)
-    buildReferences.__doc__ = build_references.__doc__
 
     addVolume = staticmethod(add_volume)
     removeVolume = staticmethod(remove_volume)
@@ -11866,11 +12451,10 @@ class RootExports(object):
         logger.debug("Tagging %d builds to %s on behalf of %s",
                      len(builds), tag['name'], user['name'])
         start = time.time()
-        for build in builds:
-            binfo = get_build(build, strict=True)
-            _direct_tag_build(tag, binfo, user, force=True)
-            # ensure tagging order by updating event id
-            _delete_event_id()
+        binfos = [get_build(build, strict=True) for build in builds]
+        # each build gets its own event to ensure the tagging order
+        _direct_tag_builds(tag, binfos, user, force=True)
+        _delete_event_id()
         length = time.time() - start
         logger.debug("Tagged %d builds to %s in %.2f seconds", len(builds), tag['name'], length)
 
@@ -11929,24 +12513,28 @@ class RootExports(object):
         if pkgs:
             logger.debug("Cloning package list to %s", dst['name'])
             start = time.time()
-            for pkg in self.listPackages(tagID=src['id'], event=event, inherited=True):
-                _direct_pkglist_add(
-                    taginfo=dst['id'],
-                    pkginfo=pkg['package_name'],
-                    owner=pkg['owner_name'],
-                    block=pkg['blocked'],
-                    extra_arches=pkg['extra_arches'],
-                    force=True,
-                    update=False)
-                _delete_event_id()
+            # the new tag has no package data, so the whole list is added in bulk
+            _bulk_pkglist_add(dst, self.listPackages(tagID=src['id'], event=event,
+                                                     inherited=True), force=True)
+            _delete_event_id()
             length = time.time() - start
             logger.debug("Cloned packages to %s in %.2f seconds", dst['name'], length)
 
         # builds
         if builds:
+            logger.debug("Cloning builds to %s", dst['name'])
+            start = time.time()
             builds = readTaggedBuilds(tag=src['id'], inherit=inherit_builds,
                                       event=event, latest=latest_only)
-            self.massTag(dst['id'], list(reversed(builds)))
+            # the tag callbacks get the same build data as with massTag
+            binfos = get_builds([build['id'] for build in builds], strict=True)
+            # tag oldest first to keep the order, each build gets its own event
+            user = get_user(context.session.user_id, strict=True)
+            _direct_tag_builds(dst, list(reversed(binfos)), user, force=True)
+            _delete_event_id()
+            length = time.time() - start
+            logger.debug("Cloned %d builds to %s in %.2f seconds", len(builds), dst['name'],
+                         length)
 
         # groups
         if groups:
@@ -12064,6 +12652,9 @@ class RootExports(object):
             for build in reversed(readTaggedBuilds(dst['id'], inherit=False, latest=False)):
                 dstbldsbypkg[build['package_name']][build['nvr']] = build
 
+            # collect the untag/tag operations, in order
+            changes = []
+            check_access = False
             if remove:
                 for (pkg, dstblds) in dstbldsbypkg.items():
                     if pkg not in srcbldsbypkg:
@@ -12071,8 +12662,7 @@ class RootExports(object):
                         for build in dstblds:
                             # don't untag inherited builds
                             if build['tag_name'] == dst['name']:
-                                _direct_untag_build(dst, build, user, force=force)
-                                _delete_event_id()
+                                changes.append((build, False))
 
             # add and/or remove builds from dst to match src contents and order
             for (pkg, srcblds) in srcbldsbypkg.items():
@@ -12087,8 +12677,8 @@ class RootExports(object):
                         if dstnvr in removed_nvrs:
                             dnvrs.append(dstnvr)
                             if dstbld['tag_name'] == dst['name']:
-                                _untag_build(dst['name'], dstbld, force=force)
-                                _delete_event_id()
+                                changes.append((dstbld, False))
+                                check_access = True
                     # we also remove them from dstblds now so that they do not
                     # interfere with the order comparison below
                     for dnvr in dnvrs:
@@ -12116,8 +12706,8 @@ class RootExports(object):
                         else:
                             out_of_order.append(dstnvr)
                             if dstbld['tag_name'] == dst['name']:
-                                _untag_build(dst['name'], dstbld, force=force)
-                                _delete_event_id()
+                                changes.append((dstbld, False))
+                                check_access = True
                     for dnvr in out_of_order:
                         del dstblds[dnvr]
                         # these will be re-added in the proper order later
@@ -12127,8 +12717,16 @@ class RootExports(object):
                         del dstblds[nvr]
                     else:
                         # missing from dst, so we need to add it
-                        _direct_tag_build(dst, srcbld, user, force=force)
-                        _delete_event_id()
+                        changes.append((srcbld, True))
+
+            # the changes are applied in bulk, still with one event each
+            if check_access:
+                assert_tag_access(dst['id'], force=force)
+            # the tag callbacks get get_build data rather than tag listing rows
+            binfos = get_builds([build['id'] for build, tagged in changes], strict=True)
+            changes = [(binfo, tagged) for binfo, (build, tagged) in zip(binfos, changes)]
+            _direct_tag_changes(dst, changes, user, force=force)
+            _delete_event_id()
 
         if groups:
             srcgroups = OrderedDict()
@@ -13729,6 +14327,7 @@ class RootExports(object):
     tagChangedSinceEvent = staticmethod(tag_changed_since_event)
     tagLastChangeEvent = staticmethod(tag_last_change_event)
     tagFirstChangeEvent = staticmethod(tag_first_change_event)
+    checkTagLastChange = staticmethod(check_tag_last_change)
     createBuildTarget = staticmethod(create_build_target)
     editBuildTarget = staticmethod(edit_build_target)
     deleteBuildTarget = staticmethod(delete_build_target)
@@ -15113,6 +15712,25 @@ class Host(object):
                     task['alert'] = True
         return tasks
 
+    def hasWork(self, task_ids=None, alerted=None):
+        """Check whether the host has something to act on
+
+        That is an assigned task, a change in its open tasks compared to task_ids,
+        or a waiting task with finished subtasks that is not in alerted.
+        """
+        # this runs the scheduler if nothing is assigned yet, as the waiting
+        # hosts do not poll for tasks
+        if scheduler.get_tasks_for_host(hostID=self.id, retry=True):
+            return True
+        tasks = self.getHostTasks()
+        if set([t['id'] for t in tasks]) != set(task_ids or []):
+            return True
+        alerted = set(alerted or [])
+        for task in tasks:
+            if task.get('alert') and task['id'] not in alerted:
+                return True
+        return False
+
     def updateHost(self, task_load, ready):
         task_load = float(task_load)
         update = UpdateProcessor(
@@ -15260,6 +15878,100 @@ class HostExports(object):
         host.verify()
         return host.getHostTasks()
 
+    def waitForWork(self, task_ids=None, alerted=None, timeout=None):
+        """Wait until there is something for this host to do
+
+        :param list task_ids: ids of the open tasks the host is running
+        :param list alerted: ids of waiting tasks the host has already woken up
+        :param int timeout: maximal wait in seconds, capped by the hub HostWaitTimeout
+        :returns: True if the host should check its tasks, False if the wait
+                  timed out, None if waiting is disabled on the hub
+        """
+        task_ids = convert_value(task_ids, cast=list, none_allowed=True)
+        alerted = convert_value(alerted, cast=list, none_allowed=True)
+        timeout = convert_value(timeout, cast=int, none_allowed=True)
+        host = Host()
+        host.verify()
+        max_wait = context.opts['HostWaitTimeout']
+        if not max_wait:
+            return None
+        if timeout is None or timeout > max_wait:
+            timeout = max_wait
+        end = time.time() + timeout
+        # listen before checking, so no change can slip in between. Free tasks
+        # don't wake the hosts, the scheduler only runs once per RunInterval
+        # anyway and then notifies the hosts it assigned tasks to
+        listener = Listener([host_channel(host.id)])
+        try:
+            while True:
+                if host.hasWork(task_ids, alerted):
+                    return True
+                # don't keep the transaction (and the session row lock) open
+                # while waiting
+                _close_transaction()
+                remain = end - time.time()
+                if remain <= 0:
+                    return False
+                # wake up at least once per scheduler interval, so that the
+                # scheduler still runs if all hosts are waiting
+                channels = listener.wait(min(remain, context.opts['RunInterval']))
+                if host_channel(host.id) in channels:
+                    return True
+        finally:
+            listener.close()
+
+    def heartbeat(self, task_load, ready, data=None, task_ids=None):
+        """Update the host status and return the data for the next builder iteration
+
+        This combines updateHost, getHostTasks, getTasks and the task and buildroot
+        queries the builder needs in a single call.
+
+        :param float task_load: current task load
+        :param bool ready: whether the host is ready to take a task
+        :param dict data: data for the scheduler
+        :param list task_ids: ids of the tasks the host has processes for
+        :returns: a dict with
+            - host: the host data, like getHost
+            - ready: whether the host was considered ready
+            - tasks: the open tasks of the host, like getHostTasks
+            - assigned: the tasks assigned to the host if it is ready, like getTasks
+            - task_info: id, state and host_id of the given tasks which are not open
+              for the host
+            - buildroots: the active buildroots of the host, like listBuildroots
+        """
+        task_ids = convert_value(task_ids, cast=list, none_allowed=True)
+        host = Host()
+        host.verify()
+        hostdata = get_host(host.id)
+        # the builder checked the host data of its previous heartbeat
+        if not hostdata['enabled'] or task_load > hostdata['capacity']:
+            ready = False
+        host.updateHost(task_load, ready)
+        if data is not None:
+            scheduler.set_host_data(host.id, data)
+        tasks = host.getHostTasks()
+        open_ids = set([t['id'] for t in tasks])
+        other_ids = [i for i in task_ids or [] if i not in open_ids]
+        task_info = []
+        if other_ids:
+            query = QueryProcessor(tables=['task'], columns=['id', 'state', 'host_id'],
+                                   clauses=['id IN %(other_ids)s'],
+                                   values={'other_ids': other_ids})
+            task_info = query.execute()
+        assigned = []
+        if ready:
+            assigned = scheduler.get_tasks_for_host(hostID=host.id, retry=True)
+        states = [koji.BR_STATES[x] for x in ('INIT', 'WAITING', 'BUILDING')]
+        buildroots = query_buildroots(hostID=host.id, state=states)
+        return {
+            'host': hostdata,
+            'ready': ready,
+            'tasks': tasks,
+            'assigned': assigned,
+            'task_info': task_info,
+            'buildroots': buildroots,
+        }
+
     def taskSetWait(self, parent, tasks):
         host = Host()
         host.verify()
@@ -15909,11 +16621,14 @@ class HostExports(object):
         host.verify()
         check_policy(name, data, default=default, strict=True)
 
-    def evalPolicy(self, name, data):
-        """Evaluate named policy with given data and return the result"""
+    def evalPolicy(self, name, data, timing=False):
+        """Evaluate named policy with given data and return the result
+
+        If timing is set, the time spent in each rule is reported, see eval_policy
+        """
         host = Host()
         host.verify()
-        return eval_policy(name, data)
+        return eval_policy(name, data, timing=timing)
 
     def newBuildRoot(self, repo, arch, task_id=None):
         host = Host()
@@ -16371,6 +17086,10 @@ def handle_upload(environ):
     offset = args.get('offset', ('0',))[0]
     offset = int(offset)
     volume = args.get('volume', ('DEFAULT',))[0]
+    # parallel uploads send chunks concurrently and in any order
+    parallel = args.get('parallel', ('',))[0]
+    if parallel and (overwrite or offset < 0):
+        raise koji.GenericError("parallel uploads require an offset and cannot overwrite")
 
     # check upload destination
     fn = get_upload_path(path, name, create=True, volume=volume)
@@ -16395,7 +17114,12 @@ def handle_upload(environ):
     try:
         # acquire lock
         try:
-            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if parallel:
+                # only lock our part of the file
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB, length, offset, os.SEEK_SET)
+            else:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
         except IOError as e:
             raise koji.LockError(e)
 
@@ -16437,7 +17161,8 @@ def handle_upload(environ):
             os.write(fd, chunk)
 
         # offset check
-        if not overwrite:
+        # (later chunks of a parallel upload may already be written)
+        if not overwrite and not parallel:
             # end of file should match where we think we are
             flen = os.lseek(fd, 0, 2)
             expected = offset + size
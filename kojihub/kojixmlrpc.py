@@ -31,6 +31,7 @@ import traceback
 import re
 
 import koji
+import koji.jsonrpc
 import koji.plugin
 import koji.policy
 import koji.util
@@ -38,7 +39,7 @@ import kojihub
 from koji.context import context
 # import xmlrpclib functions from koji to use tweaked Marshaller
 from koji.server import ServerError, BadRequest, RequestTimeout
-from koji.xmlrpcplus import ExtendedMarshaller, Fault, dumps, getparser
+from koji.xmlrpcplus import ExtendedMarshaller, Fault, dumps, dumps_chunks, getparser
 from . import auth
 from . import db
 from . import scheduler
@@ -48,6 +49,8 @@ from . import repos
 # HTTP headers included in every request
 GLOBAL_HEADERS = [
     ('Koji-Version', koji.__version__),
+    # request encodings we accept, see koji.jsonrpc
+    ('Koji-Content-Types', 'text/xml %s' % koji.jsonrpc.CONTENT_TYPE),
 ]
 
 
@@ -203,9 +206,10 @@ class HandlerAccess(object):
 class ModXMLRPCRequestHandler(object):
     """Simple XML-RPC handler for mod_wsgi environment"""
 
-    def __init__(self, handlers):
+    def __init__(self, handlers, use_json=False):
         self.traceback = False
         self.handlers = handlers  # expecting HandlerRegistry instance
+        self.use_json = use_json
         self.logger = logging.getLogger('koji.xmlrpc')
 
     def _get_handler(self, name):
@@ -217,7 +221,10 @@ class ModXMLRPCRequestHandler(object):
             return self.handlers.get(name)
 
     def _read_request(self, stream):
-        parser, unmarshaller = getparser()
+        if self.use_json:
+            parser, unmarshaller = koji.jsonrpc.getparser()
+        else:
+            parser, unmarshaller = getparser()
         rlen = 0
         maxlen = opts.get('MaxRequestLength', None)
         while True:
@@ -271,28 +278,38 @@ class ModXMLRPCRequestHandler(object):
         return faultCode, faultString
 
     def _wrap_handler(self, handler, environ):
-        """Catch exceptions and encode response of handler"""
+        """Catch exceptions and encode response of handler
+
+        The response is returned as a list of encoded chunks
+        """
 
         # generate response
         try:
             response = handler(environ)
             # wrap response in a singleton tuple
             response = (response,)
-            response = dumps(response, methodresponse=1, marshaller=Marshaller)
+            response = self._dumps_chunks(response, methodresponse=1)
         except ServerError:
             raise
             # these are handled higher up
         except Fault as fault:
             self.traceback = True
-            response = dumps(fault, marshaller=Marshaller)
+            response = self._dumps_chunks(fault)
         except Exception:
             self.traceback = True
             # report exception back to server
             faultCode, faultString = self._log_exception()
-            response = dumps(Fault(faultCode, faultString), marshaller=Marshaller)
+            response = self._dumps_chunks(Fault(faultCode, faultString))
 
         return response
 
+    def _dumps_chunks(self, params, methodresponse=None):
+        if self.use_json:
+            # datetimes are returned as strings, like our xmlrpc Marshaller does
+            return koji.jsonrpc.dumps_chunks(params, methodresponse=methodresponse,
+                                             datetime_as_string=True)
+        return dumps_chunks(params, methodresponse=methodresponse, marshaller=Marshaller)
+
     def handle_upload(self, environ):
         # uploads can't be in a multicall
         context.method = None
@@ -366,9 +383,13 @@ class ModXMLRPCRequestHandler(object):
                 result = self._dispatch(call['methodName'], call['params'])
             except Fault as fault:
                 savepoint.rollback()
+                kojihub.clear_inheritance_cache()
+                kojihub.clear_policy_cache()
                 results.append({'faultCode': fault.faultCode, 'faultString': fault.faultString})
             except Exception:
                 savepoint.rollback()
+                kojihub.clear_inheritance_cache()
+                kojihub.clear_policy_cache()
                 # transform unknown exceptions into XML-RPC Faults
                 # don't create a reference to full traceback since this creates
                 # a circular reference.
@@ -436,6 +457,12 @@ config_map = [
     ['DBPort', 'integer', None],
     ['DBPass', 'string', None],
     ['DBConnectionString', 'string', None],
+    ['DBPoolMinSize', 'integer', 0],
+    ['DBPoolMaxSize', 'integer', 0],
+    ['DBPoolIdleTimeout', 'integer', 300],
+    ['DBPoolMaxLifetime', 'integer', 3600],
+    ['DBPoolCheckInterval', 'integer', 30],
+    ['DBCheckOnConnect', 'boolean', True],
     ['KojiDir', 'string', None],
 
     ['ProxyPrincipals', 'string', ''],
@@ -498,6 +525,12 @@ config_map = [
     ['RPMDefaultChecksums', 'string', 'md5 sha256'],
 
     ['SessionRenewalTimeout', 'integer', 1440],
+    ['SessionCacheTime', 'integer', 0],
+
+    # performance options
+    ['RecursiveInheritanceQuery', 'boolean', False],
+    ['SingleQueryTaggedBuilds', 'boolean', False],
+    ['HostWaitTimeout', 'integer', 0],
 
     # scheduler options
     ['MaxJobs', 'integer', 15],
@@ -788,6 +821,12 @@ def server_setup(environ):
                              password=opts.get("DBPass", None),
                              host=opts.get("DBHost", None),
                              port=opts.get("DBPort", None))
+        db.provideDBpool(minsize=opts['DBPoolMinSize'],
+                         maxsize=opts['DBPoolMaxSize'],
+                         idle_timeout=opts['DBPoolIdleTimeout'],
+                         max_lifetime=opts['DBPoolMaxLifetime'],
+                         check_interval=opts['DBPoolCheckInterval'],
+                         check_on_connect=opts['DBCheckOnConnect'])
     except Exception:
         tb_str = ''.join(traceback.format_exception(*sys.exc_info()))
         logger.error(tb_str)
@@ -836,11 +875,14 @@ def application(environ, start_response):
             context.handlers = HandlerAccess(registry)
             context.environ = environ
             context.policy = policy
+            context.inheritance_cache = {}
+            context.policy_cache = {}
             try:
                 context.cnx = db.connect()
             except Exception:
                 return offline_reply(start_response, msg="database outage")
-            h = ModXMLRPCRequestHandler(registry)
+            use_json = environ.get('CONTENT_TYPE') == koji.jsonrpc.CONTENT_TYPE
+            h = ModXMLRPCRequestHandler(registry, use_json=use_json)
             try:
                 if environ.get('CONTENT_TYPE') == 'application/octet-stream':
                     response = h._wrap_handler(h.handle_upload, environ)
@@ -850,10 +892,10 @@ def application(environ, start_response):
                 return error_reply(start_response, '400 Bad Request', str(e) + '\n')
             except RequestTimeout as e:
                 return error_reply(start_response, '408 Request Timeout', str(e) + '\n')
-            response = response.encode()
+            length = sum([len(chunk) for chunk in response])
             headers = GLOBAL_HEADERS + [
-                ('Content-Length', str(len(response))),
-                ('Content-Type', "text/xml"),
+                ('Content-Length', str(length)),
+                ('Content-Type', koji.jsonrpc.CONTENT_TYPE if use_json else "text/xml"),
             ]
             start_response('200 OK', headers)
             if h.traceback:
@@ -863,6 +905,7 @@ def application(environ, start_response):
                 # Currently there is not much data we can provide to the
                 # pre/postCommit callbacks. The handler can access context at
                 # least
+                kojihub.flush_tag_last_change()
                 koji.plugin.run_callbacks('preCommit')
                 context.cnx.commit()
                 koji.plugin.run_callbacks('postCommit')
@@ -876,8 +919,8 @@ def application(environ, start_response):
                     "request %s with args %s" %
                     (os.getpid(), memory_usage_at_start, memory_usage_at_end,
                      memory_usage_at_end - memory_usage_at_start, context.method, paramstr))
-            h.logger.debug("Returning %d bytes after %f seconds", len(response),
-                           time.time() - start)
+            h.logger.debug("Returning %d bytes in %d chunks after %f seconds", length,
+                           len(response), time.time() - start)
         finally:
             # make sure context gets cleaned up
             if hasattr(context, 'cnx'):
@@ -886,7 +929,7 @@ def application(environ, start_response):
                 except Exception:
                     pass
             context._threadclear()
-        return [response]  # XXX
+        return response
 
 
 def get_registry(opts, plugins):
@@ -388,35 +388,137 @@ def repo_queue_task(req):
 
 
 def update_end_events():
-    """Update end_event for all ready repos that don't have one yet"""
+    """Update end_event for all ready repos that don't have one yet
+
+    The end event is the first entry in the tag_changes journal after the repo
+    was created, for the repo tag or any tag it inherited from at that time.
+    Repos leave this check once they have an end event, so each run only looks
+    at the journal entries since the remaining repos were created. Repos for
+    tags that the tag_last_change index shows as unchanged are skipped.
+    """
     query = RepoQuery(
         clauses=[['end_event', 'IS', None], ['state', '=', koji.REPO_READY]],
         fields=('id', 'tag_id', 'create_event'),
         opts={'order': 'id'})
     repos = query.execute()
-    n_cached = 0
-    tag_last = {}
-    updates = []
+    last = kojihub.read_tag_last_change([repo['tag_id'] for repo in repos])
+    n_current = 0
+    checks = []
+    inherited = {}
     for repo in repos:
-        tag_id = repo['tag_id']
-        # use cache to avoid redundant calls
-        if tag_id in tag_last and tag_last[tag_id] <= repo['create_event']:
-            # we already know that tag hasn't changed
-            n_cached += 1
+        tag_last = last.get(repo['tag_id'])
+        if tag_last is not None and tag_last <= repo['create_event']:
+            # no changes to the tag or its parents since the repo was created
+            n_current += 1
             continue
-        end_event = kojihub.tag_first_change_event(repo['tag_id'], after=repo['create_event'])
-        if end_event is None:
-            tag_last[tag_id] = kojihub.tag_last_change_event(tag_id)
-        else:
-            updates.append({'id': repo['id'], 'end_event': end_event})
+        key = (repo['tag_id'], repo['create_event'])
+        if key not in inherited:
+            inherited[key] = inherited_tags(*key)
+        for tag_id in inherited[key]:
+            checks.append((repo['id'], tag_id, repo['create_event']))
+    end_events = get_first_changes(checks)
+    updates = [{'id': repo_id, 'end_event': end_event}
+               for repo_id, end_event in sorted(end_events.items())]
     if updates:
         BulkUpdateProcessor('repo', data=updates, match_keys=('id',)).execute()
     logger.debug('Checked end events for %i repos', len(repos))
-    logger.debug('Got no change for %i distinct tags', len(tag_last))
-    logger.debug('Avoided %i checks due to cache', n_cached)
+    logger.debug('Skipped %i unchanged repos', n_current)
+    logger.debug('Checked %i distinct tag events', len(inherited))
     logger.debug('Added end events for %i repos', len(updates))
 
 
+def inherited_tags(tag_id, event=None):
+    """Return the tag and the tags it inherits from at the given event
+
+    Changes to any of these tags change the content of repos for the tag,
+    this is how journal entries propagate to descendant tags.
+    """
+    tags = [tag_id]
+    tags.extend([link['parent_id'] for link in kojihub.readFullInheritance(tag_id, event=event)])
+    return tags
+
+
+def get_first_changes(checks, batch=1000):
+    """Find the first tag change after given events
+
+    :param list checks: a list of (ref, tag_id, after) tuples
+    :param int batch: number of checks per query
+    :returns: a dict mapping each ref to the first event after its after value
+              that changed any of its tags. Refs without changes are omitted.
+    """
+    ret = {}
+    for i in range(0, len(checks), batch):
+        values = {}
+        rows = []
+        for n, (ref, tag_id, after) in enumerate(checks[i:i + batch]):
+            values['ref%i' % n] = ref
+            values['tag%i' % n] = tag_id
+            values['after%i' % n] = after
+            rows.append('(%%(ref%i)s, %%(tag%i)s, %%(after%i)s)' % (n, n, n))
+        table = '(VALUES %s) AS checks (ref, tag_id, after)' % ', '.join(rows)
+        query = QueryProcessor(
+            tables=[table],
+            columns=['checks.ref', 'min(tag_changes.event_id)'],
+            aliases=['ref', 'event_id'],
+            joins=['tag_changes ON tag_changes.tag_id = checks.tag_id '
+                   'AND tag_changes.event_id > checks.after'],
+            values=values,
+            opts={'group': 'checks.ref'},
+            enable_group=True)
+        for row in query.execute():
+            ref = row['ref']
+            if ref not in ret or row['event_id'] < ret[ref]:
+                ret[ref] = row['event_id']
+    return ret
+
+
+def get_inherited_last_changes(tag_ids):
+    """Find the last change for each tag, including changes in its parent tags
+
+    The values come from the tag_last_change index. Tags that are not indexed
+    yet are looked up in the tag_changes journal.
+
+    :param list tag_ids: tags to check
+    :returns: a dict mapping tag ids to their last change event.
+              Tags without changes are omitted.
+    """
+    ret = kojihub.read_tag_last_change(tag_ids)
+    missing = [tag_id for tag_id in tag_ids if tag_id not in ret]
+    if missing:
+        inherited = dict([(tag_id, inherited_tags(tag_id)) for tag_id in missing])
+        all_tags = set()
+        for tags in inherited.values():
+            all_tags.update(tags)
+        last_changes = get_last_changes(all_tags)
+        for tag_id in missing:
+            events = [last_changes[t] for t in inherited[tag_id] if t in last_changes]
+            if events:
+                ret[tag_id] = max(events)
+    return ret
+
+
+def get_last_changes(tag_ids):
+    """Find the last journal entry for each of the given tags
+
+    Inheritance is not followed here, see inherited_tags.
+
+    :param list tag_ids: tags to check
+    :returns: a dict mapping tag ids to their last change event.
+              Tags without journal entries are omitted.
+    """
+    if not tag_ids:
+        return {}
+    query = QueryProcessor(
+        tables=['tag'],
+        columns=['tag.id',
+                 '(SELECT max(event_id) FROM tag_changes WHERE tag_changes.tag_id = tag.id)'],
+        aliases=['tag_id', 'event_id'],
+        clauses=['tag.id IN %(tag_ids)s'],
+        values={'tag_ids': sorted(set(tag_ids))})
+    return dict([(row['tag_id'], row['event_id']) for row in query.execute()
+                 if row['event_id'] is not None])
+
+
 def get_external_repo_data(erepo):
     external_repo_id = kojihub.get_external_repo_id(erepo, strict=True)
     query = QueryProcessor(
@@ -453,6 +555,7 @@ def set_external_repo_data(erepo, data):
     insert = InsertProcessor(table='external_repo_data', data=values)
     insert.make_create()
     insert.execute()
+    kojihub.log_external_repo_change(external_repo_id, 'external_repo_data')
 
 
 def do_auto_requests():
@@ -489,6 +592,9 @@ def do_auto_requests():
 
     logger.debug('Found %i tags for automatic repos', len(auto_tags))
 
+    # changes in parent tags count for their descendants
+    last_changes = get_inherited_last_changes(auto_tags)
+
     reqs = {}
     dups = {}
     default_lag = context.opts['RepoAutoLag']
@@ -496,7 +602,7 @@ def do_auto_requests():
     for tag_id in auto_tags:
         # choose min_event similar to default_min_event, but different lag
         # TODO unify code?
-        last = kojihub.tag_last_change_event(tag_id)
+        last = last_changes.get(tag_id)
         if last is None:
             # shouldn't happen
             # last event cannot be None for a valid tag, but we only queried tag_extra
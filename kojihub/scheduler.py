@@ -1,3 +1,5 @@
+import bisect
+import heapq
 import json
 import logging
 import time
@@ -288,11 +290,15 @@ class TaskScheduler(object):
             return False
 
         logger.info('Running task scheduler')
+        start = time.time()
         self.get_tasks()
         self.get_hosts()
         self.check_hosts()
-        self.do_schedule()
+        assigned = self.do_schedule()
         self.check_active_tasks()
+        log_both(f'Scheduler run: assigned {assigned} of {len(self.free_tasks)} free tasks, '
+                 f'{len(self.active_tasks)} active tasks, {len(self.hosts)} hosts, '
+                 f'{time.time() - start:.3f} seconds')
 
         return True
 
@@ -337,6 +343,10 @@ class TaskScheduler(object):
         return ret
 
     def do_schedule(self):
+        """Assign free tasks to hosts
+
+        Returns the number of assigned tasks
+        """
         # debug
         logger.info(f'Hosts: {len(self.hosts)}')
         logger.info(f'Free tasks: {len(self.free_tasks)}')
@@ -365,31 +375,53 @@ class TaskScheduler(object):
             if hostdata is None:
                 hostdata = {}
             host.setdefault('_maxjobs', hostdata.get('maxjobs') or self.maxjobs)
-            # temporary test code
-            logger.info(f'Host: {host}')
+            logger.debug(f'Host: {host}')
             ldiff = host['task_load'] - host['_load']
             if abs(ldiff) > 0.01:
                 # this is expected in a number of cases, just observing
                 logger.info(f'Host load differs by {ldiff:.2f}: {host}')
 
         # figure out which hosts *can* take each task
-        # at the moment this is mostly just bin, but in the future it will be more complex
-        refusals = self.get_refusals()
+        # at the moment this is mostly just bin, so we index the usable hosts of each bin
+        # by available capacity. The hosts that fit a task are then a prefix of that list.
+        bins = {}
+        for tbin, hosts in self.hosts_by_bin.items():
+            usable = [h for h in hosts if h['ready'] and h['_ntasks'] < h['_maxjobs']]
+            usable.sort(key=lambda h: h['_load'] - h['capacity'])
+            bins[tbin] = {
+                'hosts': usable,
+                'avail': [h['_load'] - h['capacity'] for h in usable],
+                'index': dict([(h['id'], n) for n, h in enumerate(usable)]),
+                # demand shares, by the number of hosts the task fits on
+                'shares': [0.0] * (len(usable) + 1),
+            }
+        refusals = self.get_refusals([t['task_id'] for t in self.free_tasks])
         for task in self.free_tasks:
-            task['_hosts'] = []
+            tbin = bins.get(task['_bin'])
+            if not tbin:
+                logger.debug(f'Task {task["task_id"]}: no options')
+                continue
             min_avail = max(0, task['weight'] - self.capacity_overcommit)
-            h_refused = refusals.get(task['task_id'], {})
-            for host in self.hosts_by_bin.get(task['_bin'], []):
-                if (host['ready'] and
-                        host['_ntasks'] < host['_maxjobs'] and
-                        host['capacity'] - host['_load'] > min_avail and
-                        host['id'] not in h_refused):
-                    task['_hosts'].append(host)
-            logger.info(f'Task {task["task_id"]}: {len(task["_hosts"])} options')
-            for host in task['_hosts']:
-                # demand gives us a rough measure of how much overall load is pending for the host
-                host.setdefault('_demand', 0.0)
-                host['_demand'] += task['weight'] / len(task['_hosts'])
+            nfit = bisect.bisect_left(tbin['avail'], -min_avail)
+            refused = []
+            for host_id in refusals.get(task['task_id'], {}):
+                n = tbin['index'].get(host_id)
+                if n is not None and n < nfit:
+                    refused.append(tbin['hosts'][n])
+            noptions = nfit - len(refused)
+            logger.debug(f'Task {task["task_id"]}: {noptions} options')
+            if noptions:
+                # demand gives us a rough measure of how much overall load is pending for the
+                # host. Each option gets an equal share of the task weight.
+                share = task['weight'] / noptions
+                tbin['shares'][nfit] += share
+                for host in refused:
+                    host['_demand'] -= share
+        for tbin in bins.values():
+            total = 0.0
+            for n in range(len(tbin['hosts']) - 1, -1, -1):
+                total += tbin['shares'][n + 1]
+                tbin['hosts'][n]['_demand'] += total
 
         # normalize demand to 1
         max_demand = sum([h['_demand'] for h in self.hosts.values()])
@@ -400,24 +432,57 @@ class TaskScheduler(object):
         for h in self.hosts.values():
             self._rank_host(h)
 
+        # keep a heap of the usable hosts of each bin, ordered by rank
+        # entries are (rank, position in bin, host), with stale ranks skipped when popped
+        heaps = {}
+        positions = {}
+        for tbin, hosts in self.hosts_by_bin.items():
+            heap = []
+            for n, host in enumerate(hosts):
+                positions.setdefault((tbin, host['id']), n)
+                if host['ready'] and host['_ntasks'] < host['_maxjobs']:
+                    heap.append((host['_rank'], n, host))
+            heapq.heapify(heap)
+            heaps[tbin] = heap
+
         # tasks are already in priority order
+        assigned = 0
         for task in self.free_tasks:
+            heap = heaps.get(task['_bin'])
+            if not heap:
+                logger.debug('Could not assign task %s', task['task_id'])
+                continue
             min_avail = max(0, task['weight'] - self.capacity_overcommit)
-            task['_hosts'].sort(key=lambda h: h['_rank'])
-            logger.debug('Task %i choices: %s', task['task_id'],
-                         [(h['name'], "%(_rank).2f" % h) for h in task['_hosts']])
-            for host in task['_hosts']:
-                if (host['capacity'] - host['_load'] > min_avail and
-                        host['_ntasks'] < host['_maxjobs']):
-                    # add run entry
-                    self.assign(task, host)
-                    # update our totals and rank
-                    host['_load'] += task['weight']
-                    host['_ntasks'] += 1
-                    self._rank_host(host)
+            refused = refusals.get(task['task_id'], {})
+            skipped = []
+            chosen = None
+            while heap:
+                entry = heapq.heappop(heap)
+                rank, n, host = entry
+                if rank != host['_rank'] or host['_ntasks'] >= host['_maxjobs']:
+                    # stale entry, or host is full for the rest of this run
+                    continue
+                skipped.append(entry)
+                if host['id'] not in refused and host['capacity'] - host['_load'] > min_avail:
+                    chosen = host
                     break
-            else:
+            for entry in skipped:
+                heapq.heappush(heap, entry)
+            if chosen is None:
                 logger.debug('Could not assign task %s', task['task_id'])
+                continue
+            # add run entry
+            if self.assign(task, chosen) is not False:
+                assigned += 1
+            # update our totals and rank
+            chosen['_load'] += task['weight']
+            chosen['_ntasks'] += 1
+            self._rank_host(chosen)
+            for tbin in chosen['_bins']:
+                if tbin in heaps:
+                    heapq.heappush(heaps[tbin],
+                                   (chosen['_rank'], positions[(tbin, chosen['id'])], chosen))
+        return assigned
 
     def _rank_host(self, host):
         host['_rank'] = host['_load'] + host['_ntasks'] + host['_demand']
@@ -573,27 +638,29 @@ class TaskScheduler(object):
         self.free_tasks = free_tasks
         self.active_tasks = active_tasks
 
-    def get_refusals(self):
-        """Get task refusals and clean stale entries"""
+    def get_refusals(self, task_ids=None):
+        """Get task refusals and clean stale entries
+
+        Only refusals for the given tasks are returned, indexed by task and host
+        """
+        # drop stale entries
+        states = [koji.TASK_STATES[s] for s in ('FREE', 'OPEN', 'ASSIGNED')]
+        delete = DeleteProcessor(
+            'scheduler_task_refusals',
+            clauses=['(soft AND time < to_timestamp(%(cutoff_ts)s)) OR '
+                     'task_id IN (SELECT id FROM task WHERE state NOT IN %(states)s)'],
+            values={'cutoff_ts': time.time() - self.soft_refusal_timeout, 'states': states},
+        )
+        delete.execute()
+
         refusals = {}
-        cutoff_ts = time.time() - self.soft_refusal_timeout
-        to_drop = []
-        for row in get_task_refusals(fields=('id', 'task_id', 'host_id', 'soft', 'ts', 'state')):
-            if ((row['soft'] and row['ts'] < cutoff_ts) or
-                    koji.TASK_STATES[row['state']] not in ('FREE', 'OPEN', 'ASSIGNED')):
-                to_drop.append(row['id'])
-            else:
-                # index by task and host
-                refusals.setdefault(row['task_id'], {})[row['host_id']] = row
-
-        if to_drop:
-            # drop stale entries
-            delete = DeleteProcessor(
-                'scheduler_task_refusals',
-                clauses=['id IN %(to_drop)s'],
-                values=locals(),
-            )
-            delete.execute()
+        if not task_ids:
+            return refusals
+        rows = get_task_refusals(clauses=[['task_id', 'IN', list(task_ids)]],
+                                 fields=('id', 'task_id', 'host_id', 'soft', 'ts'))
+        for row in rows:
+            # index by task and host
+            refusals.setdefault(row['task_id'], {})[row['host_id']] = row
 
         return refusals
 
@@ -5,23 +5,62 @@
 # Authors:
 #     Mike Bonnet <mikeb@redhat.com>
 
+import atexit
 import json
 import logging
+import queue
 import random
+import threading
+import time
+from collections import deque
 
 from proton import Message, SSLDomain
 from proton.handlers import MessagingHandler
-from proton.reactor import Container
+from proton.reactor import ApplicationEvent, Container, EventInjector
 
 import koji
 from koji.context import context
 from koji.plugin import callback, convert_datetime, ignore_error
 from kojihub import get_build_type
 from kojihub.db import QueryProcessor, InsertProcessor, DeleteProcessor, db_lock
+from kojihub.db import connect as db_connect
 
 CONFIG_FILE = '/etc/koji-hub/plugins/protonmsg.conf'
 CONFIG = None
 LOG = logging.getLogger('koji.plugin.protonmsg')
+# background sender for this process, see get_publisher
+PUBLISHER = None
+PUBLISHER_LOCK = threading.Lock()
+
+
+def _ssl_domain(conf):
+    """Return the SSLDomain for the broker connection, or None"""
+    if conf.has_option('broker', 'cert') and conf.has_option('broker', 'cacert'):
+        ssl = SSLDomain(SSLDomain.MODE_CLIENT)
+        cert = conf.get('broker', 'cert')
+        ssl.set_credentials(cert, cert, None)
+        ssl.set_trusted_ca_db(conf.get('broker', 'cacert'))
+        ssl.set_peer_authentication(SSLDomain.VERIFY_PEER)
+        return ssl
+    return None
+
+
+def _topic_prefix(conf):
+    """Normalize topic_prefix value that the user configured.
+
+    RabbitMQ brokers require that topics start with "/topic/"
+    ActiveMQ brokers require that topics start with "topic://"
+
+    If the user specified a prefix that begins with one or the other, use
+    that. For backwards compatibility, if the user chose neither, prepend
+    "topic://".
+    """
+    koji_topic_prefix = conf.get('broker', 'topic_prefix')
+    if koji_topic_prefix.startswith('/topic/'):
+        return koji_topic_prefix
+    if koji_topic_prefix.startswith('topic://'):
+        return koji_topic_prefix
+    return 'topic://' + koji_topic_prefix
 
 
 class TimeoutHandler(MessagingHandler):
@@ -39,14 +78,7 @@ class TimeoutHandler(MessagingHandler):
     def on_start(self, event):
         self.log.debug('Container starting')
         event.container.connected = False
-        if self.conf.has_option('broker', 'cert') and self.conf.has_option('broker', 'cacert'):
-            ssl = SSLDomain(SSLDomain.MODE_CLIENT)
-            cert = self.conf.get('broker', 'cert')
-            ssl.set_credentials(cert, cert, None)
-            ssl.set_trusted_ca_db(self.conf.get('broker', 'cacert'))
-            ssl.set_peer_authentication(SSLDomain.VERIFY_PEER)
-        else:
-            ssl = None
+        ssl = _ssl_domain(self.conf)
         self.log.debug('connecting to %s', self.url)
         event.container.connect(url=self.url, reconnect=False, ssl_domain=ssl)
         connect_timeout = self.conf.getint('broker', 'connect_timeout')
@@ -76,21 +108,7 @@ class TimeoutHandler(MessagingHandler):
 
     @property
     def topic_prefix(self):
-        """Normalize topic_prefix value that the user configured.
-
-        RabbitMQ brokers require that topics start with "/topic/"
-        ActiveMQ brokers require that topics start with "topic://"
-
-        If the user specified a prefix that begins with one or the other, use
-        that. For backwards compatibility, if the user chose neither, prepend
-        "topic://".
-        """
-        koji_topic_prefix = self.conf.get('broker', 'topic_prefix')
-        if koji_topic_prefix.startswith('/topic/'):
-            return koji_topic_prefix
-        if koji_topic_prefix.startswith('topic://'):
-            return koji_topic_prefix
-        return 'topic://' + koji_topic_prefix
+        return _topic_prefix(self.conf)
 
     def send_msgs(self, event):
         ttl = self.conf.getfloat('message', 'ttl', fallback=None)
@@ -158,6 +176,339 @@ class TimeoutHandler(MessagingHandler):
             self.timeout_task = None
 
 
+class SenderStats(object):
+    """Counters for the background sender, reported at regular intervals"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.since = time.time()
+        self.sent = 0
+        self.failed = 0
+        self.overflow = 0
+        self.max_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record_depth(self, depth):
+        with self.lock:
+            self.max_depth = max(self.max_depth, depth)
+
+    def record_sent(self, latency):
+        with self.lock:
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def record_failed(self, count=1):
+        with self.lock:
+            self.failed += count
+
+    def record_overflow(self, count):
+        with self.lock:
+            self.overflow += count
+
+    def report(self, depth):
+        """Return the stats for the current interval and start a new one"""
+        with self.lock:
+            elapsed = time.time() - self.since
+            stats = {
+                'interval': elapsed,
+                'sent': self.sent,
+                'failed': self.failed,
+                'overflow': self.overflow,
+                'queue_depth': depth,
+                'max_queue_depth': max(self.max_depth, depth),
+                'avg_latency': self.latency_total / self.sent if self.sent else 0.0,
+                'max_latency': self.latency_max,
+            }
+            self.reset()
+        return stats
+
+
+class Publisher(MessagingHandler):
+    """Sends messages over a persistent broker connection
+
+    The publisher runs a proton container in a background thread of the hub
+    process. Request threads hand over their messages with submit() and do not
+    wait for the broker. The in-memory queue is bounded; messages that do not
+    fit, or that the broker does not accept, are returned to the request
+    threads to be stored in the proton_queue table. Messages left over when
+    the publisher stops are stored there as well.
+    """
+
+    def __init__(self, urls, conf, *args, **kws):
+        super(Publisher, self).__init__(*args, **kws)
+        self.urls = urls
+        self.conf = conf
+        self.queue = queue.Queue(maxsize=conf.getint('sender', 'queue_size', fallback=1000))
+        self.stats = SenderStats()
+        self.stats_interval = conf.getint('sender', 'stats_interval', fallback=300)
+        self.send_timeout = conf.getint('broker', 'send_timeout')
+        self.check_interval = min(self.stats_interval, self.send_timeout)
+        self.ttl = conf.getfloat('message', 'ttl', fallback=None)
+        self.connected = False
+        self.disconnected_since = time.time()
+        self.stopping = False
+        self.url_index = 0
+        self.reconnect_delay = 0
+        # messages to hand back to request threads, guarded by lock
+        self.lock = threading.Lock()
+        self.failed = []
+        # only used in the container thread
+        self.connection = None
+        self.senders = {}
+        self.pending = {}
+        self.retry = deque()
+        self.container = None
+        self.injector = None
+        self.thread = None
+        self.log = logging.getLogger('koji.plugin.protonmsg.Publisher')
+
+    def start(self):
+        self.container = Container(self)
+        self.injector = EventInjector()
+        self.container.selectable(self.injector)
+        self.thread = threading.Thread(target=self.container.run, name='protonmsg-publisher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the container thread
+
+        Messages that were not sent yet are stored in the proton_queue table
+        if the db queue is enabled, otherwise they are lost and logged as such.
+        """
+        if self.thread is None:
+            return
+        self.injector.trigger(ApplicationEvent('protonmsg_stop'))
+        self.thread.join(timeout)
+        self.thread = None
+        unsent = self.take_failed() + list(self.retry)
+        unsent.extend(sorted(self.pending.values(), key=lambda m: m['queued_ts']))
+        self.retry.clear()
+        self.pending = {}
+        while True:
+            try:
+                unsent.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not unsent:
+            return
+        if not self.conf.getboolean('queue', 'enabled', fallback=False):
+            self.log.error('publisher stopped with %i messages unsent', len(unsent))
+            return
+        try:
+            self.store(unsent)
+        except Exception:
+            self.log.exception('could not store %i unsent messages', len(unsent))
+        else:
+            self.log.info('publisher stopped, stored %i unsent messages', len(unsent))
+
+    def store(self, msgs):
+        """Store messages in the proton_queue table
+
+        This runs outside of any hub request, so it uses its own connection.
+        """
+        cnx = db_connect()
+        try:
+            c = cnx.cursor()
+            for msg in msgs:
+                c.execute('INSERT INTO proton_queue (address, props, body) '
+                          'VALUES (%(address)s, %(props)s, %(body)s)',
+                          {'address': msg['address'], 'props': json.dumps(msg['props']),
+                           'body': msg['body']})
+            cnx.commit()
+        finally:
+            cnx.close()
+
+    def submit(self, msgs):
+        """Queue messages to be sent
+
+        Called from request threads. Returns the messages that did not fit in
+        the queue.
+        """
+        overflow = []
+        now = time.time()
+        for msg in msgs:
+            if overflow:
+                # keep the message order
+                overflow.append(msg)
+                continue
+            msg['queued_ts'] = now
+            try:
+                self.queue.put_nowait(msg)
+            except queue.Full:
+                overflow.append(msg)
+        if overflow:
+            self.stats.record_overflow(len(overflow))
+        self.stats.record_depth(self.queue.qsize())
+        self.injector.trigger(ApplicationEvent('protonmsg_send'))
+        return overflow
+
+    def take_failed(self):
+        """Return (and forget) the messages that could not be sent"""
+        with self.lock:
+            failed = self.failed
+            self.failed = []
+        return failed
+
+    def is_idle(self):
+        """Report whether the publisher is connected and has nothing queued"""
+        return self.connected and self.queue.empty()
+
+    def _fail(self, msgs):
+        if msgs:
+            self.stats.record_failed(len(msgs))
+            with self.lock:
+                self.failed.extend(msgs)
+
+    def connect(self):
+        """Open a new connection, trying the urls in turn"""
+        url = self.urls[self.url_index % len(self.urls)]
+        self.url_index += 1
+        self.log.debug('connecting to %s', url)
+        self.connection = self.container.connect(url=url, reconnect=False,
+                                                 ssl_domain=_ssl_domain(self.conf))
+
+    def on_start(self, event):
+        self.connect()
+        event.container.schedule(self.check_interval, self)
+
+    def on_connection_opened(self, event):
+        self.connected = True
+        self.reconnect_delay = 0
+        self.log.info('connection to %s opened', event.connection.hostname)
+        self.send_msgs()
+
+    def on_transport_closed(self, event):
+        if self.stopping or event.connection != self.connection:
+            return
+        if self.connected:
+            self.log.warning('connection to %s lost', event.connection.hostname)
+            self.disconnected_since = time.time()
+        self.connected = False
+        # deliveries that were not settled are sent again after reconnecting
+        unsettled = sorted(self.pending.values(), key=lambda m: m['queued_ts'])
+        self.retry.extendleft(reversed(unsettled))
+        self.pending = {}
+        # links belong to the old connection, we open new ones
+        self.senders = {}
+        self.connection = None
+        if self.url_index % len(self.urls) == 0:
+            # we went through all the urls, back off before the next round
+            self.reconnect_delay = min(max(self.reconnect_delay * 2, 1), 60)
+        self.container.schedule(self.reconnect_delay, _Reconnect(self))
+
+    def on_timer_task(self, event):
+        if time.time() - self.stats.since >= self.stats_interval:
+            self.log_stats()
+        if not self.connected and time.time() - self.disconnected_since > self.send_timeout:
+            # don't hold on to messages while the broker is away
+            msgs = list(self.retry)
+            self.retry.clear()
+            while True:
+                try:
+                    msgs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if msgs:
+                self.log.error('not connected, returning %i messages', len(msgs))
+                self._fail(msgs)
+        event.container.schedule(self.check_interval, self)
+
+    def log_stats(self):
+        stats = self.stats.report(self.queue.qsize())
+        if stats['sent'] or stats['failed'] or stats['overflow'] or stats['queue_depth']:
+            self.log.info('Sent %(sent)i messages in %(interval).0fs, %(failed)i failed, '
+                          '%(overflow)i overflowed, queue depth %(queue_depth)i '
+                          '(max %(max_queue_depth)i), send latency avg %(avg_latency).3fs '
+                          'max %(max_latency).3fs', stats)
+
+    # application events are triggered from other threads and don't carry the container
+
+    def on_protonmsg_send(self, event):
+        self.send_msgs()
+
+    def on_protonmsg_stop(self, event):
+        self.stopping = True
+        if self.connection is not None:
+            self.connection.close()
+        self.injector.close()
+        self.container.stop()
+
+    def next_msg(self):
+        if self.retry:
+            return self.retry.popleft()
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+    def send_msgs(self):
+        if not self.connected:
+            return
+        topic_prefix = _topic_prefix(self.conf)
+        while True:
+            msg = self.next_msg()
+            if msg is None:
+                break
+            # address is like "topic://koji.package.add"
+            address = topic_prefix + '.' + msg['address']
+            sender = self.senders.get(address)
+            if sender is None:
+                sender = self.container.create_sender(self.connection, target=address)
+                self.log.debug('created new sender for %s', address)
+                self.senders[address] = sender
+            pmsg = Message(properties=msg['props'], body=msg['body'])
+            if self.ttl:
+                # The message class expects seconds, even though the c api uses milliseconds
+                pmsg.ttl = self.ttl
+            delivery = sender.send(pmsg)
+            self.pending[delivery] = msg
+
+    def on_accepted(self, event):
+        msg = self.pending.pop(event.delivery, None)
+        if msg is not None:
+            self.stats.record_sent(time.time() - msg['queued_ts'])
+
+    def on_rejected(self, event):
+        msg = self.pending.pop(event.delivery, None)
+        if msg is not None:
+            self.log.error('message was rejected: %s', msg['props'])
+            self._fail([msg])
+
+    def on_released(self, event):
+        msg = self.pending.pop(event.delivery, None)
+        if msg is not None:
+            self.log.error('message was released: %s', msg['props'])
+            self._fail([msg])
+
+
+class _Reconnect(object):
+    """Timer handler for the publisher reconnects"""
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    def on_timer_task(self, event):
+        if not self.publisher.stopping:
+            self.publisher.connect()
+
+
+def get_publisher(urls, conf):
+    """Return the background publisher for this process, starting it if needed"""
+    global PUBLISHER
+    with PUBLISHER_LOCK:
+        if PUBLISHER is None:
+            PUBLISHER = Publisher(urls, conf)
+            PUBLISHER.start()
+            atexit.register(PUBLISHER.stop, conf.getint('broker', 'send_timeout'))
+    return PUBLISHER
+
+
 def _strip_extra(buildinfo):
     """If extra_limit is configured, compare extra's size and drop it,
     if it is over"""
@@ -436,6 +787,10 @@ def send_queued_msgs(cbtype, *args, **kws):
     if CONFIG.has_option('queue', 'enabled'):
         db_enabled = CONFIG.getboolean('queue', 'enabled')
 
+    if not test_mode and CONFIG.getboolean('sender', 'enabled', fallback=False):
+        _submit_msgs(urls, msgs, db_enabled)
+        return
+
     if test_mode:
         LOG.debug('test mode: skipping send to urls: %r', urls)
         fail_chance = CONFIG.getint('broker', 'test_mode_fail', fallback=0)
@@ -467,3 +822,19 @@ def send_queued_msgs(cbtype, *args, **kws):
             handle_db_msgs(urls, CONFIG)
     elif unsent:
         LOG.error('could not send %i messages. db queue disabled' % len(msgs))
+
+
+def _submit_msgs(urls, msgs, db_enabled):
+    """Hand messages to the background publisher"""
+    publisher = get_publisher(urls, CONFIG)
+    unsent = publisher.submit(msgs) + publisher.take_failed()
+    if db_enabled:
+        if unsent:
+            store_to_db(unsent)
+        elif publisher.is_idle():
+            # the publisher keeps up, send the messages stored earlier. These
+            # are sent directly, so their rows are only deleted once the broker
+            # has settled them
+            handle_db_msgs(urls, CONFIG)
+    elif unsent:
+        LOG.error('could not send %i messages. db queue disabled' % len(unsent))
@@ -0,0 +1,64 @@
+-- upgrade script to migrate the Koji database schema
+-- from version 1.37 to 1.38
+
+BEGIN;
+
+-- journal of tag changes, used by the repo code
+CREATE TABLE IF NOT EXISTS tag_changes (
+        tag_id INTEGER NOT NULL REFERENCES tag(id),
+        event_id INTEGER NOT NULL REFERENCES events(id),
+        kind TEXT NOT NULL,
+        PRIMARY KEY (tag_id, event_id, kind)
+) WITHOUT OIDS;
+
+CREATE INDEX IF NOT EXISTS tag_changes_by_event ON tag_changes (event_id);
+
+-- fill the journal from the existing history
+INSERT INTO tag_changes (tag_id, event_id, kind)
+        SELECT tag_id, update_event, 'tag_updates' FROM tag_updates
+        UNION SELECT tag_id, create_event, 'tag_listing' FROM tag_listing
+        UNION SELECT tag_id, revoke_event, 'tag_listing' FROM tag_listing WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'tag_inheritance' FROM tag_inheritance
+        UNION SELECT tag_id, revoke_event, 'tag_inheritance' FROM tag_inheritance WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'tag_config' FROM tag_config
+        UNION SELECT tag_id, revoke_event, 'tag_config' FROM tag_config WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'tag_packages' FROM tag_packages
+        UNION SELECT tag_id, revoke_event, 'tag_packages' FROM tag_packages WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'tag_external_repos' FROM tag_external_repos
+        UNION SELECT tag_id, revoke_event, 'tag_external_repos' FROM tag_external_repos WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'tag_extra' FROM tag_extra
+        UNION SELECT tag_id, revoke_event, 'tag_extra' FROM tag_extra WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'group_package_listing' FROM group_package_listing
+        UNION SELECT tag_id, revoke_event, 'group_package_listing' FROM group_package_listing WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'group_req_listing' FROM group_req_listing
+        UNION SELECT tag_id, revoke_event, 'group_req_listing' FROM group_req_listing WHERE revoke_event IS NOT NULL
+        UNION SELECT tag_id, create_event, 'group_config' FROM group_config
+        UNION SELECT tag_id, revoke_event, 'group_config' FROM group_config WHERE revoke_event IS NOT NULL
+        -- external repo changes count for the tags using the repo at the time
+        UNION SELECT tre.tag_id, erc.event_id, 'external_repo_config'
+                FROM (SELECT external_repo_id, create_event AS event_id FROM external_repo_config
+                      UNION SELECT external_repo_id, revoke_event FROM external_repo_config
+                      WHERE revoke_event IS NOT NULL) AS erc
+                JOIN tag_external_repos AS tre ON tre.external_repo_id = erc.external_repo_id
+                WHERE tre.create_event <= erc.event_id
+                        AND (tre.revoke_event IS NULL OR tre.revoke_event > erc.event_id)
+        UNION SELECT tre.tag_id, erd.event_id, 'external_repo_data'
+                FROM (SELECT external_repo_id, create_event AS event_id FROM external_repo_data
+                      UNION SELECT external_repo_id, revoke_event FROM external_repo_data
+                      WHERE revoke_event IS NOT NULL) AS erd
+                JOIN tag_external_repos AS tre ON tre.external_repo_id = erd.external_repo_id
+                WHERE tre.create_event <= erd.event_id
+                        AND (tre.revoke_event IS NULL OR tre.revoke_event > erd.event_id)
+ON CONFLICT DO NOTHING;
+
+-- index of the last change for each tag
+CREATE TABLE IF NOT EXISTS tag_last_change (
+        tag_id INTEGER NOT NULL PRIMARY KEY REFERENCES tag(id),
+        event_id INTEGER REFERENCES events(id)
+) WITHOUT OIDS;
+
+INSERT INTO tag_last_change (tag_id, event_id)
+        SELECT tag_id, max(event_id) FROM tag_changes GROUP BY tag_id
+ON CONFLICT DO NOTHING;
+
+COMMIT;
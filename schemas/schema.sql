@@ -436,6 +436,29 @@ CREATE TABLE tag_updates (
 CREATE INDEX tag_updates_by_tag ON tag_updates (tag_id);
 CREATE INDEX tag_updates_by_event ON tag_updates (update_event);
 
+-- the tag_changes table is a journal of the events that changed a tag, i.e. the events
+-- in the versioned tag tables, tag_updates and the external repos used by the tag.
+-- It is maintained by the hub and lets the repo code find changes without scanning
+-- all of those tables. Changes are recorded for the tag whose data changed, readers
+-- follow inheritance for the descendant tags.
+CREATE TABLE tag_changes (
+        tag_id INTEGER NOT NULL REFERENCES tag(id),
+        event_id INTEGER NOT NULL REFERENCES events(id),
+        kind TEXT NOT NULL,
+        PRIMARY KEY (tag_id, event_id, kind)
+) WITHOUT OIDS;
+
+CREATE INDEX tag_changes_by_event ON tag_changes (event_id);
+
+-- tag_last_change holds the last tag_changes event for each tag.
+-- It is maintained by the hub along with tag_changes, readers add the values of the
+-- parent tags. Missing or NULL values are not known yet, readers fall back to
+-- tag_changes for those.
+CREATE TABLE tag_last_change (
+        tag_id INTEGER NOT NULL PRIMARY KEY REFERENCES tag(id),
+        event_id INTEGER REFERENCES events(id)
+) WITHOUT OIDS;
+
 -- a build target tells the system where to build the package
 -- and how to tag it afterwards.
 CREATE TABLE build_target (
@@ -61,6 +61,162 @@ class TestGetNextTask(unittest.TestCase):
         self.tm.takeTask.assert_called_once_with(tasks[3])
 
 
+class TestHeartbeat(unittest.TestCase):
+
+    def setUp(self):
+        self.options = mock.MagicMock()
+        self.session = mock.MagicMock()
+        self.tm = koji.daemon.TaskManager(self.options, self.session)
+        self.tm.readyForTask = mock.MagicMock(return_value=True)
+        self.tm.takeTask = mock.MagicMock()
+
+    def test_heartbeat(self):
+        self.tm.task_load = 2.0
+        self.tm.pids = {1: 1001}
+        self.tm._waitTask = mock.MagicMock(return_value=False)
+        hostdata = {'id': 999, 'enabled': True, 'capacity': 3.0}
+        data = {'host': hostdata, 'ready': True}
+        self.session.host.heartbeat.return_value = data
+
+        self.assertEqual(self.tm.heartbeat(), data)
+        self.session.host.heartbeat.assert_called_once_with(
+            2.0, True, data=self.tm._get_host_data(), task_ids=[1])
+        self.assertEqual(self.tm.ready, True)
+        self.assertEqual(self.tm.hostdata, hostdata)
+        # the host data of the previous heartbeat is used for the next one
+        self.tm.readyForTask.assert_called_once_with(hostdata=None)
+        self.tm.heartbeat()
+        self.tm.readyForTask.assert_called_with(hostdata=hostdata)
+
+    def test_heartbeat_not_ready(self):
+        self.session.host.heartbeat.return_value = {'host': {}, 'ready': False}
+        self.tm.heartbeat()
+        # the hub had the final say
+        self.assertEqual(self.tm.ready, False)
+
+    def test_heartbeat_reaps_tasks(self):
+        self.tm.pids = {1: 1001, 2: 1002}
+        self.tm.tasks = {1: {'id': 1, 'waiting': False, 'weight': 1.5},
+                         2: {'id': 2, 'waiting': False, 'weight': 2.0}}
+        self.tm.task_load = 3.5
+        self.tm._waitTask = mock.MagicMock(side_effect=lambda task_id, pid: task_id == 2)
+        self.tm.cleanupTask = mock.MagicMock(return_value=True)
+        self.session.host.heartbeat.return_value = {'host': {}, 'ready': True}
+
+        self.tm.heartbeat()
+
+        # the finished task is not reported
+        self.tm.cleanupTask.assert_called_once_with(2, wait=False)
+        self.session.host.heartbeat.assert_called_once_with(
+            1.5, True, data=self.tm._get_host_data(), task_ids=[1])
+        self.assertEqual(list(self.tm.tasks), [1])
+
+    def test_old_hub(self):
+        self.session.host.heartbeat.side_effect = koji.GenericError(
+            'Invalid method: host.heartbeat')
+        self.assertIsNone(self.tm.heartbeat())
+        # no more attempts
+        self.assertIsNone(self.tm.heartbeat())
+        self.session.host.heartbeat.assert_called_once()
+
+    def test_get_next_task(self):
+        self.tm.host_id = 999
+        self.tm.ready = True
+        task = {'id': 4, 'state': koji.TASK_STATES['ASSIGNED'], 'host_id': 999}
+        self.tm.takeTask.return_value = True
+
+        self.assertTrue(self.tm.getNextTask(heartbeat={'assigned': [task]}))
+        self.session.host.updateHost.assert_not_called()
+        self.session.host.getTasks.assert_not_called()
+        self.tm.takeTask.assert_called_once_with(task)
+
+    def test_get_next_task_not_ready(self):
+        self.tm.ready = False
+        self.assertFalse(self.tm.getNextTask(heartbeat={'assigned': ['task']}))
+        self.tm.takeTask.assert_not_called()
+
+    def test_update_tasks(self):
+        self.tm.host_id = 999
+        self.tm.pids = {1: 1001, 2: 1002, 3: 1003}
+        self.tm._waitTask = mock.MagicMock(return_value=False)
+        self.tm.cleanupTask = mock.MagicMock(return_value=True)
+        heartbeat = {
+            'tasks': [{'id': 1, 'waiting': False, 'weight': 1.5}],
+            'task_info': [{'id': 2, 'state': koji.TASK_STATES['CANCELED'], 'host_id': 999}],
+        }
+        self.session.getTaskInfo.return_value = {'id': 3, 'host_id': 999,
+                                                 'state': koji.TASK_STATES['OPEN']}
+
+        self.tm.updateTasks(heartbeat=heartbeat)
+
+        self.session.host.getHostTasks.assert_not_called()
+        self.assertEqual(self.tm.task_load, 1.5)
+        self.assertEqual(list(self.tm.tasks), [1])
+        # the canceled task is killed, task 3 is not in the data and is looked up
+        self.tm.cleanupTask.assert_called_once_with(2)
+        self.session.getTaskInfo.assert_called_once_with(3)
+        self.assertEqual(sorted(self.tm.pids), [1, 3])
+
+    def test_update_buildroots(self):
+        self.tm.tasks = {}
+        br = {'id': 10, 'task_id': 5, 'tag_name': 'tag', 'arch': 'x86_64'}
+
+        self.tm.updateBuildroots(nolocal=True, heartbeat={'buildroots': [br]})
+
+        self.session.listBuildroots.assert_not_called()
+        self.session.host.setBuildRootState.assert_called_once_with(
+            10, koji.BR_STATES['EXPIRED'])
+
+
+class TestWaitForWork(unittest.TestCase):
+
+    def setUp(self):
+        self.options = mock.MagicMock()
+        self.options.long_poll_timeout = 60
+        self.session = mock.MagicMock()
+        self.tm = koji.daemon.TaskManager(self.options, self.session)
+
+    def test_wait(self):
+        self.tm.pids = {1: 1001, 2: 1002}
+        self.tm.tasks = {1: {}, 2: {}}
+        self.tm.alerted = set([2])
+        self.session.host.waitForWork.return_value = False
+
+        self.assertTrue(self.tm.waitForWork())
+        self.session.host.waitForWork.assert_called_once_with([1, 2], [2], 60)
+
+    def test_disabled(self):
+        self.options.long_poll_timeout = 0
+        self.assertFalse(self.tm.waitForWork())
+        self.session.host.waitForWork.assert_not_called()
+
+    def test_exiting_task(self):
+        # a task process we are not tracking as open anymore
+        self.tm.pids = {1: 1001}
+        self.tm.tasks = {}
+        self.assertFalse(self.tm.waitForWork())
+        self.session.host.waitForWork.assert_not_called()
+
+    def test_hub_disabled(self):
+        self.session.host.waitForWork.return_value = None
+        self.assertFalse(self.tm.waitForWork())
+        # no more attempts
+        self.assertFalse(self.tm.waitForWork())
+        self.session.host.waitForWork.assert_called_once()
+
+    def test_old_hub(self):
+        self.session.host.waitForWork.side_effect = koji.GenericError(
+            'Invalid method: host.waitForWork')
+        self.assertFalse(self.tm.waitForWork())
+        self.assertFalse(self.tm.hub_wait)
+
+    def test_error(self):
+        self.session.host.waitForWork.side_effect = koji.GenericError('other error')
+        with self.assertRaises(koji.GenericError):
+            self.tm.waitForWork()
+        self.assertTrue(self.tm.hub_wait)
+
+
 class TestTakeTask(unittest.TestCase):
 
     def setUp(self):
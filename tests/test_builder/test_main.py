@@ -26,6 +26,7 @@ class TestMain(unittest.TestCase):
         self.options.pluginpath = ''
         self.setup_rlimits = mock.patch('koji.util.setup_rlimits').start()
         self.TaskManager = mock.MagicMock()
+        self.TaskManager.waitForWork.return_value = False
         # the kojid import is weird, so we use patch.object
         self.tm_class = mock.patch.object(kojid, 'TaskManager',
                                           return_value=self.TaskManager).start()
@@ -50,6 +51,16 @@ class TestMain(unittest.TestCase):
         self.TaskManager.shutdown.assert_called_once()
         self.session.logout.assert_called_once()
 
+    def test_kojid_main_wait(self):
+        # waiting on the hub replaces the sleep
+        self.TaskManager.getNextTask.side_effect = [False, True, False, KeyboardInterrupt()]
+        self.TaskManager.waitForWork.return_value = True
+        kojid.main(self.options, self.session)
+
+        self.assertEqual(len(self.TaskManager.waitForWork.mock_calls), 2)
+        self.sleep.assert_not_called()
+        self.TaskManager.shutdown.assert_called_once()
+
     def test_kojid_main_several_tasks(self):
         # simulate getting a block of tasks
         self.TaskManager.getNextTask.side_effect = [True, True, True, False, KeyboardInterrupt()]
@@ -301,5 +301,6 @@ Options:
                         packages not found
   --topurl=URL          URL under which Koji files are accessible
   --noprogress          Do not display progress meter
+  -j N, --jobs=N        Download up to N files at once (implies --noprogress)
   -q, --quiet           Suppress output
 """ % self.progname)
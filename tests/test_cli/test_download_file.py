@@ -9,10 +9,12 @@ import tempfile
 import os
 import requests_mock
 import requests
+import threading
+import time
 import unittest
 
 
-from koji_cli.lib import download_file, _download_progress
+from koji_cli.lib import DownloadPool, download_file, _download_progress
 
 
 def mock_open():
@@ -150,6 +152,27 @@ class TestDownloadFile(unittest.TestCase):
         expected = 'Downloading: %s\n' % self.filename
         self.assertMultiLineEqual(actual, expected)
 
+    def test_handle_download_file_session(self):
+        session = mock.MagicMock()
+        session.head.return_value.status_code = 200
+        session.head.return_value.headers = {'Content-Length': '10'}
+        response = session.get.return_value
+        response.status_code = 206
+        response.headers.get.return_value = None
+        response.iter_content.return_value = [b'fghij']
+        with open(self.filename, 'wb') as fo:
+            fo.write(b'abcde')
+
+        download_file("http://url", self.filename, quiet=True, session=session)
+
+        session.head.assert_called_once_with("http://url", timeout=10, allow_redirects=True)
+        session.get.assert_called_once_with("http://url", headers={'Range': 'bytes=5-'},
+                                            stream=True)
+        self.request_with_retry.assert_not_called()
+        self.head.assert_not_called()
+        with open(self.filename, 'rb') as fo:
+            self.assertEqual(fo.read(), b'abcdefghij')
+
     '''
     possible tests
     - handling redirect headers
@@ -157,6 +180,76 @@ class TestDownloadFile(unittest.TestCase):
     '''
 
 
+class TestDownloadPool(unittest.TestCase):
+
+    def setUp(self):
+        self.request_with_retry = mock.patch('koji.request_with_retry').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_single_job(self):
+        pool = DownloadPool()
+        self.request_with_retry.assert_called_once_with(pool_maxsize=1)
+        self.assertEqual(pool.session, self.request_with_retry.return_value)
+        func = mock.MagicMock()
+        pool.add(func, 'url', 'path', session=pool.session)
+        # runs right away
+        func.assert_called_once_with('url', 'path', session=pool.session)
+        pool.wait()
+        func.assert_called_once()
+
+    def wait_for(self, check):
+        for i in range(1000):
+            if check():
+                return
+            time.sleep(0.01)
+
+    def test_parallel(self):
+        pool = DownloadPool(3)
+        self.request_with_retry.assert_called_once_with(pool_maxsize=3)
+        started = []
+        seen = []
+
+        def download(n):
+            started.append(n)
+            # only passes if three downloads run at once
+            self.wait_for(lambda: len(started) >= 3)
+            seen.append(len(started))
+
+        for n in range(6):
+            pool.add(download, n)
+        self.assertEqual(started, [])
+        pool.wait()
+        self.assertEqual(sorted(started), list(range(6)))
+        self.assertGreaterEqual(min(seen), 3)
+
+    def test_error(self):
+        pool = DownloadPool(2)
+        running = threading.Event()
+        done = []
+
+        def download(n):
+            if n == 0:
+                running.wait(10)
+                # e.g. failed checks in download_rpm
+                raise SystemExit(1)
+            if n == 1:
+                running.set()
+                # finish only after the error is recorded
+                self.wait_for(lambda: pool.errors)
+            done.append(n)
+
+        for n in range(10):
+            pool.add(download, n)
+        with self.assertRaises(SystemExit):
+            pool.wait()
+        # the running download is finished, queued ones are dropped
+        self.assertEqual(done, [1])
+        pool.wait()
+        self.assertEqual(done, [1])
+
+
 class TestDownloadProgress(unittest.TestCase):
     # Show long diffs in error output...
     maxDiff = None
@@ -229,4 +229,5 @@ Options:
   -c, --continue        Continue previous download
   -d DIRECTORY, --dir=DIRECTORY
                         Write logs to DIRECTORY
+  -j N, --jobs=N        Download up to N build logs at once
 """ % (self.progname, self.progname))
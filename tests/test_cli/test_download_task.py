@@ -19,7 +19,7 @@ progname = os.path.basename(sys.argv[0]) or 'koji'
 
 class TestDownloadTask(utils.CliTestCase):
 
-    def gen_calls(self, task_output, pattern, blacklist=[], arch=None):
+    def gen_calls(self, task_output, pattern, blacklist=[], arch=None, noprogress=None):
 
         params = [(k, v) for k, vl in
                   six.iteritems(task_output)
@@ -37,8 +37,8 @@ class TestDownloadTask(utils.CliTestCase):
             url = pattern % (subpath, k)
             if target.endswith('.log') and arch is not None:
                 target = "%s.%s.log" % (target.rstrip(".log"), arch)
-            calls.append(call(url, target, quiet=None, noprogress=None,
-                              size=total, num=i + 1))
+            calls.append(call(url, target, quiet=None, noprogress=noprogress,
+                              size=total, num=i + 1, session=mock.ANY))
         return calls
 
     def setUp(self):
@@ -102,6 +102,36 @@ Default behavior without --all option downloads .rpm files only for build and bu
         self.assertListEqual(self.download_file.mock_calls, calls)
         self.assertIsNone(rv)
 
+    def test_handle_download_task_jobs(self):
+        args = [str(self.parent_task_id), '--jobs', '3']
+        self.session.getTaskInfo.return_value = self.parent_task_info
+        self.session.getTaskChildren.return_value = []
+        self.list_task_output_all_volumes.return_value = {
+            'somerpm.src.rpm': ['DEFAULT', 'vol1'],
+            'somerpm.x86_64.rpm': ['DEFAULT', 'vol2'],
+            'somerpm.noarch.rpm': ['vol3']}
+        calls = self.gen_calls(self.list_task_output_all_volumes.return_value,
+                               'https://topurl/%swork/tasks/123/123/%s', noprogress=True)
+
+        rv = anon_handle_download_task(self.options, self.session, args)
+
+        self.assertIsNone(rv)
+        self.assertEqual(self.download_file.call_count, len(calls))
+        self.download_file.assert_has_calls(calls, any_order=True)
+        # all downloads share one connection pool
+        sessions = set(id(c[2]['session']) for c in self.download_file.mock_calls)
+        self.assertEqual(len(sessions), 1)
+
+    def test_handle_download_task_bad_jobs(self):
+        args = [str(self.parent_task_id), '--jobs', '0']
+        self.assert_system_exit(
+            anon_handle_download_task,
+            self.options, self.session, args,
+            stderr=self.format_error_message('The number of jobs must be at least 1'),
+            activate_session=None,
+            exit_code=2)
+        self.download_file.assert_not_called()
+
     def test_handle_download_task_not_found(self):
         args = [str(self.parent_task_id)]
         self.session.getTaskInfo.return_value = None
@@ -170,9 +200,9 @@ Default behavior without --all option downloads .rpm files only for build and bu
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=2, num=1),
+                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=2, num=1, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=2, num=2)])
+                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=2, num=2, session=mock.ANY)])
         self.assertIsNone(rv)
 
     def test_handle_download_task_log(self):
@@ -205,19 +235,19 @@ Default behavior without --all option downloads .rpm files only for build and bu
             mock.call(self.session, self.parent_task_id), mock.call(self.session, 22222)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 'somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=1),
+                 'somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=1, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somerpm.src.rpm',
-                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=2),
+                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=2, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=3),
+                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=3, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/2222/22222/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=4),
+                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=4, session=mock.ANY),
             call('https://topurl/vol/vol3/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=5),
+                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=5, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somelog.log',
-                 'somelog.noarch.log', quiet=None, noprogress=None, size=7, num=6),
+                 'somelog.noarch.log', quiet=None, noprogress=None, size=7, num=6, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somelog.log',
-                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=7, num=7)
+                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=7, num=7, session=mock.ANY)
         ])
         self.assertIsNone(rv)
 
@@ -428,6 +458,7 @@ Options:
   --logs           Also download build logs
   --topurl=URL     URL under which Koji files are accessible
   --noprogress     Do not display progress meter
+  -j N, --jobs=N   Download up to N files at once (implies --noprogress)
   --wait           Wait for running tasks to finish, even if running in the
                    background
   --nowait         Do not wait for running tasks to finish
@@ -515,15 +546,15 @@ Options:
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 '22222/somerpm.noarch.rpm', quiet=None, noprogress=None, size=5, num=1),
+                 '22222/somerpm.noarch.rpm', quiet=None, noprogress=None, size=5, num=1, session=mock.ANY),
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 '33333/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=2),
+                 '33333/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=2, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 '33333/vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=3),
+                 '33333/vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=3, session=mock.ANY),
             call('https://topurl/work/tasks/5555/55555/somelog.log',
-                 '55555/somelog.log', quiet=None, noprogress=None, size=5, num=4),
+                 '55555/somelog.log', quiet=None, noprogress=None, size=5, num=4, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/5555/55555/somelog.log',
-                 '55555/vol1/somelog.log', quiet=None, noprogress=None, size=5, num=5),
+                 '55555/vol1/somelog.log', quiet=None, noprogress=None, size=5, num=5, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -576,11 +607,11 @@ Options:
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/3333/33333/somerpm.json',
-                 'somerpm.x86_64.json', quiet=None, noprogress=None, size=3, num=1),
+                 'somerpm.x86_64.json', quiet=None, noprogress=None, size=3, num=1, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.json',
-                 'vol2/somerpm.x86_64.json', quiet=None, noprogress=None, size=3, num=2),
+                 'vol2/somerpm.x86_64.json', quiet=None, noprogress=None, size=3, num=2, session=mock.ANY),
             call('https://topurl/vol/vol3/work/tasks/5555/55555/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=3),
+                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=3, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -655,19 +686,19 @@ Options:
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 '22222/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=1),
+                 '22222/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=1, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somerpm.src.rpm',
-                 '22222/vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=2),
+                 '22222/vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=2, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 '22222/somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=3),
+                 '22222/somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=3, session=mock.ANY),
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 '33333/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=4),
+                 '33333/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=4, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 '33333/vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=5),
+                 '33333/vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=5, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/4444/44444/somerpm.s390.rpm',
-                 '44444/vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=7, num=6),
+                 '44444/vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=7, num=6, session=mock.ANY),
             call('https://topurl/vol/vol3/work/tasks/5555/55555/somerpm.noarch.rpm',
-                 '55555/vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=7),
+                 '55555/vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=7, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -700,11 +731,11 @@ Options:
         self.list_task_output_all_volumes.assert_has_calls([mock.call(self.session, 22222)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/vol/vol3/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=1),
+                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=1, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somelog.noarch.log',
-                 'somelog.noarch.log', quiet=None, noprogress=None, size=3, num=2),
+                 'somelog.noarch.log', quiet=None, noprogress=None, size=3, num=2, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somelog.noarch.log',
-                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=3, num=3)
+                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=3, num=3, session=mock.ANY)
         ])
         self.assertIsNone(rv)
 
@@ -756,23 +787,23 @@ Options:
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 'somerpm.src.rpm', quiet=None, noprogress=None, size=9, num=1),
+                 'somerpm.src.rpm', quiet=None, noprogress=None, size=9, num=1, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somerpm.src.rpm',
-                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=9, num=2),
+                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=9, num=2, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 'somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=3),
+                 'somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=3, session=mock.ANY),
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=4),
+                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=4, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=5),
+                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=5, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/4444/44444/somerpm.s390.rpm',
-                 'vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=9, num=6),
+                 'vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=9, num=6, session=mock.ANY),
             call('https://topurl/work/tasks/5555/55555/somelog.log',
-                 'somelog.noarch.log', quiet=None, noprogress=None, size=9, num=7),
+                 'somelog.noarch.log', quiet=None, noprogress=None, size=9, num=7, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/5555/55555/somelog.log',
-                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=9, num=8),
+                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=9, num=8, session=mock.ANY),
             call('https://topurl/vol/vol3/work/tasks/5555/55555/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=9),
+                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=9, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -824,17 +855,17 @@ Options:
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 'somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=1),
+                 'somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=1, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somerpm.src.rpm',
-                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=2),
+                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=7, num=2, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 'somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=3),
+                 'somerpm.noarch.rpm', quiet=None, noprogress=None, size=7, num=3, session=mock.ANY),
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=4),
+                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=4, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=5),
+                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=7, num=5, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/4444/44444/somerpm.s390.rpm',
-                 'vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=7, num=6),
+                 'vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=7, num=6, session=mock.ANY),
         ])
 
     def test_handle_download_task_without_all_json_not_downloaded(self):
@@ -918,21 +949,21 @@ Options:
             call(self.session, 55555)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 'somerpm.src.rpm', quiet=None, noprogress=None, size=9, num=1),
+                 'somerpm.src.rpm', quiet=None, noprogress=None, size=9, num=1, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 'somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=2),
+                 'somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=2, session=mock.ANY),
             call('https://topurl/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=4),
+                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=4, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/3333/33333/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=5),
+                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=9, num=5, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/4444/44444/somerpm.s390.rpm',
-                 'vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=9, num=6),
+                 'vol2/somerpm.s390.rpm', quiet=None, noprogress=None, size=9, num=6, session=mock.ANY),
             call('https://topurl/work/tasks/5555/55555/somelog.log',
-                 'somelog.noarch.log', quiet=None, noprogress=None, size=9, num=7),
+                 'somelog.noarch.log', quiet=None, noprogress=None, size=9, num=7, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/5555/55555/somelog.log',
-                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=9, num=8),
+                 'vol1/somelog.noarch.log', quiet=None, noprogress=None, size=9, num=8, session=mock.ANY),
             call('https://topurl/vol/vol3/work/tasks/5555/55555/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=9),
+                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=9, num=9, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -966,11 +997,11 @@ Options:
             mock.call(self.session, self.parent_task_id), mock.call(self.session, 22222)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 'somerpm.src.rpm', quiet=None, noprogress=None, size=3, num=1),
+                 'somerpm.src.rpm', quiet=None, noprogress=None, size=3, num=1, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somerpm.src.rpm',
-                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=3, num=2),
+                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=3, num=2, session=mock.ANY),
             call('https://topurl/vol/vol3/work/tasks/2222/22222/somerpm.noarch.rpm',
-                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=3),
+                 'vol3/somerpm.noarch.rpm', quiet=None, noprogress=None, size=3, num=3, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -1005,15 +1036,15 @@ Options:
             mock.call(self.session, self.parent_task_id), mock.call(self.session, 22222)])
         self.assertListEqual(self.download_file.mock_calls, [
             call('https://topurl/work/tasks/2222/22222/somerpm.src.rpm',
-                 'somerpm.src.rpm', quiet=None, noprogress=None, size=5, num=1),
+                 'somerpm.src.rpm', quiet=None, noprogress=None, size=5, num=1, session=mock.ANY),
             call('https://topurl/vol/vol1/work/tasks/2222/22222/somerpm.src.rpm',
-                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=5, num=2),
+                 'vol1/somerpm.src.rpm', quiet=None, noprogress=None, size=5, num=2, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/somerpm.x86_64.rpm',
-                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=3),
+                 'somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=3, session=mock.ANY),
             call('https://topurl/vol/vol2/work/tasks/2222/22222/somerpm.x86_64.rpm',
-                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=4),
+                 'vol2/somerpm.x86_64.rpm', quiet=None, noprogress=None, size=5, num=4, session=mock.ANY),
             call('https://topurl/work/tasks/2222/22222/nextlog.log',
-                 'nextlog.noarch.log', quiet=None, noprogress=None, size=5, num=5),
+                 'nextlog.noarch.log', quiet=None, noprogress=None, size=5, num=5, session=mock.ANY),
         ])
         self.assertIsNone(rv)
 
@@ -5,8 +5,11 @@ try:
     from unittest import mock
 except ImportError:
     import mock
+import json
 import os
+import shutil
 import six
+import tempfile
 import time
 
 from koji_cli.commands import handle_prune_signed_copies
@@ -65,6 +68,10 @@ Options:
                         File to read tag protect patterns from
   --trashcan-tag=TRASHCAN_TAG
                         Specify trashcan tag
+  --bulk                Query history and signatures for many packages at once
+  --batch=N             Packages per batch in bulk mode (default: 100)
+  -j N, --jobs=N        Threads removing files per volume in bulk mode
+  --checkpoint=FILE     Save bulk mode progress to FILE and resume from it
 """ % self.progname)
 
     def test_handle_prune_signes_copies_non_exist_build(self):
@@ -733,3 +740,157 @@ Bytes: 1
         self.activate_session_mock.assert_called_once_with(self.session, self.options)
         self.session.getBuild.assert_not_called()
         self.session.getPackage.assert_called_once_with('package-name')
+
+
+class TestPruneSignedCopiesBulk(utils.CliTestCase):
+
+    def setUp(self):
+        self.maxDiff = None
+        self.tempdir = tempfile.mkdtemp()
+        self.error_format = """Usage: %s prune-signed-copies [options]
+(Specify the --help global option for a list of other help options)
+
+%s: error: {message}
+""" % (self.progname, self.progname)
+        self.options = mock.MagicMock()
+        self.options.debug = False
+        self.session = mock.MagicMock()
+        self.activate_session_mock = mock.patch('koji_cli.commands.activate_session').start()
+        self.stdout = mock.patch('sys.stdout', new_callable=six.StringIO).start()
+        mock.patch('koji.pathinfo.build', side_effect=self.build_path).start()
+        self.builds = [
+            {'build_id': 1, 'nvr': 'foo-1-1', 'package_name': 'foo', 'version': '1',
+             'release': '1', 'volume_name': 'DEFAULT'},
+            {'build_id': 2, 'nvr': 'foo-2-1', 'package_name': 'foo', 'version': '2',
+             'release': '1', 'volume_name': 'DEFAULT'},
+            {'build_id': 3, 'nvr': 'bar-1-1', 'package_name': 'bar', 'version': '1',
+             'release': '1', 'volume_name': 'vol2'},
+        ]
+        self.session.listBuilds.side_effect = [self.builds, []]
+        self.history = {
+            'foo': [
+                # foo-1-1 was replaced by foo-2-1 long ago
+                self.entry(1, 'tag-a', 10, None),
+                self.entry(2, 'tag-a', 20, None),
+            ],
+            'bar': [
+                # bar-1-1 was untagged long ago
+                self.entry(3, 'tag-b', 30, 40),
+            ],
+        }
+        self.mcall = self.session.multicall.return_value.__enter__.return_value
+        self.mcall.queryHistory.side_effect = self.queryHistory
+        self.mcall.listRPMs.side_effect = self.listRPMs
+        self.mcall.queryRPMSigs.side_effect = self.queryRPMSigs
+        self.paths = {}
+        for binfo in self.builds:
+            rpminfo = self.rpminfo(binfo['build_id'])
+            binfo = dict(binfo, name=binfo['package_name'])
+            path = os.path.join(self.build_path(binfo),
+                                koji.pathinfo.signed(rpminfo, 'abcdef'))
+            koji.ensuredir(os.path.dirname(path))
+            with open(path, 'wb') as fo:
+                fo.write(b'x' * 10)
+            os.utime(path, (1000000, 1000000))
+            self.paths[binfo['build_id']] = path
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.tempdir)
+
+    def build_path(self, binfo):
+        return os.path.join(self.tempdir, binfo['volume_name'], binfo['nvr'])
+
+    def entry(self, build_id, tag_name, create_event, revoke_event):
+        return {'build_id': build_id, 'tag.name': tag_name, 'tag_name': tag_name,
+                'name': 'pkg', 'version': '1', 'release': '1',
+                'create_event': create_event, 'create_ts': 1000000 + create_event,
+                'revoke_event': revoke_event,
+                'revoke_ts': revoke_event and 1000000 + revoke_event,
+                'active': revoke_event is None}
+
+    def rpminfo(self, build_id):
+        return {'id': build_id * 10, 'name': 'pkg', 'version': str(build_id), 'release': '1',
+                'arch': 'noarch'}
+
+    def queryHistory(self, tables, package):
+        self.assertEqual(tables, ['tag_listing'])
+        return mock.MagicMock(result={'tag_listing': self.history[package]})
+
+    def listRPMs(self, buildID):
+        return mock.MagicMock(result=[self.rpminfo(buildID)])
+
+    def queryRPMSigs(self, rpm_id):
+        return mock.MagicMock(result=[{'rpm_id': rpm_id, 'sigkey': 'abcdef'}])
+
+    def test_bulk(self):
+        checkpoint = os.path.join(self.tempdir, 'checkpoint.json')
+        handle_prune_signed_copies(self.options, self.session,
+                                   ['--bulk', '--jobs', '2', '--checkpoint', checkpoint])
+
+        self.assertFalse(os.path.exists(self.paths[1]))
+        self.assertTrue(os.path.exists(self.paths[2]))
+        self.assertFalse(os.path.exists(self.paths[3]))
+        # one history query per package, no per build queries
+        self.assertEqual(self.mcall.queryHistory.call_count, 2)
+        self.session.queryHistory.assert_not_called()
+        self.assertEqual(sorted(c[2]['buildID'] for c in self.mcall.listRPMs.mock_calls),
+                         [1, 3])
+        self.assertTrue(self.stdout.getvalue().endswith(
+            "--- Grand Totals ---\nFiles: 2\nBytes: 20\n"))
+        # the run is complete, so the next one starts over
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_bulk_resume(self):
+        checkpoint = os.path.join(self.tempdir, 'checkpoint.json')
+        with open(checkpoint, 'wt') as fo:
+            json.dump({'package': 'bar', 'files': 5, 'space': 50}, fo)
+        handle_prune_signed_copies(self.options, self.session,
+                                   ['--bulk', '--checkpoint', checkpoint])
+
+        # bar was done already
+        self.assertTrue(os.path.exists(self.paths[3]))
+        self.assertFalse(os.path.exists(self.paths[1]))
+        self.mcall.queryHistory.assert_called_once_with(tables=['tag_listing'], package='foo')
+        self.assertEqual(self.stdout.getvalue(),
+                         "Resuming after package bar\n"
+                         "--- Grand Totals ---\nFiles: 6\nBytes: 60\n")
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_bulk_checkpoint_interrupted(self):
+        checkpoint = os.path.join(self.tempdir, 'checkpoint.json')
+        self.mcall.queryHistory.side_effect = [self.queryHistory(['tag_listing'], 'bar'),
+                                               koji.GenericError("interrupted")]
+        with self.assertRaises(koji.GenericError):
+            handle_prune_signed_copies(self.options, self.session,
+                                       ['--bulk', '--batch', '1', '--checkpoint', checkpoint])
+        with open(checkpoint) as fo:
+            self.assertEqual(json.load(fo), {'package': 'bar', 'files': 1, 'space': 10})
+
+    def test_bulk_test_mode(self):
+        handle_prune_signed_copies(self.options, self.session, ['--bulk', '--test'])
+        for path in self.paths.values():
+            self.assertTrue(os.path.exists(path))
+        output = self.stdout.getvalue()
+        self.assertIn("Would have unlinked: %s\n" % self.paths[1], output)
+        self.assertIn("Would have unlinked: %s\n" % self.paths[3], output)
+        self.assertNotIn(self.paths[2], output)
+
+    def test_bulk_test_mode_checkpoint(self):
+        checkpoint = os.path.join(self.tempdir, 'checkpoint.json')
+        handle_prune_signed_copies(self.options, self.session,
+                                   ['--bulk', '--test', '--batch', '1',
+                                    '--checkpoint', checkpoint])
+        for path in self.paths.values():
+            self.assertTrue(os.path.exists(path))
+        # a dry run must not make the next real run skip packages
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_jobs_without_bulk(self):
+        self.assert_system_exit(
+            handle_prune_signed_copies,
+            self.options, self.session, ['--jobs', '4'],
+            stderr=self.format_error_message(
+                "--jobs and --checkpoint can only be used with --bulk"),
+            activate_session=None,
+            exit_code=2)
@@ -0,0 +1,16 @@
+from __future__ import absolute_import
+import importlib
+import importlib.machinery
+import os
+import sys
+
+# koji-gc is a script, so it is loaded like kojira
+GC_MOD = "koji_gc_"
+GC_FILENAME = os.path.dirname(__file__) + "/../../util/koji-gc"
+
+importlib.machinery.SOURCE_SUFFIXES.append('')
+spec = importlib.util.spec_from_file_location(GC_MOD, GC_FILENAME)
+koji_gc = importlib.util.module_from_spec(spec)
+sys.modules[GC_MOD] = koji_gc
+spec.loader.exec_module(koji_gc)
+importlib.machinery.SOURCE_SUFFIXES.pop()
@@ -0,0 +1,318 @@
+from __future__ import absolute_import
+from unittest import mock
+import time
+import unittest
+
+import koji
+
+from . import loadgc
+koji_gc = loadgc.koji_gc
+
+
+class FakeCall(object):
+
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self._result = None
+        self._error = None
+
+    @property
+    def result(self):
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class FakeMultiCall(object):
+
+    def __init__(self, hub, opts):
+        self.hub = hub
+        self.opts = opts
+        self.calls = []
+
+    def __getattr__(self, name):
+        def add_call(*args, **kwargs):
+            call = FakeCall(name, args, kwargs)
+            self.calls.append(call)
+            return call
+        return add_call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        if _type is not None:
+            return False
+        for call in self.calls:
+            try:
+                call._result = getattr(self.hub, call.method)(*call.args, **call.kwargs)
+            except koji.GenericError as e:
+                if self.opts.get('strict'):
+                    raise
+                call._error = e
+        return False
+
+
+class FakeHub(object):
+    """Just enough of the hub for koji-gc, with the calls logged in order"""
+
+    def __init__(self):
+        self.tags = {}
+        self.listings = []
+        self.sigs = {}
+        self.log = []
+        self.multicalls = []
+
+    def add_tag(self, tag_id, name):
+        self.tags[tag_id] = {'id': tag_id, 'name': name, 'maven_include_all': False}
+        return self.tags[tag_id]
+
+    def tag_build(self, tag_id, build_id, name, create_ts):
+        self.listings.append({'tag_id': tag_id, 'build_id': build_id, 'name': name,
+                              'version': '1', 'release': str(build_id),
+                              'create_ts': create_ts})
+
+    def tag_id(self, tag):
+        if isinstance(tag, int):
+            return tag
+        for tag_id, taginfo in self.tags.items():
+            if taginfo['name'] == tag:
+                return tag_id
+
+    def multicall(self, **opts):
+        self.multicalls.append(opts)
+        return FakeMultiCall(self, opts)
+
+    def queryHistory(self, tables=None, tag=None, active=None, before=None):
+        self.log.append(('queryHistory', tag))
+        tag_id = self.tag_id(tag)
+        return {'tag_listing': [dict(entry) for entry in self.listings
+                                if entry['tag_id'] == tag_id]}
+
+    def listTags(self, build, perms=True):
+        self.log.append(('listTags', build))
+        return [self.tags[entry['tag_id']] for entry in self.listings
+                if entry['build_id'] == build]
+
+    def untagBuildBypass(self, tag, build, force=False):
+        self.log.append(('untagBuildBypass', tag, build))
+        tag_id = self.tag_id(tag)
+        self.listings = [entry for entry in self.listings
+                         if (entry['tag_id'], entry['build_id']) != (tag_id, build)]
+
+    def deleteBuild(self, build, strict=True):
+        self.log.append(('deleteBuild', build))
+        if self.listTags(build):
+            raise koji.GenericError('Cannot delete build, tagged')
+
+    def listRPMs(self, buildID=None):
+        return [{'id': buildID}]
+
+    def queryRPMSigs(self, rpm_id=None):
+        return [{'sigkey': key} for key in self.sigs.get(rpm_id, [])]
+
+
+class GCTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = FakeHub()
+        self.options = mock.MagicMock()
+        self.options.debug = False
+        self.options.test = False
+        self.options.pkg_filter = None
+        self.options.jobs = 4
+        self.options.batch = 10
+        self.options.key_aliases = {}
+        self.options.unprotected_key_patterns = ['unsigned*']
+        self.options.trashcan_tag = 'trashcan'
+        self.options.grace_period = 0
+        mock.patch.object(koji_gc, 'session', new=self.hub, create=True).start()
+        mock.patch.object(koji_gc, 'options', new=self.options, create=True).start()
+        mock.patch.object(koji_gc, 'build_sig_cache', new={}).start()
+        mock.patch.object(koji_gc, 'worker_sessions', new=['worker']).start()
+        mock.patch('sys.stdout').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def get_pruner(self, policy):
+        policies = koji_gc.scan_policies(policy)
+        return koji_gc.Pruner(policies, True, koji_gc.PhaseStats())
+
+
+class TestPruner(GCTestCase):
+
+    def test_untag_state_across_batches(self):
+        now = time.time()
+        tag_a = self.hub.add_tag(1, 'tag-a')
+        tag_b = self.hub.add_tag(2, 'tag-b')
+        self.hub.tag_build(1, 100, 'foo', now)
+        self.hub.tag_build(2, 100, 'foo', now)
+        pruner = self.get_pruner("""
+            hastag keep-* :: keep
+            tag tag-a :: untag
+            hastag tag-a :: keep
+            order >= 0 :: untag
+            """)
+
+        pruner.prune_tags([(tag_a, False)])
+        pruner.prune_tags([(tag_b, False)])
+
+        # the cached tags of the build leave out the tag it was untagged from,
+        # so the next batch sees that it is no longer in tag-a
+        self.assertEqual(pruner.untagged, {'foo-1-100': {'tag-a': 1, 'tag-b': 1}})
+        self.assertEqual(pruner.cache['tags'][100], [])
+        self.assertEqual([c for c in self.hub.log if c[0] == 'listTags'], [('listTags', 100)])
+        self.assertEqual(self.hub.listings, [])
+
+    def test_untag_state_in_batch(self):
+        now = time.time()
+        tag_a = self.hub.add_tag(1, 'tag-a')
+        tag_b = self.hub.add_tag(2, 'tag-b')
+        self.hub.tag_build(1, 100, 'foo', now)
+        self.hub.tag_build(2, 100, 'foo', now)
+        pruner = self.get_pruner("""
+            hastag keep-* :: keep
+            tag tag-a :: untag
+            hastag tag-a :: keep
+            order >= 0 :: untag
+            """)
+
+        pruner.prune_tags([(tag_a, False), (tag_b, False)])
+
+        # the untags of the batch are only done at the end of it, but the
+        # tags data already leaves them out
+        self.assertEqual(pruner.untagged, {'foo-1-100': {'tag-a': 1, 'tag-b': 1}})
+        self.assertEqual(pruner.untagging, {})
+        untags = [c for c in self.hub.log if c[0] == 'untagBuildBypass']
+        self.assertEqual(untags, [('untagBuildBypass', 1, 100), ('untagBuildBypass', 2, 100)])
+
+    def test_multicalls_reuse_worker_sessions(self):
+        tag_a = self.hub.add_tag(1, 'tag-a')
+        self.hub.tag_build(1, 100, 'foo', time.time())
+        pruner = self.get_pruner("order >= 0 :: untag")
+
+        pruner.prune_tags([(tag_a, False)])
+
+        self.assertTrue(self.hub.multicalls)
+        for opts in self.hub.multicalls:
+            self.assertEqual(opts['worker_sessions'], ['worker'])
+
+    def test_purge(self):
+        trashcan = self.hub.add_tag(1, 'trashcan')
+        self.hub.add_tag(2, 'other')
+        pruner = self.get_pruner("order >= 0 :: untag")
+        for build_id in (100, 101, 102, 103):
+            nvr = 'foo-1-%i' % build_id
+            pruner.untagged[nvr] = {'tag-a': 1}
+            pruner.build_ids[nvr] = build_id
+        # still tagged
+        self.hub.tag_build(2, 100, 'foo', 0)
+        self.hub.tag_build(trashcan['id'], 100, 'foo', 0)
+        # signed when the policy was applied
+        koji_gc.build_sig_cache[101] = ['abcd1234']
+        # signed since then
+        koji_gc.build_sig_cache[102] = ['unsigned']
+        self.hub.sigs[102] = ['abcd1234']
+        self.hub.sigs[103] = ['unsigned']
+
+        pruner.purge()
+
+        deletes = [c for c in self.hub.log if c[0] == 'deleteBuild']
+        self.assertEqual(deletes, [('deleteBuild', 103)])
+
+    def test_purge_test_mode(self):
+        self.options.test = True
+        self.hub.add_tag(1, 'tag-a')
+        self.hub.tag_build(1, 100, 'foo', 0)
+        pruner = self.get_pruner("order >= 0 :: untag")
+        # in test mode, the builds are still in the tags they would be untagged from
+        pruner.untagged['foo-1-100'] = {'tag-a': 1}
+        pruner.build_ids['foo-1-100'] = 100
+
+        pruner.purge()
+
+        self.assertNotIn('deleteBuild', [c[0] for c in self.hub.log])
+
+
+class TestHandleDelete(GCTestCase):
+
+    def test_delete_order(self):
+        self.hub.add_tag(1, 'trashcan')
+        self.hub.add_tag(2, 'other')
+        for build_id in (100, 101, 102):
+            self.hub.tag_build(1, build_id, 'foo', 0)
+        # tagged elsewhere, salvaged
+        self.hub.tag_build(2, 101, 'foo', 0)
+
+        koji_gc.handle_delete()
+
+        calls = [c for c in self.hub.log if c[0] in ('untagBuildBypass', 'deleteBuild')]
+        self.assertEqual(calls, [
+            ('untagBuildBypass', 'trashcan', 101),
+            ('untagBuildBypass', 'trashcan', 100),
+            ('untagBuildBypass', 'trashcan', 102),
+            ('deleteBuild', 100),
+            ('deleteBuild', 102),
+        ])
+        # the untags and deletes are in one multicall, which must not use
+        # parallel batches
+        self.assertEqual(self.hub.multicalls[-1]['workers'], 1)
+        self.assertEqual([entry['build_id'] for entry in self.hub.listings], [101])
+
+    def test_salvage(self):
+        self.hub.add_tag(1, 'trashcan')
+        self.hub.tag_build(1, 100, 'foo', 0)
+        self.hub.sigs[100] = ['abcd1234']
+
+        koji_gc.handle_delete(just_salvage=True)
+
+        self.assertEqual([c for c in self.hub.log if c[0] != 'listTags'][-1],
+                         ('untagBuildBypass', 'trashcan', 100))
+        self.assertNotIn('deleteBuild', [c[0] for c in self.hub.log])
+        self.assertEqual(self.hub.listings, [])
+
+
+class TestGetReferences(GCTestCase):
+
+    def setUp(self):
+        super(TestGetReferences, self).setUp()
+        self.refs_calls = []
+
+    def refs(self, build_id):
+        return {'tags': [], 'last_used': build_id}
+
+    def test_list(self):
+        def buildReferences(build, limit=None, lazy=False):
+            self.refs_calls.append(build)
+            return [self.refs(b) for b in build]
+        self.hub.buildReferences = buildReferences
+        build_ids = list(range(250))
+
+        result = koji_gc.get_references(build_ids)
+
+        self.assertEqual(result, [self.refs(b) for b in build_ids])
+        self.assertEqual(self.refs_calls, [build_ids[:100], build_ids[100:200], build_ids[200:]])
+
+    def test_old_hub(self):
+        def buildReferences(build, limit=None, lazy=False):
+            self.refs_calls.append(build)
+            if isinstance(build, list):
+                raise koji.GenericError("Invalid type for argument: <class 'list'>")
+            return self.refs(build)
+        self.hub.buildReferences = buildReferences
+
+        result = koji_gc.get_references([1, 2, 3])
+
+        self.assertEqual(result, [self.refs(1), self.refs(2), self.refs(3)])
+        self.assertEqual(self.refs_calls, [[1, 2, 3], 1, 2, 3])
+
+    def test_error(self):
+        def buildReferences(build, limit=None, lazy=False):
+            raise koji.GenericError('No such build: 2')
+        self.hub.buildReferences = buildReferences
+
+        with self.assertRaises(koji.GenericError):
+            koji_gc.get_references([1, 2, 3])
@@ -768,3 +768,175 @@ class TestAuthSession(unittest.TestCase):
         with self.assertRaises(koji.ActionNotAllowed) as ex:
             s.logout(session_id=1)
         self.assertEqual("only admins or owner may logout other session", str(ex.exception))
+
+
+class TestSessionCache(unittest.TestCase):
+    getUpdate = TestAuthSession.getUpdate
+    getQuery = TestAuthSession.getQuery
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.auth.context').start()
+        self.UpdateProcessor = mock.patch('kojihub.auth.UpdateProcessor',
+                                          side_effect=self.getUpdate).start()
+        self.updates = []
+        self.query_execute = mock.MagicMock()
+        self.query_executeOne = mock.MagicMock()
+        self.query_singleValue = mock.MagicMock()
+        self.QueryProcessor = mock.patch('kojihub.auth.QueryProcessor',
+                                         side_effect=self.getQuery).start()
+        self.queries = []
+        self.time = mock.patch('kojihub.auth.time.time', return_value=1000.0).start()
+        self.session_cache = kojihub.auth.SessionCache()
+        mock.patch('kojihub.auth.session_cache', new=self.session_cache).start()
+        self.context.opts = {
+            'CheckClientIP': True,
+            'DisableURLSessions': True,
+            'SessionRenewalTimeout': 0,
+            'SessionCacheTime': 30,
+        }
+        self.context.method = 'host.getTasks'
+        self.context.environ = {
+            'HTTP_KOJI_SESSION_ID': '123',
+            'HTTP_KOJI_SESSION_KEY': 'xyz',
+            'HTTP_KOJI_SESSION_CALLNUM': '345',
+            'REMOTE_ADDR': 'remote-addr',
+        }
+        self.query_singleValue.return_value = None
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def session_rows(self, status=0):
+        return [
+            {'authtype': 2, 'callnum': 345, 'start_ts': 1666599426.227002,
+             'update_ts': 1666599426.254308, 'renew_ts': None, 'exclusive': None,
+             'expired': False, 'master': None, 'user_id': 1},
+            {'name': 'kojiadmin', 'status': status, 'usertype': 0}]
+
+    def set_session_data(self):
+        self.query_executeOne.side_effect = self.session_rows()
+
+    def test_cache_miss(self):
+        self.set_session_data()
+        s = kojihub.auth.Session()
+        self.assertTrue(s.logged_in)
+        self.assertEqual(s.user_id, 1)
+        self.assertEqual(s.callnum, 345)
+        # no row lock, no RetryError for the repeated callnum and no writes
+        self.assertFalse(self.queries[0].opts.get('rowlock'))
+        self.assertEqual(self.updates, [])
+        self.assertEqual(self.session_cache.rowlocks, 0)
+        self.assertEqual(self.session_cache.touched, set([123]))
+
+    def test_cache_hit(self):
+        self.set_session_data()
+        kojihub.auth.Session()
+        self.queries = []
+        self.query_executeOne.side_effect = [self.check_row()]
+        s = kojihub.auth.Session()
+        self.assertTrue(s.logged_in)
+        self.assertEqual(s.user_data, {'name': 'kojiadmin', 'status': 0, 'usertype': 0})
+        # a single check of the session and user state
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.queries[0].joins, ['users ON users.id = sessions.user_id'])
+        self.assertFalse(self.queries[0].opts.get('rowlock'))
+        self.assertEqual(self.queries[0].values, {'id': 123, 'key': 'xyz',
+                                                  'hostip': 'remote-addr'})
+        # cache entry expired
+        self.time.return_value += 31
+        self.set_session_data()
+        kojihub.auth.Session()
+        self.assertEqual(len(self.queries), 4)
+
+    def check_row(self, **kwargs):
+        row = {'expired': False, 'exclusive': None, 'status': 0, 'excl_id': None}
+        row.update(kwargs)
+        return row
+
+    def test_cache_recheck(self):
+        self.set_session_data()
+        kojihub.auth.Session()
+        # logged out via another hub process
+        self.query_executeOne.side_effect = [None, None, None]
+        with self.assertRaises(koji.AuthError):
+            kojihub.auth.Session()
+        # user disabled
+        self.query_executeOne.side_effect = [self.check_row(status=1)] + \
+            self.session_rows(status=1)
+        with self.assertRaises(koji.AuthError):
+            kojihub.auth.Session()
+        # exclusive session taken by another session, the full check is done again
+        self.queries = []
+        self.query_executeOne.side_effect = [self.check_row(excl_id=999)] + self.session_rows()
+        self.query_singleValue.return_value = 999
+        s = kojihub.auth.Session()
+        self.assertEqual(len(self.queries), 4)
+        self.assertEqual(s.lockerror, "User locked by another session")
+
+    def test_write_calls_not_cached(self):
+        for method in kojihub.auth.RetryWhitelist:
+            self.assertNotIn(method, kojihub.auth.SessionCacheWhitelist)
+
+    def test_batched_update_time(self):
+        self.set_session_data()
+        kojihub.auth.Session()
+        self.context.environ['HTTP_KOJI_SESSION_CALLNUM'] = '346'
+        self.query_executeOne.side_effect = [self.check_row()]
+        kojihub.auth.Session()
+        self.assertEqual(self.updates, [])
+        self.time.return_value += 30
+        self.set_session_data()
+        kojihub.auth.Session()
+        self.assertEqual(len(self.updates), 1)
+        update = self.updates[0]
+        self.assertEqual(update.clauses, ['id IN %(session_ids)s'])
+        self.assertEqual(update.values, {'session_ids': [123]})
+        self.assertEqual(update.rawdata, {'update_time': 'NOW()'})
+        self.context.cnx.commit.assert_called()
+
+    def test_not_whitelisted(self):
+        self.context.method = 'tagBuild'
+        self.set_session_data()
+        with self.assertRaises(koji.RetryError):
+            kojihub.auth.Session()
+        self.assertTrue(self.queries[0].opts['rowlock'])
+        self.assertEqual(self.session_cache.rowlocks, 1)
+        self.assertEqual(self.session_cache.entries, {})
+
+    def test_disabled(self):
+        self.context.opts['SessionCacheTime'] = 0
+        self.context.environ['HTTP_KOJI_SESSION_CALLNUM'] = '346'
+        self.set_session_data()
+        kojihub.auth.Session()
+        self.assertTrue(self.queries[0].opts['rowlock'])
+        self.assertEqual(len(self.updates), 2)
+        self.assertEqual(self.session_cache.entries, {})
+
+    def test_lockerror_cached(self):
+        self.set_session_data()
+        self.query_singleValue.return_value = 999
+        kojihub.auth.Session()
+        self.queries = []
+        self.query_executeOne.side_effect = [self.check_row(excl_id=999)]
+        s = kojihub.auth.Session()
+        self.assertEqual(len(self.queries), 1)
+        with self.assertRaises(koji.AuthLockError):
+            s.validate()
+
+    def test_logout_clears_cache(self):
+        self.set_session_data()
+        s = kojihub.auth.Session()
+        self.assertEqual(len(self.session_cache.entries), 1)
+        s.logout()
+        self.assertEqual(self.session_cache.entries, {})
+
+    def test_rowlock_rate(self):
+        log = mock.patch('kojihub.auth.logger').start()
+        for i in range(10):
+            self.session_cache.count_rowlock()
+        log.info.assert_not_called()
+        self.time.return_value += kojihub.auth.ROWLOCK_STATS_INTERVAL
+        self.session_cache.count_rowlock()
+        log.info.assert_called_once_with('Session row locks: %.2f/s (%i in %.0fs)',
+                                         11 / 60.0, 11, 60.0)
+        self.assertEqual(self.session_cache.rowlocks, 0)
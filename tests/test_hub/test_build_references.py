@@ -0,0 +1,117 @@
+from unittest import mock
+import unittest
+
+import koji
+import kojihub
+
+QP = kojihub.QueryProcessor
+
+
+class TestBuildReferences(unittest.TestCase):
+
+    def getQuery(self, *args, **kwargs):
+        query = QP(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=self.query_results.get(query.tables[0], []))
+        self.queries.append(query)
+        return query
+
+    def setUp(self):
+        self.QueryProcessor = mock.patch('kojihub.kojihub.QueryProcessor',
+                                         side_effect=self.getQuery).start()
+        self.queries = []
+        self.query_results = {}
+        self._multiRow = mock.patch('kojihub.kojihub._multiRow').start()
+        self._multiRow.return_value = []
+        self.exports = kojihub.RootExports()
+        self.get_build = mock.patch('kojihub.kojihub.get_build').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_no_references(self):
+        ret = kojihub.build_references(1)
+        self.assertEqual(ret, {'tags': [], 'rpms': [], 'component_of': [], 'archives': [],
+                               'last_used': None, 'images': []})
+        # no rpms or archives, so only the tag and component queries are needed
+        self.assertEqual([q.tables for q in self.queries],
+                         [['tag_listing'], ['rpminfo'], ['archiveinfo']])
+        self._multiRow.assert_not_called()
+
+    def test_lazy_tags(self):
+        self.query_results['tag_listing'] = [{'build_id': 1, 'tag_id': 10, 'name': 'tag'}]
+        ret = kojihub.builds_references([1, 2], lazy=True)
+        self.assertEqual(ret[1], {'tags': [{'tag_id': 10, 'name': 'tag'}]})
+        self.assertEqual(ret[2]['tags'], [])
+        self.assertIsNone(ret[2]['last_used'])
+        # the tagged build is not checked any further
+        self.assertEqual(self.queries[1].values['build_ids'], [2])
+
+    def test_lazy_all_tagged(self):
+        self.query_results['tag_listing'] = [{'build_id': 1, 'tag_id': 10, 'name': 'tag'}]
+        ret = kojihub.builds_references([1], lazy=True)
+        self.assertEqual(ret, {1: {'tags': [{'tag_id': 10, 'name': 'tag'}]}})
+        self.assertEqual(len(self.queries), 1)
+
+    def test_rpm_references(self):
+        self.query_results['rpminfo'] = [[1], [2]]
+        self.query_results['events'] = [{'id': 100, 'ts': 1000.0}]
+        rpm = {'id': 5, 'name': 'foo', 'version': '1', 'release': '1', 'arch': 'noarch',
+               'build_id': 7}
+        self._multiRow.side_effect = [
+            # rpms
+            [dict(rpm, src_build_id=1)],
+            # rpm components
+            [{'src_build_id': 2, 'archive_id': 9}],
+            # last used, by rpms
+            [{'build_id': 1, 'event_id': 100}, {'build_id': 2, 'event_id': 99}],
+        ]
+        ret = kojihub.builds_references([1, 2], limit=10)
+        self.assertEqual(ret[1]['rpms'], [rpm])
+        self.assertEqual(ret[1]['component_of'], [])
+        self.assertEqual(ret[1]['last_used'], 1000.0)
+        self.assertEqual(ret[2]['rpms'], [])
+        self.assertEqual(ret[2]['component_of'], [9])
+        self.assertEqual(ret[2]['images'], [9])
+        self.assertIsNone(ret[2]['last_used'])
+        self.assertEqual(self._multiRow.call_count, 3)
+        # the limit applies to each build, and only builds with rpms are queried
+        values = self._multiRow.call_args_list[0][0][1]
+        self.assertEqual(values['build_ids'], '{1,2}')
+        self.assertEqual(values['limit'], 10)
+        self.assertEqual(values['st_complete'], koji.BUILD_STATES['COMPLETE'])
+        self.assertEqual(self.queries[-1].values['event_ids'], [99, 100])
+
+    def test_lazy_archive_references(self):
+        self.query_results['archiveinfo'] = [[1], [2]]
+        archive = {'id': 5, 'type_id': 1, 'type_name': 'jar', 'build_id': 7,
+                   'filename': 'foo.jar'}
+        self._multiRow.side_effect = [
+            # archives
+            [dict(archive, src_build_id=1)],
+            # archive components
+            [],
+            # last used, by archives
+            [],
+        ]
+        ret = kojihub.builds_references([1, 2], lazy=True)
+        self.assertEqual(ret[1], {'tags': [], 'rpms': [], 'component_of': [],
+                                  'archives': [archive]})
+        self.assertEqual(ret[2]['archives'], [])
+        self.assertIsNone(ret[2]['last_used'])
+        self.assertEqual(self._multiRow.call_args_list[1][0][1]['build_ids'], '{2}')
+
+    def test_export_list(self):
+        self.get_build.side_effect = lambda b, strict: {'id': {'a': 1, 'b': 2}[b]}
+        self.query_results['tag_listing'] = [{'build_id': 2, 'tag_id': 10, 'name': 'tag'}]
+        ret = self.exports.buildReferences(['b', 'a'], limit=5, lazy=True)
+        self.assertEqual(self.queries[0].values['build_ids'], [2, 1])
+        self.assertEqual(ret[0], {'tags': [{'tag_id': 10, 'name': 'tag'}]})
+        self.assertEqual(ret[1]['tags'], [])
+        self.assertIsNone(ret[1]['last_used'])
+
+    def test_export_single(self):
+        self.get_build.return_value = {'id': 1}
+        ret = self.exports.buildReferences('a')
+        self.get_build.assert_called_once_with('a', strict=True)
+        self.assertEqual(ret['tags'], [])
+        self.assertEqual(self.queries[0].values['build_ids'], [1])
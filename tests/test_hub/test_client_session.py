@@ -55,7 +55,7 @@ class FakeReqSession:
         environ['SERVER_PORT'] = '443'
         environ['REMOTE_ADDR'] = '127.0.0.1'
         environ['REQUEST_METHOD'] = 'POST'
-        environ['CONTENT_TYPE'] = 'text/xml'
+        environ['CONTENT_TYPE'] = headers.get('Content-Type', 'text/xml')
 
         for k in headers:
             k2 = 'HTTP_' + k.upper().replace('-', '_')
@@ -64,7 +64,7 @@ class FakeReqSession:
         # environ['wsgi.input'] = io.StringIO(request)
         environ['wsgi.input'] = io.BytesIO(request)
         data = kojixmlrpc.application(environ, start_response)
-        data = data[0]
+        data = b''.join(data)
         return data, _nonlocal['status'], _nonlocal['headers']
 
 
@@ -198,6 +198,44 @@ class TestClientSession(unittest.TestCase):
             self.session.fault()
         self.assertEqual(len(self.queries), 0)
 
+    def test_json(self):
+        self.session.opts['use_json'] = True
+        args = ['OK 123', 2 ** 40, None, {'a': [1.5, True]}]
+        # the first call tells us that the hub accepts json
+        self.session.echo(*args)
+        self.assertEqual(self.session.rsession.last.headers['Content-Type'], 'text/xml')
+        result = self.session.echo(*args)
+        self.assertEqual(result, args)
+        self.assertEqual(self.session.rsession.last.headers['Content-Type'],
+                         'application/json')
+
+    def test_json_fault(self):
+        self.session.opts['use_json'] = True
+        self.session.echo('test')
+        with self.assertRaises(koji.GenericError):
+            self.session.error()
+        self.assertEqual(self.session.rsession.last.headers['Content-Type'],
+                         'application/json')
+
+    def test_json_multicall(self):
+        self.session.opts['use_json'] = True
+        self.session.echo('test')
+        with self.session.multicall() as m:
+            echo = m.echo('multi')
+            error = m.error()
+        self.assertEqual(echo.result, ['multi'])
+        with self.assertRaises(koji.GenericError):
+            error.result
+        self.assertEqual(self.session.rsession.last.headers['Content-Type'],
+                         'application/json')
+
+    def test_json_old_hub(self):
+        self.session.opts['use_json'] = True
+        with mock.patch('kojihub.kojixmlrpc.GLOBAL_HEADERS', new=self.TEST_VER_HDR):
+            self.session.echo('test')
+            self.session.echo('test')
+        self.assertEqual(self.session.rsession.last.headers['Content-Type'], 'text/xml')
+
     TEST_VER_HDR = [('Koji-Version', '1.2.3')]
 
     @mock.patch('kojihub.kojixmlrpc.GLOBAL_HEADERS', new=TEST_VER_HDR)
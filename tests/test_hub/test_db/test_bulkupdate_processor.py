@@ -89,3 +89,24 @@ class TestUpdateProcessor(unittest.TestCase):
             str(proc)
         expected = 'mismatched update keys'
         self.assertEqual(str(ex.exception), expected)
+
+    def test_revoke(self):
+        data = [{'tag_id': 1, 'build_id': n, 'revoke_event': 100 + n} for n in range(2)]
+        data.append({'tag_id': 1, 'build_id': 2})
+        proc = db.BulkUpdateProcessor('tag_listing', data=data, match_keys=('tag_id', 'build_id'))
+        with mock.patch('kojihub.db.get_event', return_value=42):
+            proc.make_revoke(user_id=5)
+        actual = str(proc)
+        expected_sql = (
+            'UPDATE tag_listing SET revoke_event = __kojibulk_tag_listing.revoke_event, '
+            'revoker_id = __kojibulk_tag_listing.revoker_id, active = NULL\n'
+            'FROM (VALUES (%(val_build_id_0)s, %(val_revoke_event_0)s, %(val_revoker_id_0)s, '
+            '%(val_tag_id_0)s), (%(val_build_id_1)s, %(val_revoke_event_1)s, '
+            '%(val_revoker_id_1)s, %(val_tag_id_1)s), (%(val_build_id_2)s, '
+            '%(val_revoke_event_2)s, %(val_revoker_id_2)s, %(val_tag_id_2)s))\n'
+            'AS __kojibulk_tag_listing (build_id, revoke_event, revoker_id, tag_id)\n'
+            'WHERE (tag_listing.build_id = __kojibulk_tag_listing.build_id AND '
+            'tag_listing.tag_id = __kojibulk_tag_listing.tag_id AND tag_listing.active = TRUE)')
+        self.assertEqual(actual, expected_sql)
+        self.assertEqual([r['revoke_event'] for r in data], [100, 101, 42])
+        self.assertEqual([r['revoker_id'] for r in data], [5, 5, 5])
@@ -0,0 +1,216 @@
+import threading
+import unittest
+
+from unittest import mock
+
+import psycopg2
+
+import koji
+from kojihub import db
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.statements = []
+        self.status = psycopg2.extensions.STATUS_READY
+        self.rollbacks = 0
+
+    def cursor(self):
+        cursor = mock.MagicMock()
+        cursor.execute.side_effect = self.execute
+        return cursor
+
+    def execute(self, sql, *args, **kwargs):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.statements.append(sql)
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.rollbacks += 1
+        self.status = psycopg2.extensions.STATUS_READY
+
+    def close(self):
+        self.closed = 1
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = []
+        self.time = mock.patch('kojihub.db.time.time', return_value=1000.0).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def connect(self):
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+
+    def get_pool(self, **kwargs):
+        kwargs.setdefault('check_interval', 0)
+        return db.ConnectionPool(connect=self.connect, **kwargs)
+
+    def test_reuse(self):
+        pool = self.get_pool(maxsize=2)
+        conn = pool.get()
+        pool.put(conn)
+        self.assertIs(pool.get(), conn)
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(pool.size(), 1)
+
+    def test_maxsize(self):
+        pool = self.get_pool(maxsize=2, wait_timeout=0)
+        conn1 = pool.get()
+        conn2 = pool.get()
+        self.assertIsNot(conn1, conn2)
+        with self.assertRaises(koji.GenericError):
+            pool.get()
+        pool.put(conn2)
+        self.assertIs(pool.get(), conn2)
+
+    def test_wait_for_connection(self):
+        # real time is needed for the wait
+        mock.patch.stopall()
+        pool = self.get_pool(maxsize=1)
+        conn = pool.get()
+        result = []
+        thread = threading.Thread(target=lambda: result.append(pool.get()))
+        thread.start()
+        pool.put(conn)
+        thread.join(10)
+        self.assertEqual(result, [conn])
+
+    def test_broken_connection_on_get(self):
+        pool = self.get_pool(maxsize=2)
+        conn = pool.get()
+        pool.put(conn)
+        conn.broken = True
+        conn2 = pool.get()
+        self.assertIsNot(conn2, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size(), 1)
+
+    def test_no_check_on_get(self):
+        pool = self.get_pool(maxsize=2, check_on_connect=False)
+        conn = pool.get()
+        pool.put(conn)
+        self.assertIs(pool.get(), conn)
+        self.assertEqual(conn.statements, [])
+        self.assertEqual(conn.rollbacks, 0)
+
+    def test_no_check_resets_transaction(self):
+        pool = self.get_pool(maxsize=2, check_on_connect=False)
+        conn = pool.get()
+        conn.status = psycopg2.extensions.STATUS_BEGIN
+        pool.put(conn)
+        self.assertIs(pool.get(), conn)
+        self.assertEqual(conn.rollbacks, 1)
+        self.assertEqual(conn.status, psycopg2.extensions.STATUS_READY)
+
+    def test_no_check_broken(self):
+        pool = self.get_pool(maxsize=2, check_on_connect=False)
+        conn = pool.get()
+        conn.status = psycopg2.extensions.STATUS_BEGIN
+        pool.put(conn)
+        conn.broken = True
+        self.assertIsNot(pool.get(), conn)
+        self.assertTrue(conn.closed)
+
+    def test_max_lifetime(self):
+        pool = self.get_pool(maxsize=2, max_lifetime=100)
+        conn = pool.get()
+        pool.put(conn)
+        self.time.return_value += 101
+        conn2 = pool.get()
+        self.assertIsNot(conn2, conn)
+        self.assertTrue(conn.closed)
+
+    def test_check(self):
+        pool = self.get_pool(minsize=1, maxsize=5, idle_timeout=60)
+        conns = [pool.get() for i in range(4)]
+        for conn in conns:
+            pool.put(conn)
+        conns[3].broken = True
+        self.time.return_value += 61
+        # broken conns[3] is dropped, conns[2] is used and the others stay idle
+        pool.put(pool.get())
+        pool.check()
+        # idle conns[0] and conns[1] are beyond minsize
+        self.assertEqual([c.closed for c in conns], [1, 1, 0, 1])
+        self.assertEqual(pool.size(), 1)
+
+    def test_check_fills_minsize(self):
+        pool = self.get_pool(minsize=2, maxsize=5)
+        pool.check()
+        self.assertEqual(pool.size(), 2)
+        self.assertEqual(len(self.connections), 2)
+
+    def test_put_unknown(self):
+        pool = self.get_pool(maxsize=2)
+        conn = FakeConnection()
+        pool.put(conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size(), 0)
+
+
+class TestConnect(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = mock.MagicMock()
+        mock.patch('kojihub.db._DBpool', new=self.pool).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_connect_pool(self):
+        conn = FakeConnection()
+        self.pool.get.return_value = conn
+        wrapper = db.connect()
+        self.assertIs(wrapper.cnx, conn)
+        wrapper.close()
+        self.assertEqual(conn.statements, ['ROLLBACK'])
+        self.pool.put.assert_called_once_with(conn)
+        self.pool.discard.assert_not_called()
+
+    def test_connect_pool_no_check(self):
+        conn = FakeConnection()
+        self.pool.get.return_value = conn
+        self.pool.check_on_connect = False
+        wrapper = db.connect()
+        wrapper.close()
+        # psycopg2 has to know that the transaction is over
+        self.assertEqual(conn.statements, [])
+        self.assertEqual(conn.rollbacks, 1)
+        self.pool.put.assert_called_once_with(conn)
+
+    def test_connect_no_pool_no_check(self):
+        mock.patch('kojihub.db._DBpool', new=None).start()
+        mock.patch('kojihub.db._DBcheck', new=False).start()
+        local = mock.patch('kojihub.db._DBconn').start()
+        conn = FakeConnection()
+        local.conn = conn
+        wrapper = db.connect()
+        self.assertIs(wrapper.cnx, conn)
+        wrapper.close()
+        self.assertEqual(conn.statements, [])
+        self.assertEqual(conn.rollbacks, 1)
+        # a transaction left open by psycopg2 is rolled back on connect
+        conn.status = psycopg2.extensions.STATUS_BEGIN
+        wrapper = db.connect()
+        self.assertEqual(conn.rollbacks, 2)
+
+    def test_connect_pool_broken(self):
+        conn = FakeConnection()
+        self.pool.get.return_value = conn
+        wrapper = db.connect()
+        conn.broken = True
+        with self.assertRaises(psycopg2.Error):
+            wrapper.close()
+        self.pool.put.assert_not_called()
+        self.pool.discard.assert_called_once_with(conn)
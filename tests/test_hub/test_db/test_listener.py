@@ -0,0 +1,111 @@
+from unittest import mock
+import threading
+import unittest
+
+import psycopg2
+
+import koji
+from kojihub import db
+
+
+class TestNotify(unittest.TestCase):
+
+    def test_notify(self):
+        with mock.patch('kojihub.db._fetchMulti') as _fetchMulti:
+            db.notify('koji_host_1')
+        _fetchMulti.assert_called_once_with("SELECT pg_notify(%(channel)s, %(payload)s)",
+                                            {'channel': 'koji_host_1', 'payload': ''})
+
+
+class TestListener(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = self.new_conn()
+        self.cursor = self.conn.cursor.return_value
+        self._open_connection = mock.patch('kojihub.db._open_connection',
+                                           return_value=self.conn).start()
+        self.select = mock.patch('kojihub.db.select.select').start()
+        self.time = mock.patch('kojihub.db.time.time', return_value=1000.0).start()
+        mock.patch('kojihub.db._DBlisten', new=threading.local()).start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def new_conn(self):
+        conn = mock.MagicMock()
+        conn.notifies = []
+        conn.closed = 0
+        return conn
+
+    def test_listen(self):
+        listener = db.Listener(['koji_host_1', 'koji_host_2'])
+        self.assertTrue(self.conn.autocommit)
+        self.cursor.execute.assert_has_calls([mock.call('LISTEN koji_host_1'),
+                                              mock.call('LISTEN koji_host_2')])
+        self.conn.notifies.append(mock.MagicMock(channel='koji_host_2'))
+        listener.close()
+        # the connection is kept for the next listener
+        self.cursor.execute.assert_called_with('UNLISTEN *')
+        self.assertEqual(self.conn.notifies, [])
+        self.conn.close.assert_not_called()
+
+    def test_reuse(self):
+        db.Listener(['koji_host_1']).close()
+        listener = db.Listener(['koji_host_2'])
+        self.assertIs(listener.conn, self.conn)
+        self._open_connection.assert_called_once_with()
+
+    def test_reuse_lost(self):
+        db.Listener(['koji_host_1']).close()
+        self.cursor.execute.side_effect = psycopg2.OperationalError('connection lost')
+        conn2 = self.new_conn()
+        self._open_connection.return_value = conn2
+        listener = db.Listener(['koji_host_1'])
+        # the lost connection is replaced
+        self.assertIs(listener.conn, conn2)
+        self.conn.close.assert_called_once_with()
+        conn2.cursor.return_value.execute.assert_called_once_with('LISTEN koji_host_1')
+
+    def test_listen_error(self):
+        self.cursor.execute.side_effect = psycopg2.OperationalError('error')
+        with self.assertRaises(psycopg2.OperationalError):
+            db.Listener(['koji_host_1'])
+        self.conn.close.assert_called_once_with()
+        self._open_connection.assert_called_once_with()
+
+    def test_close_error(self):
+        listener = db.Listener(['koji_host_1'])
+        self.cursor.execute.side_effect = psycopg2.OperationalError('error')
+        listener.close()
+        self.conn.close.assert_called_once_with()
+        # the next listener opens a new connection
+        self.cursor.execute.side_effect = None
+        db.Listener(['koji_host_1'])
+        self.assertEqual(self._open_connection.call_count, 2)
+
+    def test_bad_channel(self):
+        with self.assertRaises(koji.ParameterError):
+            db.Listener(['koji_host_1; DROP TABLE task'])
+        self._open_connection.assert_not_called()
+
+    def test_wait_notified(self):
+        listener = db.Listener(['koji_host_1'])
+
+        def poll():
+            self.conn.notifies.append(mock.MagicMock(channel='koji_host_1'))
+        self.conn.poll.side_effect = poll
+
+        self.assertEqual(listener.wait(30), ['koji_host_1'])
+        self.select.assert_called_once_with([self.conn], [], [], 30.0)
+        self.assertEqual(self.conn.notifies, [])
+
+    def test_wait_timeout(self):
+        listener = db.Listener(['koji_host_1'])
+
+        def select(*args):
+            self.time.return_value += 30
+            return [], [], []
+        self.select.side_effect = select
+
+        self.assertEqual(listener.wait(30), [])
+        self.select.assert_called_once()
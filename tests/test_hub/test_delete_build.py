@@ -130,21 +130,29 @@ class TestDeleteBuild(unittest.TestCase):
     def test_delete_build_queries(self, rmtree, unlink):
         self.query_execute.side_effect = [
             [(123,)],  # rpm ids
+            [(5,), (6,)],  # tag ids
             {'id': 0, 'name': 'DEFAULT'},  # volume DEFAULT
             [{'id': 0, 'name': 'DEFAULT'},
              {'id': 1, 'name': 'testvol'},
              {'id': 2, 'name': 'other'}]  # list_volumes()
         ]
 
-        kojihub._delete_build(self.binfo)
+        with mock.patch('kojihub.kojihub.log_tag_change') as log_tag_change:
+            kojihub._delete_build(self.binfo)
 
-        self.assertEqual(len(self.queries), 3)
+        self.assertEqual(len(self.queries), 4)
         query = self.queries[0]
         self.assertEqual(query.tables, ["rpminfo"])
         self.assertEqual(query.joins, None)
         self.assertEqual(query.clauses, ["build_id=%(build_id)i"])
         self.assertEqual(query.columns, ["id"])
 
+        query = self.queries[1]
+        self.assertEqual(query.tables, ["tag_listing"])
+        self.assertEqual(query.clauses, ["active = TRUE", "build_id=%(build_id)i"])
+        self.assertEqual(query.columns, ["tag_id"])
+        log_tag_change.assert_called_once_with([5, 6], 'tag_listing')
+
         self.assertEqual(len(self.deletes), 2)
         delete = self.deletes[0]
         self.assertEqual(delete.table, "rpmsigs")
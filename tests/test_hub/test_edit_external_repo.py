@@ -36,6 +36,8 @@ class TestEditExternalRepo(unittest.TestCase):
     def setUp(self):
         self.get_external_repo = mock.patch('kojihub.kojihub.get_external_repo').start()
         self.verify_name_internal = mock.patch('kojihub.kojihub.verify_name_internal').start()
+        self.log_external_repo_change = mock.patch(
+            'kojihub.kojihub.log_external_repo_change').start()
         self.context = mock.patch('kojihub.kojihub.context').start()
         # It seems MagicMock will not automatically handle attributes that
         # start with "assert"
@@ -109,6 +111,8 @@ class TestEditExternalRepo(unittest.TestCase):
         self.assertEqual(len(self.queries), 1)
         self.assertEqual(len(self.inserts), 1)
         self.assertEqual(len(self.updates), 2)
+        self.log_external_repo_change.assert_called_once_with(self.repo_info['id'],
+                                                              'external_repo_config')
 
         query = self.queries[0]
         self.assertEqual(query.tables, ['external_repo'])
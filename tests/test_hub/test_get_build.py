@@ -92,3 +92,39 @@ class TestGetBuild(DBQueryTestCase):
         query = self.queries[0]
         self.assertEqual(query.tables, ['build'])
         self.assertEqual(query.clauses, ['build.id = %(buildID)i'])
+
+
+class TestGetBuilds(DBQueryTestCase):
+
+    def setUp(self):
+        super(TestGetBuilds, self).setUp()
+        self.lookup_name = mock.patch('kojihub.kojihub.lookup_name').start()
+        self.lookup_name.return_value = {'name': 'cg_name'}
+
+    def test_empty(self):
+        self.assertEqual(kojihub.get_builds([]), [])
+        self.assertEqual(len(self.queries), 0)
+
+    def test_order_and_cg(self):
+        self.qp_execute_return_value = [
+            {'id': 1, 'cg_id': None},
+            {'id': 2, 'cg_id': 5},
+            {'id': 3, 'cg_id': 5},
+        ]
+        result = kojihub.get_builds([3, 1, 2, 3])
+        self.assertEqual([b['id'] for b in result], [3, 1, 2, 3])
+        self.assertEqual([b['cg_name'] for b in result], ['cg_name', None, 'cg_name', 'cg_name'])
+        self.assertIsNot(result[0], result[3])
+        self.lookup_name.assert_called_once_with('content_generator', 5, strict=True)
+        self.assertEqual(len(self.queries), 1)
+        query = self.queries[0]
+        self.assertEqual(query.tables, ['build'])
+        self.assertEqual(query.clauses, ['build.id IN %(build_ids)s'])
+        self.assertEqual(sorted(query.values['build_ids']), [1, 2, 3])
+
+    def test_missing(self):
+        self.qp_execute_return_value = [{'id': 1, 'cg_id': None}]
+        self.assertEqual(kojihub.get_builds([2, 1])[0], None)
+        with self.assertRaises(koji.GenericError) as cm:
+            kojihub.get_builds([2, 1], strict=True)
+        self.assertEqual('No such build: 2', str(cm.exception))
@@ -218,4 +218,52 @@ class TestHandleUpload(unittest.TestCase):
         # verify
         fn = f'{self.tempdir}/work/FOO/hello.txt'
         self.assertEqual(contents2, open(fn, 'rb').read())
+
+    def test_parallel(self):
+        # with the parallel option, chunks can arrive in any order
+        environ = {}
+        args = {
+            'filename': 'hello.txt',
+            'filepath': 'FOO',
+            'fileverify': 'adler32',
+            'offset': '0',
+        }
+        environ['QUERY_STRING'] = urllib.parse.urlencode(args)
+        contents = b'hello world\nthis is line two\nthis is line three'
+        chunks = contents.splitlines(keepends=True)
+
+        # chunk 0
+        environ['wsgi.input'] = io.BytesIO(chunks[0])
+        kojihub.handle_upload(environ)
+
+        # chunk 2, then chunk 1
+        args['parallel'] = '1'
+        for n in (2, 1):
+            args['offset'] = str(len(b''.join(chunks[:n])))
+            environ['QUERY_STRING'] = urllib.parse.urlencode(args)
+            environ['CONTENT_LENGTH'] = str(len(chunks[n]))
+            environ['wsgi.input'] = io.BytesIO(chunks[n])
+            kojihub.handle_upload(environ)
+
+        # verify
+        fn = f'{self.tempdir}/work/FOO/hello.txt'
+        self.assertEqual(contents, open(fn, 'rb').read())
+
+    def test_parallel_overwrite(self):
+        environ = {}
+        args = {
+            'filename': 'hello.txt',
+            'filepath': 'FOO',
+            'fileverify': 'adler32',
+            'offset': '10',
+            'overwrite': '1',
+            'parallel': '1',
+        }
+        environ['QUERY_STRING'] = urllib.parse.urlencode(args)
+        environ['wsgi.input'] = io.BytesIO(b'hello')
+
+        with self.assertRaises(koji.GenericError) as ex:
+            kojihub.handle_upload(environ)
+
+        self.assertIn('parallel uploads', str(ex.exception))
 # the end
@@ -0,0 +1,95 @@
+from unittest import mock
+import unittest
+
+import koji
+import kojihub
+
+
+QP = kojihub.QueryProcessor
+
+
+class TestHostHeartbeat(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.host = mock.MagicMock(id=99)
+        self.Host = mock.patch('kojihub.kojihub.Host', return_value=self.host).start()
+        self.set_host_data = mock.patch('kojihub.kojihub.scheduler.set_host_data').start()
+        self.get_tasks_for_host = mock.patch(
+            'kojihub.kojihub.scheduler.get_tasks_for_host').start()
+        self.query_buildroots = mock.patch('kojihub.kojihub.query_buildroots').start()
+        self.get_host = mock.patch('kojihub.kojihub.get_host').start()
+        self.hostdata = {'id': 99, 'enabled': True, 'capacity': 3.0}
+        self.get_host.return_value = self.hostdata
+        self.QueryProcessor = mock.patch('kojihub.kojihub.QueryProcessor',
+                                         side_effect=self.getQuery).start()
+        self.queries = []
+        self.exports = kojihub.HostExports()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getQuery(self, *args, **kwargs):
+        query = QP(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=[
+            {'id': 3, 'state': koji.TASK_STATES['CANCELED'], 'host_id': 99}])
+        self.queries.append(query)
+        return query
+
+    def test_heartbeat(self):
+        self.host.getHostTasks.return_value = [{'id': 1, 'waiting': False, 'weight': 1.0}]
+        self.get_tasks_for_host.return_value = ['assigned']
+        self.query_buildroots.return_value = ['buildroots']
+
+        ret = self.exports.heartbeat(2.0, True, data={'maxjobs': 5}, task_ids=[1, 3])
+
+        self.host.verify.assert_called_once_with()
+        self.host.updateHost.assert_called_once_with(2.0, True)
+        self.set_host_data.assert_called_once_with(99, {'maxjobs': 5})
+        self.get_tasks_for_host.assert_called_once_with(hostID=99, retry=True)
+        states = [koji.BR_STATES[x] for x in ('INIT', 'WAITING', 'BUILDING')]
+        self.query_buildroots.assert_called_once_with(hostID=99, state=states)
+        # only the task which is no longer open is queried
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.queries[0].values, {'other_ids': [3]})
+        self.get_host.assert_called_once_with(99)
+        self.assertEqual(ret, {
+            'host': self.hostdata,
+            'ready': True,
+            'tasks': [{'id': 1, 'waiting': False, 'weight': 1.0}],
+            'assigned': ['assigned'],
+            'task_info': [{'id': 3, 'state': koji.TASK_STATES['CANCELED'], 'host_id': 99}],
+            'buildroots': ['buildroots'],
+        })
+
+    def test_not_ready(self):
+        self.host.getHostTasks.return_value = []
+
+        ret = self.exports.heartbeat(0.0, False)
+
+        self.set_host_data.assert_not_called()
+        self.get_tasks_for_host.assert_not_called()
+        self.assertEqual(self.queries, [])
+        self.assertEqual(ret['assigned'], [])
+        self.assertEqual(ret['task_info'], [])
+
+    def test_disabled(self):
+        self.host.getHostTasks.return_value = []
+        self.hostdata['enabled'] = False
+
+        ret = self.exports.heartbeat(0.0, True)
+
+        # the host data is checked again, as the builder may have older data
+        self.host.updateHost.assert_called_once_with(0.0, False)
+        self.get_tasks_for_host.assert_not_called()
+        self.assertFalse(ret['ready'])
+        self.assertEqual(ret['assigned'], [])
+
+    def test_over_capacity(self):
+        self.host.getHostTasks.return_value = []
+
+        ret = self.exports.heartbeat(4.0, True)
+
+        self.host.updateHost.assert_called_once_with(4.0, False)
+        self.get_tasks_for_host.assert_not_called()
+        self.assertFalse(ret['ready'])
@@ -0,0 +1,146 @@
+from unittest import mock
+import unittest
+
+import kojihub
+import kojihub.kojihub
+
+
+UP = kojihub.UpdateProcessor
+
+
+class TestLogTagChange(unittest.TestCase):
+
+    def setUp(self):
+        self._dml = mock.patch('kojihub.kojihub._dml').start()
+        self.get_event = mock.patch('kojihub.kojihub.get_event', return_value=42).start()
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        del self.context.tag_last_change
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_single(self):
+        kojihub.kojihub.log_tag_change(5, 'tag_listing')
+        self._dml.assert_called_once()
+        sql, values = self._dml.call_args.args
+        self.assertIn('INSERT INTO tag_changes', sql)
+        self.assertIn('ORDER BY tag.id, events.id', sql)
+        self.assertIn('ON CONFLICT DO NOTHING', sql)
+        self.assertEqual(values, {'tag_ids': [5], 'event_ids': [42], 'kind': 'tag_listing'})
+        # the index is only updated before the commit
+        self.assertEqual(self.context.tag_last_change, [(5, 42)])
+
+    def test_multiple(self):
+        kojihub.kojihub.log_tag_change([6, 5, 6], 'tag_packages', event_id=[101, 100])
+        self.get_event.assert_not_called()
+        sql, values = self._dml.call_args.args
+        self.assertEqual(values, {'tag_ids': [5, 6], 'event_ids': [100, 101],
+                                  'kind': 'tag_packages'})
+        self.assertEqual(self.context.tag_last_change, [(5, 100), (6, 100)])
+
+        kojihub.kojihub.log_tag_change([7, 5], 'tag_listing', event_id=99)
+        self.assertEqual(self.context.tag_last_change,
+                         [(5, 100), (6, 100), (5, 99), (7, 99)])
+
+    def test_no_tags(self):
+        kojihub.kojihub.log_tag_change([], 'tag_inheritance')
+        self._dml.assert_not_called()
+        self.assertFalse(hasattr(self.context, 'tag_last_change'))
+
+    def test_external_repo(self):
+        with mock.patch('kojihub.kojihub.QueryProcessor') as QueryProcessor, \
+                mock.patch('kojihub.kojihub.log_tag_change') as log_tag_change:
+            QueryProcessor.return_value.execute.return_value = [[5], [6]]
+            kojihub.kojihub.log_external_repo_change(7, 'external_repo_config')
+        kwargs = QueryProcessor.call_args.kwargs
+        self.assertEqual(kwargs['tables'], ['tag_external_repos'])
+        self.assertEqual(kwargs['values'], {'repo_id': 7})
+        log_tag_change.assert_called_once_with([5, 6], 'external_repo_config', event_id=None)
+
+    def test_set_tag_update(self):
+        with mock.patch('kojihub.kojihub.InsertProcessor'):
+            kojihub.kojihub.set_tag_update(5, 'IMPORT', user_id=1)
+        sql, values = self._dml.call_args.args
+        self.assertEqual(values, {'tag_ids': [5], 'event_ids': [42], 'kind': 'tag_updates'})
+
+
+class TestFlushTagLastChange(unittest.TestCase):
+
+    def setUp(self):
+        self._dml = mock.patch('kojihub.kojihub._dml').start()
+        self.context = mock.patch('kojihub.kojihub.context').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_flush(self):
+        self.context.tag_last_change = [(6, 100), (5, 90), (6, 95)]
+        kojihub.kojihub.flush_tag_last_change()
+        self._dml.assert_called_once()
+        sql, values = self._dml.call_args.args
+        self.assertIn('FROM tag_changes', sql)
+        self.assertIn('ORDER BY tag_id', sql)
+        self.assertIn('GREATEST(tag_last_change.event_id', sql)
+        self.assertEqual(values, {'tag_ids': [5, 6], 'after': 90})
+        self.assertEqual(self.context.tag_last_change, [])
+
+        # nothing left to write
+        kojihub.kojihub.flush_tag_last_change()
+        self._dml.assert_called_once()
+
+    def test_no_changes(self):
+        self.context.tag_last_change = None
+        kojihub.kojihub.flush_tag_last_change()
+        self._dml.assert_not_called()
+
+
+class TestTagWrites(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context_db = mock.patch('kojihub.db.context').start()
+        self.context_db.event_id = 42
+        self.context_db.session.user_id = 1
+        self.context_db.session.assertLogin = mock.MagicMock()
+        self.count = 1
+        self.log_tag_change = mock.patch('kojihub.kojihub.log_tag_change').start()
+        self.UpdateProcessor = mock.patch('kojihub.kojihub.UpdateProcessor',
+                                          side_effect=self.getUpdate).start()
+        self.updates = []
+        self.tag = {'id': 5, 'name': 'tag'}
+        self.build = {'id': 10, 'name': 'pkg', 'version': '1', 'release': '1'}
+        self.user = {'id': 1}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getUpdate(self, *args, **kwargs):
+        update = UP(*args, **kwargs)
+        update.execute = mock.MagicMock(return_value=self.count)
+        self.updates.append(update)
+        return update
+
+    def test_untag(self):
+        with mock.patch('koji.plugin.run_callbacks'):
+            kojihub._direct_untag_build(self.tag, self.build, self.user)
+        self.log_tag_change.assert_called_once_with(5, 'tag_listing')
+
+    def test_untag_not_tagged(self):
+        self.count = 0
+        with mock.patch('koji.plugin.run_callbacks'):
+            kojihub._direct_untag_build(self.tag, self.build, self.user, strict=False)
+        self.log_tag_change.assert_not_called()
+
+    def test_delete_tag(self):
+        with mock.patch('kojihub.kojihub.get_tag', return_value=self.tag), \
+                mock.patch('kojihub.kojihub.readDescendantsData') as readDescendantsData:
+            readDescendantsData.return_value = [{'tag_id': 6}, {'tag_id': 7}]
+            kojihub._delete_tag(5)
+        self.assertEqual(self.log_tag_change.mock_calls, [
+            mock.call(5, 'tag_config'),
+            mock.call([6, 7], 'tag_inheritance'),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,9 @@ from unittest import mock
 import unittest
 import koji
 import kojihub
+import kojihub.kojihub
+
+BUP = kojihub.kojihub.BulkUpdateProcessor
 
 
 class TestDeleteEventId(unittest.TestCase):
@@ -22,7 +25,7 @@ class TestMassTag(unittest.TestCase):
         self.get_tag = mock.patch('kojihub.kojihub.get_tag').start()
         self.get_build = mock.patch('kojihub.kojihub.get_build').start()
         self.get_user = mock.patch('kojihub.kojihub.get_user').start()
-        self._direct_tag_build = mock.patch('kojihub.kojihub._direct_tag_build').start()
+        self._direct_tag_builds = mock.patch('kojihub.kojihub._direct_tag_builds').start()
         self._delete_event_id = mock.patch('kojihub.kojihub._delete_event_id').start()
         self.context = mock.patch('kojihub.kojihub.context').start()
         self.context.session.assertPerm = mock.MagicMock()
@@ -51,3 +54,197 @@ class TestMassTag(unittest.TestCase):
 
     def test_correct_tagging_tag_dict(self):
         self.hub.massTag({'id': 1234, 'name': 'tag'}, ['n-v-r1', 123])
+
+    def test_bulk(self):
+        self.get_build.side_effect = lambda build, strict: {'id': build}
+        self.hub.massTag('tag', [3, 1, 2])
+        self._direct_tag_builds.assert_called_once_with(
+            self.get_tag.return_value, [{'id': 3}, {'id': 1}, {'id': 2}],
+            self.get_user.return_value, force=True)
+        self._delete_event_id.assert_called_once_with()
+
+
+class TestDirectTagBuilds(unittest.TestCase):
+
+    def getQuery(self, *args, **kwargs):
+        query = kojihub.QueryProcessor(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=self.tagged)
+        self.queries.append(query)
+        return query
+
+    def getUpdate(self, *args, **kwargs):
+        update = BUP(*args, **kwargs)
+        update.execute = mock.MagicMock()
+        self.updates.append(update)
+        return update
+
+    def getBulkInsert(self, *args, **kwargs):
+        insert = kojihub.BulkInsertProcessor(*args, **kwargs)
+        insert.execute = mock.MagicMock()
+        self.inserts.append(insert)
+        return insert
+
+    def setUp(self):
+        self.queries = []
+        self.updates = []
+        self.inserts = []
+        self.tagged = []
+        mock.patch('kojihub.kojihub.QueryProcessor', side_effect=self.getQuery).start()
+        mock.patch('kojihub.kojihub.BulkUpdateProcessor', side_effect=self.getUpdate).start()
+        mock.patch('kojihub.kojihub.BulkInsertProcessor',
+                   side_effect=self.getBulkInsert).start()
+        self.get_events = mock.patch('kojihub.kojihub.get_events').start()
+        self.get_events.side_effect = lambda count: list(range(100, 100 + count))
+        self.run_callbacks = mock.patch('koji.plugin.run_callbacks').start()
+        self.log_tag_change = mock.patch('kojihub.kojihub.log_tag_change').start()
+        self._direct_tag_build = mock.patch('kojihub.kojihub._direct_tag_build').start()
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.tag = {'id': 10, 'name': 'tag'}
+        self.user = {'id': 5, 'name': 'user'}
+        self.builds = [self.build(i) for i in (3, 1, 2)]
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def build(self, build_id, state='COMPLETE'):
+        return {'id': build_id, 'name': 'pkg', 'version': '1', 'release': str(build_id),
+                'state': koji.BUILD_STATES[state]}
+
+    def test_tag(self):
+        kojihub.kojihub._direct_tag_builds(self.tag, self.builds, self.user)
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.queries[0].values['build_ids'], (1, 2, 3))
+        self.updates[0].execute.assert_not_called()
+        self.assertEqual(len(self.inserts), 1)
+        self.assertEqual(self.inserts[0].data, [
+            {'tag_id': 10, 'build_id': 3, 'create_event': 100, 'creator_id': 5},
+            {'tag_id': 10, 'build_id': 1, 'create_event': 101, 'creator_id': 5},
+            {'tag_id': 10, 'build_id': 2, 'create_event': 102, 'creator_id': 5},
+        ])
+        self.inserts[0].execute.assert_called_once_with()
+        callbacks = [(c[0][0], c[1]['build']['id']) for c in self.run_callbacks.call_args_list]
+        self.assertEqual(callbacks, [('preTag', 3), ('preTag', 1), ('preTag', 2),
+                                     ('postTag', 3), ('postTag', 1), ('postTag', 2)])
+        self._direct_tag_build.assert_not_called()
+        self.log_tag_change.assert_called_once_with(10, 'tag_listing', event_id=[100, 101, 102])
+
+    def test_retag(self):
+        self.tagged = [{'build_id': 1}]
+        kojihub.kojihub._direct_tag_builds(self.tag, self.builds, self.user, force=True)
+        update = self.updates[0]
+        self.assertEqual(update.data, [{'tag_id': 10, 'build_id': 1, 'revoke_event': 101,
+                                        'revoker_id': 5}])
+        update.execute.assert_called_once_with()
+        self.assertEqual([r['create_event'] for r in self.inserts[0].data], [100, 101, 102])
+
+    def test_already_tagged(self):
+        self.tagged = [{'build_id': 1}]
+        with self.assertRaises(koji.TagError):
+            kojihub.kojihub._direct_tag_builds(self.tag, self.builds, self.user)
+        self.inserts[0].execute.assert_not_called()
+
+    def test_incomplete(self):
+        self.builds[1] = self.build(1, 'FAILED')
+        with self.assertRaises(koji.TagError):
+            kojihub.kojihub._direct_tag_builds(self.tag, self.builds, self.user, force=True)
+        self.get_events.assert_not_called()
+        self.assertEqual(self.inserts, [])
+
+    def test_duplicates(self):
+        builds = self.builds + [self.builds[0]]
+        kojihub.kojihub._direct_tag_builds(self.tag, builds, self.user, force=True)
+        self.assertEqual(self._direct_tag_build.call_count, 4)
+        self.assertEqual(self.inserts, [])
+
+    def test_empty(self):
+        kojihub.kojihub._direct_tag_builds(self.tag, [], self.user)
+        self.get_events.assert_not_called()
+        self.run_callbacks.assert_not_called()
+
+    def test_changes(self):
+        # untag 3, move 1 after 2 by untagging and tagging it again
+        self.tagged = [{'build_id': 1}, {'build_id': 3}]
+        changes = [(self.builds[0], False), (self.builds[1], False), (self.builds[2], True),
+                   (self.builds[1], True)]
+        kojihub.kojihub._direct_tag_changes(self.tag, changes, self.user)
+        self.assertEqual(self.updates[0].data, [
+            {'tag_id': 10, 'build_id': 3, 'revoke_event': 100, 'revoker_id': 5},
+            {'tag_id': 10, 'build_id': 1, 'revoke_event': 101, 'revoker_id': 5},
+        ])
+        self.assertEqual([(r['build_id'], r['create_event']) for r in self.inserts[0].data],
+                         [(2, 102), (1, 103)])
+        callbacks = [(c[0][0], c[1]['build']['id']) for c in self.run_callbacks.call_args_list]
+        self.assertEqual(callbacks, [('preUntag', 3), ('preUntag', 1), ('preTag', 2),
+                                     ('preTag', 1), ('postUntag', 3), ('postUntag', 1),
+                                     ('postTag', 2), ('postTag', 1)])
+        self._direct_tag_build.assert_not_called()
+
+    def test_untag_missing(self):
+        self.tagged = [{'build_id': 3}]
+        changes = [(self.builds[0], False), (self.builds[1], False)]
+        with self.assertRaises(koji.TagError):
+            kojihub.kojihub._direct_tag_changes(self.tag, changes, self.user)
+        self.updates[0].execute.assert_not_called()
+
+
+class TestBulkPkglistAdd(unittest.TestCase):
+
+    def getBulkInsert(self, *args, **kwargs):
+        insert = kojihub.BulkInsertProcessor(*args, **kwargs)
+        insert.execute = mock.MagicMock()
+        self.inserts.append(insert)
+        return insert
+
+    def setUp(self):
+        self.inserts = []
+        mock.patch('kojihub.kojihub.BulkInsertProcessor',
+                   side_effect=self.getBulkInsert).start()
+        self.get_events = mock.patch('kojihub.kojihub.get_events').start()
+        self.get_events.side_effect = lambda count: list(range(100, 100 + count))
+        self.get_user = mock.patch('kojihub.kojihub.get_user').start()
+        self.get_user.return_value = {'id': 5, 'name': 'user'}
+        self.run_callbacks = mock.patch('koji.plugin.run_callbacks').start()
+        self.log_tag_change = mock.patch('kojihub.kojihub.log_tag_change').start()
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.tag = {'id': 10, 'name': 'tag'}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_add(self):
+        pkgs = [
+            {'package_id': 1, 'package_name': 'foo', 'owner_id': 7, 'blocked': False,
+             'extra_arches': None},
+            {'package_id': 2, 'package_name': 'bar', 'owner_id': None, 'blocked': True,
+             'extra_arches': 'x86_64 ppc64le'},
+        ]
+        kojihub.kojihub._bulk_pkglist_add(self.tag, pkgs, force=True)
+        packages, owners = self.inserts
+        self.assertEqual(packages.table, 'tag_packages')
+        self.assertEqual(packages.data, [
+            {'tag_id': 10, 'package_id': 1, 'blocked': False, 'extra_arches': None,
+             'create_event': 100, 'creator_id': 5},
+            {'tag_id': 10, 'package_id': 2, 'blocked': True, 'extra_arches': 'x86_64 ppc64le',
+             'create_event': 101, 'creator_id': 5},
+        ])
+        self.assertEqual(owners.table, 'tag_package_owners')
+        self.assertEqual(owners.data, [
+            {'tag_id': 10, 'package_id': 1, 'owner': 7, 'create_event': 100, 'creator_id': 5},
+            {'tag_id': 10, 'package_id': 2, 'owner': 5, 'create_event': 101, 'creator_id': 5},
+        ])
+        packages.execute.assert_called_once_with()
+        owners.execute.assert_called_once_with()
+        self.log_tag_change.assert_called_once_with(10, 'tag_packages', event_id=[100, 101])
+        callbacks = [(c[0][0], c[1]['action'], c[1]['package']['name'])
+                     for c in self.run_callbacks.call_args_list]
+        self.assertEqual(callbacks, [
+            ('prePackageListChange', 'add', 'foo'),
+            ('prePackageListChange', 'block', 'bar'),
+            ('postPackageListChange', 'add', 'foo'),
+            ('postPackageListChange', 'block', 'bar'),
+        ])
+
+    def test_empty(self):
+        kojihub.kojihub._bulk_pkglist_add(self.tag, [])
+        self.assertEqual(self.inserts, [])
+        self.get_events.assert_not_called()
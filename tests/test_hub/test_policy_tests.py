@@ -763,6 +763,121 @@ class IsBuildOwnerTest(unittest.TestCase):
         self.get_user_groups.assert_not_called()
 
 
+class TestPolicyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.policy_cache = {}
+        self.context.session.logged_in = True
+        self.context.session.user_id = 99
+        self.get_user = mock.patch('kojihub.kojihub.get_user').start()
+        self.get_user.side_effect = lambda user_id: {'id': user_id, 'name': 'user%i' % user_id}
+        self.lookup_package = mock.patch('kojihub.kojihub.lookup_package').start()
+        self.get_tag = mock.patch('kojihub.kojihub.get_tag').start()
+        self.get_tag.side_effect = lambda tag, **kw: {'id': 1, 'name': tag}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_user(self):
+        for n in range(3):
+            self.assertEqual(kojihub.policy_get_user({}), {'id': 99, 'name': 'user99'})
+        self.assertEqual(kojihub.policy_get_user({'user_id': 99})['id'], 99)
+        self.get_user.assert_called_once_with(99)
+        self.assertEqual(kojihub.policy_get_user({'user_id': 42})['id'], 42)
+        self.assertEqual(self.get_user.call_count, 2)
+
+    def test_copies(self):
+        user = kojihub.policy_get_user({})
+        user['name'] = 'changed'
+        self.assertEqual(kojihub.policy_get_user({})['name'], 'user99')
+
+    def test_new_package_not_cached(self):
+        self.lookup_package.return_value = None
+        self.assertEqual(kojihub.policy_get_pkg({'package': 'foo'}), {'id': None, 'name': 'foo'})
+        self.lookup_package.return_value = {'id': 1, 'name': 'foo'}
+        self.assertEqual(kojihub.policy_get_pkg({'package': 'foo'}), {'id': 1, 'name': 'foo'})
+        self.assertEqual(kojihub.policy_get_pkg({'package': 'foo'}), {'id': 1, 'name': 'foo'})
+        self.assertEqual(self.lookup_package.call_count, 2)
+
+    def test_build_tags(self):
+        data = {'build_tag': 'foo-build'}
+        self.assertEqual(kojihub.policy_get_build_tags(data), ['foo-build'])
+        self.assertEqual(kojihub.policy_get_build_tags(data, taginfo=True),
+                         [{'id': 1, 'name': 'foo-build'}])
+        self.get_tag.assert_called_once_with('foo-build', strict=True, event='auto')
+        kojihub.policy_get_build_tags({'build_tag': 'bar-build'})
+        self.assertEqual(self.get_tag.call_count, 2)
+
+    def test_groups_and_perms(self):
+        get_user_groups = mock.patch('kojihub.kojihub.get_user_groups').start()
+        get_user_groups.return_value = {1: 'group'}
+        get_user_perms = mock.patch('kojihub.kojihub.get_user_perms').start()
+        get_user_perms.return_value = ['admin']
+        tests = {
+            'user_in_group': kojihub.UserInGroupTest,
+            'has_perm': kojihub.HasPermTest,
+        }
+        rules = [
+            'user_in_group nomatch :: deny',
+            'has_perm repo :: deny',
+            'user_in_group group && has_perm admin :: allow',
+        ]
+        ruleset = koji.policy.SimpleRuleSet(rules, tests)
+        for n in range(3):
+            self.assertEqual(ruleset.apply({}), 'allow')
+        get_user_groups.assert_called_once_with(99)
+        get_user_perms.assert_called_once_with(99)
+        self.assertEqual(kojihub.policy_get_user_groups({'id': 42}), {1: 'group'})
+        get_user_groups.assert_called_with(42)
+
+    def test_clear(self):
+        kojihub.policy_get_user({})
+        kojihub.clear_policy_cache()
+        kojihub.policy_get_user({})
+        self.assertEqual(self.get_user.call_count, 2)
+
+    def test_no_cache(self):
+        # outside of a request, nothing is cached
+        del self.context.policy_cache
+        kojihub.policy_get_user({})
+        kojihub.policy_get_user({})
+        self.assertEqual(self.get_user.call_count, 2)
+
+
+class TestEvalPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        tests = koji.policy.findSimpleTests(koji.policy.__dict__)
+        rules = [
+            'has foo :: {',
+            '    match foo bar :: allow',
+            '}',
+            'all :: deny',
+        ]
+        self.context.policy = {'test': koji.policy.SimpleRuleSet(rules, tests)}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_eval(self):
+        self.assertEqual(kojihub.eval_policy('test', {'foo': 'bar'}), 'allow')
+
+    def test_timing(self):
+        result = kojihub.eval_policy('test', {'foo': 'baz'}, timing=True)
+        self.assertEqual(result['result'], 'deny')
+        self.assertIsInstance(result['time'], float)
+        rules = [(r['rule'], r['depth'], r['matched']) for r in result['rules']]
+        self.assertEqual(rules, [('has foo :: {', 0, True),
+                                 ('match foo bar :: allow', 1, False),
+                                 ('all :: deny', 0, True)])
+
+    def test_missing(self):
+        with self.assertRaises(koji.GenericError):
+            kojihub.eval_policy('nosuchpolicy', {})
+
+
 class TestPolicyDataFromTask(unittest.TestCase):
 
     def setUp(self):
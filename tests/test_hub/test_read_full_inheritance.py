@@ -0,0 +1,169 @@
+import random
+import unittest
+
+from unittest import mock
+
+import kojihub
+
+
+class TestReadFullInheritance(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.opts = {}
+        self.context.inheritance_cache = {}
+        self.readInheritanceData = mock.patch('kojihub.kojihub.readInheritanceData').start()
+        self.readInheritanceData.side_effect = self.read_inheritance
+        self.readDescendantsData = mock.patch('kojihub.kojihub.readDescendantsData').start()
+        # tag 1 -> 2 -> 3
+        self.parents = {1: [2], 2: [3], 3: []}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def read_inheritance(self, tag_id, event=None):
+        data = []
+        for n, parent_id in enumerate(self.parents[tag_id]):
+            data.append({
+                'parent_id': parent_id,
+                'child_id': tag_id,
+                'name': 'tag-%i' % parent_id,
+                'priority': n * 10,
+                'maxdepth': None,
+                'intransitive': False,
+                'noconfig': False,
+                'pkg_filter': '',
+            })
+        return data
+
+    def test_walk(self):
+        result = kojihub.readFullInheritance(1)
+        self.assertEqual([link['parent_id'] for link in result], [2, 3])
+        self.assertEqual([link['currdepth'] for link in result], [1, 2])
+        self.readInheritanceData.assert_has_calls([mock.call(1, None), mock.call(2, None),
+                                                   mock.call(3, None)])
+
+    def test_cached(self):
+        first = kojihub.readFullInheritance(1, event=100)
+        self.readInheritanceData.reset_mock()
+        second = kojihub.readFullInheritance(1, event=100)
+        self.readInheritanceData.assert_not_called()
+        self.assertEqual(first, second)
+        # callers get their own copies
+        second[0]['filter'].append('foo')
+        third = kojihub.readFullInheritance(1, event=100)
+        self.assertEqual(third[0]['filter'], [])
+
+    def test_cache_key(self):
+        kojihub.readFullInheritance(1, event=100)
+        self.readInheritanceData.reset_mock()
+        kojihub.readFullInheritance(1, event=101)
+        self.readInheritanceData.assert_called()
+        self.readInheritanceData.reset_mock()
+        kojihub.readFullInheritance(2, event=100)
+        self.readInheritanceData.assert_called()
+        self.readDescendantsData.return_value = []
+        kojihub.readFullInheritance(1, event=100, reverse=True)
+        self.readDescendantsData.assert_called_once_with(1, 100)
+
+    def test_clear_cache(self):
+        kojihub.readFullInheritance(1)
+        kojihub.clear_inheritance_cache()
+        self.readInheritanceData.reset_mock()
+        kojihub.readFullInheritance(1)
+        self.readInheritanceData.assert_called()
+
+    def test_no_cache(self):
+        # outside of a request, nothing is cached
+        del self.context.inheritance_cache
+        kojihub.readFullInheritance(1)
+        self.readInheritanceData.reset_mock()
+        kojihub.readFullInheritance(1)
+        self.readInheritanceData.assert_called()
+
+
+class TestReadInheritanceGraph(unittest.TestCase):
+    """The single query engine must give the same results as the per-tag walk"""
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.opts = {}
+        self.context.inheritance_cache = None
+        self.log_error = mock.patch('kojihub.kojihub.log_error').start()
+        self.readInheritanceData = mock.patch('kojihub.kojihub.readInheritanceData').start()
+        self.readInheritanceData.side_effect = self.read_inheritance
+        self.readDescendantsData = mock.patch('kojihub.kojihub.readDescendantsData').start()
+        self.readDescendantsData.side_effect = self.read_descendants
+        self._multiRow = mock.patch('kojihub.kojihub._multiRow').start()
+        self._multiRow.side_effect = self.multi_row
+        self.links = []
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def random_graph(self, rnd, ntags):
+        self.links = []
+        for tag_id in range(1, ntags + 1):
+            parents = rnd.sample(range(1, ntags + 1), rnd.randint(0, min(3, ntags)))
+            priorities = rnd.sample(range(0, 50), len(parents))
+            for parent_id, priority in zip(parents, priorities):
+                if parent_id == tag_id:
+                    continue
+                self.links.append({
+                    'tag_id': tag_id,
+                    'parent_id': parent_id,
+                    'name': 'tag-%i' % parent_id,
+                    'priority': priority,
+                    'maxdepth': rnd.choice([None, None, None, 0, 1, 2, 3]),
+                    'intransitive': rnd.random() < 0.2,
+                    'noconfig': rnd.random() < 0.2,
+                    'pkg_filter': rnd.choice(['', '', '', '^foo', 'bar$']),
+                })
+        self.links.sort(key=lambda x: (x['priority'], x['tag_id']))
+
+    def read_inheritance(self, tag_id, event=None):
+        data = []
+        for link in self.links:
+            if link['tag_id'] == tag_id:
+                link = link.copy()
+                link['child_id'] = link.pop('tag_id')
+                data.append(link)
+        return data
+
+    def read_descendants(self, tag_id, event=None):
+        for link in self.links:
+            if link['parent_id'] == tag_id:
+                link = link.copy()
+                link['name'] = 'tag-%i' % link['tag_id']
+                yield link
+
+    def multi_row(self, query, values, fields):
+        reverse = 'JOIN tag ON tag_inheritance.tag_id = tag.id' in query
+        data = []
+        for link in self.links:
+            link = link.copy()
+            if reverse:
+                link['name'] = 'tag-%i' % link['tag_id']
+            data.append(link)
+        return data
+
+    def test_random_graphs(self):
+        rnd = random.Random(42)
+        for n in range(200):
+            self.random_graph(rnd, rnd.randint(1, 25))
+            for reverse in (False, True):
+                for tag_id in rnd.sample(range(1, 26), 3):
+                    self.context.opts = {}
+                    expected = kojihub.readFullInheritance(tag_id, reverse=reverse)
+                    self.context.opts = {'RecursiveInheritanceQuery': True}
+                    self._multiRow.reset_mock()
+                    result = kojihub.readFullInheritance(tag_id, reverse=reverse)
+                    self._multiRow.assert_called_once()
+                    self.assertEqual(result, expected)
+
+    def test_event_condition(self):
+        self.context.opts = {'RecursiveInheritanceQuery': True}
+        kojihub.readFullInheritance(1, event=1234)
+        query = self._multiRow.call_args[0][0]
+        self.assertIn('tag_inheritance.create_event <= 1234', query)
+        self.readInheritanceData.assert_not_called()
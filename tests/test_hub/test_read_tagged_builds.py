@@ -25,12 +25,14 @@ class TestReadTaggedBuilds(unittest.TestCase):
                                          side_effect=self.getQuery).start()
         self.queries = []
         self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.opts = {}
         # It seems MagicMock will not automatically handle attributes that
         # start with "assert"
         self.exports = kojihub.RootExports()
         self.readPackageList = mock.patch('kojihub.kojihub.readPackageList').start()
         self.lookup_name = mock.patch('kojihub.kojihub.lookup_name').start()
         self.tag_name = 'test-tag'
+        self.tag_id = 42
         self.columns = ['build.id', 'build.completion_time', 'tag_listing.create_event',
                         'events.id', 'events.time', 'build.draft', 'build.epoch', 'build.id',
                         'package.name',
@@ -210,3 +212,54 @@ class TestReadTaggedBuilds(unittest.TestCase):
         self.assertEqual(set(query.clauses), set(clauses))
         # function passes values=locals(), so we only check the relevant values
         self.assertEqual(dslice(query.values, values.keys()), values)
+
+    def test_get_tagged_builds_single_query(self):
+        self.context.opts = {'SingleQueryTaggedBuilds': True}
+        self.readPackageList.return_value = {
+            1: {'blocked': False, 'package_id': 1},
+            2: {'blocked': True, 'package_id': 2},
+        }
+        kojihub.readTaggedBuilds(self.tag_id, latest=2)
+
+        self.assertEqual(len(self.queries), 2)
+        ranked, query = self.queries
+
+        self.assertEqual(ranked.tables, self.tables)
+        self.assertEqual(ranked.joins[1:], self.joins)
+        self.assertIn('WITH ORDINALITY AS taglist(tag_id, depth)', ranked.joins[0])
+        clauses = copy.deepcopy(self.clauses)
+        clauses.remove('tag_id = %(tagid)s')
+        clauses.append('build.pkg_id IN %(pkg_ids)s')
+        self.assertEqual(set(ranked.clauses), set(clauses))
+        self.assertIn('PARTITION BY build.pkg_id', str(ranked))
+
+        self.assertEqual(query.tables, ['(%s) AS tag_listing' % ranked])
+        self.assertEqual(query.joins, self.joins)
+        self.assertEqual(set(query.columns), set(self.columns))
+        self.assertEqual(set(query.aliases), set(self.aliases))
+        self.assertEqual(query.clauses, ['tag_listing.pkg_rank <= %(latest)i'])
+        self.assertEqual(query.values['taglist'], '{%i}' % self.tag_id)
+        self.assertEqual(query.values['pkg_ids'], [1])
+        self.assertEqual(query.values['latest'], 2)
+        self.assertIn('ORDER BY tag_listing.depth, tag_listing.create_event DESC, build.id DESC',
+                      str(query))
+        query.execute.assert_called_once_with()
+
+    def test_get_tagged_builds_single_query_all(self):
+        self.context.opts = {'SingleQueryTaggedBuilds': True}
+        self.readPackageList.return_value = {1: {'blocked': False, 'package_id': 1}}
+        kojihub.readTaggedBuilds(self.tag_id, extra=True)
+
+        self.assertEqual(len(self.queries), 2)
+        ranked, query = self.queries
+        self.assertNotIn('PARTITION BY', str(ranked))
+        self.assertFalse(query.clauses)
+        self.assertIn('build.extra', query.columns)
+        self.assertEqual(query.transform, kojihub.kojihub._fix_extra_field)
+
+    def test_get_tagged_builds_single_query_no_packages(self):
+        self.context.opts = {'SingleQueryTaggedBuilds': True}
+        self.readPackageList.return_value = {1: {'blocked': True, 'package_id': 1}}
+        result = kojihub.readTaggedBuilds(self.tag_id)
+        self.assertEqual(result, [])
+        self.assertEqual(len(self.queries), 0)
@@ -256,6 +256,24 @@ class TestRepoInit(unittest.TestCase):
                 lines = fo.readlines()
                 self.assertEqual(len(lines), len(arch_rpms))
 
+    def test_repo_with_rpms_small_batch(self):
+        # output must not depend on how often the buffers are flushed
+        self.test_repo_with_rpms()
+        repodir = f'{self.tempdir}/repos/TAG/REPOID'
+        expected = {}
+        for arch in ['x86_64', 'aarch64']:
+            for fn in ['pkglist', 'rpmlist.jsonl']:
+                with open(f'{repodir}/{arch}/{fn}', 'rt') as fo:
+                    expected[(arch, fn)] = fo.read()
+        shutil.rmtree(f'{self.tempdir}/repos')
+
+        with mock.patch('kojihub.kojihub.REPO_INIT_BATCH', new=2):
+            self.test_repo_with_rpms()
+        for arch in ['x86_64', 'aarch64']:
+            for fn in ['pkglist', 'rpmlist.jsonl']:
+                with open(f'{repodir}/{arch}/{fn}', 'rt') as fo:
+                    self.assertEqual(fo.read(), expected[(arch, fn)])
+
     def test_separate_source(self):
         task_id = 100
         rpms, builds = self.DATA1
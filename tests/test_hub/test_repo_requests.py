@@ -614,65 +614,162 @@ class TestUpdateEndEvents(BaseTest):
     def setUp(self):
         super(TestUpdateEndEvents, self).setUp()
         self.BulkUpdateProcessor = mock.patch('kojihub.repos.BulkUpdateProcessor').start()
+        self.get_first_changes = mock.patch('kojihub.repos.get_first_changes').start()
+        self.readFullInheritance = mock.patch('kojihub.kojihub.readFullInheritance').start()
+        self.readFullInheritance.return_value = []
+        self.read_tag_last_change = mock.patch('kojihub.kojihub.read_tag_last_change').start()
+        self.read_tag_last_change.return_value = {}
 
     def test_no_update(self):
         repo = {'id': 1, 'tag_id': 99, 'create_event': 1000}
         self.RepoQuery.return_value.execute.return_value = [repo]
-        self.tag_first_change_event.return_value = None
-        self.tag_last_change_event.return_value = 1000
+        self.get_first_changes.return_value = {}
 
         repos.update_end_events()
 
+        self.get_first_changes.assert_called_once_with([(1, 99, 1000)])
         self.BulkUpdateProcessor.assert_not_called()
 
     def test_update(self):
         repo = {'id': 1, 'tag_id': 99, 'create_event': 1000}
         self.RepoQuery.return_value.execute.return_value = [repo]
-        self.tag_first_change_event.return_value = 1001
+        self.get_first_changes.return_value = {1: 1001}
 
         repos.update_end_events()
 
-        self.tag_last_change_event.assert_not_called()
         expect = [{'id': 1, 'end_event': 1001}]
         self.BulkUpdateProcessor.assert_called_once()
         updates = self.BulkUpdateProcessor.call_args.kwargs['data']
         self.assertEqual(updates, expect)
 
-    def test_event_cache(self):
-        # two current and one obsolete. all same tag
+    def test_inheritance(self):
+        # three repos for the same tag, two from the same event
         repolist = [
             {'id': 1, 'tag_id': 99, 'create_event': 1000},
-            # first is current, populates tag_last cache
             {'id': 2, 'tag_id': 99, 'create_event': 1000},
-            {'id': 3, 'tag_id': 99, 'create_event': 1000},
-            # 2 and 3 avoid checking tag due to cache
-            {'id': 4, 'tag_id': 99, 'create_event': 999},
-            # 4 is obsolete
+            {'id': 3, 'tag_id': 99, 'create_event': 999},
         ]
-        self.tag_last_change_event.return_value = 1000
         self.RepoQuery.return_value.execute.return_value = repolist
-        self.tag_first_change_event.side_effect = [None, 1000]
-        # the latter should only be called twice due to cache
+        self.readFullInheritance.return_value = [{'parent_id': 10}, {'parent_id': 11}]
+        # parent change at 1000 only affects the older repo
+        self.get_first_changes.return_value = {3: 1000}
 
         repos.update_end_events()
 
-        self.tag_last_change_event.assert_called_once_with(99)
-        expect_calls = [
-            mock.call(99, after=1000),
-            mock.call(99, after=999),
+        # inheritance is read once per tag and event
+        self.assertEqual(self.readFullInheritance.mock_calls,
+                         [mock.call(99, event=1000), mock.call(99, event=999)])
+        expect_checks = [
+            (1, 99, 1000), (1, 10, 1000), (1, 11, 1000),
+            (2, 99, 1000), (2, 10, 1000), (2, 11, 1000),
+            (3, 99, 999), (3, 10, 999), (3, 11, 999),
         ]
-        self.assertEqual(self.tag_first_change_event.mock_calls, expect_calls)
-        expect_updates = [{'id': 4, 'end_event': 1000}]
+        self.get_first_changes.assert_called_once_with(expect_checks)
+        expect_updates = [{'id': 3, 'end_event': 1000}]
         self.BulkUpdateProcessor.assert_called_once()
         updates = self.BulkUpdateProcessor.call_args.kwargs['data']
         self.assertEqual(updates, expect_updates)
 
+    def test_unchanged_tags(self):
+        repolist = [
+            {'id': 1, 'tag_id': 99, 'create_event': 1000},
+            {'id': 2, 'tag_id': 98, 'create_event': 1000},
+            {'id': 3, 'tag_id': 97, 'create_event': 1000},
+        ]
+        self.RepoQuery.return_value.execute.return_value = repolist
+        # 99 is unchanged, 98 changed and 97 is not indexed
+        self.read_tag_last_change.return_value = {99: 1000, 98: 1001}
+        self.get_first_changes.return_value = {2: 1001}
+
+        repos.update_end_events()
+
+        self.read_tag_last_change.assert_called_once_with([99, 98, 97])
+        self.get_first_changes.assert_called_once_with([(2, 98, 1000), (3, 97, 1000)])
+        self.assertEqual(self.readFullInheritance.mock_calls,
+                         [mock.call(98, event=1000), mock.call(97, event=1000)])
+
+
+class TestTagChanges(BaseTest):
+
+    def test_first_changes(self):
+        self.query_execute.side_effect = [
+            [{'ref': 1, 'event_id': 1005}, {'ref': 2, 'event_id': 1003}],
+            [{'ref': 2, 'event_id': 1001}],
+        ]
+        checks = [(1, 99, 1000), (1, 10, 1000), (2, 98, 1000), (2, 10, 1000)]
+
+        ret = repos.get_first_changes(checks, batch=3)
+
+        # earliest event across batches
+        self.assertEqual(ret, {1: 1005, 2: 1001})
+        self.assertEqual(len(self.queries), 2)
+        query = self.queries[0]
+        self.assertEqual(query.tables, [
+            '(VALUES (%(ref0)s, %(tag0)s, %(after0)s), (%(ref1)s, %(tag1)s, %(after1)s), '
+            '(%(ref2)s, %(tag2)s, %(after2)s)) AS checks (ref, tag_id, after)'])
+        self.assertEqual(query.values, {'ref0': 1, 'tag0': 99, 'after0': 1000,
+                                        'ref1': 1, 'tag1': 10, 'after1': 1000,
+                                        'ref2': 2, 'tag2': 98, 'after2': 1000})
+        self.assertEqual(query.opts, {'group': 'checks.ref'})
+        self.assertEqual(self.queries[1].values, {'ref0': 2, 'tag0': 10, 'after0': 1000})
+
+    def test_first_changes_empty(self):
+        self.assertEqual(repos.get_first_changes([]), {})
+        self.QueryProcessor.assert_not_called()
+
+    def test_last_changes(self):
+        self.query_execute.return_value = [
+            {'tag_id': 10, 'event_id': 1000},
+            {'tag_id': 11, 'event_id': None},
+        ]
+
+        ret = repos.get_last_changes([11, 10, 11])
+
+        self.assertEqual(ret, {10: 1000})
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(self.queries[0].values, {'tag_ids': [10, 11]})
+
+    def test_last_changes_empty(self):
+        self.assertEqual(repos.get_last_changes([]), {})
+        self.QueryProcessor.assert_not_called()
+
+    def test_inherited_tags(self):
+        with mock.patch('kojihub.kojihub.readFullInheritance') as readFullInheritance:
+            readFullInheritance.return_value = [{'parent_id': 10}, {'parent_id': 11}]
+            self.assertEqual(repos.inherited_tags(99, event=1000), [99, 10, 11])
+        readFullInheritance.assert_called_once_with(99, event=1000)
+
+    def test_inherited_last_changes(self):
+        with mock.patch('kojihub.kojihub.read_tag_last_change') as read_tag_last_change, \
+                mock.patch('kojihub.repos.get_last_changes') as get_last_changes, \
+                mock.patch('kojihub.kojihub.readFullInheritance') as readFullInheritance:
+            read_tag_last_change.return_value = {99: 1000}
+            readFullInheritance.side_effect = [[{'parent_id': 10}], []]
+            get_last_changes.return_value = {98: 990, 10: 1020}
+
+            ret = repos.get_inherited_last_changes([99, 98, 97])
+
+        # only the tags missing from the index use the journal
+        self.assertEqual(ret, {99: 1000, 98: 1020})
+        self.assertEqual(readFullInheritance.mock_calls,
+                         [mock.call(98, event=None), mock.call(97, event=None)])
+        get_last_changes.assert_called_once_with({98, 10, 97})
+
+    def test_inherited_last_changes_indexed(self):
+        with mock.patch('kojihub.kojihub.read_tag_last_change') as read_tag_last_change, \
+                mock.patch('kojihub.repos.get_last_changes') as get_last_changes:
+            read_tag_last_change.return_value = {99: 1000}
+            self.assertEqual(repos.get_inherited_last_changes([99]), {99: 1000})
+        get_last_changes.assert_not_called()
+
 
 class TestExternalRepo(BaseTest):
 
     def setUp(self):
         super(TestExternalRepo, self).setUp()
         self.get_external_repo_id = mock.patch('kojihub.kojihub.get_external_repo_id').start()
+        self.log_external_repo_change = mock.patch(
+            'kojihub.kojihub.log_external_repo_change').start()
 
     def test_get_external(self):
         self.get_external_repo_id.return_value = 42
@@ -698,6 +795,7 @@ class TestExternalRepo(BaseTest):
         insert = self.inserts[0]
         self.assertEqual(insert.data['external_repo_id'], 42)
         self.assertEqual(json.loads(insert.data['data']), data)
+        self.log_external_repo_change.assert_called_once_with(42, 'external_repo_data')
 
 
 class TestAutoRequests(BaseTest):
@@ -705,7 +803,12 @@ class TestAutoRequests(BaseTest):
     def setUp(self):
         super(TestAutoRequests, self).setUp()
         self.request_repo = mock.patch('kojihub.repos.request_repo').start()
-        self.tag_last_change_event = mock.patch('kojihub.kojihub.tag_last_change_event').start()
+        self.get_last_changes = mock.patch('kojihub.repos.get_last_changes').start()
+        self.get_last_changes.return_value = {99: 1000}
+        self.readFullInheritance = mock.patch('kojihub.kojihub.readFullInheritance').start()
+        self.readFullInheritance.return_value = []
+        self.read_tag_last_change = mock.patch('kojihub.kojihub.read_tag_last_change').start()
+        self.read_tag_last_change.return_value = {}
         self.time = mock.patch('time.time').start()
 
     def test_auto_requests(self):
@@ -714,18 +817,37 @@ class TestAutoRequests(BaseTest):
         ]
         self.query_execute.return_value = autokeys
         self.getLastEvent.return_value = {'id': 1050}
-        self.tag_last_change_event.return_value = 1000
         self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': False}
 
         repos.do_auto_requests()
 
         self.request_repo.assert_called_once_with(99, min_event=1000, priority=5)
 
+    def test_parent_change(self):
+        autokeys = [
+            {'tag_id': 99, 'key': 'repo.auto', 'value': 'true'},
+            {'tag_id': 98, 'key': 'repo.auto', 'value': 'true'},
+        ]
+        self.query_execute.return_value = autokeys
+        self.getLastEvent.return_value = {'id': 1050}
+        # 99 inherits from 10, which changed after 99 itself
+        self.readFullInheritance.side_effect = [[{'parent_id': 10}], []]
+        self.get_last_changes.return_value = {99: 1000, 98: 1010, 10: 1020}
+        self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': False}
+
+        repos.do_auto_requests()
+
+        self.get_last_changes.assert_called_once_with({99, 98, 10})
+        self.assertEqual(self.request_repo.mock_calls, [
+            mock.call(99, min_event=1020, priority=5),
+            mock.call(98, min_event=1010, priority=5),
+        ])
+
     def test_no_tags(self):
         autokeys = []
         self.query_execute.return_value = autokeys
         self.request_repo.assert_not_called()
-        self.tag_last_change_event.assert_not_called()
+        self.get_last_changes.assert_not_called()
 
     def test_bad_row(self):
         autokeys = [
@@ -736,7 +858,6 @@ class TestAutoRequests(BaseTest):
         # the bad rows should be ignored without blocking other auto requests
         self.query_execute.return_value = autokeys
         self.getLastEvent.return_value = {'id': 1050}
-        self.tag_last_change_event.return_value = 1000
         self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': False}
 
         repos.do_auto_requests()
@@ -751,7 +872,6 @@ class TestAutoRequests(BaseTest):
         # the blocked row should be ignored without blocking other auto requests
         self.query_execute.return_value = autokeys
         self.getLastEvent.return_value = {'id': 1050}
-        self.tag_last_change_event.return_value = 1000
         self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': False}
 
         repos.do_auto_requests()
@@ -769,7 +889,6 @@ class TestAutoRequests(BaseTest):
         self.time.return_value = now
         self.query_execute.return_value = autokeys
         self.getLastEvent.return_value = {'id': 1050}
-        self.tag_last_change_event.return_value = 1000
         self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': True}
 
         repos.do_auto_requests()
@@ -788,7 +907,6 @@ class TestAutoRequests(BaseTest):
         self.time.return_value = now
         self.query_execute.return_value = autokeys
         self.getLastEvent.return_value = {'id': 1050}
-        self.tag_last_change_event.return_value = 1000
         self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': False}
 
         repos.do_auto_requests()
@@ -807,12 +925,12 @@ class TestAutoRequests(BaseTest):
             {'tag_id': 99, 'key': 'repo.auto', 'value': 'true'},
         ]
         self.query_execute.return_value = autokeys
-        self.tag_last_change_event.return_value = None
+        self.get_last_changes.return_value = {}
 
         repos.do_auto_requests()
 
         self.request_repo.assert_not_called()
-        self.tag_last_change_event.assert_called_once()
+        self.get_last_changes.assert_called_once_with({99})
 
     def test_no_last_event(self):
         # corner case that can happen with very new instances
@@ -821,14 +939,13 @@ class TestAutoRequests(BaseTest):
         ]
         self.getLastEvent.return_value = None
         self.query_execute.return_value = autokeys
-        self.tag_last_change_event.return_value = 1000
         self.tag_first_change_event.return_value = 990
         self.request_repo.return_value = {'repo': None, 'request': 'REQ', 'duplicate': False}
 
         repos.do_auto_requests()
 
         self.request_repo.assert_called_once_with(99, min_event=990, priority=5)
-        self.tag_last_change_event.assert_called_once()
+        self.get_last_changes.assert_called_once_with({99})
         self.tag_first_change_event.assert_called_once()
 
         repos.do_auto_requests()
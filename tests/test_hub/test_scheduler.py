@@ -1,4 +1,5 @@
 import datetime
+import random
 from unittest import mock
 import unittest
 
@@ -120,6 +121,22 @@ class TestScheduler(BaseTest):
         s.run()
         # TODO
 
+    def test_run_summary(self):
+        s = scheduler.TaskScheduler()
+        s.check_ts = mock.MagicMock(return_value=True)
+        for name in ('get_tasks', 'get_hosts', 'check_hosts', 'check_active_tasks'):
+            setattr(s, name, mock.MagicMock())
+        s.do_schedule = mock.MagicMock(return_value=2)
+        s.free_tasks = [{}, {}, {}]
+        s.active_tasks = [{}]
+        s.hosts = {1: {}}
+        with mock.patch('kojihub.scheduler.log_both') as log_both:
+            self.assertTrue(s.run())
+        log_both.assert_called_once()
+        msg = log_both.call_args.args[0]
+        self.assertTrue(msg.startswith('Scheduler run: assigned 2 of 3 free tasks, '
+                                       '1 active tasks, 1 hosts, '), msg)
+
 
 class TestDoSchedule(BaseTest):
 
@@ -265,6 +282,169 @@ class TestDoSchedule(BaseTest):
         self.assertEqual(t_assigned, list(range(3,5)))
         self.assertEqual(h_used, list(range(3,5)))
 
+    def test_refusals(self):
+        hosts = [self.mkhost(id=n) for n in range(3)]
+        self.sched._get_hosts.return_value = hosts
+        self.sched.get_hosts()
+        self.sched.free_tasks = [self.mktask(task_id=n) for n in range(3)]
+        # task 0 refused by every host, task 1 by all but host 2
+        self.sched.get_refusals.return_value = {
+            0: {0: {}, 1: {}, 2: {}},
+            1: {0: {}, 1: {}},
+        }
+
+        assigned = self.sched.do_schedule()
+
+        self.assertEqual(assigned, 2)
+        self.sched.get_refusals.assert_called_once_with([0, 1, 2])
+        result = sorted([(t['task_id'], h['id']) for t, h in self.assigns])
+        self.assertEqual(result[0], (1, 2))
+        self.assertEqual(result[1][0], 2)
+        self.assertNotEqual(result[1][1], 2)
+        # the refused hosts get no demand from task 0 or 1
+        self.assertEqual(hosts[0]['_demand'], hosts[1]['_demand'])
+        self.assertGreater(hosts[2]['_demand'], hosts[0]['_demand'])
+
+    def test_maxjobs(self):
+        hosts = [self.mkhost(id=1, data={'maxjobs': 2}), self.mkhost(id=2)]
+        self.sched._get_hosts.return_value = hosts
+        self.sched.get_hosts()
+        active = [self.mktask(task_id=n, host_id=2, weight=0.1) for n in range(15)]
+        self.sched.active_tasks = active
+        self.sched.free_tasks = [self.mktask(task_id=n, weight=0.1) for n in range(15, 20)]
+
+        self.sched.do_schedule()
+
+        # host 2 is at the default limit and host 1 only takes two
+        self.assertEqual([(t['task_id'], h['id']) for t, h in self.assigns], [(15, 1), (16, 1)])
+
+    def reference_schedule(self, sched):
+        """The original quadratic scheduling loop, for comparison"""
+        result = []
+        refusals = sched.get_refusals.return_value
+        for host in sched.hosts.values():
+            host['_demand'] = 0.0
+        for task in sched.free_tasks:
+            task['_hosts'] = []
+            min_avail = max(0, task['weight'] - sched.capacity_overcommit)
+            h_refused = refusals.get(task['task_id'], {})
+            for host in sched.hosts_by_bin.get(task['_bin'], []):
+                if (host['ready'] and
+                        host['_ntasks'] < host['_maxjobs'] and
+                        host['capacity'] - host['_load'] > min_avail and
+                        host['id'] not in h_refused):
+                    task['_hosts'].append(host)
+            for host in task['_hosts']:
+                host['_demand'] += task['weight'] / len(task['_hosts'])
+        max_demand = sum([h['_demand'] for h in sched.hosts.values()])
+        if max_demand > 0.0:
+            for h in sched.hosts.values():
+                h['_demand'] = (h['_demand'] / max_demand)
+        for h in sched.hosts.values():
+            sched._rank_host(h)
+        for task in sched.free_tasks:
+            min_avail = max(0, task['weight'] - sched.capacity_overcommit)
+            task['_hosts'].sort(key=lambda h: h['_rank'])
+            for host in task['_hosts']:
+                if (host['capacity'] - host['_load'] > min_avail and
+                        host['_ntasks'] < host['_maxjobs']):
+                    result.append((task['task_id'], host['id']))
+                    host['_load'] += task['weight']
+                    host['_ntasks'] += 1
+                    sched._rank_host(host)
+                    break
+        return result
+
+    def test_matches_reference(self):
+        # compare against the old code on random data
+        for seed in range(20):
+            rnd = random.Random(seed)
+            hosts = []
+            for n in range(rnd.randint(1, 30)):
+                hosts.append(self.mkhost(
+                    id=n,
+                    ready=rnd.random() > 0.1,
+                    capacity=float(rnd.randint(2, 16)),
+                    channels=rnd.sample([1, 2, 3], rnd.randint(1, 3)),
+                    arches=rnd.choice(['x86_64', 'x86_64 i686', 'aarch64'])))
+            free = []
+            for n in range(rnd.randint(0, 200)):
+                free.append(self.mktask(
+                    task_id=n,
+                    weight=rnd.randint(1, 16) / 4.0,
+                    channel_id=rnd.randint(1, 3),
+                    arch=rnd.choice(['noarch', 'x86_64', 'aarch64', 'i686'])))
+            active = []
+            for n in range(rnd.randint(0, 50)):
+                active.append(self.mktask(
+                    task_id=1000 + n,
+                    host_id=rnd.randint(0, 30),
+                    waiting=rnd.random() > 0.8,
+                    weight=rnd.randint(1, 8) / 4.0))
+            refusals = {}
+            for n in range(len(free) // 4):
+                refusals.setdefault(rnd.randint(0, len(free)), {})[rnd.randint(0, 30)] = {}
+
+            results = []
+            for method in ('do_schedule', 'reference'):
+                sched = scheduler.TaskScheduler()
+                sched.get_refusals = mock.MagicMock(return_value=refusals)
+                sched._get_hosts = mock.MagicMock(return_value=[h.copy() for h in hosts])
+                sched.get_hosts()
+                sched.active_tasks = [t.copy() for t in active]
+                self.assigns = []
+                sched.assign = mock.MagicMock(side_effect=self.my_assign)
+                if method == 'do_schedule':
+                    sched.free_tasks = [t.copy() for t in free]
+                    sched.do_schedule()
+                    demand = dict([(h['id'], h['_demand']) for h in sched.hosts.values()])
+                    results.append([(t['task_id'], h['id']) for t, h in self.assigns])
+                else:
+                    # an empty run sets up the host load, then the old loop runs from there
+                    sched.free_tasks = []
+                    sched.do_schedule()
+                    sched.free_tasks = [t.copy() for t in free]
+                    results.append(self.reference_schedule(sched))
+                    for host in sched.hosts.values():
+                        self.assertAlmostEqual(demand[host['id']], host['_demand'])
+            self.assertEqual(results[0], results[1], 'seed %i' % seed)
+
+
+class TestGetRefusals(BaseTest):
+
+    def setUp(self):
+        super(TestGetRefusals, self).setUp()
+        self.DeleteProcessor = mock.patch('kojihub.scheduler.DeleteProcessor').start()
+        self.sched = scheduler.TaskScheduler()
+
+    def test_get_refusals(self):
+        self.get_task_refusals.return_value = [
+            {'id': 1, 'task_id': 100, 'host_id': 1, 'soft': False, 'ts': 0},
+            {'id': 2, 'task_id': 100, 'host_id': 2, 'soft': True, 'ts': 0},
+            {'id': 3, 'task_id': 101, 'host_id': 1, 'soft': True, 'ts': 0},
+        ]
+        with mock.patch('time.time', return_value=10000):
+            refusals = self.sched.get_refusals([100, 101, 102])
+
+        self.assertEqual(sorted(refusals), [100, 101])
+        self.assertEqual(sorted(refusals[100]), [1, 2])
+        self.assertEqual(refusals[101][1]['id'], 3)
+        # only the refusals of the free tasks are fetched
+        self.get_task_refusals.assert_called_once_with(
+            clauses=[['task_id', 'IN', [100, 101, 102]]],
+            fields=('id', 'task_id', 'host_id', 'soft', 'ts'))
+        # stale entries are deleted in the db
+        self.DeleteProcessor.assert_called_once()
+        values = self.DeleteProcessor.call_args.kwargs['values']
+        self.assertEqual(values['cutoff_ts'], 10000 - self.sched.soft_refusal_timeout)
+        self.DeleteProcessor.return_value.execute.assert_called_once_with()
+
+    def test_get_refusals_no_tasks(self):
+        self.assertEqual(self.sched.get_refusals([]), {})
+        self.get_task_refusals.assert_not_called()
+        self.DeleteProcessor.return_value.execute.assert_called_once_with()
+
+
 class TestCheckActiveRuns(BaseTest):
 
     def setUp(self):
@@ -9,9 +9,11 @@ class TestSnapshotTag(unittest.TestCase):
         self._create_tag = mock.patch('kojihub.kojihub._create_tag').start()
         self.get_tag = mock.patch('kojihub.kojihub.get_tag').start()
         self.get_build = mock.patch('kojihub.kojihub.get_build').start()
+        self.get_builds = mock.patch('kojihub.kojihub.get_builds').start()
         self.get_user = mock.patch('kojihub.kojihub.get_user').start()
         self._direct_tag_build = mock.patch('kojihub.kojihub._direct_tag_build').start()
-        self._direct_pkglist_add = mock.patch('kojihub.kojihub._direct_pkglist_add').start()
+        self._bulk_pkglist_add = mock.patch('kojihub.kojihub._bulk_pkglist_add').start()
+        self._direct_tag_builds = mock.patch('kojihub.kojihub._direct_tag_builds').start()
         self._delete_event_id = mock.patch('kojihub.kojihub._delete_event_id').start()
         self._grplist_add = mock.patch('kojihub.kojihub._grplist_add').start()
         self._grp_pkg_add = mock.patch('kojihub.kojihub._grp_pkg_add').start()
@@ -83,6 +85,8 @@ class TestSnapshotTag(unittest.TestCase):
         self._create_tag.return_value = dst['id']
         self.hub.listPackages.return_value = [pkg]
         self.readTaggedBuilds.return_value = [build]
+        binfo = dict(build, cg_name=None)
+        self.get_builds.return_value = [binfo]
         self.readTagGroups.return_value = [
             {
                 'id': 1,
@@ -107,14 +111,9 @@ class TestSnapshotTag(unittest.TestCase):
             mock.call(dst['id'], strict=True),
         ])
         self.hub.listPackages.assert_called_once_with(tagID=src['id'], event=None, inherited=True)
-        self._direct_pkglist_add.assert_called_once_with(
-            taginfo=dst['id'],
-            pkginfo=pkg['package_name'],
-            owner=pkg['owner_name'],
-            block=pkg['blocked'],
-            extra_arches=pkg['extra_arches'],
-            force=True,
-            update=False,
-        )
+        self._bulk_pkglist_add.assert_called_once_with(dst, [pkg], force=True)
         self.readTaggedBuilds.assert_called_once_with(tag=src['id'], inherit=True, event=None, latest=True)
-        self.hub.massTag.assert_called_once_with(dst['id'], [build])
+        self.get_builds.assert_called_once_with([build['id']], strict=True)
+        self._direct_tag_builds.assert_called_once_with(dst, [binfo], self.get_user.return_value,
+                                                        force=True)
+        self.hub.massTag.assert_not_called()
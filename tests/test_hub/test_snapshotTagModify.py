@@ -9,11 +9,15 @@ class TestSnapshotTagModify(unittest.TestCase):
         self._create_tag = mock.patch('kojihub.kojihub._create_tag').start()
         self.get_tag = mock.patch('kojihub.kojihub.get_tag').start()
         self.get_build = mock.patch('kojihub.kojihub.get_build').start()
+        self.get_builds = mock.patch('kojihub.kojihub.get_builds').start()
+        self.get_builds.side_effect = lambda ids, strict: [{'id': i, 'cg_name': None} for i in ids]
         self.get_user = mock.patch('kojihub.kojihub.get_user').start()
         self._direct_tag_build = mock.patch('kojihub.kojihub._direct_tag_build').start()
         self._direct_untag_build = mock.patch('kojihub.kojihub._direct_untag_build').start()
         self._tag_build = mock.patch('kojihub.kojihub._tag_build').start()
         self._untag_build = mock.patch('kojihub.kojihub._untag_build').start()
+        self._direct_tag_changes = mock.patch('kojihub.kojihub._direct_tag_changes').start()
+        self.assert_tag_access = mock.patch('kojihub.kojihub.assert_tag_access').start()
         self._direct_pkglist_add = mock.patch('kojihub.kojihub._direct_pkglist_add').start()
         self._delete_event_id = mock.patch('kojihub.kojihub._delete_event_id').start()
         self._grplist_add = mock.patch('kojihub.kojihub._grplist_add').start()
@@ -205,8 +209,14 @@ class TestSnapshotTagModify(unittest.TestCase):
             mock.call(dst['id'], inherit=False, latest=False),
         ])
         self._direct_untag_build.assert_not_called()
-        self._untag_build.assert_called_once_with('dst', build2, force=True)
-        self._direct_tag_build.assert_called_once_with(dst, build, user, force=True)
+        self._untag_build.assert_not_called()
+        self._direct_tag_build.assert_not_called()
+        # untag the extra build, then tag the missing one
+        self.assert_tag_access.assert_called_once_with(dst['id'], force=True)
+        self.get_builds.assert_called_once_with([build2['id'], build['id']], strict=True)
+        self._direct_tag_changes.assert_called_once_with(
+            dst, [({'id': build2['id'], 'cg_name': None}, False),
+                  ({'id': build['id'], 'cg_name': None}, True)], user, force=True)
         self._grp_pkg_add.assert_called_once_with('dst', 'group1', pkg1['package_name'],
                                                   block=False, force=True)
         self._grp_req_add.assert_has_calls([
@@ -26,63 +26,55 @@ class TestTagChangeEvent(unittest.TestCase):
         self.readFullInheritance = mock.patch('kojihub.kojihub.readFullInheritance').start()
         self.get_tag_external_repos = mock.patch('kojihub.kojihub.get_tag_external_repos').start()
         self.get_tag_external_repos.return_value = []
+        self.read_tag_last_change = mock.patch('kojihub.kojihub.read_tag_last_change').start()
+        self.read_tag_last_change.return_value = {}
+        self.rows = []
 
     def tearDown(self):
         mock.patch.stopall()
 
     def get_query(self, *args, **kwargs):
         query = QP(*args, **kwargs)
-        query.execute = mock.MagicMock()
+        query.execute = mock.MagicMock(return_value=self.rows)
         query.singleValue = self.singleValue
         self.queries.append(query)
         return query
 
     def test_tag_last_change_simple(self):
-        tags = [5, 6, 7, 8, 17, 23, 42]
-        self.get_tag.return_value = {'id': tags[0], 'revoke_event': None}
-        self.readFullInheritance.return_value = [{'parent_id':n} for n in tags[1:]]
-        erepos = [101, 201]
-        self.get_tag_external_repos.return_value = [{'external_repo_id': n} for n in erepos]
-        events = [8, 8, 8, 8, 8, 8, None, 8, 8, 42, 23, 23, 23, 23, 23, None, 23, 23, 23,
-                  8, 8, 8, 8]  # len=23
-        # called once for tag_updates, twice for versioned tag tables, and twice for erepo tables
-        # 1 + 2*9 + 2*2 = 23
-        self.singleValue.side_effect = events
+        self.get_tag.return_value = {'id': 5, 'revoke_event': None}
+        self.read_tag_last_change.return_value = {5: 42}
 
         event = kojihub.tag_last_change_event('TAG')
 
-        self.assertEqual(event, 42)  # max(events)
-        self.assertEqual(len(self.queries), 23)
-        self.readFullInheritance.assert_called_once_with(tags[0], event=None)
-        for query in self.queries[:19]:  # tag queries
-            self.assertEqual(query.clauses[0], 'tag_id IN %(tags)s')
-            self.assertEqual(query.values['tags'], tags)
-            # we didn't pass an event, so there should be no second clause
-            self.assertEqual(len(query.clauses), 1)
-        for query in self.queries[19:]:  # erepo queries
-            self.assertEqual(query.clauses[0], 'external_repo_id IN %(repos)s')
-            self.assertEqual(query.values['repos'], erepos)
-            # we didn't pass an event, so there should be no second clause
-            self.assertEqual(len(query.clauses), 1)
+        self.assertEqual(event, 42)
+        self.read_tag_last_change.assert_called_once_with([5], inherit=True)
+        self.readFullInheritance.assert_not_called()
+        self.assertEqual(len(self.queries), 0)
 
     def test_tag_last_change_noinherit(self):
-        tags = [5, 6, 7, 8, 17, 23, 42]
-        self.get_tag.return_value = {'id': tags[0], 'revoke_event': None}
-        self.readFullInheritance.return_value = [{'parent_id':n} for n in tags[1:]]
-        events = [8, 8, 8, 8, 8, 8, None, 8, 8, 42, 23, 23, 23, 23, 23, None, 23, 23, 23]  # len=19
-        self.singleValue.side_effect = events
+        self.get_tag.return_value = {'id': 5, 'revoke_event': None}
+        self.read_tag_last_change.return_value = {5: 23}
 
         event = kojihub.tag_last_change_event('TAG', inherit=False)
 
-        self.assertEqual(event, 42)  # max(events)
-        self.assertEqual(len(self.queries), 19)
+        self.assertEqual(event, 23)
+        self.read_tag_last_change.assert_called_once_with([5], inherit=False)
         self.readFullInheritance.assert_not_called()
-        for query in self.queries:
-            self.assertEqual(query.clauses[0], 'tag_id IN %(tags)s')
-            # only the tag itself should be in the query condition
-            self.assertEqual(query.values['tags'], [tags[0]])
-            # we didn't pass an event, so there should be no second clause
-            self.assertEqual(len(query.clauses), 1)
+
+    def test_tag_last_change_not_indexed(self):
+        tags = [5, 6, 7]
+        self.get_tag.return_value = {'id': tags[0], 'revoke_event': None}
+        self.readFullInheritance.return_value = [{'parent_id': n} for n in tags[1:]]
+        self.rows = [{'event_id': 8}, {'event_id': None}, {'event_id': 42}]
+
+        event = kojihub.tag_last_change_event('TAG')
+
+        self.assertEqual(event, 42)
+        self.readFullInheritance.assert_called_once_with(tags[0], event=None)
+        self.assertEqual(len(self.queries), 1)
+        query = self.queries[0]
+        self.assertEqual(query.values['tags'], tags)
+        self.assertIn('max(event_id)', query.columns[0])
 
     def test_tag_last_change_deleted(self):
         self.get_tag.return_value = {'id': 5, 'revoke_event': 9999}
@@ -91,45 +83,38 @@ class TestTagChangeEvent(unittest.TestCase):
 
         self.assertEqual(event, 9999)
         self.readFullInheritance.assert_not_called()
-        self.get_tag_external_repos.assert_not_called()
-        self.singleValue.assert_not_called()
+        self.read_tag_last_change.assert_not_called()
         self.assertEqual(len(self.queries), 0)
 
     def test_tag_last_change_before(self):
-        tags = [5, 6, 7, 8, 17, 23, 42]
+        tags = [5, 6, 7]
         before = 123
         self.get_tag.return_value = {'id': tags[0], 'revoke_event': None}
-        self.readFullInheritance.return_value = [{'parent_id':n} for n in tags[1:]]
-        erepos = [101, 201]
-        self.get_tag_external_repos.return_value = [{'external_repo_id': n} for n in erepos]
-        events = [8, 8, 8, 8, 8, 8, None, 8, 8, 42, 23, 23, 23, 23, 23, None, 23, 23, 23,
-                  8, 8, 8, 8]  # len=23
-        # called once for tag_updates, twice for versioned tag tables, and twice for erepo tables
-        # 1 + 2*9 + 2*2 = 23
-        self.singleValue.side_effect = events
+        self.readFullInheritance.return_value = [{'parent_id': n} for n in tags[1:]]
+        self.rows = [{'event_id': 8}, {'event_id': 23}, {'event_id': None}]
 
         event = kojihub.tag_last_change_event('TAG', before=before)
 
-        self.assertEqual(event, 42)  # max(events)
-        self.assertEqual(len(self.queries), 23)
+        self.assertEqual(event, 23)
+        # the index only holds the latest change
+        self.read_tag_last_change.assert_not_called()
         self.readFullInheritance.assert_called_once_with(tags[0], event=before)
-        for query in self.queries[:19]:
-            self.assertEqual(query.values['tags'], tags)
-            self.assertEqual(query.values['before'], before)
-            # QP sorts the clauses, so they are not in the order the code adds them
-            self.assertIn('tag_id IN %(tags)s', query.clauses)
-            self.assertEqual(len(query.clauses), 2)
-        for query in self.queries[19:]:  # erepo queries
-            self.assertIn('external_repo_id IN %(repos)s', query.clauses)
-            self.assertEqual(query.values['repos'], erepos)
-            self.assertEqual(query.values['before'], before)
-            # we didn't pass an event, so there should be no second clause
-            self.assertEqual(len(query.clauses), 2)
+        query = self.queries[0]
+        self.assertEqual(query.values['before'], before)
+        self.assertIn('tag_changes.event_id < %(before)i', query.columns[0])
+
+    def test_tag_last_change_before_creation(self):
+        self.get_tag.return_value = {'id': 5, 'revoke_event': None}
+        self.rows = [{'event_id': None}]
+
+        event = kojihub.tag_last_change_event('TAG', before=1, inherit=False)
+
+        self.assertIsNone(event)
+        self.readFullInheritance.assert_not_called()
 
     def test_tag_first_change_simple(self):
         self.get_tag_id.return_value = 99
-        events = [88]
-        self.singleValue.side_effect = events
+        self.singleValue.return_value = 88
 
         event = kojihub.tag_first_change_event('TAG')
 
@@ -143,80 +128,158 @@ class TestTagChangeEvent(unittest.TestCase):
         self.assertEqual(query.values['tag_id'], 99)
         self.assertEqual(len(query.clauses), 1)
 
-    def test_tag_first_change_noinherit(self):
+    def test_tag_first_change_unchanged(self):
         self.get_tag_id.return_value = 99
-        events = [88]
-        self.singleValue.side_effect = events
+        self.singleValue.return_value = 3
+        self.read_tag_last_change.return_value = {99: 5}
 
-        event = kojihub.tag_first_change_event('TAG', inherit=False)
+        event = kojihub.tag_first_change_event('TAG', after=5)
 
-        # with no after arg, we should only query tag_config
-        self.assertEqual(event, 88)
+        self.assertIsNone(event)
+        self.read_tag_last_change.assert_called_once_with([99], inherit=True)
         self.readFullInheritance.assert_not_called()
         self.assertEqual(len(self.queries), 1)
-        query = self.queries[0]
-        self.assertEqual(query.tables, ['tag_config'])
-        self.assertEqual(query.clauses[0], 'tag_id = %(tag_id)s')
-        # only the tag itself should be in the query condition
-        self.assertEqual(query.values['tag_id'], 99)
-        # we didn't pass an event, so there should be no second clause
-        self.assertEqual(len(query.clauses), 1)
 
     def test_tag_first_change_after(self):
-        tags = [5, 6, 7, 8, 17, 23, 42]
+        tags = [5, 6, 7]
         after = 5
         self.get_tag_id.return_value = tags[0]
-        self.readFullInheritance.return_value = [{'parent_id':n} for n in tags[1:]]
-        erepos = [101, 201]
-        self.get_tag_external_repos.return_value = [{'external_repo_id': n} for n in erepos]
-        events = [8, 8, 8, 8, 8, 8, 8, None, 8, 8, 42, 23, 23, 23, 23, 23, None, 23, 23, 23,
-                  8, 8, 8, 8]  # len=24
-        self.assertEqual(len(events), 24)
-        # called once for tag_config, once for tag_updates, twice for versioned tag tables,
-        # and twice for erepo tables
-        # 1 + 1 + 2*9 + 2*2 = 23
-        self.singleValue.side_effect = events
+        self.singleValue.return_value = 3
+        self.read_tag_last_change.return_value = {5: 42}
+        self.readFullInheritance.return_value = [{'parent_id': n} for n in tags[1:]]
+        self.rows = [{'event_id': 8}, {'event_id': 23}, {'event_id': None}]
 
         event = kojihub.tag_first_change_event('TAG', after=after)
 
-        self.assertEqual(event, 8)  # min(events)
-        self.assertEqual(len(self.queries), 24)
+        self.assertEqual(event, 8)
         self.readFullInheritance.assert_called_once_with(tags[0], event=after)
-        for query in self.queries[1:20]:
-            self.assertEqual(query.values['tags'], tags)
-            self.assertEqual(query.values['after'], after)
-            # QP sorts the clauses, so they are not in the order the code adds them
-            self.assertIn('tag_id IN %(tags)s', query.clauses)
-            self.assertEqual(len(query.clauses), 2)
-        for query in self.queries[20:]:
-            self.assertEqual(query.values['repos'], erepos)
-            self.assertEqual(query.values['after'], after)
-            # QP sorts the clauses, so they are not in the order the code adds them
-            self.assertIn('external_repo_id IN %(repos)s', query.clauses)
-            self.assertEqual(len(query.clauses), 2)
+        self.assertEqual(len(self.queries), 2)
+        query = self.queries[1]
+        self.assertEqual(query.values['tags'], tags)
+        self.assertEqual(query.values['after'], after)
+        self.assertIn('min(event_id)', query.columns[0])
 
     def test_tag_first_change_after_noinherit(self):
-        # without inheritance, we'll only query the tag itself
-        tag_id = 999
         after = 5
-        self.get_tag_id.return_value = tag_id
-        events = [8, 8, 8, 8, 8, 8, 8, None, 8, 8, 42, 23, 23, 23, 23, 23, None, 23, 23, 23]
-        self.assertEqual(len(events), 20)
-        # called once for tag_config, once for tag_updates, and twice for versioned tag tables
-        # 2 + 2*9 = 20
-        self.singleValue.side_effect = events
+        self.get_tag_id.return_value = 999
+        self.singleValue.return_value = 3
+        self.rows = [{'event_id': None}]
 
         event = kojihub.tag_first_change_event('TAG', after=after, inherit=False)
 
-        self.assertEqual(event, 8)  # min(events)
-        self.assertEqual(len(self.queries), 20)
+        self.assertIsNone(event)
+        self.read_tag_last_change.assert_called_once_with([999], inherit=False)
         self.readFullInheritance.assert_not_called()
-        for query in self.queries[1:]:
-            self.assertEqual(query.values['tags'], [tag_id])
-            self.assertEqual(query.values['after'], after)
-            # QP sorts the clauses, so they are not in the order the code adds them
-            self.assertIn('tag_id IN %(tags)s', query.clauses)
-            self.assertEqual(len(query.clauses), 2)
+        self.assertEqual(self.queries[1].values['tags'], [999])
+
+
+class TestTagLastChangeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.QueryProcessor = mock.patch('kojihub.kojihub.QueryProcessor',
+                                         side_effect=self.get_query).start()
+        self.readFullInheritance = mock.patch('kojihub.kojihub.readFullInheritance').start()
+        # 6 inherits from 5
+        self.readFullInheritance.side_effect = lambda tag_id: \
+            [{'parent_id': 5}] if tag_id == 6 else []
+        self.queries = []
+        self.results = {}
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def get_query(self, *args, **kwargs):
+        query = QP(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=self.results.get(query.tables[0], []))
+        self.queries.append(query)
+        return query
+
+    def test_read_tag_last_change(self):
+        self.results['tag_last_change'] = [{'tag_id': 5, 'event_id': 42},
+                                           {'tag_id': 6, 'event_id': 10}]
+        self.assertEqual(kojihub.read_tag_last_change([6, 5, 6]), {5: 42, 6: 42})
+        query = self.queries[0]
+        self.assertEqual(query.values['tag_ids'], [5, 6])
+        self.assertIn('event_id IS NOT NULL', query.clauses)
+
+        self.assertEqual(kojihub.read_tag_last_change([6], inherit=False), {6: 10})
+        self.assertEqual(self.queries[1].values['tag_ids'], [6])
+
+    def test_read_tag_last_change_parent_not_indexed(self):
+        self.results['tag_last_change'] = [{'tag_id': 6, 'event_id': 10}]
+        self.assertEqual(kojihub.read_tag_last_change([6]), {})
+        self.assertEqual(self.queries[0].values['tag_ids'], [5, 6])
+
+    def test_read_tag_last_change_empty(self):
+        self.assertEqual(kojihub.read_tag_last_change([]), {})
+        self.assertEqual(len(self.queries), 0)
+
+    def test_changed_since_event(self):
+        self.results['tag_last_change'] = [{'tag_id': 5, 'event_id': 42},
+                                           {'tag_id': 6, 'event_id': 10}]
+        self.assertTrue(kojihub.tag_changed_since_event(41, [5, 6]))
+        self.assertFalse(kojihub.tag_changed_since_event(42, [5, 6]))
+        self.assertFalse(kojihub.tag_changed_since_event(42, []))
+
+    def test_changed_since_event_not_indexed(self):
+        self.results['tag_last_change'] = [{'tag_id': 5, 'event_id': 10}]
+        self.results['tag'] = [{'event_id': 50}]
+        self.assertTrue(kojihub.tag_changed_since_event(42, [5, 6]))
+        query = self.queries[1]
+        self.assertEqual(query.values['tags'], [5, 6])
+        self.assertEqual(query.values['after'], 42)
+
+
+class TestCheckTagLastChange(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.session.assertPerm = mock.MagicMock()
+        self.QueryProcessor = mock.patch('kojihub.kojihub.QueryProcessor',
+                                         side_effect=self.get_query).start()
+        self.UpsertProcessor = mock.patch('kojihub.kojihub.UpsertProcessor').start()
+        self.queries = []
+        self.results = {
+            'tag_updates': [{'tag_id': 5, 'event_id': 30}],
+            'tag_listing': [{'tag_id': 5, 'event_id': 20}, {'tag_id': 6, 'event_id': 10}],
+        }
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def get_query(self, *args, **kwargs):
+        query = QP(*args, **kwargs)
+        query.execute = mock.MagicMock(return_value=self.results.get(query.tables[0], []))
+        self.queries.append(query)
+        return query
+
+    def test_consistent(self):
+        self.results['tag_last_change'] = [
+            {'tag_id': 5, 'event_id': 30},
+            {'tag_id': 6, 'event_id': 10},
+        ]
+        self.assertEqual(kojihub.check_tag_last_change(), [])
+        self.context.session.assertPerm.assert_called_once_with('admin')
+        self.UpsertProcessor.assert_not_called()
+
+    def test_repair(self):
+        self.results['tag_last_change'] = [
+            {'tag_id': 5, 'event_id': 30},
+            {'tag_id': 7, 'event_id': 1},
+        ]
+        result = kojihub.check_tag_last_change(repair=True)
+        self.assertEqual(result, [
+            {'tag_id': 6, 'event_id': None, 'expected_event_id': 10},
+            {'tag_id': 7, 'event_id': 1, 'expected_event_id': None},
+        ])
+        self.UpsertProcessor.assert_has_calls([
+            mock.call('tag_last_change', keys=['tag_id'],
+                      data={'tag_id': 6, 'event_id': 10}),
+            mock.call().execute(),
+            mock.call('tag_last_change', keys=['tag_id'],
+                      data={'tag_id': 7, 'event_id': None}),
+            mock.call().execute(),
+        ])
 
 
 # the end
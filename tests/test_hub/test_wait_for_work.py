@@ -0,0 +1,218 @@
+from unittest import mock
+import unittest
+
+import koji
+import kojihub
+import kojihub.kojihub
+
+
+UP = kojihub.UpdateProcessor
+
+
+class TestWaitForWork(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.opts = {'HostWaitTimeout': 60, 'RunInterval': 20}
+        self.context.commit_pending = False
+        self.context.tag_last_change = []
+        self.host_id = 99
+        self.host = mock.MagicMock(id=self.host_id)
+        self.Host = mock.patch('kojihub.kojihub.Host', return_value=self.host).start()
+        self.Listener = mock.patch('kojihub.kojihub.Listener').start()
+        self.listener = self.Listener.return_value
+        self.time = mock.patch('kojihub.kojihub.time.time', return_value=1000.0).start()
+        self.run_callbacks = mock.patch('koji.plugin.run_callbacks').start()
+        self.exports = kojihub.HostExports()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def wait(self, timeout):
+        self.time.return_value += timeout
+        return []
+
+    def test_disabled(self):
+        self.context.opts['HostWaitTimeout'] = 0
+        self.assertIsNone(self.exports.waitForWork([1], [], 30))
+        self.host.verify.assert_called_once_with()
+        self.Listener.assert_not_called()
+
+    def test_has_work(self):
+        self.host.hasWork.return_value = True
+        self.assertTrue(self.exports.waitForWork([1, 2], [2], 30))
+        # we listen before checking
+        self.Listener.assert_called_once_with(['koji_host_99'])
+        self.host.hasWork.assert_called_once_with([1, 2], [2])
+        self.listener.wait.assert_not_called()
+        self.listener.close.assert_called_once_with()
+        # the transaction is left to the end of the call
+        self.context.cnx.rollback.assert_not_called()
+        self.context.cnx.commit.assert_not_called()
+
+    def test_notified(self):
+        self.host.hasWork.return_value = False
+        self.listener.wait.return_value = ['koji_host_99']
+        self.assertTrue(self.exports.waitForWork([], [], 15))
+        self.listener.wait.assert_called_once_with(15)
+        self.listener.close.assert_called_once_with()
+
+    def test_transaction_ended(self):
+        self.host.hasWork.return_value = False
+        self.listener.wait.side_effect = self.wait
+        self.assertFalse(self.exports.waitForWork([], [], 30))
+        # nothing to commit
+        self.context.cnx.rollback.assert_called()
+        self.context.cnx.commit.assert_not_called()
+
+    def test_scheduler_changes_committed(self):
+        def hasWork(task_ids, alerted):
+            # the scheduler assigned tasks to other hosts
+            self.context.commit_pending = True
+            return False
+        self.host.hasWork.side_effect = hasWork
+        self.listener.wait.return_value = ['koji_host_99']
+        self.assertTrue(self.exports.waitForWork([], [], 30))
+        self.context.cnx.commit.assert_called_once_with()
+        self.run_callbacks.assert_has_calls([mock.call('preCommit'), mock.call('postCommit')])
+
+    def test_timeout(self):
+        self.host.hasWork.return_value = False
+        self.listener.wait.side_effect = self.wait
+        # the hub limit applies, and the scheduler runs once per interval
+        self.assertFalse(self.exports.waitForWork(None, None, 3600))
+        self.assertEqual(self.listener.wait.call_args_list,
+                         [mock.call(20), mock.call(20), mock.call(20)])
+        self.assertEqual(self.host.hasWork.call_count, 4)
+        self.listener.close.assert_called_once_with()
+
+    def test_close_on_error(self):
+        self.host.hasWork.side_effect = koji.GenericError('error')
+        with self.assertRaises(koji.GenericError):
+            self.exports.waitForWork([], [], None)
+        self.listener.close.assert_called_once_with()
+
+
+class TestHasWork(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.session.getHostId.return_value = 99
+        self.get_tasks_for_host = mock.patch(
+            'kojihub.kojihub.scheduler.get_tasks_for_host').start()
+        self.get_tasks_for_host.return_value = []
+        self.host = kojihub.Host(99)
+        self.host.getHostTasks = mock.MagicMock()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def test_assigned(self):
+        self.get_tasks_for_host.return_value = [{'id': 5}]
+        self.assertTrue(self.host.hasWork([], []))
+        self.get_tasks_for_host.assert_called_once_with(hostID=99, retry=True)
+        self.host.getHostTasks.assert_not_called()
+
+    def test_no_change(self):
+        self.host.getHostTasks.return_value = [{'id': 1, 'waiting': False},
+                                               {'id': 2, 'waiting': True}]
+        self.assertFalse(self.host.hasWork([2, 1], []))
+
+    def test_task_changes(self):
+        self.host.getHostTasks.return_value = [{'id': 1, 'waiting': False}]
+        # canceled or reassigned
+        self.assertTrue(self.host.hasWork([1, 2], []))
+        # unknown to the host
+        self.assertTrue(self.host.hasWork([], []))
+
+    def test_alert(self):
+        self.host.getHostTasks.return_value = [{'id': 1, 'waiting': True, 'alert': True}]
+        self.assertTrue(self.host.hasWork([1], []))
+        # already woken up
+        self.assertFalse(self.host.hasWork([1], [1]))
+
+
+class TestNotifyHosts(unittest.TestCase):
+
+    def setUp(self):
+        self.context = mock.patch('kojihub.kojihub.context').start()
+        self.context.opts = {'HostWaitTimeout': 60}
+        self.notify = mock.patch('kojihub.kojihub.notify').start()
+        self.UpdateProcessor = mock.patch('kojihub.kojihub.UpdateProcessor',
+                                          side_effect=self.getUpdate).start()
+        self.updates = []
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def getUpdate(self, *args, **kwargs):
+        update = UP(*args, **kwargs)
+        update.execute = mock.MagicMock()
+        self.updates.append(update)
+        return update
+
+    def test_notify_hosts(self):
+        kojihub.kojihub.notify_hosts([3, None, 1, 3])
+        self.notify.assert_has_calls([mock.call('koji_host_1'), mock.call('koji_host_3')])
+        self.assertEqual(self.notify.call_count, 2)
+
+    def test_notify_disabled(self):
+        self.context.opts = {}
+        kojihub.kojihub.notify_hosts([1])
+        self.notify.assert_not_called()
+
+    def test_free(self):
+        task = kojihub.Task(100)
+        task.getInfo = mock.MagicMock(return_value={'id': 100, 'host_id': 5})
+        task.runCallbacks = mock.MagicMock()
+        with mock.patch('kojihub.kojihub.QueryProcessor') as QueryProcessor:
+            QueryProcessor.return_value.singleValue.return_value = koji.TASK_STATES['OPEN']
+            task.free()
+        # only the host that had the task is woken
+        self.notify.assert_called_once_with('koji_host_5')
+
+    def make_task(self, **opts):
+        self.context.policy.get.return_value.apply.return_value = None
+        with mock.patch('kojihub.kojihub.get_channel_id', return_value=1), \
+                mock.patch('kojihub.kojihub.InsertProcessor'), \
+                mock.patch('kojihub.kojihub.currval', return_value=100), \
+                mock.patch('kojihub.kojihub.policy_data_from_task_args', return_value={}), \
+                mock.patch('kojihub.kojihub.scheduler.auto_arch_refuse'), \
+                mock.patch('koji.plugin.run_callbacks'):
+            return kojihub.kojihub.make_task('build', [], owner=1, **opts)
+
+    def test_make_task(self):
+        self.assertEqual(self.make_task(), 100)
+        # free tasks wait for the next scheduler run
+        self.notify.assert_not_called()
+
+    def test_make_task_assigned(self):
+        self.make_task(assign=5)
+        self.notify.assert_called_once_with('koji_host_5')
+
+    def test_assign(self):
+        task = kojihub.Task(100)
+        task.getInfo = mock.MagicMock(return_value={'id': 100, 'host_id': None})
+        task.runCallbacks = mock.MagicMock()
+        self.assertTrue(task.lock(5, 'ASSIGNED', force=True))
+        self.notify.assert_called_once_with('koji_host_5')
+
+    def test_open(self):
+        task = kojihub.Task(100)
+        task.getInfo = mock.MagicMock(return_value={'id': 100, 'host_id': 5})
+        task.runCallbacks = mock.MagicMock()
+        self.assertTrue(task.lock(5, 'OPEN', force=True))
+        self.notify.assert_not_called()
+
+    def test_close_wakes_parent(self):
+        task = kojihub.Task(100)
+        task.getInfo = mock.MagicMock(return_value={'id': 100, 'host_id': 5, 'parent': 90})
+        task.runCallbacks = mock.MagicMock()
+        with mock.patch('kojihub.kojihub.QueryProcessor') as QueryProcessor:
+            QueryProcessor.return_value.singleValue.return_value = 7
+            task.close('result')
+        self.notify.assert_has_calls([mock.call('koji_host_5'), mock.call('koji_host_7')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -36,6 +36,7 @@ class TestWriteInheritanceData(unittest.TestCase):
         self.updates = []
         self.read_inheritance_data = mock.patch('kojihub.kojihub.readInheritanceData').start()
         self.get_tag = mock.patch('kojihub.kojihub.get_tag').start()
+        self.log_tag_change = mock.patch('kojihub.kojihub.log_tag_change').start()
         self.context = mock.patch('kojihub.kojihub.context').start()
         self.context.session.assertPerm = mock.MagicMock()
         self.tag_id = 5
@@ -77,6 +78,7 @@ class TestWriteInheritanceData(unittest.TestCase):
                                        'intransitive': False, 'noconfig': False,
                                        'pkg_filter': '', 'tag_id': 5})
         self.assertEqual(insert.rawdata, {})
+        self.log_tag_change.assert_called_once_with(5, 'tag_inheritance')
 
     def test_delete_link(self):
         changes = self.changes.copy()
@@ -94,6 +96,7 @@ class TestWriteInheritanceData(unittest.TestCase):
         update = self.updates[0]
         self.assertEqual(update.table, 'tag_inheritance')
         self.assertEqual(update.clauses, ['tag_id=%(tag_id)s', 'parent_id = %(parent_id)s'])
+        self.log_tag_change.assert_called_once_with(5, 'tag_inheritance')
 
     def test_multiple_parent_with_the_same_priority(self):
         changes = self.changes.copy()
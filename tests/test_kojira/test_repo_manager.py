@@ -193,36 +193,62 @@ class RepoManagerTest(unittest.TestCase):
         mrepo = delete_check.mock_calls[0][1][0]  # self arg
         self.assertEqual(mrepo.repo_id, repo_id)
 
-    @mock.patch('requests.get')
-    def test_check_external(self, get):
+    def setup_external(self):
+        self.options.max_external_repo_threads = 4
+        self.options.max_external_repo_host_threads = 2
+        repomd_fn = os.path.dirname(__file__) + '/data/external-repomd.xml'
+        with open(repomd_fn, 'rb') as fo:
+            self.repomd = fo.read()
+        self.rsession = mock.MagicMock()
+        self.Session = mock.patch('requests.Session', return_value=self.rsession).start()
+        self.response = self.rsession.get.return_value.__enter__.return_value
+        self.response.status_code = 200
+        self.response.headers = {'ETag': '"abc"', 'Last-Modified': 'Mon, 25 Mar 2024'}
+        self.response.iter_content.side_effect = self.iter_content
+        # multicall results
+        self.erepo_data = {}
+        self.set_calls = []
+        self.multicall = self.session.multicall.return_value.__enter__.return_value
+        self.multicall.repo.getExternalRepoData.side_effect = \
+            lambda erepo_id: mock.MagicMock(result=self.erepo_data.get(erepo_id))
+        self.multicall.repo.setExternalRepoData.side_effect = \
+            lambda *args: self.set_calls.append(args)
+
+    def iter_content(self, chunk_size):
+        # feed the parser a few bytes at a time
+        for i in range(0, len(self.repomd), 100):
+            yield self.repomd[i:i + 100]
+
+    def test_check_external(self):
+        self.setup_external()
         # fake ext repo data
         repo1 = {'external_repo_id': 1, 'external_repo_name': 'myrepo',
                  'url': 'https://localhost/NOSUCHPATH'}
         repo2 = {'external_repo_id': 2, 'external_repo_name': 'myotherrepo',
                  'url': 'https://localhost/FAKEPATH/$arch'}
         self.session.getTagExternalRepos.return_value = [repo1, repo2]
-        data1 = {}
-        data2 = {}
-        self.session.repo.getExternalRepoData.side_effect = [data1, data2]
+        self.erepo_data = {2: {'max_ts': 1}}
         self.session.getAllArches.return_value = ['i386', 'x86_64', 'riscv']
-        repomd_fn = os.path.dirname(__file__) + '/data/external-repomd.xml'
-        with open(repomd_fn, 'rt') as fo:
-            repomd = fo.read()
-        get.return_value.text = repomd
 
         self.mgr.checkExternalRepos()
 
-        self.session.repo.getExternalRepoData.assert_has_calls([
+        # one shared session, with a connection pool per host
+        self.Session.assert_called_once_with()
+        adapter = self.rsession.mount.call_args.args[1]
+        self.assertEqual(adapter._pool_maxsize, 2)
+        self.assertTrue(adapter._pool_block)
+        self.assertEqual(self.rsession.get.call_count, 4)
+        self.multicall.repo.getExternalRepoData.assert_has_calls([
             mock.call(1),
             mock.call(2),
         ])
-        self.session.repo.setExternalRepoData.assert_has_calls([
-            mock.call(1, {'max_ts': 1711390493}),
-            mock.call(2, {'max_ts': 1711390493}),
+        self.assertEqual(self.set_calls, [
+            (1, {'max_ts': 1711390493}),
+            (2, {'max_ts': 1711390493}),
         ])
 
-    @mock.patch('requests.get')
-    def test_check_external_no_arches(self, get):
+    def test_check_external_no_arches(self):
+        self.setup_external()
         # a new system with no hosts could report no arches
         self.session.getAllArches.return_value = []
         # fake ext repo data
@@ -231,52 +257,113 @@ class RepoManagerTest(unittest.TestCase):
         repo2 = {'external_repo_id': 2, 'external_repo_name': 'myotherrepo',
                  'url': 'https://localhost/FAKEPATH/$arch'}
         self.session.getTagExternalRepos.return_value = [repo1, repo2]
-        data1 = {}
-        data2 = {}
-        self.session.repo.getExternalRepoData.side_effect = [data1, data2]
-        repomd_fn = os.path.dirname(__file__) + '/data/external-repomd.xml'
-        with open(repomd_fn, 'rt') as fo:
-            repomd = fo.read()
-        get.return_value.text = repomd
 
         self.mgr.checkExternalRepos()
 
-        self.session.repo.getExternalRepoData.assert_has_calls([
-            mock.call(1),
-            # no call for repo2 since it has $arch in the url
-        ])
-        self.session.repo.setExternalRepoData.assert_has_calls([
-            mock.call(1, {'max_ts': 1711390493}),
-            # no call for repo2 since it has $arch in the url
-        ])
+        # no call for repo2 since it has $arch in the url
+        self.multicall.repo.getExternalRepoData.assert_called_once_with(1)
+        self.assertEqual(self.set_calls, [(1, {'max_ts': 1711390493})])
 
-    @mock.patch('requests.get')
-    def test_check_external_cache(self, get):
+    def test_check_external_cache(self):
+        self.setup_external()
         # fake ext repo data
         repo1 = {'external_repo_id': 1, 'external_repo_name': 'myrepo',
                  'url': 'https://localhost/NOSUCHPATH'}
         repo2 = {'external_repo_id': 2, 'external_repo_name': 'myotherrepo',
                  'url': 'https://localhost/NOSUCHPATH'}  # same url
         self.session.getTagExternalRepos.return_value = [repo1, repo2]
-        data1 = {}
-        data2 = {}
-        self.session.repo.getExternalRepoData.side_effect = [data1, data2]
         self.session.getAllArches.return_value = ['i386', 'x86_64', 'riscv']
-        repomd_fn = os.path.dirname(__file__) + '/data/external-repomd.xml'
-        with open(repomd_fn, 'rt') as fo:
-            repomd = fo.read()
-        get.return_value.text = repomd
 
         self.mgr.checkExternalRepos()
 
-        get.assert_called_once()
-        self.session.repo.getExternalRepoData.assert_has_calls([
+        self.rsession.get.assert_called_once()
+        self.multicall.repo.getExternalRepoData.assert_has_calls([
             mock.call(1),
             mock.call(2),
         ])
-        self.session.repo.setExternalRepoData.assert_has_calls([
-            mock.call(1, {'max_ts': 1711390493}),
-            mock.call(2, {'max_ts': 1711390493}),
+        self.assertEqual(self.set_calls, [
+            (1, {'max_ts': 1711390493}),
+            (2, {'max_ts': 1711390493}),
         ])
 
+    def test_check_external_unchanged(self):
+        self.setup_external()
+        repo1 = {'external_repo_id': 1, 'external_repo_name': 'myrepo',
+                 'url': 'https://localhost/NOSUCHPATH'}
+        self.session.getTagExternalRepos.return_value = [repo1]
+        self.session.getAllArches.return_value = ['x86_64']
+
+        self.mgr.checkExternalRepos()
+        self.assertEqual(self.set_calls, [(1, {'max_ts': 1711390493})])
+        self.assertEqual(self.rsession.get.call_args.kwargs['headers'], {})
+
+        # second pass sends a conditional request and reuses the cached value
+        self.set_calls = []
+        self.erepo_data = {1: {'max_ts': 1711390493}}
+        self.response.status_code = 304
+        self.response.iter_content.side_effect = None
+        self.response.iter_content.return_value = []
+        self.mgr.checkExternalRepos()
+
+        self.assertEqual(self.rsession.get.call_args.kwargs['headers'],
+                         {'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 25 Mar 2024'})
+        self.assertEqual(self.set_calls, [])
+        self.Session.assert_called_once_with()
+
+    def test_check_external_errors(self):
+        self.setup_external()
+        repo1 = {'external_repo_id': 1, 'external_repo_name': 'myrepo',
+                 'url': 'https://localhost/FAKEPATH/$arch'}
+        repo2 = {'external_repo_id': 2, 'external_repo_name': 'myotherrepo',
+                 'url': 'https://otherhost/PATH'}
+        self.session.getTagExternalRepos.return_value = [repo1, repo2]
+        self.session.getAllArches.return_value = ['x86_64', 'riscv']
+        response = mock.MagicMock(status_code=404)
+
+        def get(url, **kwargs):
+            if 'riscv' in url:
+                raise kojira.requests.exceptions.HTTPError(response=response)
+            elif 'otherhost' in url:
+                raise kojira.requests.exceptions.ConnectionError()
+            return mock.DEFAULT
+        self.rsession.get.side_effect = get
+
+        self.mgr.checkExternalRepos()
+
+        # one arch is enough, the unreachable repo is left alone
+        self.assertEqual(self.set_calls, [(1, {'max_ts': 1711390493})])
+        self.Session.assert_called_once_with()
+        self.assertNotIn('https://otherhost/PATH/repodata/repomd.xml', self.mgr.repomd_cache)
+
+    def test_repomd_timestamps_order(self):
+        self.setup_external()
+        urls = ['https://a/1', 'https://a/2', 'https://a/3', 'https://b/1', 'https://c/1']
+        checked = []
+
+        def getRepomdTimestamp(url, rsession):
+            checked.append(url)
+            return len(checked)
+        self.mgr.getRepomdTimestamp = getRepomdTimestamp
+        self.options.max_external_repo_threads = 1
+
+        result = self.mgr.getRepomdTimestamps(urls)
+
+        # the urls are spread over the hosts
+        self.assertEqual(checked, ['https://a/1', 'https://b/1', 'https://c/1',
+                                   'https://a/2', 'https://a/3'])
+        self.assertEqual(result, {'https://a/1': 1, 'https://b/1': 2, 'https://c/1': 3,
+                                  'https://a/2': 4, 'https://a/3': 5})
+
+    def test_http_session_pools(self):
+        self.setup_external()
+        self.options.max_external_repo_threads = 4
+        rsession = self.mgr.getHttpSession(2)
+        self.assertIs(self.mgr.getHttpSession(4), rsession)
+        self.assertEqual(self.mgr.http_pools, 4)
+        # more hosts than pools, the session is replaced
+        self.mgr.getHttpSession(5)
+        rsession.close.assert_called_once_with()
+        self.assertEqual(self.mgr.http_pools, 5)
+        self.assertEqual(self.Session.call_count, 2)
+
 # the end
@@ -3,7 +3,11 @@ try:
     from unittest import mock
 except ImportError:
     import mock
+import os
+import shutil
 import six
+import tempfile
+import threading
 import weakref
 import requests
 import unittest
@@ -180,6 +184,92 @@ class TestFastUpload(unittest.TestCase):
             self.assertEqual(kwargs['volume'], 'foobar')
 
 
+class TestParallelUpload(unittest.TestCase):
+
+    def setUp(self):
+        self._callMethod = mock.patch.object(koji.ClientSession, '_callMethod',
+                                             autospec=True).start()
+        self._callMethod.side_effect = self.call_method
+        self.logout = mock.patch.object(koji.ClientSession, 'logout', autospec=True).start()
+        self.ksession = koji.ClientSession('http://koji.example.com/kojihub',
+                                           opts={'upload_workers': 3})
+        self.ksession.setSession({'session-id': 1, 'session-key': 'abc', 'header-auth': True})
+        self.ksession.retries = 1
+        self.tempdir = tempfile.mkdtemp()
+        self.localfile = os.path.join(self.tempdir, 'upload')
+        self.data = os.urandom(10000)
+        with open(self.localfile, 'wb') as fo:
+            fo.write(self.data)
+        self.uploaded = bytearray()
+        self.lock = threading.Lock()
+        self.parallel_error = None
+        self.raw_calls = []
+
+    def tearDown(self):
+        mock.patch.stopall()
+        shutil.rmtree(self.tempdir)
+
+    def call_method(self, session, name, args, kwargs=None, retry=True):
+        session.retries = 1
+        if name == 'subsession':
+            return {'session-id': 2, 'session-key': 'xyz', 'header-auth': True}
+        elif name == 'checkUpload':
+            return {'size': len(self.uploaded),
+                    'hexdigest': koji.util.adler32_constructor(
+                        bytes(self.uploaded)).hexdigest()}
+        self.assertEqual(name, 'rawUpload')
+        chunk, ofs, path, fn = args
+        with self.lock:
+            self.raw_calls.append((session, ofs, kwargs))
+            if kwargs.get('parallel'):
+                if self.parallel_error:
+                    raise self.parallel_error
+            if kwargs.get('overwrite'):
+                del self.uploaded[ofs:]
+            if len(self.uploaded) < ofs:
+                self.uploaded.extend(b'\0' * (ofs - len(self.uploaded)))
+            self.uploaded[ofs:ofs + len(chunk)] = chunk
+        return {'size': len(chunk), 'hexdigest': koji.util.adler32_constructor(chunk).hexdigest()}
+
+    def test_parallel(self):
+        callback = mock.MagicMock()
+        self.ksession.fastUpload(self.localfile, 'target', blocksize=1000, callback=callback,
+                                 volume='foobar')
+        self.assertEqual(bytes(self.uploaded), self.data)
+        # first chunk is uploaded by our session, the rest by the subsessions
+        self.assertEqual(self.raw_calls[0][0], self.ksession)
+        self.assertEqual(self.raw_calls[0][2], {'overwrite': False, 'volume': 'foobar'})
+        offsets = []
+        for session, ofs, kwargs in self.raw_calls[1:]:
+            self.assertIsNot(session, self.ksession)
+            self.assertEqual(kwargs, {'parallel': True, 'volume': 'foobar'})
+            offsets.append(ofs)
+        self.assertEqual(sorted(offsets), list(range(1000, 10000, 1000)))
+        self.assertEqual(self.logout.call_count, 3)
+        callback.assert_called_with(10000, 10000, 1000, mock.ANY, mock.ANY)
+        self.assertEqual(callback.call_count, 11)
+        check = self._callMethod.call_args_list[-1][0]
+        self.assertEqual(check[1:], ('checkUpload', ('target', 'upload'), {'volume': 'foobar'}))
+
+    def test_parallel_fallback(self):
+        # e.g. an older hub, locking the whole file
+        self.parallel_error = koji.LockError('locked')
+        self.ksession.fastUpload(self.localfile, 'target', blocksize=1000)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        sequential = [c for c in self.raw_calls if c[0] is self.ksession]
+        # first chunk of the parallel upload, then the full sequential upload
+        self.assertEqual([c[1] for c in sequential], [0] + list(range(0, 10000, 1000)))
+        self.assertEqual(sequential[1][2], {'overwrite': True})
+        self.assertEqual(self.logout.call_count, 3)
+
+    def test_small_file(self):
+        self.ksession.fastUpload(self.localfile, 'target', blocksize=5000)
+        self.assertEqual(bytes(self.uploaded), self.data)
+        for session, ofs, kwargs in self.raw_calls:
+            self.assertIs(session, self.ksession)
+        self.logout.assert_not_called()
+
+
 class TestMultiCall(unittest.TestCase):
 
     def setUp(self):
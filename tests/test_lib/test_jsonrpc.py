@@ -0,0 +1,150 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import re
+import unittest
+
+from koji import jsonrpc, xmlrpcplus
+
+
+class TestJsonRPC(unittest.TestCase):
+
+    standard_data = [
+        "Hello World",
+        5,
+        5.5,
+        None,
+        True,
+        False,
+        u'Hævē s°mə ŭnıčođė',
+        [1],
+        {"a": 1},
+        ["fnord"],
+        {"a": ["b", 1, 2, None], "b": {"c": 1}},
+        2 ** 40,
+        -2 ** 63,
+    ]
+
+    def test_call(self):
+        for value in self.standard_data:
+            value = (value, "other arg")
+            enc = jsonrpc.dumps(value, methodname='my_rpc_method')
+            params, method = jsonrpc.loads(enc)
+            self.assertEqual(params, value)
+            self.assertEqual(method, 'my_rpc_method')
+
+    def test_response(self):
+        for value in self.standard_data:
+            enc = jsonrpc.dumps((value,), methodresponse=1)
+            params, method = jsonrpc.loads(enc)
+            self.assertEqual(params, (value,))
+            self.assertEqual(method, None)
+
+    def test_same_as_xmlrpc(self):
+        for value in self.standard_data:
+            params, method = jsonrpc.loads(jsonrpc.dumps((value,), methodresponse=1))
+            _params, _method = xmlrpcplus.loads(xmlrpcplus.dumps((value,), methodresponse=1))
+            self.assertEqual(params, _params)
+
+    def test_datetime(self):
+        dt = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        for value in (dt, xmlrpcplus.DateTime(dt)):
+            params, method = jsonrpc.loads(jsonrpc.dumps((value,), methodname='foo'))
+            self.assertIsInstance(params[0], xmlrpcplus.DateTime)
+            self.assertEqual(params[0].value, '20240102T03:04:05')
+        # the hub returns datetimes as strings
+        enc = jsonrpc.dumps(({'ts': dt},), methodresponse=1, datetime_as_string=True)
+        params, method = jsonrpc.loads(enc)
+        self.assertEqual(params, ({'ts': '2024-01-02 03:04:05'},))
+
+    def test_binary(self):
+        for value in (b'\x00\xffdata', xmlrpcplus.xmlrpc_client.Binary(b'\x00\xffdata')):
+            params, method = jsonrpc.loads(jsonrpc.dumps((value,), methodresponse=1))
+            self.assertIsInstance(params[0], jsonrpc.Binary)
+            self.assertEqual(params[0].data, b'\x00\xffdata')
+
+    def test_generator(self):
+        def gen():
+            for i in range(3):
+                yield {'id': i}
+        params, method = jsonrpc.loads(jsonrpc.dumps((gen(),), methodresponse=1))
+        self.assertEqual(params, ([{'id': 0}, {'id': 1}, {'id': 2}],))
+
+    def test_pattern(self):
+        pattern = re.compile('a.*b')
+        params, method = jsonrpc.loads(jsonrpc.dumps((pattern,), methodresponse=1))
+        self.assertEqual(params, (repr(pattern),))
+
+    def test_fault(self):
+        enc = jsonrpc.dumps(xmlrpcplus.Fault(1000, 'an error'))
+        with self.assertRaises(xmlrpcplus.Fault) as cm:
+            jsonrpc.loads(enc)
+        self.assertEqual(cm.exception.faultCode, 1000)
+        self.assertEqual(cm.exception.faultString, 'an error')
+
+    def test_badargs(self):
+        with self.assertRaises(TypeError):
+            jsonrpc.dumps([1], methodresponse=1)
+        with self.assertRaises(ValueError):
+            jsonrpc.dumps((1, 2), methodresponse=1)
+        with self.assertRaises(TypeError):
+            jsonrpc.dumps((set([1]),), methodresponse=1)
+        with self.assertRaises(ValueError):
+            jsonrpc.loads('[1, 2]')
+        with self.assertRaises(ValueError):
+            jsonrpc.loads('{"__jsonclass__": ["Unknown", []]}')
+
+    def test_chunks(self):
+        value = (['x' * 100] * 100,)
+        chunks = jsonrpc.dumps_chunks(value, methodresponse=1, chunk_size=1000)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(b''.join(chunks), jsonrpc.dumps(value, methodresponse=1).encode())
+
+    def test_chunks_generator(self):
+        def gen():
+            for i in range(100):
+                yield {'id': i, 'name': 'x' * 100}
+        chunks = jsonrpc.dumps_chunks((gen(),), methodresponse=1, chunk_size=1000)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(b''.join(chunks), jsonrpc.dumps((gen(),), methodresponse=1).encode())
+
+    def test_streaming(self):
+        written = []
+
+        def gen():
+            for i in range(3):
+                yield i
+                # the item has been written before the next one is requested
+                self.assertEqual(written[-1], str(i))
+        encoder = jsonrpc.ExtendedEncoder()
+        encoder.dump(gen(), written.append)
+        self.assertEqual(''.join(written), '[0, 1, 2]')
+
+    def test_nonstring_keys(self):
+        for value in ({1: 'a'}, {None: 'a'}, {'a': {2.5: 'b'}}):
+            with self.assertRaises(TypeError):
+                jsonrpc.dumps((value,), methodresponse=1)
+            with self.assertRaises(TypeError):
+                jsonrpc.dumps_chunks((value,), methodresponse=1)
+            # same as xmlrpc
+            with self.assertRaises(TypeError):
+                xmlrpcplus.dumps((value,), methodresponse=1)
+
+    def test_jsonclass_key(self):
+        dt = datetime.datetime(2024, 1, 2, 3, 4, 5)
+        for value in ({'__jsonclass__': ['DateTime', ['20240102T03:04:05']]},
+                      {'__jsonclass__': 'x'},
+                      {'__jsonclass__': {'__jsonclass__': dt}}):
+            params, method = jsonrpc.loads(jsonrpc.dumps((value,), methodresponse=1))
+            self.assertEqual(params, (value,))
+
+    def test_parser(self):
+        enc = jsonrpc.dumps((u'Hævē', {'a': None}), methodname='foo').encode('utf-8')
+        p, u = jsonrpc.getparser()
+        for i in range(0, len(enc), 3):
+            # split multibyte characters too
+            p.feed(enc[i:i + 3])
+        p.close()
+        self.assertEqual(u.close(), (u'Hævē', {'a': None}))
+        self.assertEqual(u.getmethodname(), 'foo')
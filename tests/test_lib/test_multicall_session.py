@@ -2,6 +2,9 @@ try:
     from unittest import mock
 except ImportError:
     import mock
+import random
+import threading
+import time
 import unittest
 
 import koji
@@ -53,3 +56,169 @@ class TestNewMultiCall(unittest.TestCase):
                 self.assertEqual(call['methodName'], "echo")
                 self.assertEqual(call['params'], (i,))
                 i += 1
+
+
+class TestParallelMultiCall(unittest.TestCase):
+
+    def setUp(self):
+        self._callMethod = mock.patch.object(koji.ClientSession, '_callMethod',
+                                             autospec=True).start()
+        self._callMethod.side_effect = self.call_method
+        self.logout = mock.patch.object(koji.ClientSession, 'logout', autospec=True).start()
+        self.session = koji.ClientSession('FAKE_URL')
+        self.lock = threading.Lock()
+        self.batch_sessions = []
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def call_method(self, session, name, args, kwargs=None, retry=True):
+        if name == 'subsession':
+            return {'session-id': 2, 'session-key': 'xyz', 'header-auth': True}
+        self.assertEqual(name, 'multiCall')
+        with self.lock:
+            self.batch_sessions.append(session)
+        # scramble the completion order
+        time.sleep(random.random() * 0.01)
+        results = []
+        for call in args[0]:
+            if call['methodName'] == 'error':
+                results.append({'faultCode': 1000, 'faultString': 'error %s' % call['params'][0],
+                                'traceback': []})
+            elif call['methodName'] == 'crash':
+                raise koji.GenericError('connection failed')
+            else:
+                results.append([call['params'][0]])
+        return results
+
+    def test_result_order(self):
+        with self.session.multicall(batch=10, workers=4) as m:
+            calls = [m.echo(i) for i in range(95)]
+        self.assertEqual([c.result for c in calls], list(range(95)))
+        self.assertEqual(len(self.batch_sessions), 10)
+        # batches were sent by the worker sessions
+        self.assertNotIn(self.session, self.batch_sessions)
+        self.assertEqual(len(set(self.batch_sessions)), 4)
+        for worker in self.batch_sessions:
+            self.assertFalse(worker.logged_in)
+
+    def test_call_all_results(self):
+        m = self.session.multicall(batch=3)
+        m.echo(1)
+        m.error(2)
+        m.echo(3)
+        m.echo(4)
+        results = m.call_all(workers=2)
+        self.assertEqual(results[0], [1])
+        self.assertEqual(results[1]['faultString'], 'error 2')
+        self.assertEqual(results[2:], [[3], [4]])
+
+    def test_strict(self):
+        m = self.session.multicall(strict=True, batch=2, workers=2)
+        m.echo(1)
+        m.echo(2)
+        error = m.error(3)
+        with self.assertRaises(koji.GenericError):
+            m.call_all()
+        with self.assertRaises(koji.GenericError):
+            error.result
+
+    def test_batch_error(self):
+        m = self.session.multicall(batch=2, workers=2)
+        m.echo(1)
+        m.crash(2)
+        with self.assertRaises(koji.GenericError) as cm:
+            m.call_all()
+        self.assertEqual(str(cm.exception), 'connection failed')
+
+    def test_logged_in(self):
+        self.session.setSession({'session-id': 1, 'session-key': 'abc', 'header-auth': True})
+        self.session.auth_method = {'method': 'login', 'args': (), 'kwargs': {}}
+        with self.session.multicall(batch=5, workers=3) as m:
+            calls = [m.echo(i) for i in range(30)]
+        self.assertEqual([c.result for c in calls], list(range(30)))
+        subsession_calls = [c for c in self._callMethod.call_args_list
+                            if c[0][1] == 'subsession']
+        self.assertEqual(len(subsession_calls), 3)
+        for c in subsession_calls:
+            self.assertIs(c[0][0], self.session)
+        workers = set(self.batch_sessions)
+        self.assertEqual(len(workers), 3)
+        for worker in workers:
+            self.assertTrue(worker.logged_in)
+            self.assertEqual(worker.auth_method, self.session.auth_method)
+        self.assertEqual(self.logout.call_count, 3)
+
+    def test_subsession_error(self):
+        self.session.setSession({'session-id': 1, 'session-key': 'abc', 'header-auth': True})
+        self.session.auth_method = {'method': 'login', 'args': (), 'kwargs': {}}
+        subsessions = []
+
+        def call_method(session, name, args, kwargs=None, retry=True):
+            if name == 'subsession':
+                if len(subsessions) == 2:
+                    raise koji.GenericError('subsession failed')
+                subsessions.append(1)
+            return self.call_method(session, name, args, kwargs, retry)
+        self._callMethod.side_effect = call_method
+        m = self.session.multicall(batch=5, workers=3)
+        for i in range(30):
+            m.echo(i)
+        with self.assertRaises(koji.GenericError):
+            m.call_all()
+        # the subsessions which were created are closed
+        self.assertEqual(self.logout.call_count, 2)
+        self.assertEqual(self.batch_sessions, [])
+
+    def test_worker_sessions(self):
+        self.session.setSession({'session-id': 1, 'session-key': 'abc', 'header-auth': True})
+        self.session.auth_method = {'method': 'login', 'args': (), 'kwargs': {}}
+        workers = self.session.multicall().open_worker_sessions(3)
+        self.assertEqual(len(workers), 3)
+        for i in range(2):
+            with self.session.multicall(batch=5, workers=3, worker_sessions=workers) as m:
+                calls = [m.echo(n) for n in range(30)]
+            self.assertEqual([c.result for c in calls], list(range(30)))
+        # the given sessions are used and left open
+        self.assertEqual(set(self.batch_sessions), set(workers))
+        subsession_calls = [c for c in self._callMethod.call_args_list
+                            if c[0][1] == 'subsession']
+        self.assertEqual(len(subsession_calls), 3)
+        self.logout.assert_not_called()
+
+    def test_batch_options(self):
+        self.session.opts['timeout'] = 100
+        with self.session.multicall(batch=1, workers=2, batch_timeout=5,
+                                    batch_retries=1) as m:
+            m.echo(1)
+            m.echo(2)
+        for worker in self.batch_sessions:
+            self.assertEqual(worker.opts['timeout'], 5)
+            self.assertEqual(worker.opts['max_retries'], 1)
+        self.assertEqual(self.session.opts['timeout'], 100)
+
+    def test_worker_sessions_batch_options(self):
+        self.session.setSession({'session-id': 1, 'session-key': 'abc', 'header-auth': True})
+        self.session.auth_method = {'method': 'login', 'args': (), 'kwargs': {}}
+        self.session.opts['timeout'] = 100
+        with mock.patch.object(self.session, 'subsession',
+                               wraps=self.session.subsession) as subsession:
+            workers = self.session.multicall(batch_timeout=5,
+                                             batch_retries=1).open_worker_sessions(2)
+        # the workers are subsessions, with the batch options applied
+        self.assertEqual(subsession.call_count, 2)
+        for worker in workers:
+            self.assertTrue(worker.logged_in)
+            self.assertEqual(worker.opts['timeout'], 5)
+            self.assertEqual(worker.opts['max_retries'], 1)
+        self.assertEqual(self.session.opts['timeout'], 100)
+        # the options can't be changed for sessions that are already open
+        with self.assertRaises(koji.ParameterError):
+            self.session.multicall(workers=2, worker_sessions=workers, batch_timeout=10)
+
+    def test_single_batch(self):
+        # nothing to parallelize
+        with self.session.multicall(workers=4) as m:
+            call = m.echo(1)
+        self.assertEqual(call.result, 1)
+        self.assertEqual(self.batch_sessions, [self.session])
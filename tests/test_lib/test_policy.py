@@ -331,3 +331,97 @@ has DEPTH :: {
 
         actions = set(obj.all_actions())
         self.assertEqual(actions, set(['1', '2', '3', '4', 'ERROR', 'END']))
+
+    def test_shared_tests(self):
+        runs = []
+
+        class CountTest(koji.policy.BaseSimpleTest):
+            name = 'count'
+
+            def run(self, data):
+                runs.append(self.str)
+                return False
+
+        tests = koji.policy.findSimpleTests(koji.policy.__dict__)
+        tests['count'] = CountTest
+        policy = '''
+count a :: one
+true && count a :: two
+count b !! {
+    count a :: three
+    count b :: four
+}
+'''
+        obj = koji.policy.SimpleRuleSet(policy.splitlines(), tests)
+        self.assertEqual(obj.apply({}), None)
+        # each distinct test only runs once per apply
+        self.assertEqual(runs, ['count a ', 'count b '])
+        runs[:] = []
+        obj.apply({})
+        self.assertEqual(runs, ['count a ', 'count b '])
+
+        CountTest.cacheable = False
+        runs[:] = []
+        obj.apply({})
+        self.assertEqual(runs, ['count a ', ' count a ', 'count b ', 'count a ', 'count b '])
+
+    def test_uncacheable_test(self):
+        runs = []
+
+        class CountTest(koji.policy.BaseSimpleTest):
+            name = 'count'
+
+            def run(self, data):
+                runs.append(self.name)
+                return False
+
+        class VolatileTest(CountTest):
+            name = 'volatile'
+            cacheable = False
+
+        tests = koji.policy.findSimpleTests(koji.policy.__dict__)
+        tests['count'] = CountTest
+        tests['volatile'] = VolatileTest
+        policy = '''
+count :: one
+volatile :: two
+count :: three
+volatile :: four
+'''
+        obj = koji.policy.SimpleRuleSet(policy.splitlines(), tests)
+        self.assertEqual(obj.apply({}), None)
+        # the uncacheable test runs every time it is used
+        self.assertEqual(runs, ['count', 'volatile', 'volatile'])
+
+    def test_rule_text(self):
+        tests = koji.policy.findSimpleTests(koji.policy.__dict__)
+        policy = '''
+true && all :: {
+    none !! allow
+}
+'''
+        obj = koji.policy.SimpleRuleSet(policy.splitlines(), tests)
+        timing = []
+        obj.apply({}, timing=timing)
+        # the same format as last_rule
+        self.assertEqual([t['rule'] for t in timing], ['true && all :: {', 'none !! allow'])
+        self.assertEqual(obj.last_rule(), 'true && all :: ... none !! allow')
+
+    def test_timing(self):
+        tests = koji.policy.findSimpleTests(koji.policy.__dict__)
+        policy = '''
+has DEPTH :: {
+    match DEPTH 1 :: 1
+    all :: END
+}
+all !! never
+'''
+        obj = koji.policy.SimpleRuleSet(policy.splitlines(), tests)
+        timing = []
+        self.assertEqual(obj.apply({'DEPTH': '2'}, timing=timing), 'END')
+        self.assertEqual([(t['rule'], t['depth'], t['matched']) for t in timing],
+                         [('has DEPTH :: {', 0, True),
+                          ('match DEPTH 1 :: 1', 1, False),
+                          ('all :: END', 1, True)])
+        for t in timing:
+            self.assertGreaterEqual(t['time'], 0)
@@ -199,6 +199,52 @@ class TestDump(unittest.TestCase):
             self.assertEqual(method, None)
 
 
+class TestDumpChunks(unittest.TestCase):
+
+    def test_same_as_dumps(self):
+        for value in TestDump.standard_data + [2 ** 40, {'a': [2 ** 40]}]:
+            value = (value,)
+            chunks = xmlrpcplus.dumps_chunks(value, methodresponse=1)
+            enc = xmlrpcplus.dumps(value, methodresponse=1)
+            self.assertEqual(b''.join(chunks), enc.encode('utf-8'))
+
+    def test_generator(self):
+        def gen():
+            for i in range(1000):
+                yield {'id': i, 'name': u'pkg-%i-Hævē' % i}
+        chunks = xmlrpcplus.dumps_chunks((gen(),), methodresponse=1, chunk_size=1024)
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks[:-1]:
+            self.assertTrue(len(chunk) >= 1024)
+        params, method = xmlrpc_client.loads(b''.join(chunks))
+        expected = [{'id': i, 'name': u'pkg-%i-Hævē' % i} for i in range(1000)]
+        self.assertEqual(params, (expected,))
+
+    def test_fault(self):
+        fault = xmlrpcplus.Fault(1000, 'an error')
+        chunks = xmlrpcplus.dumps_chunks(fault)
+        self.assertEqual(b''.join(chunks), xmlrpcplus.dumps(fault).encode('utf-8'))
+
+    def test_encoding(self):
+        value = ({"a": 5.5, "b": [None]},)
+        chunks = xmlrpcplus.dumps_chunks(value, methodresponse=1, encoding='us-ascii')
+        enc = xmlrpcplus.dumps(value, methodresponse=1, encoding='us-ascii')
+        self.assertEqual(b''.join(chunks), enc.encode('us-ascii'))
+
+    def test_marshaller(self):
+        chunks = xmlrpcplus.dumps_chunks((3.14159,), methodresponse=1, marshaller=MyMarshaller)
+        params, method = xmlrpc_client.loads(b''.join(chunks))
+        self.assertEqual(params, (3,))
+
+    def test_badargs(self):
+        with self.assertRaises(TypeError):
+            xmlrpcplus.dumps_chunks([1], methodresponse=1)
+        with self.assertRaises(ValueError):
+            xmlrpcplus.dumps_chunks((1, 2), methodresponse=1)
+        with self.assertRaises(ValueError):
+            xmlrpcplus.dumps_chunks((1,))
+
+
 class MyMarshaller(xmlrpcplus.ExtendedMarshaller):
 
     dispatch = xmlrpcplus.ExtendedMarshaller.dispatch.copy()
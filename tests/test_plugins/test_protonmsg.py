@@ -1,11 +1,16 @@
 from __future__ import absolute_import
 
 import json
+import socket
 import tempfile
+import threading
+import time
 import unittest
 import pytest
 
 import protonmsg
+from proton.handlers import MessagingHandler
+from proton.reactor import ApplicationEvent, Container, EventInjector
 try:
     from unittest import mock
     from unittest.mock import patch, MagicMock
@@ -517,3 +522,321 @@ def test_topic_prefix(topic_prefix, expected):
     conf.set('broker', 'topic_prefix', topic_prefix)
     handler = protonmsg.TimeoutHandler('amqp://broker1.example.com:5672', [], conf)
     assert handler.topic_prefix == expected
+
+
+PUBLISHER_CONF = """[broker]
+urls = amqp://broker1.example.com:5672 amqp://broker2.example.com:5672
+topic_prefix = koji
+connect_timeout = 10
+send_timeout = 60
+
+[sender]
+enabled = true
+queue_size = 2
+"""
+
+
+def make_conf(text):
+    conf = ConfigParser()
+    conf.read_string(text)
+    return conf
+
+
+def make_msg(n):
+    return {'address': 'test.topic', 'props': {'n': n}, 'body': '"body %i"' % n}
+
+
+def msg_nums(msgs):
+    return [m['props']['n'] for m in msgs]
+
+
+class TestPublisher(unittest.TestCase):
+    def setUp(self):
+        self.publisher = protonmsg.Publisher(['amqp://broker1.example.com:5672',
+                                              'amqp://broker2.example.com:5672'],
+                                             make_conf(PUBLISHER_CONF))
+        self.publisher.container = MagicMock()
+        self.publisher.injector = MagicMock()
+        self.container = self.publisher.container
+        self.Message = mock.patch('protonmsg.Message').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+
+    def connect(self):
+        event = MagicMock()
+        self.publisher.on_start(event)
+        self.publisher.on_connection_opened(event)
+        return event
+
+    def test_submit_overflow(self):
+        msgs = [make_msg(n) for n in range(3)]
+        overflow = self.publisher.submit(msgs)
+        self.assertEqual(overflow, msgs[2:])
+        self.assertEqual(self.publisher.queue.qsize(), 2)
+        self.publisher.injector.trigger.assert_called_once()
+        stats = self.publisher.stats.report(self.publisher.queue.qsize())
+        self.assertEqual(stats['overflow'], 1)
+        self.assertEqual(stats['max_queue_depth'], 2)
+
+    def test_send(self):
+        self.publisher.submit([make_msg(1)])
+        self.assertFalse(self.publisher.is_idle())
+        self.connect()
+        self.container.connect.assert_called_once_with(
+            url='amqp://broker1.example.com:5672', reconnect=False, ssl_domain=None)
+        self.container.create_sender.assert_called_once_with(
+            self.container.connect.return_value, target='topic://koji.test.topic')
+        self.assertTrue(self.publisher.is_idle())
+        delivery = self.container.create_sender.return_value.send.return_value
+        self.assertEqual(msg_nums(self.publisher.pending.values()), [1])
+
+        self.publisher.on_accepted(MagicMock(delivery=delivery))
+        self.assertEqual(self.publisher.pending, {})
+        stats = self.publisher.stats.report(0)
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(self.publisher.take_failed(), [])
+
+    def test_rejected(self):
+        self.connect()
+        self.publisher.submit([make_msg(1)])
+        self.publisher.on_protonmsg_send(MagicMock())
+        delivery = self.container.create_sender.return_value.send.return_value
+        self.publisher.on_rejected(MagicMock(delivery=delivery))
+        self.assertEqual(msg_nums(self.publisher.take_failed()), [1])
+        self.assertEqual(self.publisher.take_failed(), [])
+
+    def test_connection_lost(self):
+        event = self.connect()
+        self.container.create_sender.return_value.send.side_effect = ['d1', 'd2', 'd3', 'd4']
+        self.publisher.submit([make_msg(1), make_msg(2)])
+        self.publisher.on_protonmsg_send(MagicMock())
+        self.publisher.on_accepted(MagicMock(delivery='d1'))
+
+        event.connection = self.container.connect.return_value
+        self.publisher.on_transport_closed(event)
+
+        self.assertFalse(self.publisher.connected)
+        self.assertEqual(msg_nums(self.publisher.retry), [2])
+        self.assertEqual(self.publisher.senders, {})
+        # reconnect goes to the next url
+        reconnect = self.container.schedule.call_args.args[1]
+        reconnect.on_timer_task(MagicMock())
+        self.assertEqual(self.container.connect.call_args.kwargs['url'],
+                         'amqp://broker2.example.com:5672')
+        # unsettled messages are sent first
+        self.publisher.submit([make_msg(3)])
+        self.publisher.on_connection_opened(event)
+        sent = [c.kwargs['properties'] for c in self.Message.call_args_list]
+        self.assertEqual(sent, [{'n': 1}, {'n': 2}, {'n': 2}, {'n': 3}])
+
+    def test_give_up_messages(self):
+        self.publisher.submit([make_msg(1)])
+        self.publisher.retry.append(make_msg(0))
+        self.publisher.disconnected_since = 0
+        self.publisher.on_timer_task(MagicMock())
+        # not connected for longer than send_timeout
+        self.assertEqual(msg_nums(self.publisher.take_failed()), [0, 1])
+        self.assertTrue(self.publisher.queue.empty())
+
+    def test_stop(self):
+        self.publisher.thread = MagicMock()
+        self.publisher.stop(5)
+        self.publisher.injector.trigger.assert_called_once()
+        self.publisher.on_protonmsg_stop(MagicMock())
+        self.assertTrue(self.publisher.stopping)
+        self.container.stop.assert_called_once_with()
+
+    def test_stop_store(self):
+        self.publisher.conf = make_conf(PUBLISHER_CONF + """
+[queue]
+enabled = true
+""")
+        db_connect = mock.patch('protonmsg.db_connect').start()
+        cnx = db_connect.return_value
+        self.connect()
+        self.container.create_sender.return_value.send.side_effect = ['d1', 'd2']
+        self.publisher.submit([make_msg(1), make_msg(2)])
+        self.publisher.on_protonmsg_send(MagicMock())
+        self.publisher.on_rejected(MagicMock(delivery='d1'))
+        self.publisher.retry.append(make_msg(3))
+        self.publisher.submit([make_msg(4)])
+        self.publisher.thread = MagicMock()
+
+        self.publisher.stop(5)
+
+        # failed, retry, pending and queued messages are all stored
+        inserts = cnx.cursor.return_value.execute.call_args_list
+        self.assertEqual([json.loads(c.args[1]['props'])['n'] for c in inserts], [1, 3, 2, 4])
+        self.assertEqual(inserts[0].args[1], {'address': 'test.topic', 'props': '{"n": 1}',
+                                              'body': '"body 1"'})
+        cnx.commit.assert_called_once_with()
+        cnx.close.assert_called_once_with()
+        self.assertEqual(self.publisher.pending, {})
+        self.assertTrue(self.publisher.queue.empty())
+
+    def test_stop_no_db_queue(self):
+        db_connect = mock.patch('protonmsg.db_connect').start()
+        self.publisher.submit([make_msg(1)])
+        self.publisher.thread = MagicMock()
+        self.publisher.log = MagicMock()
+
+        self.publisher.stop(5)
+
+        db_connect.assert_not_called()
+        self.publisher.log.error.assert_called_once_with(
+            'publisher stopped with %i messages unsent', 1)
+
+
+class TestSubmitMsgs(unittest.TestCase):
+    def setUp(self):
+        self.conf = tempfile.NamedTemporaryFile()
+        self.conf.write(six.b(PUBLISHER_CONF + """
+[queue]
+enabled = true
+"""))
+        self.conf.flush()
+        protonmsg.CONFIG_FILE = self.conf.name
+        protonmsg.CONFIG = None
+        protonmsg.LOG = MagicMock()
+        self.get_publisher = mock.patch('protonmsg.get_publisher').start()
+        self.publisher = self.get_publisher.return_value
+        self.publisher.submit.return_value = []
+        self.publisher.take_failed.return_value = []
+        self.store_to_db = mock.patch('protonmsg.store_to_db').start()
+        self.handle_db_msgs = mock.patch('protonmsg.handle_db_msgs').start()
+        self.Container = mock.patch('protonmsg.Container').start()
+        context.protonmsg_msgs = [make_msg(1), make_msg(2)]
+
+    def tearDown(self):
+        if hasattr(context, 'protonmsg_msgs'):
+            del context.protonmsg_msgs
+        del self.conf
+        mock.patch.stopall()
+
+    def test_submit(self):
+        self.publisher.is_idle.return_value = False
+        protonmsg.send_queued_msgs('postCommit')
+        self.publisher.submit.assert_called_once_with([make_msg(1), make_msg(2)])
+        self.Container.assert_not_called()
+        self.store_to_db.assert_not_called()
+        self.handle_db_msgs.assert_not_called()
+
+    def test_submit_idle(self):
+        self.publisher.is_idle.return_value = True
+        protonmsg.send_queued_msgs('postCommit')
+        self.handle_db_msgs.assert_called_once_with(
+            ['amqp://broker1.example.com:5672', 'amqp://broker2.example.com:5672'],
+            protonmsg.CONFIG)
+
+    def test_submit_unsent(self):
+        self.publisher.submit.return_value = [make_msg(2)]
+        self.publisher.take_failed.return_value = [make_msg(0)]
+        protonmsg.send_queued_msgs('postCommit')
+        self.store_to_db.assert_called_once_with([make_msg(2), make_msg(0)])
+        self.handle_db_msgs.assert_not_called()
+
+
+class StubBroker(MessagingHandler):
+    """A minimal AMQP listener that accepts every message it gets"""
+
+    def __init__(self, port):
+        super(StubBroker, self).__init__()
+        self.port = port
+        self.received = []
+        self.connections = []
+        self.ready = threading.Event()
+        self.container = Container(self)
+        self.injector = EventInjector()
+        self.acceptor = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.container.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.ready.wait(5)
+
+    def stop(self):
+        self.injector.trigger(ApplicationEvent('stub_stop'))
+        self.thread.join(5)
+
+    def on_start(self, event):
+        event.container.selectable(self.injector)
+        self.acceptor = event.container.listen('127.0.0.1:%i' % self.port)
+        self.ready.set()
+
+    def on_link_opening(self, event):
+        if event.link.remote_target.address:
+            event.link.target.address = event.link.remote_target.address
+
+    def on_connection_opened(self, event):
+        self.connections.append(event.connection)
+
+    def on_message(self, event):
+        self.received.append((event.link.remote_target.address, event.message.properties,
+                              event.message.body))
+
+    def on_stub_stop(self, event):
+        for connection in self.connections:
+            connection.close()
+        self.acceptor.close()
+        # let the close frames go out before stopping
+        self.container.schedule(0.2, self)
+
+    def on_timer_task(self, event):
+        self.injector.close()
+        self.container.stop()
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for(check, timeout=10):
+    start = time.time()
+    while not check():
+        if time.time() - start > timeout:
+            raise AssertionError('timed out')
+        time.sleep(0.05)
+
+
+class TestPublisherBroker(unittest.TestCase):
+    def setUp(self):
+        self.port = free_port()
+        self.broker = StubBroker(self.port)
+        self.broker.start()
+        conf = make_conf(PUBLISHER_CONF.replace('queue_size = 2', 'queue_size = 100'))
+        self.publisher = protonmsg.Publisher(['amqp://127.0.0.1:%i' % self.port], conf)
+        self.publisher.start()
+
+    def tearDown(self):
+        self.publisher.stop(5)
+        if self.broker.thread.is_alive():
+            self.broker.stop()
+
+    def test_send(self):
+        overflow = self.publisher.submit([make_msg(n) for n in range(5)])
+        self.assertEqual(overflow, [])
+        wait_for(lambda: len(self.broker.received) == 5 and not self.publisher.pending)
+        self.assertEqual(self.broker.received[0],
+                         ('topic://koji.test.topic', {'n': 0}, '"body 0"'))
+        stats = self.publisher.stats.report(0)
+        self.assertEqual(stats['sent'], 5)
+        self.assertTrue(self.publisher.is_idle())
+
+    def test_reconnect(self):
+        self.publisher.submit([make_msg(1)])
+        wait_for(lambda: self.broker.received)
+        self.broker.stop()
+        wait_for(lambda: not self.publisher.connected)
+
+        self.publisher.submit([make_msg(2)])
+        self.broker = StubBroker(self.port)
+        self.broker.start()
+        wait_for(lambda: self.broker.received)
+        self.assertEqual(self.broker.received, [('topic://koji.test.topic', {'n': 2}, '"body 2"')])